@@ -7,7 +7,7 @@ Main entry point for the FLARE endpoint agent. Starts and supervises:
   • Flow collector    — live packet capture via log_collector (background thread)
   • Host rule engine  — real-time Windows Event Log subscriptions (19 rules + IOC)
   • Network inference — MLP classifier on flow CSV (every 30 s)
-  • Alert sender      — batches AlertEvent protos -> HTTP POST with retry/buffer
+  • Alert sender      — batches AlertEvent protos -> agent channel / HTTP POST with retry/buffer
   • Heartbeat         — status ping every 60 s
   • FL model poll     — checks for updated global network model from server
 
@@ -20,6 +20,10 @@ Configuration (all via environment variables):
   FLARE_NET_CSV       Path to flow CSV written by collector   (default: C:\\Program Files\\Flare-data\\client\\net_flows.csv)
   FLARE_NET_IFACE     Network interface for live capture      (default: scapy default interface)
   FLARE_FL_TEST_MODE  Set to "1" for fast FL timing           (default: 0)
+  FLARE_FL_ENCODING   FL update encoding: none/float16/int8   (default: none)
+  FLARE_FL_TOPK       Fraction of delta values sent (0 = all) (default: 0)
+  FLARE_DISCOVERY_GROUP  Multicast group of the server beacon   (default: none — broadcast only)
+  FLARE_CHANNEL_PORT  Server's agent channel port, 0 = HTTP only (default: 7332)
   FLARE_LOG_LEVEL     Logging level: DEBUG/INFO/WARNING       (default: INFO)
 
 Run:
@@ -51,6 +55,7 @@ if str(_AGENT_DIR) not in sys.path:
     sys.path.insert(0, str(_AGENT_DIR))
 
 from proto import log_schema_pb2 as pb
+from proto import weight_codec
 
 from host.host_engine import (
     start as _start_host_engine,
@@ -103,10 +108,14 @@ NET_CSV      = os.environ.get("FLARE_NET_CSV",      str(_AGENT_DIR / "logs" / "n
 _NET_CSV_DIR = Path(NET_CSV).parent          # directory where date-named CSVs are written
 NET_IFACE    = os.environ.get("FLARE_NET_IFACE",    "").strip() or None
 FL_TEST      = os.environ.get("FLARE_FL_TEST_MODE", "0") == "1"
+FL_ENCODING  = weight_codec.parse_encoding(os.environ.get("FLARE_FL_ENCODING", "none"))
+FL_TOPK      = float(os.environ.get("FLARE_FL_TOPK", "0"))
 CA_CERT      = os.environ.get("FLARE_CA_CERT",      "").strip()
 CLIENT_CERT  = os.environ.get("FLARE_CLIENT_CERT",  "").strip()
 CLIENT_KEY   = os.environ.get("FLARE_CLIENT_KEY",   "").strip()
 PROVISION_TOKEN = os.environ.get("FLARE_PROVISION_TOKEN", "flare").strip() or "flare"
+DISCOVERY_GROUP = os.environ.get("FLARE_DISCOVERY_GROUP", "").strip()
+CHANNEL_PORT = int(os.environ.get("FLARE_CHANNEL_PORT", "7332") or 0)
 
 # ── Tuning constants ──────────────────────────────────────────────────────────
 HEARTBEAT_INTERVAL_SECS = 60
@@ -115,6 +124,8 @@ ALERT_BATCH_SIZE   = 20      # max alerts per HTTP POST
 ALERT_FLUSH_SECS   = 5       # flush even if batch not full after this many seconds
 ALERT_MAX_BUFFER   = 500     # max buffered alerts while server is down
 ALERT_RETRY_BACKOFF = [2, 5, 10, 30, 60]   # seconds between retries
+CHANNEL_FLUSH_SECS = 0.5     # flush delay instead of ALERT_FLUSH_SECS while the channel is up
+CHANNEL_RETRY_SECS = [5, 30, 120, 300]     # channel reconnect backoff (HTTP meanwhile)
 
 NET_INFER_INTERVAL_SECS = 30
 
@@ -209,44 +220,86 @@ except ImportError:
 # Server auto-discovery via UDP beacon
 # ─────────────────────────────────────────────────────────────────────────────
 
-BEACON_PORT = 37020
+BEACON_PORT   = 37020     # beacons and probe replies arrive here
+DISCOVER_PORT = 37021     # the server answers FLARE_DISCOVER probes here
+PROBE_EVERY_S = 1.0
+
+
+def _local_ipv4_addresses() -> list:
+    ips = []
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ips.append(s.getsockname()[0])
+        s.close()
+    except OSError:
+        pass
+    try:
+        _, _, addrs = socket.gethostbyname_ex(socket.gethostname())
+        ips += [ip for ip in addrs if ip not in ips]
+    except OSError:
+        pass
+    return [ip for ip in ips if "." in ip and not ip.startswith("127.")]
 
 
 def _discover_server_via_beacon(timeout_s: float = 5.0) -> Optional[str]:
-    """Listen on UDP/37020 for the FLARE_SERVER beacon broadcast.
+    """Find the server on the LAN: probe for it and listen on UDP/37020.
 
     Returns the HTTPS server URL (e.g. 'https://192.168.1.10:7331') if a
-    beacon is received within `timeout_s` seconds, otherwise None.
+    reply or beacon arrives within `timeout_s` seconds, otherwise None.
 
-    The server broadcasts: FLARE_SERVER::<ip>::<port> (every 3 s)
+    A FLARE_DISCOVER probe goes to udp/37021 on the limited broadcast, each
+    local /24's directed broadcast and FLARE_DISCOVERY_GROUP, every second
+    until then. The server answers it from its responder, and also
+    broadcasts on its own (often, right after it starts; rarely later):
+    FLARE_SERVER::<ip>::<port> either way.
     """
+    sock = None
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.settimeout(timeout_s)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         sock.bind(("", BEACON_PORT))
-        deadline = time.monotonic() + timeout_s
-        while time.monotonic() < deadline:
+        probe_to = {"255.255.255.255"}
+        probe_to.update(ip.rsplit(".", 1)[0] + ".255" for ip in _local_ipv4_addresses())
+        if DISCOVERY_GROUP:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack("4s4s", socket.inet_aton(DISCOVERY_GROUP),
+                                        socket.inet_aton("0.0.0.0")))
+            probe_to.add(DISCOVERY_GROUP)
+        deadline   = time.monotonic() + timeout_s
+        next_probe = 0.0
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now >= next_probe:
+                for dest in probe_to:
+                    try:
+                        sock.sendto(b"FLARE_DISCOVER", (dest, DISCOVER_PORT))
+                    except OSError:
+                        pass
+                next_probe = now + PROBE_EVERY_S
+            sock.settimeout(max(0.01, min(deadline, next_probe) - now))
             try:
                 data, _addr = sock.recvfrom(1024)
-                msg = data.decode("utf-8")
-                if msg.startswith("FLARE_SERVER::"):
-                    parts = msg.split("::")
-                    if len(parts) == 3:
-                        ip, port = parts[1].strip(), parts[2].strip()
-                        if ip and port.isdigit():
-                            return f"https://{ip}:{port}"
             except socket.timeout:
-                break
+                continue
             except OSError:
-                break
+                # Windows: ICMP port-unreachable for a probe surfaces here.
+                continue
+            msg = data.decode("utf-8", "replace")
+            if msg.startswith("FLARE_SERVER::"):
+                parts = msg.split("::")
+                if len(parts) == 3:
+                    ip, port = parts[1].strip(), parts[2].strip()
+                    if ip and port.isdigit():
+                        return f"https://{ip}:{port}"
     except Exception:
         pass
     finally:
-        try:
+        if sock is not None:
             sock.close()
-        except Exception:
-            pass
     return None
 
 
@@ -321,9 +374,33 @@ if _HAS_REQUESTS:
 # This mirrors what the server's own embedded agent does, and uses stdlib urllib
 # so it works even if 'requests' is not importable yet.
 
+_tls_contexts: dict = {}
+
+
+def _tls_context() -> _ssl.SSLContext:
+    """Client TLS context for the current CA / client cert files — built once
+    per set of files rather than per request (urllib fallbacks, agent channel)."""
+    has_ca = bool(CA_CERT and Path(CA_CERT).exists())
+    key = (CA_CERT, CLIENT_CERT, CLIENT_KEY, has_ca)
+    ctx = _tls_contexts.get(key)
+    if ctx is None:
+        ctx = _ssl.create_default_context()
+        if has_ca:
+            ctx.load_verify_locations(CA_CERT)
+        else:
+            ctx.check_hostname = False
+            ctx.verify_mode    = _ssl.CERT_NONE
+        if CLIENT_CERT and CLIENT_KEY:
+            ctx.load_cert_chain(CLIENT_CERT, CLIENT_KEY)
+        _tls_contexts.clear()
+        _tls_contexts[key] = ctx
+    return ctx
+
+
 def _rebuild_tls_session() -> None:
     """Re-apply CA/client certs to the requests session after (re)provisioning."""
     global _TLS_MODE
+    _tls_contexts.clear()
     if not _HAS_REQUESTS:
         return
     if CA_CERT and Path(CA_CERT).exists():
@@ -421,15 +498,8 @@ def _post(endpoint: str, body: bytes, timeout: int = 10) -> bool:
                 return False
             return True
         else:
-            # urllib fallback — build an mTLS context manually
-            ctx = _ssl.create_default_context()
-            if CA_CERT and Path(CA_CERT).exists():
-                ctx.load_verify_locations(CA_CERT)
-            else:
-                ctx.check_hostname = False
-                ctx.verify_mode    = _ssl.CERT_NONE
-            if CLIENT_CERT and CLIENT_KEY:
-                ctx.load_cert_chain(CLIENT_CERT, CLIENT_KEY)
+            # urllib fallback — mTLS context shared across calls
+            ctx = _tls_context()
             req = _urllib_request.Request(url, data=body, headers=headers, method="POST")
             with _urllib_request.urlopen(req, timeout=timeout, context=ctx):
                 return True
@@ -447,14 +517,7 @@ def _get_json(endpoint: str, timeout: int = 10) -> Optional[dict]:
             if resp.status_code == 200:
                 return resp.json()
         else:
-            ctx = _ssl.create_default_context()
-            if CA_CERT and Path(CA_CERT).exists():
-                ctx.load_verify_locations(CA_CERT)
-            else:
-                ctx.check_hostname = False
-                ctx.verify_mode    = _ssl.CERT_NONE
-            if CLIENT_CERT and CLIENT_KEY:
-                ctx.load_cert_chain(CLIENT_CERT, CLIENT_KEY)
+            ctx = _tls_context()
             req = _urllib_request.Request(url)
             with _urllib_request.urlopen(req, timeout=timeout, context=ctx) as r:
                 if r.status == 200:
@@ -474,14 +537,7 @@ def _post_json(endpoint: str, data: dict, timeout: int = 15) -> bool:
             resp = _session.post(url, data=body, headers=headers, timeout=timeout)
             return 200 <= resp.status_code < 300
         else:
-            ctx = _ssl.create_default_context()
-            if CA_CERT and Path(CA_CERT).exists():
-                ctx.load_verify_locations(CA_CERT)
-            else:
-                ctx.check_hostname = False
-                ctx.verify_mode    = _ssl.CERT_NONE
-            if CLIENT_CERT and CLIENT_KEY:
-                ctx.load_cert_chain(CLIENT_CERT, CLIENT_KEY)
+            ctx = _tls_context()
             req = _urllib_request.Request(url, data=body, headers=headers, method="POST")
             with _urllib_request.urlopen(req, timeout=timeout, context=ctx):
                 return True
@@ -490,6 +546,168 @@ def _post_json(endpoint: str, data: dict, timeout: int = 15) -> bool:
     return False
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Agent channel (one mTLS connection to the server's FLARE_CHANNEL_PORT)
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _AgentChannel:
+    """
+    Carries alerts, heartbeats and FL updates to the server as framed
+    ChannelMessages over one long-lived mTLS connection, instead of an HTTPS
+    POST each; the server pushes new global models down the same connection
+    (server/agent_channel.py).
+
+    send() writes a list of messages back to back and waits for their Acks.
+    It returns None while the channel is unavailable — no client cert, port
+    closed (an older server), connection lost — and _deliver() then uses
+    the HTTP endpoints. Reconnects are attempted on a CHANNEL_RETRY_SECS
+    backoff.
+    """
+
+    def __init__(self):
+        self._lock      = threading.Lock()     # connecting and writing
+        self._sock      = None
+        self._seq       = 0
+        self._waiting: dict = {}               # seq -> [Event, Ack | None]
+        self._retry_at  = 0.0
+        self._retry_idx = 0
+        self.model_round = -1                  # sent in the hello (FLPollThread keeps it)
+        self.on_model   = None                 # on_model(ModelUpdate), on the reader thread
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def send(self, kind: str, messages: list, timeout: float = 10) -> Optional[list]:
+        """Send `messages` (protos for the ChannelMessage field `kind`) and
+        return their Acks in order — None for any not acknowledged within
+        `timeout` — or None when the channel is unavailable."""
+        seqs, frames = [], []
+        with self._lock:
+            if not self._connect():
+                return None
+            sock = self._sock
+            for m in messages:
+                self._seq += 1
+                msg = pb.ChannelMessage(seq=self._seq)
+                getattr(msg, kind).CopyFrom(m)
+                self._waiting[self._seq] = [threading.Event(), None]
+                seqs.append(self._seq)
+                frames.append(_frame(msg.SerializeToString()))
+            try:
+                sock.sendall(b"".join(frames))
+            except OSError as exc:
+                self._drop(sock, exc)
+        deadline = time.monotonic() + timeout
+        acks = []
+        for seq in seqs:
+            slot = self._waiting.get(seq)
+            if slot is not None:
+                slot[0].wait(max(0.0, deadline - time.monotonic()))
+            slot = self._waiting.pop(seq, None) or slot
+            acks.append(slot[1] if slot else None)
+        return acks
+
+    def reset(self):
+        """Drop the connection (the server moved) and reconnect at the next send."""
+        with self._lock:
+            if self._sock is not None:
+                self._drop(self._sock, None)
+            self._retry_at, self._retry_idx = 0.0, 0
+
+    def _connect(self) -> bool:
+        if self._sock is not None:
+            return True
+        if not CHANNEL_PORT or time.monotonic() < self._retry_at:
+            return False
+        if not all(p and Path(p).exists() for p in (CA_CERT, CLIENT_CERT, CLIENT_KEY)):
+            return False
+        from urllib.parse import urlparse
+        host = urlparse(SERVER_URL).hostname or "localhost"
+        try:
+            raw  = socket.create_connection((host, CHANNEL_PORT), timeout=10)
+            sock = _tls_context().wrap_socket(raw, server_hostname=host)
+            sock.settimeout(None)
+            hello = pb.ChannelMessage(hello=pb.ChannelHello(
+                client_id=_client_id(), agent_version=AGENT_VERSION,
+                model_round=self.model_round))
+            sock.sendall(_frame(hello.SerializeToString()))
+        except OSError as exc:
+            backoff = CHANNEL_RETRY_SECS[min(self._retry_idx, len(CHANNEL_RETRY_SECS) - 1)]
+            self._retry_at  = time.monotonic() + backoff
+            self._retry_idx += 1
+            log.log(logging.INFO if self._retry_idx == 1 else logging.DEBUG,
+                    "Channel: %s:%d unavailable (%s) — using HTTPS, retry in %ds",
+                    host, CHANNEL_PORT, exc, backoff)
+            return False
+        self._sock, self._retry_idx = sock, 0
+        threading.Thread(target=self._read, args=(sock,), name="ChannelReader",
+                         daemon=True).start()
+        log.info("Channel: connected to %s:%d", host, CHANNEL_PORT)
+        return True
+
+    def _drop(self, sock, exc):
+        """Close `sock` and wake everyone waiting on it (caller holds _lock)."""
+        if self._sock is not sock:
+            return
+        self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for slot in list(self._waiting.values()):
+            slot[0].set()
+        if exc is not None:
+            log.warning("Channel: connection lost (%s) — using HTTPS until it reconnects", exc)
+            self._retry_at = time.monotonic() + CHANNEL_RETRY_SECS[0]
+
+    def _read(self, sock):
+        exc = None
+        try:
+            rfile = sock.makefile("rb")
+            while True:
+                head = rfile.read(4)
+                if len(head) < 4:
+                    raise ConnectionError("closed by the server")
+                (length,) = struct.unpack(">I", head)
+                msg = pb.ChannelMessage.FromString(rfile.read(length))
+                kind = msg.WhichOneof("body")
+                if kind == "ack":
+                    slot = self._waiting.get(msg.ack.seq)
+                    if slot is not None:
+                        slot[1] = msg.ack
+                        slot[0].set()
+                elif kind == "model" and self.on_model is not None:
+                    self.on_model(msg.model)
+        except Exception as e:
+            exc = e
+        with self._lock:
+            self._drop(sock, exc)
+
+
+_channel = _AgentChannel()
+
+
+def _deliver(endpoint: str, kind: str, messages: list, timeout: int = 10) -> int:
+    """
+    Send `messages` over the agent channel, or POST them one by one to
+    `endpoint` when it is unavailable. Returns how many of them, from the
+    start, the server accepted; the caller keeps the rest for a retry.
+    """
+    acks = _channel.send(kind, messages, timeout)
+    if acks is None:
+        for n, m in enumerate(messages):
+            if not _post(endpoint, _frame(m.SerializeToString()), timeout):
+                return n
+        return len(messages)
+    for n, ack in enumerate(acks):
+        if ack is None or ack.status != 200:
+            if ack is not None:
+                log.warning("Channel: %s -> %d %s", kind, ack.status, ack.detail)
+            return n
+    return len(acks)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Alert counting wrapper queue
 # ─────────────────────────────────────────────────────────────────────────────
@@ -530,7 +748,10 @@ class _TrackingQueue:
 
 class AlertSenderThread(threading.Thread):
     """
-    Drains alert_queue, batches into AlertBatch, POSTs to /api/alerts/ingest.
+    Drains alert_queue, batches into AlertBatch and streams the batches over
+    the agent channel (POSTs to /api/alerts/ingest while it is unavailable).
+    With the channel up the buffer is flushed every CHANNEL_FLUSH_SECS rather
+    than ALERT_FLUSH_SECS, since a message no longer costs a request.
 
     On server failure:
       - Alerts accumulate in an in-memory buffer (max ALERT_MAX_BUFFER)
@@ -538,7 +759,8 @@ class AlertSenderThread(threading.Thread):
       - When server comes back the entire buffer is flushed first
       - Alerts beyond ALERT_MAX_BUFFER are dropped with a warning
 
-    Wire format: _frame(AlertBatch.SerializeToString())
+    Wire format: _frame(AlertBatch.SerializeToString()), or the AlertBatch in
+    a framed ChannelMessage on the channel.
     """
 
     def __init__(self, alert_queue: queue.Queue, stop_event: threading.Event):
@@ -561,9 +783,10 @@ class AlertSenderThread(threading.Thread):
             self._drain_queue()
 
             now = time.monotonic()
+            flush_secs = CHANNEL_FLUSH_SECS if _channel.connected else ALERT_FLUSH_SECS
             should_send = (
                 len(self._buffer) >= ALERT_BATCH_SIZE
-                or (self._buffer and now - last_flush >= ALERT_FLUSH_SECS)
+                or (self._buffer and now - last_flush >= flush_secs)
             )
 
             if self._buffer and should_send:
@@ -599,26 +822,23 @@ class AlertSenderThread(threading.Thread):
 
     def _flush_buffer(self) -> bool:
         """
-        Send buffer in batches of ALERT_BATCH_SIZE.
+        Send buffer in batches of ALERT_BATCH_SIZE (pipelined on the channel).
         On first failure: schedule retry, return False.
         On full success: clear buffer, reset retry state, return True.
         """
         total   = len(self._buffer)
-        sent    = 0
-        batches = [self._buffer[i:i + ALERT_BATCH_SIZE]
-                   for i in range(0, total, ALERT_BATCH_SIZE)]
-
-        for batch in batches:
+        batches = []
+        for i in range(0, total, ALERT_BATCH_SIZE):
             ab = pb.AlertBatch()
-            ab.alerts.extend(batch)
-            body = _frame(ab.SerializeToString())
-            ok   = _post("/api/alerts/ingest", body)
-            if not ok:
-                # Leave unsent portion in buffer
-                self._buffer = self._buffer[sent:]
-                self._schedule_retry()
-                return False
-            sent += len(batch)
+            ab.alerts.extend(self._buffer[i:i + ALERT_BATCH_SIZE])
+            batches.append(ab)
+
+        done = _deliver("/api/alerts/ingest", "alerts", batches)
+        if done < len(batches):
+            # Leave unsent portion in buffer
+            self._buffer = self._buffer[done * ALERT_BATCH_SIZE:]
+            self._schedule_retry()
+            return False
 
         # All sent
         if not self._server_ok:
@@ -648,7 +868,8 @@ class AlertSenderThread(threading.Thread):
 
 class HeartbeatThread(threading.Thread):
     """
-    Sends a Heartbeat proto to /api/heartbeat every HEARTBEAT_INTERVAL_SECS.
+    Sends a Heartbeat proto every HEARTBEAT_INTERVAL_SECS, over the agent
+    channel or to /api/heartbeat.
     Carries agent version, uptime, track health, and rule-engine counters.
 
     If HEARTBEAT_REDISCOVER_AFTER consecutive heartbeats fail, the thread
@@ -697,6 +918,7 @@ class HeartbeatThread(threading.Thread):
                 discovered, SERVER_URL,
             )
             SERVER_URL = discovered
+            _channel.reset()
             if _HAS_REQUESTS:
                 _session.verify = CA_CERT if (CA_CERT and Path(CA_CERT).exists()) else True
             self._fail_count = 0
@@ -734,7 +956,7 @@ class HeartbeatThread(threading.Thread):
         hb.ioc_matches_total  = hc.get("ioc_matches", 0)
         hb.rule_hits_total    = hc.get("rule_hits",   0)
 
-        ok = _post("/api/heartbeat", _frame(hb.SerializeToString()))
+        ok = _deliver("/api/heartbeat", "heartbeat", [hb]) == 1
         if ok:
             log.debug("Heartbeat: sent (uptime=%ds host_alerts=%d net_alerts=%d)",
                       hb.uptime_seconds, hat, nat)
@@ -750,6 +972,21 @@ class HeartbeatThread(threading.Thread):
 # FL Poll Thread (network model only)
 # ─────────────────────────────────────────────────────────────────────────────
 
+def _merge_label_windows(windows: list) -> list:
+    """Merge overlapping or touching {"start", "end", "label"} windows that
+    share a label; result sorted by start."""
+    merged, last = [], {}
+    for w in sorted(windows, key=lambda w: float(w["start"])):
+        lo, hi, label = float(w["start"]), float(w["end"]), w["label"]
+        m = last.get(label)
+        if m is not None and lo <= m["end"]:
+            m["end"] = max(m["end"], hi)
+        else:
+            m = last[label] = {"start": lo, "end": hi, "label": label}
+            merged.append(m)
+    return merged
+
+
 class FLPollThread(threading.Thread):
     """
     Polls /api/fl/model/network for a newer global model and runs local
@@ -757,9 +994,17 @@ class FLPollThread(threading.Thread):
 
     Poll cycle  — every FL_POLL_SECS: fetch the latest global model and
                   hot-swap local weights if a newer round is available.
+                  The poll names the round we already have (If-None-Match /
+                  since_round), so an unchanged model is a bodyless 304, and
+                  a server with model deltas on sends just the change from
+                  that round; a server whose round went back (database
+                  reset) sends its full model, which replaces ours. While
+                  the agent channel is up the server also pushes each new
+                  round as it closes, and it is applied on the next tick.
     Retrain cycle — every FL_RETRAIN_SECS: read recent net_flows.csv rows,
                   pseudo-label with the current model, fine-tune with
-                  partial_fit, then POST an FLUpdate to /api/fl/update.
+                  partial_fit, then send an FLUpdate (channel or /api/fl/update)
+                  (compressed when FLARE_FL_ENCODING / FLARE_FL_TOPK are set).
     """
 
     # Minimum rows in the CSV before bothering to retrain
@@ -778,7 +1023,13 @@ class FLPollThread(threading.Thread):
         self._stop          = stop_event
         self._reload_event  = reload_event
         self._current_round = -1
+        self._model_etag: Optional[str] = None
+        self._global        = None   # (round, coefs, intercepts) last received: the delta base
+        self._fb_windows: list = []            # dashboard-feedback windows (merged)
+        self._fb_cursor: Optional[float] = None  # /api/fl/labels cursor for them
         self._last_retrain  = float("-inf")  # trigger retrain on first cycle
+        self._pushed: queue.Queue = queue.Queue()   # ModelUpdates pushed on the channel
+        _channel.on_model = self._pushed.put
 
     def run(self):
         log.info("FL-Poll: started (poll=%ds retrain=%ds test_mode=%s)",
@@ -788,6 +1039,8 @@ class FLPollThread(threading.Thread):
             time.sleep(0.25)
             if self._stop.is_set():
                 return
+            while not self._pushed.empty():
+                self._take(self._pushed.get_nowait(), etag=None)
             now = time.monotonic()
             if now - last_poll >= FL_POLL_SECS:
                 self._poll()
@@ -796,30 +1049,43 @@ class FLPollThread(threading.Thread):
                 self._retrain()
                 self._last_retrain = time.monotonic()
 
-    def _poll(self):
+    def _poll(self, full: bool = False):
+        url, headers = SERVER_URL + "/api/fl/model/network", {}
+        if full:
+            url += "?full=1"
+        else:
+            if self._current_round >= 0:
+                url += f"?since_round={self._current_round}"
+            if self._model_etag:
+                headers["If-None-Match"] = self._model_etag
         try:
             if _HAS_REQUESTS:
                 # Use the mTLS session (not bare _requests) so the CA cert and
                 # client cert are presented — required by the FLARE server.
-                resp = _session.get(
-                    SERVER_URL + "/api/fl/model/network",
-                    timeout=15,
-                )
+                resp = _session.get(url, headers=headers, timeout=15)
+                if resp.status_code == 304:
+                    log.debug("FL-Poll: already on round %d", self._current_round)
+                    return
                 if resp.status_code == 204:
                     log.info("FL-Poll: no global model on server yet (204)")
                     return
                 if resp.status_code != 200:
                     log.warning("FL-Poll: server returned %d", resp.status_code)
                     return
-                raw = resp.content
+                raw  = resp.content
+                etag = resp.headers.get("ETag")
             else:
-                req = _urllib_request.Request(
-                    SERVER_URL + "/api/fl/model/network"
-                )
-                with _urllib_request.urlopen(req, timeout=15) as r:
-                    if r.status == 204:
+                req = _urllib_request.Request(url, headers=headers)
+                try:
+                    with _urllib_request.urlopen(req, timeout=15, context=_tls_context()) as r:
+                        if r.status == 204:
+                            return
+                        raw  = r.read()
+                        etag = r.headers.get("ETag")
+                except _urllib_error.HTTPError as e:
+                    if e.code == 304:
                         return
-                    raw = r.read()
+                    raise
 
             # Unframe and parse ModelUpdate
             if len(raw) < 4:
@@ -828,24 +1094,73 @@ class FLPollThread(threading.Thread):
             body   = raw[4: 4 + length]
             mu     = pb.ModelUpdate()
             mu.ParseFromString(body)
-
-            if mu.round <= self._current_round:
-                log.debug("FL-Poll: already on round %d", self._current_round)
-                return
-
-            log.info("FL-Poll: new global model — round %d -> %d (%d clients)",
-                     self._current_round, mu.round, mu.client_count)
-            self._apply_model(mu)
-            self._current_round = mu.round
+            if mu.round < self._current_round and not mu.is_delta:
+                # Only sent for a since_round ahead of the server's own:
+                # its round went back (database reset or restore).
+                log.warning("FL-Poll: server is back on round %d (we hold %d) — taking its model",
+                            mu.round, self._current_round)
+                self._current_round = -1
+            self._take(mu, etag, full)
 
         except Exception as exc:
             log.debug("FL-Poll: error: %s", exc)
 
-    def _apply_model(self, mu: pb.ModelUpdate):
+    def _take(self, mu: pb.ModelUpdate, etag: Optional[str], full: bool = False):
+        """Apply a polled or pushed ModelUpdate when it is newer than ours. A
+        delta that can't be applied is replaced by a full poll."""
+        if mu.round <= self._current_round:
+            log.debug("FL-Poll: already on round %d", self._current_round)
+            return
+
+        log.info("FL-Poll: new global model — round %d -> %d (%d clients%s%s)",
+                 self._current_round, mu.round, mu.client_count,
+                 ", delta" if mu.is_delta else "", ", pushed" if etag is None else "")
+        if not self._apply_model(mu):
+            if mu.is_delta and not full:
+                self._poll(full=True)
+            return
+        self._current_round = mu.round
+        self._model_etag    = etag
+        _channel.model_round = mu.round
+
+    def _reconstruct(self, mu: pb.ModelUpdate) -> tuple:
+        """
+        (coefs, intercepts) float32 arrays carried by `mu`, in any
+        weight_codec encoding. A delta is added to the held model of
+        mu.base_round. Raises ValueError when the layout doesn't match, a
+        value is not finite, or the result fails mu.checksum.
+        """
+        import numpy as np
+
+        coefs      = [weight_codec.decode(lw) for lw in mu.coefs]
+        intercepts = [weight_codec.decode(lw) for lw in mu.intercepts]
+        if mu.is_delta:
+            held = self._global
+            if held is None or held[0] != mu.base_round:
+                raise ValueError(f"delta is from round {mu.base_round}, holding "
+                                 f"{held[0] if held else 'no model'}")
+            _, base_coefs, base_intercepts = held
+            if [a.shape for a in base_coefs] != [a.shape for a in coefs] or \
+                    [a.shape for a in base_intercepts] != [a.shape for a in intercepts]:
+                raise ValueError("delta layout does not match the held model")
+            coefs      = [b + d for b, d in zip(base_coefs, coefs)]
+            intercepts = [b + d for b, d in zip(base_intercepts, intercepts)]
+        if not all(np.isfinite(a).all() for a in coefs + intercepts):
+            raise ValueError("non-finite weights")
+        if mu.checksum and weight_codec.checksum(coefs + intercepts) != mu.checksum:
+            raise ValueError("checksum mismatch")
+        return coefs, intercepts
+
+    def _apply_model(self, mu: pb.ModelUpdate) -> bool:
         """
         Hot-swap the network MLP weights from a ModelUpdate message.
-        Loads the local sklearn MLP pkl, replaces coefs_ and intercepts_,
-        then saves it back so the inference engine picks it up on the next cycle.
+        Reconstructs and validates the weights (_reconstruct), loads the local
+        sklearn MLP pkl, replaces coefs_ and intercepts_, then saves it back so
+        the inference engine picks it up on the next cycle.
+
+        Returns False when the update's weights are unusable (the caller then
+        fetches the full model); True once the round has been taken, even if
+        the local pkl could not be updated.
 
         TODO: signal the running _NetInferWorker to reload its model in-memory
               rather than relying on the pkl file being re-read.
@@ -853,27 +1168,23 @@ class FLPollThread(threading.Thread):
         import numpy as np
         import joblib
 
+        try:
+            new_coefs, new_intercepts = self._reconstruct(mu)
+        except ValueError as exc:
+            log.warning("FL-Poll: round %d weights unusable — %s", mu.round, exc)
+            return False
+        self._global = (mu.round, [a.copy() for a in new_coefs],
+                        [a.copy() for a in new_intercepts])
+
         mlp_path = _AGENT_DIR / "network" / "models" / "network_mlp.pkl"
         if not mlp_path.exists():
             log.warning("FL-Poll: MLP pkl not found at %s — cannot apply update",
                         mlp_path)
-            return
+            return True
 
         try:
             mlp = joblib.load(mlp_path)
 
-            new_coefs = []
-            for lw in mu.coefs:
-                arr = np.array(lw.values, dtype=np.float32)
-                if lw.cols > 0:
-                    arr = arr.reshape(lw.rows, lw.cols)
-                new_coefs.append(arr)
-
-            new_intercepts = []
-            for lw in mu.intercepts:
-                arr = np.array(lw.values, dtype=np.float32)
-                new_intercepts.append(arr)
-
             # Guard: reject the update if the new weights have a different input
             # dimension than the model was trained on.  A mismatch means the server
             # is distributing a model from a different feature set (e.g. an older
@@ -890,7 +1201,7 @@ class FLPollThread(threading.Thread):
                         "Local model unchanged.",
                         mu.round, incoming_input_dim, expected_input_dim,
                     )
-                    return
+                    return True
                 mlp.coefs_ = new_coefs
             if new_intercepts:
                 mlp.intercepts_ = new_intercepts
@@ -922,6 +1233,7 @@ class FLPollThread(threading.Thread):
         except Exception as exc:
             log.error("FL-Poll: failed to apply model update: %s", exc,
                       exc_info=True)
+        return True
 
     def _retrain(self):
         """
@@ -943,12 +1255,11 @@ class FLPollThread(threading.Thread):
         """
         try:
             import shutil
-            import numpy as np
             import joblib
             import pandas as pd
             from datetime import date as _date, timedelta
             from network.flare_network_infer import _prepare_features, load_model
-            from network.fl_train import parse_gt_windows, label_flows, fine_tune, is_improvement
+            from network.fl_train import parse_gt_windows, label_flows, fine_tune, is_improvement, evaluate
         except ImportError as exc:
             log.warning("FL retrain: dependencies unavailable (%s) — skipping", exc)
             return
@@ -979,27 +1290,40 @@ class FLPollThread(threading.Thread):
                     log.warning("FL retrain: bad ground-truth file %s — %s", g.name, exc)
 
         # Dashboard-feedback labels (Phase B Step 2): fetch analyst-marked windows
-        # from the server. false_positive → BENIGN, resolved → ATTACK.
+        # from the server. false_positive → BENIGN, resolved → ATTACK. After the
+        # first fetch only windows changed since our cursor come back (unless
+        # the server says full); if the server is unreachable the cached ones
+        # are used.
         try:
             cid = _client_id()
             url = SERVER_URL + f"/api/fl/labels/{cid}"
+            if self._fb_cursor is not None:
+                url += f"?since={self._fb_cursor!r}"
             if _HAS_REQUESTS:
                 r = _session.get(url, timeout=(5, 10))
-                fb = r.json() if r.status_code == 200 else {}
+                fb = r.json() if r.status_code == 200 else None
             else:
                 import urllib.request as _ureq, json as _json
                 with _ureq.urlopen(_ureq.Request(url), timeout=10) as _r:
                     fb = _json.loads(_r.read())
-            for w in fb.get("windows", []):
-                if w["label"] == "BENIGN":
-                    fp_windows.append((float(w["start"]), float(w["end"])))
-                else:
-                    windows.append((float(w["start"]), float(w["end"])))
-            if fb.get("windows"):
-                log.info("FL retrain: fetched %d dashboard-feedback window(s) from server",
-                         len(fb["windows"]))
+            if fb is not None:
+                got = fb.get("windows", [])
+                # Older servers send no cursor and always the full list.
+                horizon = time.time() - 7 * 86400     # the server's default `days`
+                kept = ([] if fb.get("full", True) else
+                        [w for w in self._fb_windows if float(w["end"]) >= horizon])
+                self._fb_windows = _merge_label_windows(kept + got)
+                self._fb_cursor  = fb.get("cursor")
+                if got:
+                    log.info("FL retrain: fetched %d dashboard-feedback window(s) from server%s",
+                             len(got), "" if fb.get("full", True) else " (changed since last retrain)")
         except Exception as exc:
             log.warning("FL retrain: could not fetch dashboard labels — %s", exc)
+        for w in self._fb_windows:
+            if w["label"] == "BENIGN":
+                fp_windows.append((float(w["start"]), float(w["end"])))
+            else:
+                windows.append((float(w["start"]), float(w["end"])))
 
         log.info("FL retrain: attack windows=%d  fp windows=%d", len(windows), len(fp_windows))
 
@@ -1100,36 +1424,58 @@ class FLPollThread(threading.Thread):
             flu.sample_count = int(n_atk + n_ben)
             flu.base_round   = max(self._current_round, 0)
             flu.local_loss   = float(after["fp_rate"])
-            for W in model.coefs_:
-                lw = flu.coefs.add()
-                lw.values.extend(np.asarray(W, dtype=np.float32).ravel().tolist())
-                lw.rows, lw.cols = int(W.shape[0]), int(W.shape[1])
-            for b in model.intercepts_:
-                lw = flu.intercepts.add()
-                lw.values.extend(np.asarray(b, dtype=np.float32).ravel().tolist())
-                lw.rows, lw.cols = int(len(b)), 0
-
-            payload = struct.pack(">I", len(flu.SerializeToString())) + flu.SerializeToString()
-            if _HAS_REQUESTS:
-                resp = _session.post(SERVER_URL + "/api/fl/update", data=payload,
-                                     headers={"Content-Type": "application/octet-stream"}, timeout=30)
-                ok = resp.status_code == 200
-            else:
-                import urllib.request as _ureq
-                req = _ureq.Request(SERVER_URL + "/api/fl/update", data=payload,
-                                    headers={"Content-Type": "application/octet-stream"}, method="POST")
-                with _ureq.urlopen(req, timeout=30) as r:
-                    ok = r.status == 200
-            if ok:
-                log.info("FL retrain: FLUpdate (weights) submitted (round=%d samples=%d FP=%.2f%%)",
-                         flu.base_round, flu.sample_count, after["fp_rate"] * 100)
+            form = self._encode_weights(flu, model, Xs, y, evaluate, is_improvement)
+
+            if _deliver("/api/fl/update", "fl_update", [flu], timeout=30) == 1:
+                log.info("FL retrain: FLUpdate (%s, %d bytes) submitted (round=%d samples=%d FP=%.2f%%)",
+                         form, flu.ByteSize(), flu.base_round, flu.sample_count, after["fp_rate"] * 100)
             else:
-                log.warning("FL retrain: server rejected FLUpdate (status=%s)",
-                            getattr(resp, "status_code", "?"))
+                log.warning("FL retrain: FLUpdate not accepted by the server")
         except Exception as exc:
             log.warning("FL retrain: failed to submit FLUpdate — %s", exc)
         return
 
+    def _encode_weights(self, flu, model, Xs, y, evaluate, is_improvement) -> str:
+        """
+        Fill flu.coefs / flu.intercepts from `model`; returns what was sent.
+
+        With FLARE_FL_ENCODING / FLARE_FL_TOPK set, send the compressed delta
+        against the held global model of flu.base_round (or the quantised full
+        weights when there is none) — but only if the model the server will
+        reconstruct still passes is_improvement() against the exact one on
+        Xs / y. Otherwise, and by default, send exact float32 weights.
+        """
+        import copy
+        import numpy as np
+
+        n_coefs = len(model.coefs_)
+        layers  = [np.asarray(a, dtype=np.float32) for a in list(model.coefs_) + list(model.intercepts_)]
+
+        if FL_ENCODING != weight_codec.FLOAT32 or FL_TOPK > 0:
+            base = None
+            if self._global is not None and self._global[0] == flu.base_round:
+                base = self._global[1] + self._global[2]
+                if [a.shape for a in base] != [a.shape for a in layers]:
+                    base = None
+            send = [a - b for a, b in zip(layers, base)] if base else layers
+            topk = FL_TOPK if base else 0.0
+            lossy = [weight_codec.quantize(a, FL_ENCODING, topk) for a in send]
+            if base:
+                lossy = [b + d for b, d in zip(base, lossy)]
+            probe = copy.deepcopy(model)
+            probe.coefs_, probe.intercepts_ = lossy[:n_coefs], lossy[n_coefs:]
+            if is_improvement(evaluate(model, Xs, y), evaluate(probe, Xs, y)):
+                for i, a in enumerate(send):
+                    weight_codec.encode((flu.coefs if i < n_coefs else flu.intercepts).add(),
+                                        a, FL_ENCODING, topk)
+                flu.is_delta = bool(base)
+                return "delta" if base else "quantised weights"
+            log.info("FL retrain: compressed weights would regress FP/recall — sending them exact")
+
+        for i, a in enumerate(layers):
+            weight_codec.encode((flu.coefs if i < n_coefs else flu.intercepts).add(), a)
+        return "weights"
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Log-fetch worker
@@ -1462,7 +1808,7 @@ def _send_goodbye_heartbeat() -> None:
         hb.net_alerts_total  = nat
         hb.ioc_matches_total = hc.get("ioc_matches", 0)
         hb.rule_hits_total   = hc.get("rule_hits",   0)
-        _post("/api/heartbeat", _frame(hb.SerializeToString()))
+        _deliver("/api/heartbeat", "heartbeat", [hb])
         log.info("Goodbye heartbeat sent — server will mark agent offline")
     except Exception as exc:
         log.debug("Goodbye heartbeat failed: %s", exc)
@@ -88,7 +88,8 @@ _FLOOD_MIN_FLOWS     = 50   # minimum matching flows before raising flood alert
 #  5353      : mDNS (Bonjour / multicast DNS)
 #  1900      : SSDP (UPnP discovery)
 #  123       : NTP
-_UDP_FLOOD_EXCLUDE_PORTS = {443, 80, 5353, 1900, 123, 37020}
+#  37020/1   : FLARE discovery (beacon, probes)
+_UDP_FLOOD_EXCLUDE_PORTS = {443, 80, 5353, 1900, 123, 37020, 37021}
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Model loading
@@ -718,6 +719,7 @@ def run_once(
     # resemble attack signatures but are entirely normal system behaviour.
     _SKIP_PORTS = {
         37020,          # FLARE server beacon (our own control plane)
+        37021,          # FLARE discovery probes to the server
         53,             # DNS — always UDP query/response, never an attack source
         67, 68,         # DHCP — broadcast, 1 packet, no response expected
         137, 138, 139,  # NetBIOS name/datagram/session — LAN broadcast noise
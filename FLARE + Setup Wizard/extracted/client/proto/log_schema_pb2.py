@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10log_schema.proto\x12\x05\x66lare\"/\n\nPrediction\x12\r\n\x05label\x18\x01 \x01(\t\x12\x12\n\nconfidence\x18\x02 \x01(\x02\"\xa3\x03\n\nAlertEvent\x12\x10\n\x08\x61lert_id\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\t\x12\x11\n\tclient_id\x18\x03 \x01(\t\x12\x11\n\tclient_ip\x18\x04 \x01(\t\x12!\n\x08severity\x18\x05 \x01(\x0e\x32\x0f.flare.Severity\x12\x1b\n\x05track\x18\x06 \x01(\x0e\x32\x0c.flare.Track\x12\x13\n\x0b\x61ttack_type\x18\x07 \x01(\t\x12\x12\n\nconfidence\x18\x08 \x01(\x02\x12\x14\n\x0cwindow_start\x18\t \x01(\t\x12\x12\n\nwindow_end\x18\n \x01(\t\x12\x13\n\x0b\x65vent_count\x18\x0b \x01(\x05\x12\x1f\n\x04top3\x18\x0c \x03(\x0b\x32\x11.flare.Prediction\x12\x10\n\x08\x65vidence\x18\r \x01(\t\x12\x0f\n\x07rule_id\x18\x0e \x01(\t\x12\x10\n\x08mitre_id\x18\x0f \x01(\t\x12\x14\n\x0cmitre_tactic\x18\x10 \x01(\t\x12\x12\n\nsuggestion\x18\x11 \x01(\t\x12\x11\n\trisk_note\x18\x12 \x01(\t\x12\x0f\n\x07raw_log\x18\x13 \x01(\t\"/\n\nAlertBatch\x12!\n\x06\x61lerts\x18\x01 \x03(\x0b\x32\x11.flare.AlertEvent\"\xba\x02\n\tHeartbeat\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\t\x12\x11\n\tclient_ip\x18\x03 \x01(\t\x12\x15\n\ragent_version\x18\x04 \x01(\t\x12\x17\n\x0fhost_model_hash\x18\x05 \x01(\t\x12\x16\n\x0enet_model_hash\x18\x06 \x01(\t\x12\x16\n\x0euptime_seconds\x18\x07 \x01(\x05\x12\x15\n\rhost_track_ok\x18\x08 \x01(\x08\x12\x14\n\x0cnet_track_ok\x18\t \x01(\x08\x12\x19\n\x11host_alerts_total\x18\n \x01(\x05\x12\x18\n\x10net_alerts_total\x18\x0b \x01(\x05\x12\x19\n\x11ioc_matches_total\x18\x0c \x01(\x05\x12\x17\n\x0frule_hits_total\x18\r \x01(\x05\">\n\x0cLayerWeights\x12\x12\n\x06values\x18\x01 \x03(\x02\x42\x02\x10\x01\x12\x0c\n\x04rows\x18\x02 \x01(\x05\x12\x0c\n\x04\x63ols\x18\x03 \x01(\x05\"\x8b\x02\n\x08\x46LUpdate\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x11\n\tclient_id\x18\x02 \x01(\t\x12\x1b\n\x05track\x18\x03 \x01(\x0e\x32\x0c.flare.Track\x12\x14\n\x0csample_count\x18\x04 \x01(\x05\x12\x12\n\nbase_round\x18\x05 \x01(\x05\x12\"\n\x05\x63oefs\x18\x06 \x03(\x0b\x32\x13.flare.LayerWeights\x12\'\n\nintercepts\x18\x07 \x03(\x0b\x32\x13.flare.LayerWeights\x12\x12\n\nlocal_loss\x18\x08 \x01(\x02\x12\x17\n\x0bscaler_mean\x18\t \x03(\x02\x42\x02\x10\x01\x12\x18\n\x0cscaler_scale\x18\n \x03(\x02\x42\x02\x10\x01\"\xf3\x01\n\x0bModelUpdate\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x1b\n\x05track\x18\x02 \x01(\x0e\x32\x0c.flare.Track\x12\x0f\n\x07version\x18\x03 \x01(\t\x12\r\n\x05round\x18\x04 \x01(\x05\x12\x14\n\x0c\x63lient_count\x18\x05 \x01(\x05\x12\"\n\x05\x63oefs\x18\x06 \x03(\x0b\x32\x13.flare.LayerWeights\x12\'\n\nintercepts\x18\x07 \x03(\x0b\x32\x13.flare.LayerWeights\x12\x17\n\x0bscaler_mean\x18\x08 \x03(\x02\x42\x02\x10\x01\x12\x18\n\x0cscaler_scale\x18\t \x03(\x02\x42\x02\x10\x01*q\n\x08Severity\x12\x14\n\x10SEVERITY_UNKNOWN\x10\x00\x12\x10\n\x0cSEVERITY_LOW\x10\x01\x12\x13\n\x0fSEVERITY_MEDIUM\x10\x02\x12\x11\n\rSEVERITY_HIGH\x10\x03\x12\x15\n\x11SEVERITY_CRITICAL\x10\x04*=\n\x05Track\x12\x11\n\rTRACK_UNKNOWN\x10\x00\x12\x0e\n\nTRACK_HOST\x10\x01\x12\x11\n\rTRACK_NETWORK\x10\x02\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10log_schema.proto\x12\x05\x66lare\"/\n\nPrediction\x12\r\n\x05label\x18\x01 \x01(\t\x12\x12\n\nconfidence\x18\x02 \x01(\x02\"\xa3\x03\n\nAlertEvent\x12\x10\n\x08\x61lert_id\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\t\x12\x11\n\tclient_id\x18\x03 \x01(\t\x12\x11\n\tclient_ip\x18\x04 \x01(\t\x12!\n\x08severity\x18\x05 \x01(\x0e\x32\x0f.flare.Severity\x12\x1b\n\x05track\x18\x06 \x01(\x0e\x32\x0c.flare.Track\x12\x13\n\x0b\x61ttack_type\x18\x07 \x01(\t\x12\x12\n\nconfidence\x18\x08 \x01(\x02\x12\x14\n\x0cwindow_start\x18\t \x01(\t\x12\x12\n\nwindow_end\x18\n \x01(\t\x12\x13\n\x0b\x65vent_count\x18\x0b \x01(\x05\x12\x1f\n\x04top3\x18\x0c \x03(\x0b\x32\x11.flare.Prediction\x12\x10\n\x08\x65vidence\x18\r \x01(\t\x12\x0f\n\x07rule_id\x18\x0e \x01(\t\x12\x10\n\x08mitre_id\x18\x0f \x01(\t\x12\x14\n\x0cmitre_tactic\x18\x10 \x01(\t\x12\x12\n\nsuggestion\x18\x11 \x01(\t\x12\x11\n\trisk_note\x18\x12 \x01(\t\x12\x0f\n\x07raw_log\x18\x13 \x01(\t\"/\n\nAlertBatch\x12!\n\x06\x61lerts\x18\x01 \x03(\x0b\x32\x11.flare.AlertEvent\"\xba\x02\n\tHeartbeat\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\t\x12\x11\n\tclient_ip\x18\x03 \x01(\t\x12\x15\n\ragent_version\x18\x04 \x01(\t\x12\x17\n\x0fhost_model_hash\x18\x05 \x01(\t\x12\x16\n\x0enet_model_hash\x18\x06 \x01(\t\x12\x16\n\x0euptime_seconds\x18\x07 \x01(\x05\x12\x15\n\rhost_track_ok\x18\x08 \x01(\x08\x12\x14\n\x0cnet_track_ok\x18\t \x01(\x08\x12\x19\n\x11host_alerts_total\x18\n \x01(\x05\x12\x18\n\x10net_alerts_total\x18\x0b \x01(\x05\x12\x19\n\x11ioc_matches_total\x18\x0c \x01(\x05\x12\x17\n\x0frule_hits_total\x18\r \x01(\x05\"\x9c\x01\n\x0cLayerWeights\x12\x12\n\x06values\x18\x01 \x03(\x02\x42\x02\x10\x01\x12\x0c\n\x04rows\x18\x02 \x01(\x05\x12\x0c\n\x04\x63ols\x18\x03 \x01(\x05\x12\'\n\x08\x65ncoding\x18\x04 \x01(\x0e\x32\x15.flare.WeightEncoding\x12\x0c\n\x04\x64\x61ta\x18\x05 \x01(\x0c\x12\r\n\x05scale\x18\x06 \x01(\x02\x12\x16\n\nindex_gaps\x18\x07 \x03(\rB\x02\x10\x01\"\x9d\x02\n\x08\x46LUpdate\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x11\n\tclient_id\x18\x02 \x01(\t\x12\x1b\n\x05track\x18\x03 \x01(\x0e\x32\x0c.flare.Track\x12\x14\n\x0csample_count\x18\x04 \x01(\x05\x12\x12\n\nbase_round\x18\x05 \x01(\x05\x12\"\n\x05\x63oefs\x18\x06 \x03(\x0b\x32\x13.flare.LayerWeights\x12\'\n\nintercepts\x18\x07 \x03(\x0b\x32\x13.flare.LayerWeights\x12\x12\n\nlocal_loss\x18\x08 \x01(\x02\x12\x17\n\x0bscaler_mean\x18\t \x03(\x02\x42\x02\x10\x01\x12\x18\n\x0cscaler_scale\x18\n \x03(\x02\x42\x02\x10\x01\x12\x10\n\x08is_delta\x18\x0b \x01(\x08\"\xab\x02\n\x0bModelUpdate\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x1b\n\x05track\x18\x02 \x01(\x0e\x32\x0c.flare.Track\x12\x0f\n\x07version\x18\x03 \x01(\t\x12\r\n\x05round\x18\x04 \x01(\x05\x12\x14\n\x0c\x63lient_count\x18\x05 \x01(\x05\x12\"\n\x05\x63oefs\x18\x06 \x03(\x0b\x32\x13.flare.LayerWeights\x12\'\n\nintercepts\x18\x07 \x03(\x0b\x32\x13.flare.LayerWeights\x12\x17\n\x0bscaler_mean\x18\x08 \x03(\x02\x42\x02\x10\x01\x12\x18\n\x0cscaler_scale\x18\t \x03(\x02\x42\x02\x10\x01\x12\x10\n\x08is_delta\x18\n \x01(\x08\x12\x12\n\nbase_round\x18\x0b \x01(\x05\x12\x10\n\x08\x63hecksum\x18\x0c \x01(\x07\"M\n\x0c\x43hannelHello\x12\x11\n\tclient_id\x18\x01 \x01(\t\x12\x15\n\ragent_version\x18\x02 \x01(\t\x12\x13\n\x0bmodel_round\x18\x03 \x01(\x05\"B\n\x03\x41\x63k\x12\x0b\n\x03seq\x18\x01 \x01(\x04\x12\x0e\n\x06status\x18\x02 \x01(\x05\x12\x0e\n\x06\x64\x65tail\x18\x03 \x01(\t\x12\x0e\n\x06queued\x18\x04 \x01(\x05\"\xfd\x01\n\x0e\x43hannelMessage\x12\x0b\n\x03seq\x18\x01 \x01(\x04\x12$\n\x05hello\x18\x02 \x01(\x0b\x32\x13.flare.ChannelHelloH\x00\x12#\n\x06\x61lerts\x18\x03 \x01(\x0b\x32\x11.flare.AlertBatchH\x00\x12%\n\theartbeat\x18\x04 \x01(\x0b\x32\x10.flare.HeartbeatH\x00\x12$\n\tfl_update\x18\x05 \x01(\x0b\x32\x0f.flare.FLUpdateH\x00\x12#\n\x05model\x18\x06 \x01(\x0b\x32\x12.flare.ModelUpdateH\x00\x12\x19\n\x03\x61\x63k\x18\x07 \x01(\x0b\x32\n.flare.AckH\x00\x42\x06\n\x04\x62ody*q\n\x08Severity\x12\x14\n\x10SEVERITY_UNKNOWN\x10\x00\x12\x10\n\x0cSEVERITY_LOW\x10\x01\x12\x13\n\x0fSEVERITY_MEDIUM\x10\x02\x12\x11\n\rSEVERITY_HIGH\x10\x03\x12\x15\n\x11SEVERITY_CRITICAL\x10\x04*=\n\x05Track\x12\x11\n\rTRACK_UNKNOWN\x10\x00\x12\x0e\n\nTRACK_HOST\x10\x01\x12\x11\n\rTRACK_NETWORK\x10\x02*L\n\x0eWeightEncoding\x12\x13\n\x0fWEIGHTS_FLOAT32\x10\x00\x12\x13\n\x0fWEIGHTS_FLOAT16\x10\x01\x12\x10\n\x0cWEIGHTS_INT8\x10\x02\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,6 +33,8 @@ if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_LAYERWEIGHTS'].fields_by_name['values']._loaded_options = None
   _globals['_LAYERWEIGHTS'].fields_by_name['values']._serialized_options = b'\020\001'
+  _globals['_LAYERWEIGHTS'].fields_by_name['index_gaps']._loaded_options = None
+  _globals['_LAYERWEIGHTS'].fields_by_name['index_gaps']._serialized_options = b'\020\001'
   _globals['_FLUPDATE'].fields_by_name['scaler_mean']._loaded_options = None
   _globals['_FLUPDATE'].fields_by_name['scaler_mean']._serialized_options = b'\020\001'
   _globals['_FLUPDATE'].fields_by_name['scaler_scale']._loaded_options = None
@@ -41,10 +43,12 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_MODELUPDATE'].fields_by_name['scaler_mean']._serialized_options = b'\020\001'
   _globals['_MODELUPDATE'].fields_by_name['scaler_scale']._loaded_options = None
   _globals['_MODELUPDATE'].fields_by_name['scaler_scale']._serialized_options = b'\020\001'
-  _globals['_SEVERITY']._serialized_start=1444
-  _globals['_SEVERITY']._serialized_end=1557
-  _globals['_TRACK']._serialized_start=1559
-  _globals['_TRACK']._serialized_end=1620
+  _globals['_SEVERITY']._serialized_start=2016
+  _globals['_SEVERITY']._serialized_end=2129
+  _globals['_TRACK']._serialized_start=2131
+  _globals['_TRACK']._serialized_end=2192
+  _globals['_WEIGHTENCODING']._serialized_start=2194
+  _globals['_WEIGHTENCODING']._serialized_end=2270
   _globals['_PREDICTION']._serialized_start=27
   _globals['_PREDICTION']._serialized_end=74
   _globals['_ALERTEVENT']._serialized_start=77
@@ -53,10 +57,16 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_ALERTBATCH']._serialized_end=545
   _globals['_HEARTBEAT']._serialized_start=548
   _globals['_HEARTBEAT']._serialized_end=862
-  _globals['_LAYERWEIGHTS']._serialized_start=864
-  _globals['_LAYERWEIGHTS']._serialized_end=926
-  _globals['_FLUPDATE']._serialized_start=929
-  _globals['_FLUPDATE']._serialized_end=1196
-  _globals['_MODELUPDATE']._serialized_start=1199
-  _globals['_MODELUPDATE']._serialized_end=1442
+  _globals['_LAYERWEIGHTS']._serialized_start=865
+  _globals['_LAYERWEIGHTS']._serialized_end=1021
+  _globals['_FLUPDATE']._serialized_start=1024
+  _globals['_FLUPDATE']._serialized_end=1309
+  _globals['_MODELUPDATE']._serialized_start=1312
+  _globals['_MODELUPDATE']._serialized_end=1611
+  _globals['_CHANNELHELLO']._serialized_start=1613
+  _globals['_CHANNELHELLO']._serialized_end=1690
+  _globals['_ACK']._serialized_start=1692
+  _globals['_ACK']._serialized_end=1758
+  _globals['_CHANNELMESSAGE']._serialized_start=1761
+  _globals['_CHANNELMESSAGE']._serialized_end=2014
 # @@protoc_insertion_point(module_scope)
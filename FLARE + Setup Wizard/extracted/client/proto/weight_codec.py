@@ -0,0 +1,175 @@
+"""
+FLARE - FL Weight Transport Codec
+──────────────────────────────────
+Encodes numpy weight tensors into LayerWeights messages (log_schema.proto)
+and back, for FLUpdate (agent -> server) and ModelUpdate (server -> agent).
+Identical copies live in server/proto and client/proto, like the schema.
+
+  WEIGHTS_FLOAT32  `values`, exact (what every older peer sends and reads)
+  WEIGHTS_FLOAT16  `data`, 2 bytes per value
+  WEIGHTS_INT8     `data`, 1 byte per value, value = q * scale with one
+                   symmetric scale per tensor (max |x| / 127)
+
+Any encoding can be combined with top-k sparsification (`topk`, a fraction of
+the values): only the largest-magnitude values are kept and `index_gaps`
+records where they go. That only makes sense for deltas, where most entries
+are near zero.
+
+decode() in float32 is deterministic, so a sender that applies
+quantize() to a delta knows bit for bit what the receiver will reconstruct;
+checksum() lets the receiver confirm it.
+
+Usage
+-----
+  # Bytes per exchange and reconstruction error for the network MLP
+  python -m proto.weight_codec --bench
+"""
+
+import argparse
+import zlib
+from typing import Iterable, Optional
+
+import numpy as np
+
+from . import log_schema_pb2 as pb
+
+FLOAT32 = pb.WEIGHTS_FLOAT32
+FLOAT16 = pb.WEIGHTS_FLOAT16
+INT8    = pb.WEIGHTS_INT8
+
+# Largest tensor decode() builds: what one 16 MiB frame (frame_stream.MAX_FRAME)
+# holds as dense float32. A sparse message names its shape for a few bytes, so
+# the shape is checked against this before anything is allocated.
+MAX_VALUES = 1 << 22
+
+# Configuration names (FLARE_FL_ENCODING / FLARE_FL_MODEL_ENCODING).
+ENCODINGS = {"none": FLOAT32, "float32": FLOAT32, "float16": FLOAT16, "int8": INT8}
+
+
+def parse_encoding(name: str) -> int:
+    try:
+        return ENCODINGS[name.strip().lower()]
+    except KeyError:
+        raise ValueError(f"unknown weight encoding {name!r} "
+                         f"(expected one of {', '.join(ENCODINGS)})") from None
+
+
+def encode(lw, arr, encoding: int = FLOAT32, topk: float = 0.0):
+    """Fill LayerWeights `lw` with `arr` (1-D or 2-D). Returns `lw`."""
+    arr  = np.asarray(arr, dtype=np.float32)
+    flat = arr.ravel()
+    lw.rows = arr.shape[0] if arr.ndim else 1
+    lw.cols = arr.shape[1] if arr.ndim > 1 else 0
+    if 0 < topk < 1 and flat.size:
+        k = max(1, int(np.ceil(topk * flat.size)))
+        if k < flat.size:
+            idx = np.sort(np.argpartition(np.abs(flat), flat.size - k)[flat.size - k:])
+            lw.index_gaps.extend(np.diff(idx, prepend=-1).tolist())
+            flat = flat[idx]
+    lw.encoding = encoding
+    if encoding == FLOAT16:
+        lw.data = flat.astype("<f2").tobytes()
+    elif encoding == INT8:
+        peak  = float(np.max(np.abs(flat))) if flat.size else 0.0
+        scale = np.float32(peak / 127.0)
+        lw.scale = float(scale)
+        q = np.clip(np.rint(flat / scale), -127, 127) if scale > 0 else np.zeros(flat.size)
+        lw.data = q.astype(np.int8).tobytes()
+    elif encoding == FLOAT32:
+        lw.values.extend(flat.tolist())
+    else:
+        raise ValueError(f"unknown weight encoding {encoding}")
+    return lw
+
+
+def decode(lw, size: Optional[int] = None) -> np.ndarray:
+    """LayerWeights -> float32 array of shape (rows, cols), or (rows,) when
+    cols is 0. `size`, when given, is the number of values the tensor must
+    hold (the layout it will be used with); it and MAX_VALUES are checked
+    before any array is built. Raises ValueError when the message is
+    inconsistent or too large."""
+    if lw.rows < 0 or lw.cols < 0:
+        raise ValueError(f"tensor shape {lw.rows}x{lw.cols} is negative")
+    n = lw.rows * (lw.cols if lw.cols > 0 else 1)
+    if size is not None and n != size:
+        raise ValueError(f"tensor shape {lw.rows}x{lw.cols} holds {n} values, expected {size}")
+    if n > MAX_VALUES:
+        raise ValueError(f"tensor shape {lw.rows}x{lw.cols} exceeds {MAX_VALUES} values")
+    if lw.encoding == FLOAT32:
+        vals = np.array(lw.values, dtype=np.float32)
+    elif lw.encoding == FLOAT16:
+        vals = np.frombuffer(lw.data, dtype="<f2").astype(np.float32)
+    elif lw.encoding == INT8:
+        vals = np.frombuffer(lw.data, dtype=np.int8).astype(np.float32) * np.float32(lw.scale)
+    else:
+        raise ValueError(f"unknown weight encoding {lw.encoding}")
+    if lw.index_gaps:
+        idx = np.cumsum(np.array(lw.index_gaps, dtype=np.int64)) - 1
+        if idx.size != vals.size or idx[0] < 0 or idx[-1] >= n:
+            raise ValueError("sparse tensor indices do not match its values or shape")
+        out = np.zeros(n, dtype=np.float32)
+        out[idx] = vals
+        vals = out
+    elif vals.size != n:
+        raise ValueError(f"tensor holds {vals.size} values, shape {lw.rows}x{lw.cols} needs {n}")
+    return vals.reshape((lw.rows, lw.cols) if lw.cols > 0 else (lw.rows,))
+
+
+def quantize(arr, encoding: int, topk: float = 0.0) -> np.ndarray:
+    """What the receiver of encode(arr, encoding, topk) reconstructs."""
+    return decode(encode(pb.LayerWeights(), arr, encoding, topk))
+
+
+def checksum(arrays: Iterable) -> int:
+    """CRC-32 over the float32 little-endian bytes of `arrays`, in order."""
+    crc = 0
+    for a in arrays:
+        crc = zlib.crc32(np.ascontiguousarray(a, dtype="<f4").tobytes(), crc)
+    return crc
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Micro-benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _bench():
+    rng   = np.random.default_rng(0)
+    sizes = (38, 64, 32, 1)
+    base  = [rng.standard_normal((a, b)).astype(np.float32) * 0.3 for a, b in zip(sizes, sizes[1:])]
+    base += [rng.standard_normal(b).astype(np.float32) * 0.1 for b in sizes[1:]]
+    new   = [b + rng.standard_normal(b.shape).astype(np.float32) * 0.01 for b in base]
+    n = sum(a.size for a in base)
+
+    def size(arrays, enc, topk=0.0):
+        mu = pb.ModelUpdate()
+        for a in arrays:
+            encode(mu.coefs.add(), a, enc, topk)
+        return mu.ByteSize()
+
+    full = size(new, FLOAT32)
+    print(f"  network MLP {'-'.join(map(str, sizes))}: {n} weights")
+    print(f"    {'form':<26}{'bytes':>8}{'ratio':>8}{'rel. error':>12}")
+    print(f"    {'full float32':<26}{full:>8}{1:>8.1f}x{0:>12.1e}")
+    delta = [a - b for a, b in zip(new, base)]
+    ref   = np.sqrt(sum(float((d.astype(np.float64) ** 2).sum()) for d in delta))
+    for label, enc, topk in (("delta float16", FLOAT16, 0), ("delta int8", INT8, 0),
+                             ("delta int8, top 10%", INT8, 0.1), ("delta float16, top 10%", FLOAT16, 0.1)):
+        err = np.sqrt(sum(float(((quantize(d, enc, topk) - d).astype(np.float64) ** 2).sum())
+                          for d in delta)) / ref
+        b = size(delta, enc, topk)
+        print(f"    {label:<26}{b:>8}{full / b:>8.1f}x{err:>12.1e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE FL weight transport codec")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare encodings for the network MLP")
+    args = parser.parse_args()
+    if args.bench:
+        _bench()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@
       2. Grants explicit read access on the Security channel via wevtutil
         (Security requires a separate ACL beyond Event Log Readers).
       3. Grants the target account Modify rights to the agent directory.
-      4. Adds an outbound firewall rule for TCP 7331 to the FLARE server.
+      4. Adds an outbound firewall rule for TCP 7331 and 7332 (agent channel) to the FLARE server.
 
 .PARAMETER Account
     The Windows account that will run flare_agent.py.
@@ -167,12 +167,12 @@ if (Get-NetFirewallRule -DisplayName $ruleName -ErrorAction SilentlyContinue) {
             -DisplayName $ruleName `
             -Direction   Outbound `
             -Protocol    TCP `
-            -RemotePort  $ServerPort `
+            -RemotePort  $ServerPort, 7332 `
             -Action      Allow `
             -Profile     Any `
             -Description "Allow FLARE agent to POST alerts and heartbeats to the FLARE server" |
             Out-Null
-        Write-OK "Firewall rule created (TCP outbound port $ServerPort)"
+        Write-OK "Firewall rule created (TCP outbound ports $ServerPort, 7332)"
     } catch {
         Write-Warn "Could not create firewall rule: $_"
     }
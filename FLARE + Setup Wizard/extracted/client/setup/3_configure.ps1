@@ -56,7 +56,7 @@ if ($ips.Count -eq 0) {
     $selectedIp = $ips[[int]$choice - 1].IPAddress
 }
 
-Write-Host "`n  [+] Listening for server beacon (UDP 37020) on $selectedIp..." -ForegroundColor Cyan
+Write-Host "`n  [+] Looking for the server (probe UDP 37021, beacon UDP 37020) on $selectedIp..." -ForegroundColor Cyan
 
 $discoveredUrl = $null
 try {
@@ -66,12 +66,26 @@ try {
     $udpClient.Client.SetSocketOption([System.Net.Sockets.SocketOptionLevel]::Socket, [System.Net.Sockets.SocketOptionName]::ReuseAddress, $true)
     $udpClient.ExclusiveAddressUse = $false
     $udpClient.Client.Bind($udpEndpoint)
-    $udpClient.Client.ReceiveTimeout = 5000
+    $udpClient.EnableBroadcast = $true
+    $udpClient.Client.ReceiveTimeout = 1000
+
+    # Probe the server's discovery responder (UDP 37021) once a second rather
+    # than waiting for its beacon, which backs off after the server starts.
+    # The directed broadcast is what leaves a socket bound to one address.
+    $probe   = [System.Text.Encoding]::UTF8.GetBytes("FLARE_DISCOVER")
+    $probeTo = @("255.255.255.255")
+    if ($selectedIp -ne "0.0.0.0") {
+        $o = $selectedIp.Split('.')
+        $probeTo += "$($o[0]).$($o[1]).$($o[2]).255"
+    }
 
     $deadline = [DateTime]::UtcNow.AddSeconds(15)
     while ([DateTime]::UtcNow -lt $deadline) {
+        foreach ($dest in $probeTo) {
+            try { [void]$udpClient.Send($probe, $probe.Length, $dest, 37021) } catch {}
+        }
         $ep = New-Object System.Net.IPEndPoint([System.Net.IPAddress]::Any, 0)
-        $bytes = $udpClient.Receive([ref]$ep)
+        try { $bytes = $udpClient.Receive([ref]$ep) } catch { continue }
         $msg = [System.Text.Encoding]::UTF8.GetString($bytes)
         if ($msg -match '^FLARE_SERVER::([^:]+)::(\d+)$') {
             $discoveredUrl = "https://$($Matches[1]):$($Matches[2])"
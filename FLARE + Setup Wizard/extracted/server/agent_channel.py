@@ -0,0 +1,426 @@
+"""
+FLARE - Agent Channel
+──────────────────────────────────
+One long-lived connection per agent instead of one HTTPS POST per message.
+Agents connect to FLARE_CHANNEL_PORT over TLS with their client certificate
+and stream framed ChannelMessages (proto/log_schema.proto) both ways:
+
+  up    a ChannelHello, then AlertBatch / Heartbeat / FLUpdate messages.
+        Each is answered by an Ack carrying its seq and the status the HTTP
+        endpoint would have returned. Up to MAX_IN_FLIGHT messages per
+        connection are handled concurrently, so an agent pipelines a backlog
+        rather than paying a round trip (and request headers) per batch.
+  down  the network-track ModelUpdate, pushed the moment a round is
+        installed — as a delta to agents one round behind when model deltas
+        are on — instead of waiting for the agent's next poll.
+
+Unlike the dashboard port, no browser connects here, so the TLS layer
+requires a client certificate signed by the FLARE CA. Messages go through
+the same code as the HTTP endpoints (flare_server.py passes it in), and the
+endpoints stay available for agents that can't reach the channel.
+
+With several worker processes (cluster.py) each worker listens on the port:
+with SO_REUSEPORT where the OS has it, otherwise one worker holds the port
+and the others retry the bind until it exits.
+
+Usage
+-----
+  # Heartbeat and alert-batch latency and throughput, HTTPS POST vs channel
+  python agent_channel.py --bench [-n 2000] [--batch 20]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import ssl
+import statistics
+import struct
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from proto import log_schema_pb2 as pb
+
+log = logging.getLogger("flare_server.channel")
+
+CHANNEL_PORT   = 7332
+MAX_FRAME      = 16 * 1024 * 1024   # bytes; a bigger length prefix closes the connection
+MAX_IN_FLIGHT  = 64                 # messages handled at once per connection
+IDLE_TIMEOUT_S = 200                # agents heartbeat every 60 s
+BIND_RETRY_S   = 5.0
+UPSTREAM       = ("alerts", "heartbeat", "fl_update")
+
+
+def server_context(cert: str, key: str, ca: str) -> ssl.SSLContext:
+    """TLS server context that only accepts clients with a cert from `ca`."""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    ctx.load_verify_locations(ca)
+    ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+def _frame(msg: pb.ChannelMessage) -> bytes:
+    data = msg.SerializeToString()
+    return struct.pack(">I", len(data)) + data
+
+
+def _common_name(cert: Optional[dict]) -> str:
+    for rdn in (cert or {}).get("subject", ()):
+        for key, value in rdn:
+            if key == "commonName":
+                return value
+    return ""
+
+
+class Session:
+    """One connected agent. `name` is its certificate's CN; client_id and
+    model_round come from its ChannelHello."""
+
+    __slots__ = ("name", "peer", "client_id", "model_round", "messages",
+                 "_writer", "_write_lock", "_slots")
+
+    def __init__(self, name: str, peer, writer: asyncio.StreamWriter):
+        self.name        = name
+        self.peer        = peer
+        self.client_id   = ""
+        self.model_round = -1
+        self.messages    = 0
+        self._writer     = writer
+        self._write_lock = asyncio.Lock()
+        self._slots      = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def send(self, data: bytes):
+        async with self._write_lock:
+            self._writer.write(data)
+            await self._writer.drain()
+
+
+class AgentChannel:
+    """
+    port         — TCP port to listen on, all interfaces
+    ssl_context  — server_context(): client certs required
+    handle       — async handle(session, message) -> pb.Ack for the
+                   UPSTREAM kinds
+    model        — model(since_round) -> (round, framed ModelUpdate) for an
+                   agent holding `since_round`, or None when it is current
+    shared       — several processes listen on the port (see module doc)
+
+    start() and the handlers run on the server's event loop;
+    model_changed() may be called from any thread.
+    """
+
+    def __init__(self, port: int, ssl_context: ssl.SSLContext,
+                 handle: Callable[[Session, pb.ChannelMessage], Awaitable[pb.Ack]],
+                 model: Callable[[int], Optional[tuple]], shared: bool = False):
+        self.port      = port
+        self._ssl      = ssl_context
+        self._handle   = handle
+        self._model    = model
+        self._shared   = shared
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._binder: Optional[asyncio.Task] = None
+        self._sessions: set = set()
+        self._pushes: dict = {}        # framed ModelUpdate -> framed ChannelMessage
+        self.messages = 0
+        self.pushed   = 0
+        self.rejected = 0              # connections dropped for a malformed frame
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        try:
+            await self._listen()
+        except OSError as exc:
+            if not self._shared:
+                log.error("Agent channel could not listen on tcp/%d: %s", self.port, exc)
+                return
+            # No SO_REUSEPORT: another worker holds the port; take over if it exits.
+            self._binder = asyncio.create_task(self._bind_later())
+
+    async def _listen(self):
+        reuse = self._shared and hasattr(socket, "SO_REUSEPORT")
+        self._server = await asyncio.start_server(
+            self._serve, port=self.port, ssl=self._ssl, reuse_port=reuse or None,
+            family=socket.AF_INET)
+        log.info("Agent channel: listening on tcp/%d (mTLS)", self.port)
+
+    async def _bind_later(self):
+        while self._server is None:
+            await asyncio.sleep(BIND_RETRY_S)
+            with contextlib.suppress(OSError):
+                await self._listen()
+
+    async def stop(self):
+        if self._binder is not None:
+            self._binder.cancel()
+        if self._server is not None:
+            self._server.close()
+        for s in list(self._sessions):
+            s._writer.close()
+        if self._server is not None:
+            with contextlib.suppress(Exception):
+                await asyncio.wait_for(self._server.wait_closed(), 5)
+
+    def stats(self) -> dict:
+        return {"listening": self._server is not None, "sessions": len(self._sessions),
+                "messages": self.messages, "models_pushed": self.pushed,
+                "rejected": self.rejected}
+
+    # ── Connections ──────────────────────────────────────────────────────────
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(_common_name(writer.get_extra_info("peercert")),
+                          writer.get_extra_info("peername"), writer)
+        self._sessions.add(session)
+        tasks: set = set()
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(4), IDLE_TIMEOUT_S)
+                (length,) = struct.unpack(">I", header)
+                if length > MAX_FRAME:
+                    raise ValueError(f"frame of {length} bytes")
+                msg = pb.ChannelMessage.FromString(await reader.readexactly(length))
+                kind = msg.WhichOneof("body")
+                session.messages += 1
+                self.messages += 1
+                if kind == "hello":
+                    session.client_id   = msg.hello.client_id
+                    session.model_round = msg.hello.model_round
+                    log.debug("Agent channel: %s (%s) connected from %s, model round %d",
+                              session.client_id, session.name, session.peer, session.model_round)
+                    self._push(session)
+                elif kind in UPSTREAM:
+                    await session._slots.acquire()
+                    task = asyncio.create_task(self._answer(session, msg))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await session.send(_frame(pb.ChannelMessage(
+                        ack=pb.Ack(seq=msg.seq, status=400, detail=f"unexpected {kind}"))))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ssl.SSLError):
+            pass
+        except Exception as exc:            # DecodeError, oversized frame
+            self.rejected += 1
+            log.warning("Agent channel: dropping %s (%s) — %s", session.client_id or session.name,
+                        session.peer, exc)
+        finally:
+            self._sessions.discard(session)
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+
+    async def _answer(self, session: Session, msg: pb.ChannelMessage):
+        try:
+            try:
+                ack = await self._handle(session, msg)
+            except Exception as exc:
+                log.exception("Agent channel: %s from %s failed", msg.WhichOneof("body"),
+                              session.client_id or session.name)
+                ack = pb.Ack(status=500, detail=str(exc))
+            ack.seq = msg.seq
+            await session.send(_frame(pb.ChannelMessage(ack=ack)))
+        except (ConnectionError, RuntimeError):
+            pass                            # the agent went away; it resends unacked messages
+        finally:
+            session._slots.release()
+
+    # ── Model pushes ─────────────────────────────────────────────────────────
+
+    def model_changed(self):
+        """A new model round was installed: push it to every connected agent."""
+        if self._loop is not None and self._sessions:
+            self._loop.call_soon_threadsafe(self._push_all)
+
+    def _push_all(self):
+        for session in list(self._sessions):
+            if session.client_id:
+                self._push(session)
+
+    def _push(self, session: Session):
+        entry = self._model(session.model_round)
+        if entry is None:
+            return
+        rnd, frame = entry
+        data = self._pushes.get(frame)
+        if data is None:
+            msg = pb.ChannelMessage()
+            msg.model.MergeFromString(frame[4:])
+            if len(self._pushes) >= 4:
+                self._pushes.clear()
+            data = self._pushes[frame] = _frame(msg)
+        session.model_round = rnd
+        self.pushed += 1
+        task = asyncio.ensure_future(session.send(data))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Micro-benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _bench_setup():
+    """Server process for --bench: the real app on a scratch directory."""
+    import uvicorn
+    import flare_server
+    d = Path(os.environ["FLARE_BENCH_DIR"])
+    flare_server.DB_PATH = str(d / "flare.db")
+    flare_server.TLS_CERT, flare_server.TLS_KEY = str(d / "server.crt"), str(d / "server.key")
+    flare_server.TLS_CA = str(d / "ca.crt")
+    flare_server.CHANNEL_PORT = int(os.environ["FLARE_BENCH_CHANNEL"])
+    flare_server.PROVISION_KEY_POOL = flare_server.PROVISION_WORKERS = 0
+    logging.getLogger().setLevel(logging.WARNING)
+    uvicorn.run(flare_server.app, host="127.0.0.1", port=int(os.environ["FLARE_BENCH_PORT"]),
+                log_level="warning", access_log=False, ssl_certfile=flare_server.TLS_CERT,
+                ssl_keyfile=flare_server.TLS_KEY, timeout_graceful_shutdown=1)
+
+
+def _bench_messages(n: int, per_batch: int) -> list:
+    """(kind, message) pairs: a heartbeat after every four alert batches."""
+    out = []
+    for i in range(n):
+        if i % 5 == 4:
+            out.append(("heartbeat", pb.Heartbeat(client_id="bench-0", agent_version="1.0",
+                                                  uptime_seconds=i, host_track_ok=True)))
+            continue
+        batch = pb.AlertBatch()
+        for k in range(per_batch):
+            batch.alerts.add(alert_id=str(uuid.uuid4()), client_id="bench-0",
+                             attack_type=f"type{k % 7}", track=1 + k % 2, severity=3,
+                             confidence=0.9, rule_id="bench", event_count=1,
+                             evidence=json.dumps({"src_ip": f"10.0.{i % 250}.{k}"}),
+                             raw_log="<Event><System><EventID>4625</EventID></System></Event>")
+        out.append(("alerts", batch))
+    return out
+
+
+_ENDPOINTS = {"alerts": "/api/alerts/ingest", "heartbeat": "/api/heartbeat"}
+
+
+def _bench_http(port: int, ctx: ssl.SSLContext, messages: list, keep_alive: bool) -> list:
+    import http.client
+    lat, conn = [], None
+    for kind, m in messages:
+        data = m.SerializeToString()
+        t0 = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPSConnection("127.0.0.1", port, context=ctx, timeout=30)
+        conn.request("POST", _ENDPOINTS[kind], struct.pack(">I", len(data)) + data,
+                     {"Content-Type": "application/octet-stream"})
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status}")
+        if not keep_alive:
+            conn.close()
+            conn = None
+        lat.append(time.perf_counter() - t0)
+    if conn is not None:
+        conn.close()
+    return lat
+
+
+def _bench_channel(port: int, ctx: ssl.SSLContext, messages: list, window: int) -> list:
+    """Send over one channel connection with up to `window` unacked messages."""
+    sock = ctx.wrap_socket(socket.create_connection(("127.0.0.1", port)),
+                           server_hostname="127.0.0.1")
+    rfile = sock.makefile("rb")
+    sock.sendall(_frame(pb.ChannelMessage(hello=pb.ChannelHello(client_id="bench-0",
+                                                                model_round=1 << 30))))
+    sent_at, lat = {}, []
+
+    def read_ack():
+        (length,) = struct.unpack(">I", rfile.read(4))
+        msg = pb.ChannelMessage.FromString(rfile.read(length))
+        if msg.WhichOneof("body") != "ack":
+            return
+        if msg.ack.status != 200:
+            raise RuntimeError(f"ack {msg.ack.status} {msg.ack.detail}")
+        lat.append(time.perf_counter() - sent_at.pop(msg.ack.seq))
+
+    for seq, (kind, m) in enumerate(messages, 1):
+        while len(sent_at) >= window:
+            read_ack()
+        msg = pb.ChannelMessage(seq=seq)
+        getattr(msg, kind).CopyFrom(m)
+        sent_at[seq] = time.perf_counter()
+        sock.sendall(_frame(msg))
+    while sent_at:
+        read_ack()
+    sock.close()
+    return lat
+
+
+def _bench(n: int, per_batch: int):
+    import multiprocessing
+    import generate_pki
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ca_key, ca_cert = generate_pki.generate_ca(root / "ca.crt", root / "ca.key")
+            generate_pki.generate_server_cert(root / "server.crt", root / "server.key",
+                                              ca_key, ca_cert)
+            generate_pki.generate_client_bundle("bench-0", ca_key, ca_cert, root / "agent")
+        ports = []
+        for _ in range(2):
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                ports.append(s.getsockname()[1])
+        os.environ.update(FLARE_BENCH_DIR=tmp, FLARE_BENCH_PORT=str(ports[0]),
+                          FLARE_BENCH_CHANNEL=str(ports[1]))
+        server = multiprocessing.get_context("spawn").Process(target=_bench_setup, daemon=True)
+        server.start()
+        ctx = ssl.create_default_context(cafile=str(root / "ca.crt"))
+        ctx.check_hostname = False
+        ctx.load_cert_chain(str(root / "agent" / "client.crt"), str(root / "agent" / "client.key"))
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                _bench_channel(ports[1], ctx, _bench_messages(1, 1), 1)
+                break
+            except OSError:
+                time.sleep(0.2)
+        print(f"  {n} messages (alert batches of {per_batch} + a heartbeat every 5th), "
+              f"one agent, {os.cpu_count()} CPU(s)")
+        print(f"    {'transport':<28}{'msgs/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+        runs = [("HTTPS, connection per POST", lambda m: _bench_http(ports[0], ctx, m, False)),
+                ("HTTPS, keep-alive", lambda m: _bench_http(ports[0], ctx, m, True)),
+                ("channel, one at a time", lambda m: _bench_channel(ports[1], ctx, m, 1)),
+                ("channel, pipelined (32)", lambda m: _bench_channel(ports[1], ctx, m, 32))]
+        try:
+            for name, run in runs:
+                messages = _bench_messages(n, per_batch)
+                t0 = time.perf_counter()
+                lat = sorted(run(messages))
+                elapsed = time.perf_counter() - t0
+                print(f"    {name:<28}{n / elapsed:>9.0f}{statistics.median(lat) * 1000:>9.2f}"
+                      f"{lat[int(len(lat) * 0.99) - 1] * 1000:>9.2f}")
+        finally:
+            server.terminate()
+            server.join(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE agent channel")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare HTTPS POSTs and the channel against a local server")
+    parser.add_argument("-n", type=int, default=2000, help="Messages per transport")
+    parser.add_argument("--batch", type=int, default=20, help="Alerts per AlertBatch")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.n, args.batch)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+FLARE - Alert Search Index
+──────────────────────────────────
+SQLite FTS5 table with the trigram tokenizer over the text columns analysts
+filter on, so substring search ("PASS_SP", "DESKTOP-4", "10.0.0.") uses an
+index instead of a LIKE '%x%' table scan.
+
+  alerts_fts(rule_id, attack_type, client_id, mitre_id, evidence)
+  rowid == alerts.id, one table in each alert partition (partitions.py)
+
+The ingest writer adds a row for every inserted alert and updates rule_id /
+mitre_id when a dedup merge backfills them, in the same transaction. The
+table keeps its own copy of the text (not external-content) so those updates
+are a plain UPDATE.
+
+Trigram matching needs at least 3 characters; shorter terms fall back to
+LIKE (see filter_sql).
+"""
+
+from typing import Optional
+
+COLUMNS = ("rule_id", "attack_type", "client_id", "mitre_id", "evidence")
+
+SCHEMA = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS alerts_fts
+        USING fts5({', '.join(COLUMNS)}, tokenize='trigram');
+"""
+
+_INSERT_SQL = (f"INSERT INTO {{s}}.alerts_fts (rowid, {', '.join(COLUMNS)}) "
+               f"VALUES (?, {', '.join('?' * len(COLUMNS))})")
+_UPDATE_META_SQL = "UPDATE {s}.alerts_fts SET rule_id = ?, mitre_id = ? WHERE rowid = ?"
+
+MIN_TERM = 3
+
+
+def index_rows(conn, schema: str, rows: list):
+    """rows: [(alerts.id, rule_id, attack_type, client_id, mitre_id, evidence)]
+    for the partition attached as `schema`."""
+    if rows:
+        conn.executemany(_INSERT_SQL.format(s=schema), rows)
+
+
+def update_meta(conn, schema: str, rows: list):
+    """rows: [(rule_id, mitre_id, alerts.id)] for merges that backfilled them."""
+    if rows:
+        conn.executemany(_UPDATE_META_SQL.format(s=schema), rows)
+
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def filter_sql(q: Optional[str] = None, rule: Optional[str] = None,
+               client: Optional[str] = None) -> tuple:
+    """WHERE-clause fragments + params for the /api/alerts text filters.
+
+    q       — substring of any indexed column
+    rule    — substring of rule_id or attack_type
+    client  — substring of client_id
+
+    Terms of MIN_TERM+ characters become one FTS5 MATCH; shorter ones use
+    LIKE (the trigram index can't serve them) — on alerts, or on alerts_fts
+    when evidence is among the columns. Fragments name the partition schema
+    as {s} (see PartitionStore.newest).
+    """
+    match, where, params = [], [], []
+    for term, cols in ((q, COLUMNS), (rule, ("rule_id", "attack_type")),
+                       (client, ("client_id",))):
+        if not term:
+            continue
+        if len(term) >= MIN_TERM:
+            scope = cols[0] if len(cols) == 1 else "{" + " ".join(cols) + "}"
+            match.append(f"{scope} : {_phrase(term)}")
+        else:
+            like = "(" + " OR ".join(f"{c} LIKE ?" for c in cols) + ")"
+            if "evidence" in cols:      # only stored in the index
+                like = f"id IN (SELECT rowid FROM {{s}}.alerts_fts WHERE {like})"
+            where.append(like)
+            params += [f"%{term}%"] * len(cols)
+    if match:
+        where.insert(0, "id IN (SELECT rowid FROM {s}.alerts_fts WHERE alerts_fts MATCH ?)")
+        params.insert(0, " AND ".join(match))
+    return where, params
@@ -0,0 +1,218 @@
+"""
+FLARE - Alert Blob Store
+──────────────────────────────────
+Keeps the heavy per-alert payloads — `raw_log` (full Windows event XML) and
+`evidence` (JSON) — out of the `alerts` row so list queries, the page cache
+and /api/alerts responses only carry the slim columns.
+
+  alert_blobs(id, dict_id, evidence, raw_log)   id == alerts.id, in each
+                                                alert partition (partitions.py)
+  blob_dicts(dict_id, created_at, samples, data)  flare.db, shared by all
+
+Each payload is zlib-compressed with a preset dictionary (zdict). Windows
+event XML is extremely repetitive across alerts (<System>, <Provider Name=…>,
+<Data Name='SubjectUserSid'>…), but a single 1-2 KB document is too short
+for plain zlib to find that redundancy. A dictionary built from FLARE's own
+stored payloads primes the compressor with it.
+
+Dictionary lifecycle:
+  dict_id 0        plain zlib (no dictionary) — used until there are enough
+                   samples to train on
+  dict_id 1, 2, …  trained by BlobCodec.maybe_train() from the most recent
+                   payloads; immutable once written, so every stored blob stays
+                   decodable with the dict_id recorded next to it
+"""
+
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Optional
+
+log = logging.getLogger("flare_server.blobs")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blob_dicts (
+        dict_id     INTEGER PRIMARY KEY,
+        created_at  REAL,
+        samples     INTEGER,
+        data        BLOB
+    );
+"""
+
+PARTITION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alert_blobs (
+        id        INTEGER PRIMARY KEY,
+        dict_id   INTEGER NOT NULL DEFAULT 0,
+        evidence  BLOB,
+        raw_log   BLOB
+    );
+"""
+
+_INSERT_SQL = "INSERT OR REPLACE INTO {s}.alert_blobs (id, dict_id, evidence, raw_log) VALUES (?,?,?,?)"
+
+ZDICT_SIZE    = 32 * 1024      # zlib uses at most the last 32 KiB of a zdict
+TRAIN_SAMPLES = 2000           # payloads sampled for training
+TRAIN_MIN     = 200            # don't train on fewer than this
+
+# XML tags and attribute runs, text runs between tags, and JSON keys.
+_FRAGMENT_RE = re.compile(r"<[^<>]{1,160}>|>[^<>]{4,80}<|\"[\w .-]{1,48}\"\s*:\s*")
+
+
+def train_dictionary(samples: list, size: int = ZDICT_SIZE) -> bytes:
+    """Build a zlib preset dictionary from sample payloads.
+
+    Fragments that recur across samples are scored by count × length and
+    packed at the END of the dictionary, where zlib reaches them with the
+    shortest back-references. The space left in front is filled with whole
+    sample payloads, which carry the longer runs (element order, attribute
+    sequences) that individual fragments miss.
+    """
+    counts: Counter = Counter()
+    for s in samples:
+        counts.update(set(_FRAGMENT_RE.findall(s)))
+    frags = [(n * len(f), f) for f, n in counts.items() if n > 1]
+    frags.sort(reverse=True)
+
+    picked, used = [], 0
+    for _, f in frags:
+        b = f.encode("utf-8")
+        if used + len(b) > size // 4:
+            continue
+        picked.append(b)
+        used += len(b)
+    tail = b"".join(reversed(picked))
+
+    head, seen = [], set()
+    for s in samples:
+        b = s.encode("utf-8")
+        if b in seen or used + len(b) > size:
+            continue
+        seen.add(b)
+        head.append(b)
+        used += len(b)
+    return b"".join(head) + tail
+
+
+class BlobCodec:
+    """Compresses with the newest dictionary, decompresses with whichever
+    one a blob was written with. Dictionaries are loaded lazily, so a blob
+    written by another process with a newer dictionary still decodes."""
+
+    def __init__(self, level: int = 6):
+        self.level    = level
+        self.current  = 0
+        self._dicts   = {0: b""}
+        self._lock    = threading.Lock()
+        self._written = 0          # blobs written since the last training check
+
+    def load(self, conn):
+        """(Re)load every stored dictionary and switch to the newest."""
+        dicts = {0: b""}
+        for dict_id, data in conn.execute("SELECT dict_id, data FROM main.blob_dicts"):
+            dicts[dict_id] = data
+        with self._lock:
+            self._dicts  = dicts
+            self.current = max(dicts)
+
+    def refresh(self, conn):
+        """Switch to a dictionary another process trained since load()."""
+        newest = conn.execute("SELECT MAX(dict_id) FROM main.blob_dicts").fetchone()[0]
+        if newest is not None and newest > self.current:
+            self._zdict(conn, newest)
+            with self._lock:
+                self.current = newest
+
+    def _zdict(self, conn, dict_id: int) -> bytes:
+        data = self._dicts.get(dict_id)
+        if data is None:
+            row = conn.execute("SELECT data FROM main.blob_dicts WHERE dict_id=?", (dict_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"unknown blob dictionary {dict_id}")
+            with self._lock:
+                data = self._dicts[dict_id] = row[0]
+        return data
+
+    def compress(self, text: Optional[str]) -> Optional[bytes]:
+        if not text:
+            return None
+        zdict = self._dicts[self.current]
+        c = zlib.compressobj(self.level, zdict=zdict) if zdict else zlib.compressobj(self.level)
+        return c.compress(text.encode("utf-8")) + c.flush()
+
+    def decompress(self, conn, dict_id: int, data: Optional[bytes]) -> str:
+        if not data:
+            return ""
+        zdict = self._zdict(conn, dict_id)
+        d = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return (d.decompress(data) + d.flush()).decode("utf-8")
+
+    def rows(self, items: list) -> list:
+        """[(alerts.id, evidence, raw_log)] -> alert_blobs rows for executemany."""
+        self._written += len(items)
+        return [(row_id, self.current, self.compress(ev), self.compress(raw))
+                for row_id, ev, raw in items if ev or raw]
+
+    def write(self, conn, schema: str, items: list):
+        """Store blobs for `items` in the alert_blobs of partition `schema`."""
+        rows = self.rows(items)
+        if rows:
+            conn.executemany(_INSERT_SQL.format(s=schema), rows)
+
+    def fetch(self, conn, schema: Optional[str], row_id: int) -> dict:
+        """{"evidence": str, "raw_log": str} for one alert ("" when absent)."""
+        if schema is None:
+            return {"evidence": "", "raw_log": ""}
+        row = conn.execute(f"SELECT dict_id, evidence, raw_log FROM {schema}.alert_blobs WHERE id=?",
+                           (row_id,)).fetchone()
+        if row is None:
+            return {"evidence": "", "raw_log": ""}
+        return {"evidence": self.decompress(conn, row[0], row[1]),
+                "raw_log":  self.decompress(conn, row[0], row[2])}
+
+    def fetch_many(self, conn, schema: str, row_ids: list) -> dict:
+        """{row_id: {"evidence", "raw_log"}} for the ids present in partition
+        `schema`, in one query."""
+        if not row_ids:
+            return {}
+        rows = conn.execute(
+            f"SELECT id, dict_id, evidence, raw_log FROM {schema}.alert_blobs "
+            f"WHERE id IN ({','.join('?' * len(row_ids))})", row_ids)
+        return {r[0]: {"evidence": self.decompress(conn, r[1], r[2]),
+                       "raw_log":  self.decompress(conn, r[1], r[3])} for r in rows}
+
+    def maybe_train(self, conn, schema: str) -> bool:
+        """Train the first dictionary once enough plain-zlib blobs exist in
+        partition `schema`. Returns True when a new dictionary was stored
+        (caller commits)."""
+        if self.current != 0 or self._written < TRAIN_MIN:
+            return False
+        self._written = 0
+        rows = conn.execute(
+            f"SELECT dict_id, evidence, raw_log FROM {schema}.alert_blobs ORDER BY id DESC LIMIT ?",
+            (TRAIN_SAMPLES,)).fetchall()
+        if len(rows) < TRAIN_MIN:
+            return False
+        samples = []
+        for dict_id, ev, raw in rows:
+            samples.append(self.decompress(conn, dict_id, ev))
+            samples.append(self.decompress(conn, dict_id, raw))
+        return self.train(conn, samples, len(rows))
+
+    def train(self, conn, samples: list, n_alerts: int) -> bool:
+        """Store a dictionary trained on `samples` and compress with it from
+        now on. Returns True when one was stored (caller commits)."""
+        data = train_dictionary([s for s in samples if s])
+        if not data:
+            return False
+        cur = conn.execute("INSERT INTO main.blob_dicts (created_at, samples, data) VALUES (?,?,?)",
+                           (time.time(), n_alerts, data))
+        with self._lock:
+            self._dicts[cur.lastrowid] = data
+            self.current = cur.lastrowid
+        log.info("Blob store: trained dictionary %d (%d bytes from %d alerts)",
+                 self.current, len(data), n_alerts)
+        return True
+
@@ -0,0 +1,458 @@
+"""
+FLARE - Multi-Process Workers
+──────────────────────────────────
+With FLARE_WORKERS=N (N > 1) the API runs in N uvicorn worker processes
+accepting on one listening socket, so protobuf parsing, TLS and JSON
+serialisation use N cores. The parent process binds the socket, runs LAN
+discovery and restarts workers that exit (serve()). What a single process
+used to coordinate through in-memory state is shared like this:
+
+  writer lock  a ProcessLock held around every write transaction
+               (db_pool.ConnectionPool(lock=…)). The workers' writers queue
+               on it instead of in SQLite's sleep-and-retry busy handler,
+               and a writer holding it reads exactly what the last commit
+               left — the ingest writer re-checks its dedup entries and id
+               allocation against that after another worker committed
+               (ingest_writer.py).
+  aggregator   one worker holds the leader ProcessLock for as long as it
+               lives and runs what must run once: the FedAvg scheduler,
+               rollup compaction, partition retention and the presence
+               sweep. When it exits another worker takes the lock within
+               ELECT_S and reloads the open rounds from fl_updates.
+  bus          an append-only message table in cluster.db next to flare.db.
+               Each worker writes what it publishes and reads what the
+               others did every POLL_S: data version bumps (http_cache.py),
+               live dashboard events (event_hub.py, numbered by message id
+               so Last-Event-ID means the same on every worker), agent
+               heartbeats, FL updates for the aggregator and its round
+               progress, and partitions retention removed.
+
+A ProcessLock is flock() on a lock file on POSIX and a named mutex on
+Windows. The OS releases either when its holder dies, so a crashed worker
+never wedges the others.
+
+Usage
+-----
+  # Committed alerts/s through the real server with 1, 2 and 4 workers
+  python cluster.py --bench [--workers 1,2,4] [--seconds 10] [--clients 8]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import sqlite3
+import ssl
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+log = logging.getLogger("flare_server.cluster")
+
+POLL_S  = 0.1       # bus write / read interval
+ELECT_S = 2.0       # a worker without the leader lock retries this often
+KEEP_S  = 60.0      # bus messages are pruned after this long
+
+BUS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bus (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        at      REAL    NOT NULL,
+        origin  INTEGER NOT NULL,       -- pid of the publishing worker
+        topic   TEXT    NOT NULL,
+        data    TEXT    NOT NULL        -- JSON
+    );
+"""
+
+
+class ProcessLock:
+    """An exclusive lock shared by every process that opens the same `path`.
+    Not reentrant; on Windows it must be released by the thread that
+    acquired it."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        if os.name == "nt":
+            import ctypes
+            from ctypes import wintypes
+            k32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            k32.CreateMutexW.restype  = wintypes.HANDLE
+            k32.CreateMutexW.argtypes = (ctypes.c_void_p, wintypes.BOOL, wintypes.LPCWSTR)
+            k32.WaitForSingleObject.argtypes = (wintypes.HANDLE, wintypes.DWORD)
+            k32.ReleaseMutex.argtypes = (wintypes.HANDLE,)
+            name = "Local\\flare-" + hashlib.sha1(
+                os.path.abspath(self.path).lower().encode("utf-8")).hexdigest()
+            self._k32 = k32
+            self._handle = k32.CreateMutexW(None, False, name)
+            if not self._handle:
+                raise ctypes.WinError(ctypes.get_last_error())
+        else:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if os.name == "nt":
+            rc = self._k32.WaitForSingleObject(self._handle, 0xFFFFFFFF if blocking else 0)
+            return rc in (0x0, 0x80)        # WAIT_OBJECT_0, WAIT_ABANDONED (holder died)
+        import fcntl
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+
+    def release(self):
+        if os.name == "nt":
+            self._k32.ReleaseMutex(self._handle)
+        else:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Cluster(threading.Thread):
+    """
+    directory  — flare.db's folder; cluster.db and the lock files go there
+    on_lead    — called on this thread when this worker becomes the
+                 aggregator (at the first election, or when the previous
+                 aggregator exits)
+    poll       — seconds between bus round trips
+
+    writer_lock is for db_pool.ConnectionPool. publish() never blocks; the
+    thread writes what was published and runs the handlers registered with
+    on() for the messages of the other workers, in bus order. `ready` is set
+    once the first election has been decided.
+    """
+
+    def __init__(self, directory, on_lead: Optional[Callable[[], None]] = None,
+                 poll: float = POLL_S):
+        super().__init__(name="ClusterBus", daemon=True)
+        d = Path(directory)
+        d.mkdir(parents=True, exist_ok=True)
+        self.writer_lock  = ProcessLock(d / "cluster.writer.lock")
+        self._leader_lock = ProcessLock(d / "cluster.leader.lock")
+        self._on_lead  = on_lead
+        self._poll     = poll
+        self._handlers: dict = {}     # topic -> (fn(data, seq), own)
+        self._out: queue.SimpleQueue = queue.SimpleQueue()
+        self._stop_evt = threading.Event()
+        self.ready     = threading.Event()
+        self.origin    = os.getpid()
+        self.leader    = False
+        self.sent      = 0
+        self.received  = 0
+        self._conn = sqlite3.connect(str(d / "cluster.db"), timeout=15.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")      # messages only matter while workers run
+        self._conn.executescript(BUS_SCHEMA)
+        self.cursor = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0]
+
+    def on(self, topic: str, fn: Callable, own: bool = False):
+        """Call fn(data, message id) for each `topic` message of the other
+        workers — and of this one too with own=True."""
+        self._handlers[topic] = (fn, own)
+
+    def publish(self, topic: str, data):
+        """Queue a message for the next bus write. Thread-safe, never blocks;
+        `data` is serialised (JSON) right away."""
+        self._out.put((topic, json.dumps(data, separators=(",", ":"), default=str)))
+
+    def stop(self, timeout: float = 5.0):
+        """Write what is still queued, give up the leader lock and stop."""
+        self._stop_evt.set()
+        self.join(timeout)
+
+    def stats(self) -> dict:
+        return {"pid": self.origin, "leader": self.leader, "sent": self.sent,
+                "received": self.received, "cursor": self.cursor}
+
+    # ── Bus thread ───────────────────────────────────────────────────────────
+
+    def run(self):
+        next_elect = pruned = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if not self.leader and now >= next_elect:
+                    next_elect = now + ELECT_S
+                    self._elect()
+                    self.ready.set()
+                stopping = self._stop_evt.is_set()
+                self._exchange()
+                if now - pruned >= KEEP_S:
+                    pruned = now
+                    self._prune()
+                if stopping:
+                    break
+                self._stop_evt.wait(self._poll)
+        finally:
+            if self.leader:
+                self.leader = False
+                self._leader_lock.release()
+            self._conn.close()
+
+    def _elect(self):
+        if not self._leader_lock.acquire(blocking=False):
+            return
+        self.leader = True
+        log.info("Cluster: worker %d is the aggregator", self.origin)
+        if self._on_lead is not None:
+            try:
+                self._on_lead()
+            except Exception:
+                log.exception("Cluster: starting the aggregator failed")
+
+    def _exchange(self):
+        out = []
+        while True:
+            try:
+                out.append(self._out.get_nowait())
+            except queue.Empty:
+                break
+        now = time.time()
+        try:
+            if out:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO bus (at, origin, topic, data) VALUES (?,?,?,?)",
+                        [(now, self.origin, topic, data) for topic, data in out])
+                self.sent += len(out)
+            rows = self._conn.execute("SELECT id, origin, topic, data FROM bus WHERE id > ? "
+                                      "ORDER BY id", (self.cursor,)).fetchall()
+        except sqlite3.Error as exc:
+            log.warning("Cluster: bus round trip failed (%s) — %d message(s) dropped", exc, len(out))
+            return
+        for seq, origin, topic, data in rows:
+            self.cursor = seq
+            handler = self._handlers.get(topic)
+            if handler is None or (origin == self.origin and not handler[1]):
+                continue
+            self.received += 1
+            try:
+                handler[0](json.loads(data), seq)
+            except Exception as exc:
+                log.warning("Cluster: %s handler failed: %s", topic, exc)
+
+    def _prune(self):
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM bus WHERE at < ?", (time.time() - KEEP_S,))
+        except sqlite3.Error:
+            pass
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Worker processes
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _spawn_context():
+    # spawn, not fork: the parent is full of threads by now.
+    ctx = multiprocessing.get_context("spawn")
+    if Path(sys.executable).name.lower().startswith("pythonservice"):
+        # Running as a Windows service: children must start python.exe.
+        ctx.set_executable(str(Path(sys.exec_prefix) / "python.exe"))
+    return ctx
+
+
+def _worker(config, stop, index: int, setup: Optional[str], sockets: list):
+    import uvicorn
+    config.configure_logging()
+    if setup:
+        module, _, attr = setup.partition(":")
+        getattr(importlib.import_module(module), attr)(index)
+    server = uvicorn.Server(config)
+
+    def _watch_stop():
+        stop.wait()
+        server.should_exit = True
+
+    threading.Thread(target=_watch_stop, daemon=True).start()
+    server.run(sockets=sockets)
+
+
+def serve(config, workers: int, stop_event, setup: Optional[str] = None):
+    """Run the uvicorn `config` (whose app is an import string) in `workers`
+    processes accepting on one socket until `stop_event` is set, starting a
+    worker again when it exits. `setup` ("module:function") is called with
+    the worker's index in each process before it serves."""
+    ctx  = _spawn_context()
+    sock = config.bind_socket()
+    stop = ctx.Event()
+    procs: list = [None] * workers
+
+    def start(i: int):
+        p = ctx.Process(target=_worker, args=(config, stop, i, setup, [sock]),
+                        name=f"FLAREWorker-{i}")
+        p.start()
+        procs[i] = p
+
+    for i in range(workers):
+        start(i)
+    log.info("Cluster: %d worker processes on %s:%d (pids %s)", workers, config.host, config.port,
+             ", ".join(str(p.pid) for p in procs))
+    try:
+        while not stop_event.wait(1.0):
+            for i, p in enumerate(procs):
+                if not p.is_alive():
+                    log.warning("Cluster: worker %d (pid %d) exited with code %s — restarting",
+                                i, p.pid, p.exitcode)
+                    start(i)
+    finally:
+        stop.set()
+        deadline = time.monotonic() + (config.timeout_graceful_shutdown or 5) + 15
+        for p in procs:
+            p.join(max(0.0, deadline - time.monotonic()))
+        for p in procs:
+            if p.is_alive():
+                log.warning("Cluster: worker pid %d did not stop — terminating", p.pid)
+                p.terminate()
+                p.join(5)
+        sock.close()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Load test
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _bench_setup(index: int):
+    """Worker setup for --bench: point the server at the scratch directory."""
+    import flare_server
+    d = Path(os.environ["FLARE_BENCH_DIR"])
+    flare_server.DB_PATH = str(d / "flare.db")
+    flare_server.WORKERS = int(os.environ["FLARE_BENCH_WORKERS"])
+    flare_server.INGEST_DURABILITY = "commit"
+    flare_server.PROVISION_KEY_POOL = 0
+    flare_server.PROVISION_WORKERS = 0
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _bench_server(directory: str, port: int, workers: int, stop):
+    import uvicorn
+    os.environ["FLARE_BENCH_DIR"] = directory
+    os.environ["FLARE_BENCH_WORKERS"] = str(workers)
+    config = uvicorn.Config("flare_server:app", host="127.0.0.1", port=port, log_level="warning",
+                            access_log=False, ssl_certfile=str(Path(directory) / "server.crt"),
+                            ssl_keyfile=str(Path(directory) / "server.key"),
+                            timeout_graceful_shutdown=5)
+    serve(config, workers, stop, setup="cluster:_bench_setup")
+
+
+def _bench_body(client: int, per_request: int) -> bytes:
+    from proto import log_schema_pb2 as pb
+    batch = pb.AlertBatch()
+    for k in range(per_request):
+        batch.alerts.add(alert_id=str(uuid.uuid4()), client_id=f"bench-{client}-{k % 25}",
+                         attack_type=f"type{k % 7}", track=1 + k % 2, severity=3, confidence=0.9,
+                         rule_id="bench", event_count=1, window_start="2026-06-15T12:34:56",
+                         window_end="2026-06-15T12:35:56",
+                         evidence=json.dumps({"src_ip": f"10.0.{client}.{k}", "event_id": 4625}),
+                         raw_log="<Event><System><EventID>4625</EventID></System></Event>")
+    data = batch.SerializeToString()
+    return struct.pack(">I", len(data)) + data
+
+
+def _bench_client(port: int, client: int, per_request: int, until: float, results):
+    import http.client
+    ctx = ssl.create_default_context()
+    ctx.check_hostname, ctx.verify_mode = False, ssl.CERT_NONE
+    conn = http.client.HTTPSConnection("127.0.0.1", port, context=ctx, timeout=30)
+    sent = busy = 0
+    while time.time() < until:
+        body = _bench_body(client, per_request)
+        conn.request("POST", "/api/alerts/ingest", body,
+                     {"Content-Type": "application/octet-stream"})
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status == 200:
+            sent += per_request
+        else:
+            busy += 1
+            time.sleep(0.05)
+    conn.close()
+    results.put((sent, busy))
+
+
+def _bench(worker_counts: list, seconds: float, clients: int, per_request: int):
+    import http.client
+    import generate_pki
+    ctx = _spawn_context()
+    ssl_ctx = ssl.create_default_context()
+    ssl_ctx.check_hostname, ssl_ctx.verify_mode = False, ssl.CERT_NONE
+    print(f"  {clients} agents posting {per_request}-alert batches over HTTPS for {seconds:g} s "
+          f"(FLARE_INGEST_DURABILITY=commit), {os.cpu_count()} CPU(s)")
+    print(f"    {'workers':>7}{'alerts/s':>12}{'speed-up':>10}{'503s':>7}")
+    base = None
+    for n in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            with contextlib.redirect_stdout(io.StringIO()):
+                ca_key, ca_cert = generate_pki.generate_ca(root / "ca.crt", root / "ca.key")
+                generate_pki.generate_server_cert(root / "server.crt", root / "server.key",
+                                                  ca_key, ca_cert)
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            stop = ctx.Event()
+            server = ctx.Process(target=_bench_server, args=(tmp, port, n, stop))
+            server.start()
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                c = http.client.HTTPSConnection("127.0.0.1", port, context=ssl_ctx, timeout=5)
+                try:
+                    c.request("GET", "/api/provision/health")
+                    if c.getresponse().status == 200:
+                        break
+                except OSError:
+                    time.sleep(0.2)
+                finally:
+                    c.close()
+            time.sleep(1.0)                     # let every worker finish its startup
+            results = ctx.Queue()
+            until = time.time() + seconds
+            procs = [ctx.Process(target=_bench_client, args=(port, i, per_request, until, results))
+                     for i in range(clients)]
+            for p in procs:
+                p.start()
+            done = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            stop.set()
+            server.join(60)
+            rate = sum(s for s, _ in done) / seconds
+            base = base or rate
+            print(f"    {n:>7}{rate:>12.0f}{rate / base:>9.2f}x{sum(b for _, b in done):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE multi-process workers")
+    parser.add_argument("--bench", action="store_true",
+                        help="Ingest load test against 1..N worker processes")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Load per worker count")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent agent connections")
+    parser.add_argument("--batch", type=int, default=50, help="Alerts per request")
+    args = parser.parse_args()
+    if args.bench:
+        _bench([int(w) for w in args.workers.split(",")], args.seconds, args.clients, args.batch)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+FLARE - SQLite Connection Pool
+──────────────────────────────────
+Long-lived connections for every server code path that touches flare.db:
+
+  writer   — ONE read/write connection, serialised by a lock. Used by the
+             ingest writer thread and by the handlers that write (heartbeat,
+             FL updates, sessions, alert status).
+  readers  — a small fixed pool of connections with PRAGMA query_only=ON,
+             handed out through a queue.
+
+With several server processes (cluster.py) the writer is also serialised
+across them by an OS lock, taken after the thread lock and held until the
+commit.
+
+Connections are opened once with the tuning pragmas below, so a request no
+longer pays for mkdir + connect + PRAGMA journal_mode=WAL. Keep SQL text
+constant (parameters, not f-strings) where possible: sqlite3 caches prepared
+statements per connection (cached_statements), and a long-lived connection is
+what makes that cache useful.
+
+The async helpers run the blocking work in the pool's own thread executor so
+the asyncio loop keeps serving other agents:
+
+    rows = await pool.read(lambda c: c.execute("SELECT ...").fetchall())
+    await pool.write(lambda c: c.execute("UPDATE ...", args))
+
+Tuning (environment / server.env, see flare_server.py):
+  FLARE_DB_READERS       read-only connections          (default 4)
+  FLARE_DB_SYNCHRONOUS   OFF | NORMAL | FULL            (default NORMAL — safe with WAL)
+  FLARE_DB_CACHE_MB      page cache per connection      (default 16)
+  FLARE_DB_MMAP_MB       memory-mapped I/O window       (default 256)
+  FLARE_DB_TEMP_STORE    DEFAULT | FILE | MEMORY        (default MEMORY)
+
+Usage
+-----
+  # Per-request overhead: open-per-call vs pooled checkout
+  python db_pool.py --bench [--db path/to/flare.db] [-n 5000]
+"""
+
+import argparse
+import asyncio
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Callable, Optional
+
+from metrics import Histogram
+
+_SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+_TEMP_STORE  = ("DEFAULT", "FILE", "MEMORY")
+
+
+class ConnectionPool:
+    """
+    path        — database file (its directory must already exist)
+    readers     — number of read-only connections
+    synchronous — PRAGMA synchronous for every connection
+    cache_mb    — PRAGMA cache_size, in MiB per connection
+    mmap_mb     — PRAGMA mmap_size, in MiB (0 disables mmap)
+    temp_store  — PRAGMA temp_store
+    lock        — optional cluster.ProcessLock shared with the other server
+                  processes, held with the writer connection
+    """
+
+    def __init__(self, path: str, readers: int = 4, synchronous: str = "NORMAL",
+                 cache_mb: int = 16, mmap_mb: int = 256, temp_store: str = "MEMORY",
+                 cached_statements: int = 256, lock=None):
+        synchronous = synchronous.upper()
+        temp_store  = temp_store.upper()
+        if synchronous not in _SYNCHRONOUS:
+            raise ValueError(f"synchronous must be one of {_SYNCHRONOUS}")
+        if temp_store not in _TEMP_STORE:
+            raise ValueError(f"temp_store must be one of {_TEMP_STORE}")
+
+        self.path = str(path)
+        self._pragmas = (
+            f"PRAGMA synchronous={synchronous}",
+            f"PRAGMA cache_size={-int(cache_mb) * 1024}",
+            f"PRAGMA mmap_size={int(mmap_mb) * 1024 * 1024}",
+            f"PRAGMA temp_store={temp_store}",
+        )
+        self._cached_statements = cached_statements
+
+        self._writer      = self._open(readonly=False)
+        self._writer_lock = threading.Lock()
+        self._process_lock = lock
+        self._readers: queue.Queue = queue.Queue()
+        self._all_readers = []
+        for _ in range(max(1, readers)):
+            conn = self._open(readonly=True)
+            self._all_readers.append(conn)
+            self._readers.put(conn)
+
+        # One thread per connection: a blocked executor thread is always
+        # waiting on a connection, never on another executor slot.
+        self._executor = ThreadPoolExecutor(max_workers=len(self._all_readers) + 1,
+                                            thread_name_prefix="flare-db")
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "read_checkouts":  0, "read_wait_s":  0.0, "read_wait_max_s":  0.0,
+            "write_checkouts": 0, "write_wait_s": 0.0, "write_wait_max_s": 0.0,
+        }
+        self.commit_seconds = Histogram()    # writer() commits that had work
+        self._closed = False
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=15.0,
+                               cached_statements=self._cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _record(self, kind: str, waited: float):
+        with self._stats_lock:
+            self._stats[f"{kind}_checkouts"] += 1
+            self._stats[f"{kind}_wait_s"]    += waited
+            if waited > self._stats[f"{kind}_wait_max_s"]:
+                self._stats[f"{kind}_wait_max_s"] = waited
+
+    # ── Synchronous checkout ─────────────────────────────────────────────────
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection."""
+        t0 = time.perf_counter()
+        conn = self._readers.get()
+        self._record("read", time.perf_counter() - t0)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection. Commits on normal exit, rolls back if
+        the block raises."""
+        t0 = time.perf_counter()
+        with self._writer_lock, self._process_lock or nullcontext():
+            self._record("write", time.perf_counter() - t0)
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                if self._writer.in_transaction:
+                    t0 = time.perf_counter()
+                    self._writer.commit()
+                    self.commit_seconds.observe(time.perf_counter() - t0)
+
+    @contextmanager
+    def exclusive(self):
+        """Hold every connection at once, writer first in the yielded list —
+        for maintenance that has to touch each of them (partition DETACH).
+        Readers are drained before the writer lock is taken; no code path
+        holds the writer while waiting for a reader, so this can't deadlock.
+        Commits the writer on normal exit."""
+        readers = [self._readers.get() for _ in self._all_readers]
+        try:
+            with self.writer() as conn:
+                yield [conn] + readers
+        finally:
+            for conn in readers:
+                self._readers.put(conn)
+
+    # ── Async helpers (blocking work off the event loop) ─────────────────────
+
+    def _run_read(self, fn: Callable, args: tuple):
+        with self.reader() as conn:
+            return fn(conn, *args)
+
+    def _run_write(self, fn: Callable, args: tuple):
+        with self.writer() as conn:
+            return fn(conn, *args)
+
+    async def read(self, fn: Callable, *args):
+        """Run fn(conn, *args) on a read-only connection in the pool executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_read, fn, args)
+
+    async def write(self, fn: Callable, *args):
+        """Run fn(conn, *args) on the writer connection and commit."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_write, fn, args)
+
+    async def run(self, fn: Callable, *args):
+        """Run an arbitrary blocking callable (that checks out its own
+        connections) in the pool executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # ── Introspection / shutdown ─────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+        for kind in ("read", "write"):
+            n = s[f"{kind}_checkouts"]
+            s[f"{kind}_wait_avg_ms"] = round(s[f"{kind}_wait_s"] / n * 1000, 3) if n else 0.0
+            s[f"{kind}_wait_s"]      = round(s[f"{kind}_wait_s"], 6)
+            s[f"{kind}_wait_max_s"]  = round(s[f"{kind}_wait_max_s"], 6)
+        s["readers"]      = len(self._all_readers)
+        s["readers_idle"] = self._readers.qsize()
+        return s
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        with self._writer_lock:
+            self._writer.close()
+        for conn in self._all_readers:
+            conn.close()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Micro-benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _bench(db: Optional[str], n: int):
+    if db is None:
+        db = str(Path(tempfile.mkdtemp()) / "bench.db")
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, expires_at REAL);
+        INSERT OR REPLACE INTO sessions VALUES ('bench', 1e12);
+    """)
+    conn.commit(); conn.close()
+    sql = "SELECT expires_at FROM sessions WHERE token=?"
+
+    # Old flare_server._get_conn(): mkdir + connect + WAL pragma per request
+    t0 = time.perf_counter()
+    for _ in range(n):
+        Path(db).parent.mkdir(parents=True, exist_ok=True)
+        c = sqlite3.connect(db, check_same_thread=False, timeout=15.0)
+        c.row_factory = sqlite3.Row
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute(sql, ("bench",)).fetchone()
+        c.close()
+    per_call = (time.perf_counter() - t0) / n
+
+    pool = ConnectionPool(db)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with pool.reader() as c:
+            c.execute(sql, ("bench",)).fetchone()
+    pooled = (time.perf_counter() - t0) / n
+
+    async def _async_loop():
+        for _ in range(n):
+            await pool.read(lambda c: c.execute(sql, ("bench",)).fetchone())
+    t0 = time.perf_counter()
+    asyncio.run(_async_loop())
+    pooled_async = (time.perf_counter() - t0) / n
+    pool.close()
+
+    print(f"  {n} session lookups on {db}")
+    print(f"    open per call      : {per_call * 1e6:8.1f} us/request")
+    print(f"    pooled reader      : {pooled * 1e6:8.1f} us/request  ({per_call / pooled:.0f}x)")
+    print(f"    pooled via executor: {pooled_async * 1e6:8.1f} us/request  ({per_call / pooled_async:.0f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE SQLite connection pool")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare per-request open vs pooled checkout")
+    parser.add_argument("--db", default=None,
+                        help="Database to benchmark against (default: temp file)")
+    parser.add_argument("-n", type=int, default=5000, help="Iterations")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.db, args.n)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
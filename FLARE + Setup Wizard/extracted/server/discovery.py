@@ -0,0 +1,226 @@
+"""
+FLARE - LAN Discovery
+──────────────────────────────────
+How agents on the LAN find the server without a configured URL. Everything
+is one UDP datagram, FLARE_SERVER::<advertised-ip>::<port>, which agents
+receive on udp/37020:
+
+  Beacon     sent unsolicited to the limited broadcast, every attached /24's
+             directed broadcast and, when configured, a multicast group.
+             In adaptive mode the interval starts at 1 s and doubles up to
+             max_interval, and the /24 unicast sweep (for Wi-Fi clients
+             behind APs that drop broadcast) only goes with the startup
+             beacons sent in the first SWEEP_PERIOD.
+  Responder  answers a FLARE_DISCOVER probe arriving on udp/37021 (broadcast,
+             the multicast group or unicast) with the same datagram,
+             unicast back to the prober's address and port. Agents and the
+             installer probe when they start listening, so discovery takes
+             one round trip rather than a wait for the next beacon.
+
+Modes (FLARE_DISCOVERY_MODE):
+  adaptive   backed-off beacon + responder (default)
+  responder  responder only, no unsolicited traffic
+  legacy     beacon with the full sweep every 3 s, forever, + responder
+             (agents that predate the probe rely on the beacon alone)
+
+Usage
+-----
+  # Packets sent per hour by each mode on a host with one /24
+  python discovery.py --schedule [--max-interval 600]
+"""
+
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+from typing import Optional
+
+log = logging.getLogger("flare_server.discovery")
+
+BEACON_PORT       = 37020         # agents listen here
+DISCOVER_PORT     = 37021         # the responder listens here
+PROBE             = b"FLARE_DISCOVER"
+MODES             = ("adaptive", "responder", "legacy")
+LEGACY_INTERVAL_S = 3.0
+FIRST_INTERVAL_S  = 1.0
+SWEEP_PERIOD_S    = 30.0          # adaptive: sweep only with beacons sent this early
+
+
+def beacon_payload(advertised_ip: str, port: int) -> bytes:
+    return f"FLARE_SERVER::{advertised_ip}::{port}".encode("utf-8")
+
+
+def destinations(ips: list, sweep: bool) -> tuple:
+    """(broadcasts, sweep) destination lists for the /24s holding `ips`:
+    255.255.255.255 plus each <subnet>.255, and — when `sweep` — every other
+    host of those /24s."""
+    bcast, hosts = {"255.255.255.255"}, set()
+    for ip in ips:
+        o = ip.split(".")
+        if len(o) == 4:
+            base = ".".join(o[:3])
+            bcast.add(base + ".255")
+            if sweep:
+                hosts.update(f"{base}.{h}" for h in range(1, 255) if str(h) != o[3])
+    return sorted(bcast), sorted(hosts)
+
+
+def schedule(mode: str, max_interval: float):
+    """Yield (seconds since start, sweep?) for each beacon `mode` sends."""
+    if mode == "responder":
+        return
+    t, interval = 0.0, (LEGACY_INTERVAL_S if mode == "legacy" else FIRST_INTERVAL_S)
+    while True:
+        yield t, mode == "legacy" or t < SWEEP_PERIOD_S
+        if mode != "legacy":
+            interval = min(interval * 2, max_interval) if t else interval
+        t += interval
+
+
+class Discovery(threading.Thread):
+    """
+    advertised_ip  — address put in the beacon and in probe replies
+    port           — server HTTPS port, likewise
+    ips            — local IPv4 addresses whose /24s the beacon covers
+    mode           — one of MODES
+    group          — multicast group for beacons and probes ("" = none)
+    max_interval   — adaptive: longest gap between beacons (seconds)
+    stop_event     — stops both threads when set (default: stop() only)
+
+    The thread sends the beacon; a second daemon thread runs the responder.
+    """
+
+    def __init__(self, advertised_ip: str, port: int, ips: list, mode: str = "adaptive",
+                 group: str = "", max_interval: float = 600.0,
+                 stop_event: Optional[threading.Event] = None,
+                 beacon_port: int = BEACON_PORT, discover_port: int = DISCOVER_PORT):
+        super().__init__(name="Discovery", daemon=True)
+        if mode not in MODES:
+            raise ValueError(f"discovery mode must be one of {MODES}, not {mode!r}")
+        self._payload      = beacon_payload(advertised_ip, port)
+        self._ips          = list(ips) or ([advertised_ip] if advertised_ip != "0.0.0.0" else [])
+        self._mode         = mode
+        self._group        = group
+        self._max_interval = max(FIRST_INTERVAL_S, max_interval)
+        self._beacon_port  = beacon_port
+        self._discover_port = discover_port
+        self._stop_evt     = stop_event or threading.Event()
+        self.beacons_sent  = 0       # datagrams, sweep included
+        self.probes_answered = 0
+
+    def stop(self, timeout: float = 2.0):
+        self._stop_evt.set()
+        self.join(timeout)
+
+    # ── Beacon ───────────────────────────────────────────────────────────────
+
+    def run(self):
+        threading.Thread(target=self._respond, name="DiscoveryResponder", daemon=True).start()
+        if self._mode == "responder":
+            log.info("discovery    : answering probes on udp/%d, no beacon", self._discover_port)
+            self._stop_evt.wait()
+            return
+        # IMPORTANT: do NOT bind this socket to a specific source IP. On Windows,
+        # binding a broadcast socket to a unicast address suppresses transmission of
+        # the limited broadcast (255.255.255.255) — that bind was the regression that
+        # broke install-time auto-discovery. Leave the socket unbound and let the OS
+        # pick the route per destination.
+        try:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            udp.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        except Exception as e:
+            log.error(f"Beacon socket creation failed: {e}")
+            return
+        bcast, sweep = destinations(self._ips, sweep=True)
+        if self._group:
+            bcast.append(self._group)
+        log.info("beacon       : %s on udp/%d (%s, %d broadcast/multicast + %d sweep dests)",
+                 self._payload.decode(), self._beacon_port,
+                 "every 3 s" if self._mode == "legacy"
+                 else f"backing off from 1 s to {self._max_interval:g} s", len(bcast), len(sweep))
+        start = time.monotonic()
+        with udp:
+            for at, with_sweep in schedule(self._mode, self._max_interval):
+                if self._stop_evt.wait(max(0.0, start + at - time.monotonic())):
+                    break
+                for dest in bcast + (sweep if with_sweep else []):
+                    try:
+                        udp.sendto(self._payload, (dest, self._beacon_port))
+                        self.beacons_sent += 1
+                    except OSError:
+                        pass
+
+    # ── Responder ────────────────────────────────────────────────────────────
+
+    def _respond(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(("", self._discover_port))
+            if self._group:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                struct.pack("4s4s", socket.inet_aton(self._group),
+                                            socket.inet_aton("0.0.0.0")))
+            sock.settimeout(1.0)
+        except OSError as e:
+            log.error("Discovery responder could not listen on udp/%d: %s", self._discover_port, e)
+            return
+        with sock:
+            while not self._stop_evt.is_set():
+                try:
+                    data, addr = sock.recvfrom(512)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    # Windows reports an ICMP port-unreachable for an earlier
+                    # reply as an error on the next recv.
+                    continue
+                if data.strip() != PROBE:
+                    continue
+                try:
+                    sock.sendto(self._payload, addr)
+                    self.probes_answered += 1
+                    log.debug("discovery    : answered probe from %s:%d", *addr)
+                except OSError:
+                    pass
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Traffic estimate
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _schedule_table(max_interval: float):
+    bcast, sweep = destinations(["192.168.1.10"], sweep=True)
+    print(f"  one /24: {len(bcast)} broadcast + {len(sweep)} sweep destinations per beacon")
+    print(f"    {'mode':<10}{'first 10 s':>12}{'first hour':>12}{'per hour after':>16}")
+    for mode in MODES:
+        counts = [0, 0, 0]
+        for at, with_sweep in schedule(mode, max_interval):
+            if at >= 7200:
+                break
+            n = len(bcast) + (len(sweep) if with_sweep else 0)
+            counts[0] += n if at < 10 else 0
+            counts[1] += n if at < 3600 else 0
+            counts[2] += n if at >= 3600 else 0
+        print(f"    {mode:<10}{counts[0]:>12}{counts[1]:>12}{counts[2]:>16}")
+    print("    (+ one reply per FLARE_DISCOVER probe in every mode)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE LAN discovery")
+    parser.add_argument("--schedule", action="store_true",
+                        help="Print beacon packet counts for each mode")
+    parser.add_argument("--max-interval", type=float, default=600.0,
+                        help="Adaptive mode's longest beacon interval (s)")
+    args = parser.parse_args()
+    if args.schedule:
+        _schedule_table(args.max_interval)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
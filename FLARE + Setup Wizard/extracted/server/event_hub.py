@@ -0,0 +1,203 @@
+"""
+FLARE - Live Event Hub
+──────────────────────────────────
+Fans server-side changes out to every open dashboard over Server-Sent Events
+(GET /api/stream), so the dashboard updates in place instead of polling.
+
+Events (SSE `event:` name, JSON `data:`):
+  alerts        {"new": [alert list rows], "merged": [{id, event_count,
+                confidence, received_at, rule_id, …}]} — one per ingest commit
+  alert_status  {"id", "alert_id", "status"} — an analyst changed a status
+  client        {"client_id", "online", "online_clients", "total_clients"}
+                — an agent came online or went offline
+  fl            {"fl_model": {…} | null, "fl_pending_updates": n}
+                — an FL update arrived or a round completed
+  resync        {} — this subscriber missed events; refetch everything
+
+publish() may be called from any thread (the ingest writer publishes from
+its own). It serialises the event once, numbers it and hands it to the event
+loop, which copies it into each subscriber's bounded queue. A subscriber
+that falls QUEUE_MAX events behind is reset to a single `resync` rather than
+slowing publishers down.
+
+The last REPLAY_MAX events are kept so a browser that reconnects with
+Last-Event-ID gets exactly what it missed. Events published while nobody is
+subscribed are not serialised at all; they only advance the sequence, so a
+later reconnect across that gap is answered with `resync`.
+
+With several worker processes (cluster.py) a browser's stream lives in one
+of them, but events happen in all. forward() then sends every publish()
+over the cluster bus, and each worker — the publishing one included —
+deliver()s it under the bus message id, so event ids are the same in every
+worker and a reconnect that lands elsewhere still replays correctly. Workers
+that have subscribers say so with watched(); a publish nobody in the
+cluster watches goes over the bus without its data, as a gap.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+QUEUE_MAX  = 256
+REPLAY_MAX = 512
+
+_RESYNC = "event: resync\ndata: {}\n\n"
+
+
+class Subscription:
+    __slots__ = ("queue",)
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_MAX)
+
+
+class EventHub:
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subs: set = set()
+        self._replay: deque = deque(maxlen=REPLAY_MAX)   # (seq, text), loop thread only
+        self._lock  = threading.Lock()
+        self._seq   = 0          # last sequence number handed out
+        self._hole  = 0          # newest sequence number that was not delivered
+        self._evicted = 0        # newest sequence number dropped from _replay
+        self._forward: Optional[Callable[[str, object], None]] = None
+        self._watched = 0.0      # monotonic time until which another worker has subscribers
+        self.published = 0
+        self.resyncs   = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Deliver to subscribers on `loop` (the server's event loop)."""
+        self._loop = loop
+
+    def forward(self, send: Callable[[str, object], None], seq: int):
+        """Hand every publish() to send(event, data) instead of delivering it
+        here; the cluster bus calls deliver() with the message id. `seq` is
+        the bus position this worker starts reading at — anything a browser
+        saw before it can't be replayed from here."""
+        self._forward = send
+        with self._lock:
+            self._seq = self._hole = max(self._seq, seq)
+
+    def watched(self, seconds: float):
+        """Another worker has subscribers: count as active for `seconds`."""
+        self._watched = time.monotonic() + seconds
+
+    @property
+    def active(self) -> bool:
+        """True when at least one dashboard is listening (in any worker)."""
+        return bool(self._subs) or (self._forward is not None
+                                    and time.monotonic() < self._watched)
+
+    @property
+    def subscribed(self) -> bool:
+        """True when a dashboard is listening to this hub itself."""
+        return bool(self._subs)
+
+    def publish(self, event: str, data) -> None:
+        """Send `event` to every subscriber. Thread-safe, never blocks."""
+        if self._forward is not None:
+            self._forward(event, data if self.active else None)
+        else:
+            self.deliver(event, data)
+
+    def deliver(self, event: str, data, seq: Optional[int] = None) -> None:
+        """publish() to this hub's subscribers only, as event id `seq` (default:
+        the next in sequence). data=None only advances the sequence."""
+        loop = self._loop
+        if loop is None or not self._subs or data is None:
+            with self._lock:
+                self._seq  = self._seq + 1 if seq is None else max(self._seq, seq)
+                self._hole = self._seq
+            if data is None and loop is not None and self._subs:
+                # Sent as a gap before the other workers heard about our
+                # subscribers: the streams open here have missed it.
+                try:
+                    loop.call_soon_threadsafe(self._dispatch, self._hole, "")
+                except RuntimeError:
+                    pass
+            return
+        payload = json.dumps(data, separators=(",", ":"), default=str)
+        with self._lock:
+            seq = self._seq + 1 if seq is None else seq
+            self._seq = max(self._seq, seq)
+            text = f"id: {seq}\nevent: {event}\ndata: {payload}\n\n"
+            try:
+                loop.call_soon_threadsafe(self._dispatch, seq, text)
+            except RuntimeError:        # loop closed during shutdown
+                self._hole = seq
+                return
+        self.published += 1
+
+    def _dispatch(self, seq: int, text: Optional[str]):
+        if text is None:                # close(): end every stream
+            for sub in list(self._subs):
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait(None)
+            return
+        if not text:                    # deliver() of a gap: resync every stream
+            for sub in list(self._subs):
+                self._reset(sub)
+            return
+        if len(self._replay) == self._replay.maxlen:
+            self._evicted = self._replay[0][0]
+        self._replay.append((seq, text))
+        for sub in list(self._subs):
+            try:
+                sub.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._reset(sub)
+
+    def _reset(self, sub: Subscription):
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(_RESYNC)
+        self.resyncs += 1
+
+    # ── Subscriber side (event loop thread) ──────────────────────────────────
+
+    def subscribe(self, last_id: Optional[int] = None) -> Subscription:
+        """New subscription. With `last_id` (the browser's Last-Event-ID),
+        replay what it missed, or queue a `resync` if that's no longer
+        possible."""
+        sub = Subscription()
+        if last_id is not None and last_id > self._seq:   # id from before a restart
+            self._reset(sub)
+        elif last_id is not None and last_id < self._seq:
+            missed = [text for seq, text in self._replay if seq > last_id]
+            if last_id < self._hole or last_id < self._evicted or len(missed) >= QUEUE_MAX:
+                self._reset(sub)
+            else:
+                for text in missed:
+                    sub.queue.put_nowait(text)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subs.discard(sub)
+
+    async def next(self, sub: Subscription, timeout: float) -> Optional[str]:
+        """Next SSE message for `sub`, a keep-alive comment after `timeout`
+        seconds of silence, or None once the hub is closed."""
+        try:
+            return await asyncio.wait_for(sub.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return ": keepalive\n\n"
+
+    def close(self):
+        """End every open stream (server shutdown). Thread-safe."""
+        loop = self._loop
+        self._loop = None
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._dispatch, 0, None)
+            except RuntimeError:
+                pass
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subs), "published": self.published,
+                "resyncs": self.resyncs}
@@ -0,0 +1,546 @@
+"""
+FLARE - FedAvg Round Scheduler
+──────────────────────────────────
+Federated averaging runs on its own thread instead of inside the
+/api/fl/update request. The handler stores the update in fl_updates (so a
+restart loses nothing) and hands it to FedAvgScheduler.submit(), which never
+blocks; the request returns straight away.
+
+The scheduler keeps one open round per track. Each update is folded into that
+round's fl_weights.RunningAverage as it arrives, so the work of averaging is
+spread over the round and closing it is a single division.
+
+Two aggregation modes (FLARE_FL_MODE):
+
+  sync   classic FedAvg. Updates based on a round older than
+         current - MAX_STALE_ROUNDS are dropped; a round closes on
+         `min_updates` updates (FLARE_FL_MIN_CLIENTS, trigger "quorum") and
+         the new model is their sample-weighted mean.
+  async  buffered asynchronous aggregation (FedBuff). Updates up to
+         FLARE_FL_MAX_STALENESS rounds behind are kept, each weighted by
+         n * s(tau), s(tau) = (1 + tau) ** -0.5, tau = current round -
+         base round. The model advances whenever the buffer holds
+         FLARE_FL_BUFFER_SIZE updates (trigger "buffer"):
+             g' = g + lr * sum(n_i * s_i * (w_i - g)) / sum(n_i)
+         Agents send full weights rather than deltas, so each delta is taken
+         against the current global model g. With fresh updates and lr = 1
+         this is exactly the sync average of the buffer; stale ones move the
+         model proportionally less.
+
+In either mode a round also closes `deadline` seconds after its first update
+(FLARE_FL_ROUND_DEADLINE, trigger "deadline"; 0 disables).
+
+With a model transport encoding (FLARE_FL_MODEL_ENCODING / _TOPK, see
+proto/weight_codec.py) the new model is snapped onto the previous one plus
+the quantised delta, and that encoded delta is kept: agents on the previous
+round download it instead of the full model and reconstruct the published
+weights bit for bit. What the quantiser leaves out stays in the next round's
+delta, since that is always taken against the published model.
+
+Closing writes, in ONE transaction, the new fl_models row, its
+fl_model_history row (weights + encoded delta; the last max_stale + 1 rounds
+are kept as bases for delta-encoded FLUpdates), an fl_rounds row with the
+round's timing, and the deletion of the fl_updates it consumed (and of any
+dropped as too stale), so the round
+is published atomically. on_round(track, round) is then called
+from the scheduler thread (the server uses it to install the new model frame,
+bump the "fl" data version and notify the dashboards).
+
+Rounds in progress are rebuilt from fl_updates by load() at startup.
+
+With several server processes (cluster.py) only the elected leader runs a
+scheduler. Other processes store the update and pass its id on; the leader
+reads it back with submit_stored(). Their own FedAvgScheduler is never
+started and answers accepts() / progress() from the leader's snapshot(),
+which on_progress tells them about, via mirror().
+
+Usage
+-----
+  # Simulated fleet: hours to converge, sync FedAvg vs async FedBuff
+  python fl_scheduler.py --simulate [--clients 200] [--days 14]
+"""
+
+import argparse
+import heapq
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, ContextManager, Optional
+
+import numpy as np
+
+import fl_weights
+from metrics import Histogram
+from proto import log_schema_pb2 as pb
+from proto import weight_codec
+
+log = logging.getLogger("flare_server.fl")
+
+MODES = ("sync", "async")
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS fl_rounds (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        track       INTEGER,
+        round       INTEGER,
+        trigger     TEXT,       -- quorum | buffer | deadline
+        updates     INTEGER,
+        clients     INTEGER,
+        samples     INTEGER,
+        opened_at   REAL,       -- first update of the round received
+        closed_at   REAL,
+        close_ms    REAL        -- average + pack + commit
+    );
+    CREATE INDEX IF NOT EXISTS idx_fl_rounds_track ON fl_rounds(track, round);
+    CREATE TABLE IF NOT EXISTS fl_model_history (
+        track         INTEGER,
+        round         INTEGER,
+        weights_blob  BLOB,
+        weights_shape TEXT,
+        delta_pb      BLOB,     -- ModelUpdate with the encoded delta from round - 1
+        PRIMARY KEY (track, round)
+    );
+"""
+
+_PENDING_SQL = ("SELECT id, received_at, client_id, track, sample_count, base_round, "
+                "weights_blob, weights_shape FROM fl_updates")
+
+_PUBLISH_SQL = """INSERT INTO fl_models (track, round, version, client_count, updated_at, weights_blob, weights_shape)
+    VALUES (?,?,?,?,?,?,?)
+    ON CONFLICT(track) DO UPDATE SET round=excluded.round, version=excluded.version,
+    client_count=excluded.client_count, updated_at=excluded.updated_at,
+    weights_blob=excluded.weights_blob, weights_shape=excluded.weights_shape"""
+
+
+def staleness_weight(tau: int) -> float:
+    """FedBuff's polynomial discount for an update `tau` rounds behind."""
+    return (1.0 + max(tau, 0)) ** -0.5
+
+
+class _OpenRound:
+    """Updates received towards the next round of one track."""
+    __slots__ = ("avg", "clients", "samples", "staleness", "ids", "opened_at")
+
+    def __init__(self, opened_at: float):
+        self.avg       = fl_weights.RunningAverage()
+        self.clients: set = set()
+        self.samples   = 0
+        self.staleness = 0          # summed tau of the folded updates
+        self.ids: list = []         # fl_updates ids folded in
+        self.opened_at = opened_at
+
+
+class FedAvgScheduler(threading.Thread):
+    """
+    writer       — context-manager factory yielding the writer connection
+                   (ConnectionPool.writer)
+    mode         — "sync" or "async" (see module docstring)
+    min_updates  — sync: updates that close a round
+    buffer_size  — async: updates that advance the model
+    deadline     — seconds after a round's first update at which it closes
+                   with whatever it has; 0 disables
+    max_stale    — updates based on a round older than current - max_stale
+                   are not counted
+    server_lr    — async: step size towards the buffered average
+    model_encoding, model_topk
+                 — weight_codec encoding / top-k fraction for model deltas;
+                   FLOAT32 with topk 0 publishes exact models and no deltas
+    on_round     — optional callback(track, round) after each round commits
+    on_progress  — optional callback() whenever an update is folded in or a
+                   round closes
+    """
+
+    def __init__(self, writer: Optional[Callable[[], ContextManager[sqlite3.Connection]]],
+                 mode: str = "sync", min_updates: int = 1, buffer_size: int = 10,
+                 deadline: float = 0.0, max_stale: int = 1, server_lr: float = 1.0,
+                 model_encoding: int = weight_codec.FLOAT32, model_topk: float = 0.0,
+                 on_round: Optional[Callable[[int, int], None]] = None,
+                 on_progress: Optional[Callable[[], None]] = None):
+        super().__init__(name="FedAvgScheduler", daemon=True)
+        if mode not in MODES:
+            raise ValueError(f"FL aggregation mode must be one of {MODES}, not {mode!r}")
+        self._writer    = writer
+        self.mode       = mode
+        self.min_updates = max(1, min_updates if mode == "sync" else buffer_size)
+        self.deadline   = deadline
+        self.max_stale  = max_stale
+        self.server_lr  = server_lr
+        self.model_encoding = model_encoding
+        self.model_topk = model_topk
+        self._on_round  = on_round
+        self._on_progress = on_progress
+        self._q: queue.SimpleQueue = queue.SimpleQueue()
+        self._stop_evt  = threading.Event()
+        self._rounds: dict = {}      # track -> current (published) round
+        self._open: dict = {}        # track -> _OpenRound
+        self._lock      = threading.Lock()   # guards _rounds / _open for readers
+        self._mirrored: Optional[list] = None   # progress() of the leader's scheduler
+        self.loaded_upto = 0         # newest fl_updates.id read by load()
+        self._dropped_ids: list = []  # stale fl_updates, deleted with the next round
+        self.closed     = 0
+        self.dropped    = 0
+        self.rejected   = 0          # updates whose layout didn't fit their round
+        self.aggregated = 0          # updates folded into closed rounds
+        self.close_seconds = Histogram()
+
+    def load(self, conn: sqlite3.Connection):
+        """Read the published rounds and refold the updates still pending in
+        fl_updates. Call before start()."""
+        self._rounds = {r[0]: r[1] for r in conn.execute("SELECT track, round FROM fl_models")}
+        rows = conn.execute(_PENDING_SQL + " ORDER BY id").fetchall()
+        for r in rows:
+            self._fold_checked(self._stored(r))
+        self.loaded_upto = rows[-1]["id"] if rows else 0
+        if rows:
+            log.info("FedAvg: %d pending updates reloaded", sum(o.avg.count for o in self._open.values()))
+
+    # ── Producer side (called from request handlers) ─────────────────────────
+
+    def current_round(self, track: int) -> int:
+        return self._rounds.get(track, 0)
+
+    def layout(self, track: int) -> Optional[dict]:
+        """fl_weights.layout() updates to the open round of `track` must
+        match, or None when no round is open (or this process isn't the
+        aggregator)."""
+        with self._lock:
+            o = self._open.get(track)
+            return dict(o.avg.layout) if o is not None and o.avg.count else None
+
+    def accepts(self, track: int, base_round: int) -> bool:
+        """False for an update too stale to be counted in this mode."""
+        return base_round >= self.current_round(track) - self.max_stale
+
+    def submit(self, track: int, update_id: int, client_id: str, sample_count: int,
+               base_round: int, received_at: float, weights: dict):
+        """Queue a stored fl_updates row for aggregation. Never blocks."""
+        self._q.put((track, update_id, client_id, sample_count, base_round, received_at, weights))
+
+    @staticmethod
+    def _stored(r) -> tuple:
+        return (r["track"], r["id"], r["client_id"], r["sample_count"], r["base_round"],
+                r["received_at"], fl_weights.unpack(r["weights_blob"], r["weights_shape"]))
+
+    def submit_stored(self, conn: sqlite3.Connection, update_id: int):
+        """submit() the fl_updates row `update_id`, stored by another process.
+        Rows load() has already folded in are skipped."""
+        if update_id <= self.loaded_upto:
+            return
+        r = conn.execute(_PENDING_SQL + " WHERE id = ?", (update_id,)).fetchone()
+        if r is not None:
+            self._q.put(self._stored(r))
+
+    def snapshot(self) -> dict:
+        """Published rounds and progress(), for mirror() in other processes."""
+        with self._lock:
+            rounds = sorted(self._rounds.items())
+        return {"rounds": rounds, "open": self.progress()}
+
+    def mirror(self, snap: dict):
+        """Take rounds and progress from the leader's snapshot(). Returns the
+        tracks whose round advanced."""
+        with self._lock:
+            advanced = [t for t, r in snap["rounds"] if r > self._rounds.get(t, 0)]
+            self._rounds.update((t, r) for t, r in snap["rounds"])
+            self._mirrored = snap["open"]
+        return advanced
+
+    def progress(self) -> list:
+        """Open rounds: what each track's next round has collected so far."""
+        if self._mirrored is not None:
+            return self._mirrored
+        with self._lock:
+            return [{
+                "track":         track,
+                "round":         self._rounds.get(track, 0) + 1,
+                "mode":          self.mode,
+                "updates":       o.avg.count,
+                "clients":       len(o.clients),
+                "samples":       o.samples,
+                "mean_staleness": round(o.staleness / o.avg.count, 2) if o.avg.count else 0,
+                "min_updates":   self.min_updates,
+                "opened_at":     o.opened_at,
+                "deadline_at":   o.opened_at + self.deadline if self.deadline > 0 else None,
+            } for track, o in sorted(self._open.items())]
+
+    def stop(self, timeout: float = 10.0):
+        """Fold in whatever is queued and stop. Open rounds stay in fl_updates."""
+        self._stop_evt.set()
+        self.join(timeout=timeout)
+
+    # ── Scheduler thread ──────────────────────────────────────────────────────
+
+    def run(self):
+        log.info("FedAvg scheduler: started (%s, closes at %d updates, deadline=%s)",
+                 self.mode, self.min_updates,
+                 f"{self.deadline:g}s" if self.deadline > 0 else "off")
+        while True:
+            try:
+                item = self._q.get(timeout=self._wait())
+            except queue.Empty:
+                item = None
+            if item is not None:
+                if self._fold_checked(item):
+                    self._progressed()
+            elif self._stop_evt.is_set():
+                break
+            self._close_due()
+        log.info("FedAvg scheduler: stopped (%d rounds closed, %d stale updates dropped)",
+                 self.closed, self.dropped)
+
+    def _wait(self) -> float:
+        """Seconds until the earliest deadline (at most 1)."""
+        if self.deadline <= 0 or not self._open:
+            return 1.0
+        due = min(o.opened_at for o in self._open.values()) + self.deadline
+        return min(1.0, max(0.0, due - time.time()))
+
+    def _fold_checked(self, item: tuple) -> bool:
+        """_fold() an update. One that can't be folded in (its layout differs
+        from the open round's) is logged, dropped and deleted from
+        fl_updates, so it neither stops the thread nor comes back on the
+        next load()."""
+        try:
+            self._fold(*item)
+            return True
+        except Exception as exc:
+            log.warning("FedAvg: update %d from %s dropped: %s", item[1], item[2], exc)
+            self.rejected += 1
+            self._delete_update(item[1])
+            return False
+
+    def _delete_update(self, update_id: int):
+        if self._writer is not None:
+            try:
+                with self._writer() as conn:
+                    conn.execute("DELETE FROM fl_updates WHERE id = ?", (update_id,))
+                return
+            except sqlite3.Error as exc:
+                log.warning("FedAvg: could not delete update %d: %s", update_id, exc)
+        self._dropped_ids.append(update_id)      # deleted with the next round instead
+
+    def _fold(self, track, update_id, client_id, sample_count, base_round, received_at, weights):
+        # The round may have advanced since the handler's accepts() check.
+        if not self.accepts(track, base_round):
+            self.dropped += 1
+            self._dropped_ids.append(update_id)
+            return
+        tau = max(self.current_round(track) - base_round, 0)
+        weight = sample_count * (staleness_weight(tau) if self.mode == "async" else 1.0)
+        with self._lock:
+            o = self._open.get(track)
+            if o is None:
+                o = self._open[track] = _OpenRound(received_at)
+            o.avg.add(weights, weight)
+            o.clients.add(client_id)
+            o.samples   += sample_count
+            o.staleness += tau
+            o.ids.append(update_id)
+
+    def _trigger(self, o: _OpenRound, now: float) -> Optional[str]:
+        if o.avg.count >= self.min_updates:
+            return "quorum" if self.mode == "sync" else "buffer"
+        if self.deadline > 0 and now - o.opened_at >= self.deadline:
+            return "deadline"
+        return None
+
+    def _aggregate(self, o: _OpenRound, current: Optional[dict]) -> dict:
+        """The next global model from the open round and the current one."""
+        avg = o.avg.result()
+        if self.mode == "sync":
+            return avg
+        # sum(n_i s_i (w_i - g)) / sum(n_i) == (S / N) * (avg_s - g)
+        return fl_weights.blend(current, avg, self.server_lr * o.avg.weight / o.samples)
+
+    def _snap(self, current: Optional[dict], new: dict, base_round: int) -> Optional[bytes]:
+        """Replace new's layers by current + quantised(new - current) and
+        return that delta as a serialised ModelUpdate, or None when deltas
+        are off or the layer layout changed."""
+        if self.model_encoding == weight_codec.FLOAT32 and not self.model_topk:
+            return None
+        groups = fl_weights.LAYER_GROUPS
+        if not current or any([np.shape(a) for a in current.get(g, ())] !=
+                               [np.shape(a) for a in new.get(g, ())] for g in groups):
+            return None
+        delta = pb.ModelUpdate(is_delta=True, base_round=base_round)
+        for g in groups:
+            out = getattr(delta, g)
+            snapped = []
+            for cur, target in zip(current[g], new[g]):
+                cur = np.asarray(cur, dtype=np.float32)
+                lw  = weight_codec.encode(out.add(), target.astype(np.float32) - cur,
+                                          self.model_encoding, self.model_topk)
+                snapped.append(cur + weight_codec.decode(lw))
+            new[g] = snapped
+        return delta.SerializeToString()
+
+    def _close_due(self):
+        now = time.time()
+        for track, o in list(self._open.items()):
+            trigger = self._trigger(o, now)
+            if trigger:
+                self._close(track, o, trigger)
+
+    def _close(self, track: int, o: _OpenRound, trigger: str):
+        t0 = time.perf_counter()
+        new_round = self._rounds.get(track, 0) + 1
+        version = f"round-{new_round}"
+        now = time.time()
+        try:
+            with self._writer() as conn:
+                current, row = None, conn.execute(
+                    "SELECT round, weights_blob, weights_shape FROM fl_models WHERE track=?",
+                    (track,)).fetchone()
+                if row and row[1] is not None:
+                    current = fl_weights.unpack(row[1], row[2])
+                    # Keep the outgoing model as a delta base (bootstrap / pre-history rows).
+                    conn.execute("INSERT OR IGNORE INTO fl_model_history (track, round, weights_blob, "
+                                 "weights_shape) VALUES (?,?,?,?)", (track, row[0], row[1], row[2]))
+                new = self._aggregate(o, current)
+                delta = self._snap(current, new, new_round - 1)
+                new["version"] = version
+                blob, shape = fl_weights.pack(new)
+                conn.execute(_PUBLISH_SQL, (track, new_round, version, o.avg.count, now, blob, shape))
+                conn.execute("INSERT OR REPLACE INTO fl_model_history (track, round, weights_blob, "
+                             "weights_shape, delta_pb) VALUES (?,?,?,?,?)",
+                             (track, new_round, blob, shape, delta))
+                conn.execute("DELETE FROM fl_model_history WHERE track=? AND round < ?",
+                             (track, new_round - self.max_stale))
+                dropped = list(self._dropped_ids)
+                conn.executemany("DELETE FROM fl_updates WHERE id = ?",
+                                 [(i,) for i in o.ids + dropped])
+                conn.execute(
+                    "INSERT INTO fl_rounds (track, round, trigger, updates, clients, samples, "
+                    "opened_at, closed_at, close_ms) VALUES (?,?,?,?,?,?,?,?,?)",
+                    (track, new_round, trigger, o.avg.count, len(o.clients), o.samples,
+                     o.opened_at, now, (time.perf_counter() - t0) * 1000))
+        except sqlite3.Error as exc:
+            # Round stays open; the next loop pass retries.
+            log.warning("FedAvg: could not publish round %d for track %d: %s", new_round, track, exc)
+            return
+        with self._lock:
+            self._rounds[track] = new_round
+            del self._open[track]
+        del self._dropped_ids[:len(dropped)]
+        self.closed += 1
+        self.aggregated += o.avg.count
+        self.close_seconds.observe(time.perf_counter() - t0)
+        log.info("FedAvg: track %d round %d closed by %s (%d updates, %d clients, %.1f ms)",
+                 track, new_round, trigger, o.avg.count, len(o.clients),
+                 (time.perf_counter() - t0) * 1000)
+        if self._on_round is not None:
+            try:
+                self._on_round(track, new_round)
+            except Exception as exc:
+                log.warning("FedAvg: round callback failed: %s", exc)
+        self._progressed()
+
+    def _progressed(self):
+        if self._on_progress is not None:
+            try:
+                self._on_progress()
+            except Exception as exc:
+                log.warning("FedAvg: progress callback failed: %s", exc)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Fleet simulation
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _simulate(mode: str, clients: int, days: float, quorum: int, buffer_size: int,
+              max_stale: int, seed: int) -> dict:
+    """Run the scheduler's aggregation (no thread, no DB) over a simulated
+    fleet in virtual time. Each agent polls the model every 6 h and retrains
+    every 24 h; a quarter of the fleet (laptops that are often off) polls
+    every 36 h and retrains every 72 h. A retrain pulls the scaler the agent
+    was given halfway towards its own data's statistics. Returns the error of the global scaler mean, relative to the
+    sample-weighted optimum, over time."""
+    rng   = np.random.default_rng(seed)
+    dim   = 38
+    truth = rng.standard_normal(dim) * 3
+    local = truth + rng.standard_normal((clients, dim))         # per-agent optimum
+    n     = rng.integers(200, 5000, clients)
+    target = (local * n[:, None]).sum(0) / n.sum()
+    laptop = rng.random(clients) < 0.25
+    period = np.where(laptop, 72.0, 24.0)
+    poll   = np.where(laptop, 36.0, 6.0)
+
+    sched = FedAvgScheduler(None, mode=mode, min_updates=quorum, buffer_size=buffer_size,
+                            max_stale=max_stale)
+    g = {"coefs": [], "intercepts": [], "scaler_mean": np.zeros(dim)}
+    g_round = 0
+    held = [(g, 0)] * clients                                    # (model, round) each agent runs
+    err0 = np.linalg.norm(g["scaler_mean"] - target)
+
+    # (time h, kind, client): first polls/retrains spread over the first period
+    events = [(rng.uniform(0, poll[i]), 0, i) for i in range(clients)]
+    events += [(rng.uniform(0, period[i]), 1, i) for i in range(clients)]
+    heapq.heapify(events)
+    curve, used, uid = [], 0, 0
+    while events:
+        t, kind, i = heapq.heappop(events)
+        if t > days * 24:
+            break
+        if kind == 0:                                            # poll
+            held[i] = (g, g_round)
+            heapq.heappush(events, (t + poll[i], 0, i))
+            continue
+        base, base_round = held[i]
+        w = base["scaler_mean"] + 0.5 * (local[i] - base["scaler_mean"])
+        heapq.heappush(events, (t + period[i], 1, i))
+        if not sched.accepts(0, base_round):
+            sched.dropped += 1
+            continue
+        uid += 1
+        sched._fold(0, uid, i, int(n[i]), base_round, t, {"scaler_mean": w})
+        o = sched._open[0]
+        if sched._trigger(o, t):
+            g = sched._aggregate(o, g)
+            g_round += 1
+            used += o.avg.count
+            sched._rounds[0] = g_round
+            del sched._open[0]
+            curve.append((t, np.linalg.norm(g["scaler_mean"] - target) / err0))
+    return {"rounds": g_round, "used": used, "dropped": sched.dropped, "curve": curve}
+
+
+def _hours_to(curve: list, level: float) -> Optional[float]:
+    return next((t for t, e in curve if e <= level), None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE FedAvg round scheduler")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Compare sync FedAvg and async FedBuff on a simulated fleet")
+    parser.add_argument("--clients", type=int, default=200, help="Simulated agents")
+    parser.add_argument("--days", type=float, default=14, help="Simulated days")
+    parser.add_argument("--quorum", type=int, default=0,
+                        help="Sync quorum (default: half the fleet)")
+    parser.add_argument("--buffer", type=int, default=10, help="Async buffer size K")
+    parser.add_argument("--max-staleness", type=int, default=10, help="Async staleness limit")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    if not args.simulate:
+        parser.print_help()
+        return
+
+    quorum = args.quorum or max(1, args.clients // 2)
+    print(f"  {args.clients} agents (75% poll 6 h / retrain 24 h, 25% poll 36 h / retrain 72 h), "
+          f"{args.days:g} days; error of the global scaler relative to the start")
+    print(f"  {'mode':<28}{'rounds':>7}{'used':>7}{'dropped':>8}"
+          f"{'err@end':>9}{'h to 10%':>10}{'h to 5%':>9}")
+    for mode, label, stale in (("sync", f"sync  quorum={quorum}", 1),
+                               ("async", f"async K={args.buffer} stale<={args.max_staleness}",
+                                args.max_staleness)):
+        r = _simulate(mode, args.clients, args.days, quorum, args.buffer, stale, args.seed)
+        end = f"{r['curve'][-1][1]:.4f}" if r["curve"] else "-"
+        h10, h5 = _hours_to(r["curve"], 0.10), _hours_to(r["curve"], 0.05)
+        print(f"  {label:<28}{r['rounds']:>7}{r['used']:>7}{r['dropped']:>8}{end:>9}"
+              f"{(f'{h10:.0f}' if h10 is not None else '-'):>10}"
+              f"{(f'{h5:.0f}' if h5 is not None else '-'):>9}")
+
+
+if __name__ == "__main__":
+    main()
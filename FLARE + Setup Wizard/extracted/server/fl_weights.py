@@ -0,0 +1,309 @@
+"""
+FLARE - FL Weight Storage
+──────────────────────────────────
+Model weights in fl_updates / fl_models are stored as one BLOB of raw
+little-endian float32 values plus a small JSON shape manifest, instead of a
+weights_json document of nested number lists:
+
+  weights_blob   every array back to back, '<f4', row-major
+  weights_shape  {"coefs": [[38, 64], [64, 32], [32, 1]],
+                  "intercepts": [[64], [32], [1]],
+                  "scaler_mean": [38], "scaler_scale": [38],
+                  "version": "round-3"}            (version when known)
+
+unpack() returns numpy views straight over the blob (np.frombuffer, no copy,
+no text parsing), so FedAvg and model serving work on the stored bytes
+directly. float32 is what LayerWeights / ModelUpdate carry on the wire, so
+nothing is lost against JSON; FedAvg still accumulates in float64.
+
+RunningAverage is the streaming form of weighted_average() used by the round
+scheduler (fl_scheduler.py): each update is folded into a float64 weighted
+sum as it arrives, so closing a round is one division per array. blend()
+steps the global model part of the way towards an average (async mode).
+
+Databases written before this layout are converted in place by migrate().
+
+Usage
+-----
+  # JSON vs blob: storage per update and FedAvg time for the network MLP
+  python fl_weights.py --bench [-n 50]
+"""
+
+import argparse
+import json
+import math
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+LAYER_GROUPS  = ("coefs", "intercepts")          # one array per layer
+VECTOR_GROUPS = ("scaler_mean", "scaler_scale")  # one flat array each
+_DTYPE = np.dtype("<f4")
+
+# Columns added to fl_updates / fl_models by migrate().
+_COLUMNS = (("weights_blob", "BLOB"), ("weights_shape", "TEXT"))
+
+
+def pack(weights: dict) -> tuple:
+    """{"coefs": [arrays], "intercepts": [arrays], "scaler_mean": array, …}
+    -> (blob, manifest) for weights_blob / weights_shape. Groups that are
+    missing or empty are left out."""
+    manifest, parts = {}, []
+    for g in LAYER_GROUPS:
+        arrs = [np.asarray(a, dtype=_DTYPE) for a in weights.get(g) or ()]
+        manifest[g] = [list(a.shape) for a in arrs]
+        parts += arrs
+    for g in VECTOR_GROUPS:
+        v = weights.get(g)
+        if v is not None and len(v):
+            a = np.asarray(v, dtype=_DTYPE).ravel()
+            manifest[g] = [a.size]
+            parts.append(a)
+    if weights.get("version"):
+        manifest["version"] = weights["version"]
+    blob = b"".join(np.ascontiguousarray(a).tobytes() for a in parts)
+    return blob, json.dumps(manifest, separators=(",", ":"))
+
+
+def layout(weights: dict) -> dict:
+    """Array shapes of `weights` in the form of pack()'s manifest
+    ({"coefs": [[38, 64], …], "scaler_mean": [38], …}); groups that are
+    missing or empty are left out."""
+    out = {}
+    for g in LAYER_GROUPS:
+        arrs = weights.get(g) or ()
+        if len(arrs):
+            out[g] = [list(np.shape(a)) for a in arrs]
+    for g in VECTOR_GROUPS:
+        v = weights.get(g)
+        if v is not None and len(v):
+            out[g] = [int(np.size(v))]
+    return out
+
+
+def mismatch(expected: dict, weights: dict) -> Optional[str]:
+    """Why `weights` can't be averaged with weights of layout `expected`
+    (layout(), or a weights_shape manifest), or None if it can. A group
+    either side lacks is not compared."""
+    got = layout(weights)
+    for g in LAYER_GROUPS + VECTOR_GROUPS:
+        want = expected.get(g)
+        if want and g in got and got[g] != want:
+            return f"{g} shapes {got[g]} do not match {want}"
+    return None
+
+
+def unpack(blob: bytes, manifest: str) -> dict:
+    """Inverse of pack(). Arrays are read-only float32 views into `blob`."""
+    m = json.loads(manifest)
+    flat = np.frombuffer(blob, dtype=_DTYPE)
+    pos = 0
+
+    def take(shape):
+        nonlocal pos
+        n = math.prod(shape)
+        a = flat[pos:pos + n].reshape(shape)
+        pos += n
+        return a
+
+    out = {g: [take(s) for s in m.get(g, ())] for g in LAYER_GROUPS}
+    for g in VECTOR_GROUPS:
+        if g in m:
+            out[g] = take(m[g])
+    if "version" in m:
+        out["version"] = m["version"]
+    if pos != flat.size:
+        raise ValueError(f"weights blob holds {flat.size} values, manifest describes {pos}")
+    return out
+
+
+def weighted_average(updates: Iterable) -> Optional[dict]:
+    """FedAvg over [(weights, fraction)] (fractions summing to 1), accumulated
+    in float64. Layer arrays are averaged position by position; a scaler
+    group is averaged over the updates that carry it."""
+    avg: Optional[dict] = None
+    for w, frac in updates:
+        if avg is None:
+            avg = {g: [a.astype(np.float64) * frac for a in w[g]] for g in LAYER_GROUPS}
+        else:
+            for g in LAYER_GROUPS:
+                for acc, a in zip(avg[g], w[g]):
+                    acc += np.multiply(a, frac, dtype=np.float64)
+        for g in VECTOR_GROUPS:
+            if g in w:
+                if g in avg:
+                    avg[g] += np.multiply(w[g], frac, dtype=np.float64)
+                else:
+                    avg[g] = w[g].astype(np.float64) * frac
+    return avg
+
+
+class LayoutError(ValueError):
+    """Weights whose array shapes differ from those they are averaged with."""
+
+
+class RunningAverage:
+    """FedAvg built up one update at a time: add(weights, n) folds an update
+    into float64 sums weighted by its sample count n; result() divides them
+    out. The first update fixes the layer layout, as in weighted_average();
+    a scaler group is averaged over the updates that carry it, its length
+    fixed by the first of them."""
+
+    def __init__(self):
+        self._sums: Optional[dict] = None
+        self._vec_weight: dict = {}     # vector group -> summed weight
+        self.layout: dict = {}          # layout() the updates must match
+        self.weight = 0.0
+        self.count  = 0
+
+    def add(self, w: dict, weight: float):
+        """Fold in `w`; raises LayoutError (adding nothing) when its shapes
+        differ from the updates already added."""
+        problem = mismatch(self.layout, w)
+        if problem:
+            raise LayoutError(problem)
+        shapes = layout(w)
+        if self._sums is None:
+            self.layout = shapes
+        else:
+            for g in VECTOR_GROUPS:
+                if g in shapes:
+                    self.layout.setdefault(g, shapes[g])
+        if self._sums is None:
+            self._sums = {g: [np.multiply(a, weight, dtype=np.float64) for a in w.get(g) or ()]
+                          for g in LAYER_GROUPS}
+        else:
+            for g in LAYER_GROUPS:
+                for acc, a in zip(self._sums[g], w.get(g) or ()):
+                    acc += np.multiply(a, weight, dtype=np.float64)
+        for g in VECTOR_GROUPS:
+            v = w.get(g)
+            if v is None or not len(v):
+                continue
+            if g in self._sums:
+                self._sums[g] += np.multiply(v, weight, dtype=np.float64)
+            else:
+                self._sums[g] = np.multiply(v, weight, dtype=np.float64)
+            self._vec_weight[g] = self._vec_weight.get(g, 0.0) + weight
+        self.weight += weight
+        self.count  += 1
+
+    def result(self) -> Optional[dict]:
+        """The weighted mean so far (float64 arrays), or None before any add()."""
+        if self._sums is None or self.weight <= 0:
+            return None
+        out = {g: [a / self.weight for a in self._sums[g]] for g in LAYER_GROUPS}
+        for g in VECTOR_GROUPS:
+            if g in self._sums:
+                out[g] = self._sums[g] / self._vec_weight[g]
+        return out
+
+
+def blend(base: Optional[dict], target: dict, alpha: float) -> dict:
+    """base + alpha * (target - base), array by array (float64). Arrays that
+    base lacks, or holds in another shape, are taken from target as is."""
+    if not base:
+        return dict(target)
+    def mix(b, t):
+        if b is None or np.shape(b) != t.shape:
+            return t
+        b = np.asarray(b, dtype=np.float64)
+        return b + alpha * (t - b)
+
+    out = dict(target)
+    for g in LAYER_GROUPS:
+        old = list(base.get(g) or ())
+        out[g] = [mix(old[i] if i < len(old) else None, t) for i, t in enumerate(target.get(g) or ())]
+    for g in VECTOR_GROUPS:
+        if g in target:
+            out[g] = mix(base.get(g), target[g])
+    return out
+
+
+def migrate(conn) -> int:
+    """Add the blob columns to fl_updates / fl_models if missing and convert
+    every weights_json row (emptied afterwards). Returns rows converted;
+    caller commits."""
+    moved = 0
+    for table in ("fl_updates", "fl_models"):
+        cols = {r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")}
+        for name, decl in _COLUMNS:
+            if name not in cols:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+        if "weights_json" not in cols:
+            continue
+        key = "id" if table == "fl_updates" else "track"
+        rows = conn.execute(f"SELECT {key}, weights_json FROM {table} "
+                            "WHERE weights_json IS NOT NULL").fetchall()
+        for k, text in rows:
+            blob, shape = pack(json.loads(text))
+            conn.execute(f"UPDATE {table} SET weights_blob=?, weights_shape=?, weights_json=NULL "
+                         f"WHERE {key}=?", (blob, shape, k))
+        moved += len(rows)
+    return moved
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Micro-benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _bench(n: int):
+    rng = np.random.default_rng(0)
+    sizes = (38, 64, 32, 1)
+    updates = []
+    for _ in range(n):
+        updates.append({
+            "coefs":        [rng.standard_normal((a, b)) for a, b in zip(sizes, sizes[1:])],
+            "intercepts":   [rng.standard_normal(b) for b in sizes[1:]],
+            "scaler_mean":  rng.standard_normal(sizes[0]),
+            "scaler_scale": rng.random(sizes[0]) + 0.5,
+        })
+    frac = 1.0 / n
+
+    # Old path: nested lists in JSON, parsed and re-arrayed per aggregation.
+    texts = [json.dumps({g: ([a.astype(np.float32).tolist() for a in u[g]] if g in LAYER_GROUPS
+                             else u[g].astype(np.float32).tolist()) for g in u}) for u in updates]
+    t0 = time.perf_counter()
+    avg = None
+    for text in texts:
+        w = json.loads(text)
+        if avg is None:
+            avg = {g: [np.array(a, dtype=np.float64) * frac for a in w[g]] for g in LAYER_GROUPS}
+            for g in VECTOR_GROUPS:
+                avg[g] = np.array(w[g], dtype=np.float64) * frac
+        else:
+            for g in LAYER_GROUPS:
+                for i, a in enumerate(w[g]):
+                    avg[g][i] += np.array(a, dtype=np.float64) * frac
+            for g in VECTOR_GROUPS:
+                avg[g] += np.array(w[g], dtype=np.float64) * frac
+    t_json = time.perf_counter() - t0
+
+    packed = [pack(u) for u in updates]
+    t0 = time.perf_counter()
+    weighted_average((unpack(b, m), frac) for b, m in packed)
+    t_blob = time.perf_counter() - t0
+
+    json_bytes = sum(len(t.encode()) for t in texts) / n
+    blob_bytes = sum(len(b) + len(m) for b, m in packed) / n
+    print(f"  {n} updates of a {'-'.join(map(str, sizes))} MLP + scaler")
+    print(f"    weights_json : {json_bytes:9.0f} bytes/update   FedAvg {t_json * 1000:8.2f} ms")
+    print(f"    weights_blob : {blob_bytes:9.0f} bytes/update   FedAvg {t_blob * 1000:8.2f} ms"
+          f"   ({json_bytes / blob_bytes:.1f}x smaller, {t_json / t_blob:.0f}x faster)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE FL weight storage")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare JSON and blob weight storage")
+    parser.add_argument("-n", type=int, default=50, help="Updates to aggregate")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.n)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 FLARE — Server
 """
 
+import base64
+import csv
 import ctypes
 import hashlib
 import ipaddress
@@ -18,17 +20,20 @@ import subprocess
 import sys
 import threading
 import time
-import uuid
 import zipfile
+import zlib
 import io
+import queue
 import ssl
+import asyncio
+from collections import defaultdict
 from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
 from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # ── Path setup ────────────────────────────────────────────────────────────────
 ROOT      = Path(__file__).parent
@@ -38,6 +43,29 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from proto import log_schema_pb2 as pb
+from proto import weight_codec
+from ingest_writer import IngestWriter, alert_row
+from db_pool import ConnectionPool
+import alert_search
+import blob_store
+import frame_stream
+import metrics
+import fl_weights
+import fl_scheduler
+import rollups
+from rollups import RollupCompactor
+from fl_scheduler import FedAvgScheduler
+from blob_store import BlobCodec
+from partitions import LABEL_STATUSES, PartitionRetention, PartitionStore
+from event_hub import EventHub
+from frame_stream import FrameError, read_messages
+from http_cache import DataVersions, ResponseCache, StaticAssets, not_modified
+from provisioning import Provisioner
+from discovery import Discovery
+from agent_channel import AgentChannel
+from traffic_record import TrafficRecorder
+import agent_channel
+import cluster
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Configuration
@@ -76,11 +104,79 @@ TLS_CERT            = _cfg("FLARE_CERT_FILE",            str(ROOT / "certs" / "s
 TLS_KEY             = _cfg("FLARE_KEY_FILE",             str(ROOT / "certs" / "server.key"))
 TLS_CA              = _cfg("FLARE_CA_CERT",              str(ROOT / "certs" / "ca.crt"))
 PROVISION_TOKEN     = _cfg("FLARE_PROVISION_TOKEN",      "flare") 
+# /api/provision (see provisioning.py): client key type (rsa | ecdsa), keys
+# generated ahead of demand, and processes signing bundles (0 = threads).
+PROVISION_KEY_TYPE  = _cfg("FLARE_PROVISION_KEY_TYPE",   "rsa").lower()
+PROVISION_KEY_POOL  = int(_cfg("FLARE_PROVISION_KEY_POOL",   "16"))
+PROVISION_WORKERS   = int(_cfg("FLARE_PROVISION_WORKERS",    "2"))
+# LAN discovery (see discovery.py): adaptive | responder | legacy, an optional
+# multicast group for beacons and probes, and the adaptive beacon's longest
+# interval in seconds.
+DISCOVERY_MODE      = _cfg("FLARE_DISCOVERY_MODE",       "adaptive").lower()
+DISCOVERY_GROUP     = _cfg("FLARE_DISCOVERY_GROUP",      "")
+BEACON_MAX_INTERVAL = float(_cfg("FLARE_BEACON_MAX_INTERVAL", "600"))
+# Agent channel (see agent_channel.py): the mTLS port agents keep one
+# connection open to for alerts, heartbeats and FL updates; 0 turns it off.
+CHANNEL_PORT        = int(_cfg("FLARE_CHANNEL_PORT",         str(agent_channel.CHANNEL_PORT)))
 
 MIN_FL_CLIENTS     = int(_cfg("FLARE_FL_MIN_CLIENTS", "1"))
+# A round with fewer than MIN_FL_CLIENTS updates closes this many seconds
+# after its first update (fl_scheduler.py); 0 waits for the quorum.
+FL_ROUND_DEADLINE  = float(_cfg("FLARE_FL_ROUND_DEADLINE", "0"))
+# FL aggregation: sync = FedAvg rounds of MIN_FL_CLIENTS updates; async =
+# FedBuff, the model advances every FL_BUFFER_SIZE updates, stale ones
+# (up to FL_MAX_STALENESS rounds behind) discounted rather than dropped.
+FL_MODE            = _cfg("FLARE_FL_MODE", "sync").lower()
+FL_BUFFER_SIZE     = int(_cfg("FLARE_FL_BUFFER_SIZE", "10"))
+FL_MAX_STALENESS   = int(_cfg("FLARE_FL_MAX_STALENESS", "10"))
+FL_SERVER_LR       = float(_cfg("FLARE_FL_SERVER_LR", "1.0"))
+# Model deltas for agents one round behind (proto/weight_codec.py):
+# none | float16 | int8, optionally keeping only the top fraction of values.
+FL_MODEL_ENCODING  = _cfg("FLARE_FL_MODEL_ENCODING", "none")
+FL_MODEL_TOPK      = float(_cfg("FLARE_FL_MODEL_TOPK", "0"))
 OFFLINE_AFTER_SECS = 180   # agents heartbeat every 60 s; allow 3 missed before offline
 MAX_STALE_ROUNDS   = 1
 
+# Alert ingest writer (see ingest_writer.py).
+#   FLARE_INGEST_DURABILITY=enqueue  ack once the alerts are queued (default)
+#   FLARE_INGEST_DURABILITY=commit   ack only after the group commit
+INGEST_DURABILITY  = _cfg("FLARE_INGEST_DURABILITY", "enqueue").lower()
+INGEST_QUEUE_MAX   = int(_cfg("FLARE_INGEST_QUEUE_MAX", "5000"))   # queued requests
+INGEST_BATCH_MAX   = int(_cfg("FLARE_INGEST_BATCH_MAX", "2000"))   # alerts per transaction
+INGEST_CHUNK_ROWS  = 256   # alerts handed to the writer at a time while a body streams in
+
+# Framed request bodies (see frame_stream.py): bigger frames or bodies are
+# refused with 413 before they are buffered.
+MAX_FRAME_BYTES    = int(_cfg("FLARE_MAX_FRAME_BYTES", str(frame_stream.MAX_FRAME)))
+MAX_BODY_BYTES     = int(_cfg("FLARE_MAX_BODY_BYTES",  str(frame_stream.MAX_BODY)))
+
+# SQLite connection pool (see db_pool.py)
+DB_READERS         = int(_cfg("FLARE_DB_READERS",     "4"))
+DB_SYNCHRONOUS     = _cfg("FLARE_DB_SYNCHRONOUS",     "NORMAL")
+DB_CACHE_MB        = int(_cfg("FLARE_DB_CACHE_MB",    "16"))
+DB_MMAP_MB         = int(_cfg("FLARE_DB_MMAP_MB",     "256"))
+DB_TEMP_STORE      = _cfg("FLARE_DB_TEMP_STORE",      "MEMORY")
+
+# Time-partitioned alert storage (see partitions.py). An empty
+# FLARE_PARTITION_DIR means an "alerts" folder next to the database.
+# FLARE_RETENTION_DAYS=0 keeps alerts forever.
+PARTITION_DIR      = _cfg("FLARE_PARTITION_DIR",           "")
+PARTITION_SPAN     = _cfg("FLARE_PARTITION_SPAN",          "day").lower()   # day | week
+PARTITION_ATTACH   = int(_cfg("FLARE_PARTITION_ATTACH",    "8"))     # attached per connection
+RETENTION_DAYS     = float(_cfg("FLARE_RETENTION_DAYS",    "0"))
+
+# Worker processes serving the API on one port (see cluster.py); 1 runs
+# everything in this process as before.
+WORKERS            = int(_cfg("FLARE_WORKERS",             "1"))
+
+# Traffic recording for replay.py (see traffic_record.py): the file agent
+# traffic is appended to (empty = off; with several workers each appends to
+# FILE.<worker pid>), the fraction of agents recorded, and the size at which
+# recording stops.
+RECORD_FILE        = _cfg("FLARE_RECORD_FILE",            "")
+RECORD_SAMPLE      = float(_cfg("FLARE_RECORD_SAMPLE",    "1.0"))
+RECORD_MAX_MB      = float(_cfg("FLARE_RECORD_MAX_MB",    "1024"))
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Host agent / Windows service configuration
 # ─────────────────────────────────────────────────────────────────────────────
@@ -102,7 +198,7 @@ AGENT_CERT_DIR   = ROOT / "certs" / "clients" / "server-agent"
 _LOG_DIR  = ROOT / "logs"
 _LOG_FILE = _LOG_DIR / "flare_server.log"
 
-def _setup_logging():
+def _setup_logging(log_file: Path = _LOG_FILE):
     """Attach rotating file + console handlers.
     Falls back to console-only if the log directory cannot be created
    (e.g. running without Administrator rights during testing)."""
@@ -116,7 +212,7 @@ def _setup_logging():
     try:
         _LOG_DIR.mkdir(parents=True, exist_ok=True)
         fh = logging.handlers.RotatingFileHandler(
-            str(_LOG_FILE), maxBytes=10 * 1024 * 1024, backupCount=3, encoding="utf-8"
+            str(log_file), maxBytes=10 * 1024 * 1024, backupCount=3, encoding="utf-8"
         )
         fh.setFormatter(fmt)
         root.addHandler(fh)
@@ -126,6 +222,11 @@ def _setup_logging():
     ch.setFormatter(fmt)
     root.addHandler(ch)
 
+def _setup_worker(index: int):
+    """cluster.serve() setup hook: each worker process logs to its own file
+    (rotation can't be shared between processes)."""
+    _setup_logging(_LOG_DIR / f"flare_server.worker{index}.log")
+
 # Console-only logging for import-time use (e.g. uvicorn startup messages)
 logging.basicConfig(
     level=logging.INFO,
@@ -135,17 +236,26 @@ logging.basicConfig(
 logging.getLogger("asyncio").setLevel(logging.CRITICAL)
 log = logging.getLogger("flare_server")
 
-def read_frames(body: bytes) -> list[bytes]:
-    frames = []
-    offset = 0
-    while offset < len(body):
-        if offset + 4 > len(body): raise ValueError("Truncated frame header")
-        (length,) = struct.unpack_from(">I", body, offset)
-        offset += 4
-        if offset + length > len(body): raise ValueError(f"Frame claims {length} bytes but only {len(body) - offset} remain")
-        frames.append(body[offset: offset + length])
-        offset += length
-    return frames
+async def read_frames(request: Request, message_type):
+    """Parse the framed body of `request` into `message_type` messages as it
+    streams in (frame_stream.py); limit and format errors become 413 / 400."""
+    n = 0
+    recorded = [] if _recorder is not None else None
+    try:
+        async for msg in read_messages(request.stream(), message_type, MAX_FRAME_BYTES, MAX_BODY_BYTES,
+                                       request.headers.get("content-length")):
+            n += 1
+            if recorded is not None:
+                recorded.append(msg)
+            yield msg
+        if recorded:
+            _recorder.record(request.url.path, recorded)
+    except FrameError as exc:
+        _frames_rejected.labels(str(exc.status)).inc()
+        raise HTTPException(status_code=exc.status, detail=str(exc))
+    finally:
+        if n:
+            _frames_parsed.labels(message_type.__name__).inc(n)
 
 def write_frame(data: bytes) -> bytes:
     return struct.pack(">I", len(data)) + data
@@ -176,35 +286,29 @@ def _get_conn() -> sqlite3.Connection:
     conn.execute("PRAGMA journal_mode=WAL")
     return conn
 
+# Long-lived connections for the running server, opened in _lifespan once
+# init_db() has settled DB_PATH. _get_conn() is only for one-off setup work.
+_db: Optional[ConnectionPool] = None
+_blob_codec = BlobCodec()
+_partitions: Optional[PartitionStore] = None
+
+# Columns returned by alert list views. raw_log / evidence live compressed in
+# alert_blobs and are only decoded for the detail endpoint.
+_ALERT_LIST_COLS = (
+    "id, alert_id, received_at, client_id, client_ip, timestamp, track, attack_type, "
+    "severity, confidence, window_start, window_end, event_count, rule_id, mitre_id, "
+    "mitre_tactic, suggestion, risk_note, status"
+)
+
+def _open_pool(lock=None) -> ConnectionPool:
+    return ConnectionPool(DB_PATH, readers=DB_READERS, synchronous=DB_SYNCHRONOUS,
+                          cache_mb=DB_CACHE_MB, mmap_mb=DB_MMAP_MB, temp_store=DB_TEMP_STORE,
+                          lock=lock)
+
 def init_db():
+    global _partitions
     conn = _get_conn()
     conn.executescript("""
-        CREATE TABLE IF NOT EXISTS alerts (
-            id             INTEGER PRIMARY KEY AUTOINCREMENT,
-            alert_id       TEXT    UNIQUE,
-            received_at    REAL,
-            client_id      TEXT,
-            client_ip      TEXT,
-            timestamp      TEXT,
-            track          INTEGER,
-            attack_type    TEXT,
-            severity       INTEGER,
-            confidence     REAL,
-            window_start   TEXT,
-            window_end     TEXT,
-            event_count    INTEGER,
-            evidence       TEXT,
-            rule_id        TEXT,
-            mitre_id       TEXT,
-            mitre_tactic   TEXT,
-            suggestion     TEXT,
-            risk_note      TEXT,
-            raw_log        TEXT
-        );
-        CREATE INDEX IF NOT EXISTS idx_alerts_client ON alerts(client_id);
-        CREATE INDEX IF NOT EXISTS idx_alerts_track ON alerts(track);
-        CREATE INDEX IF NOT EXISTS idx_alerts_received ON alerts(received_at DESC);
-        CREATE INDEX IF NOT EXISTS idx_alerts_rule ON alerts(rule_id);
         CREATE TABLE IF NOT EXISTS clients (
             client_id          TEXT PRIMARY KEY,
             client_ip          TEXT,
@@ -228,7 +332,8 @@ def init_db():
             sample_count  INTEGER,
             base_round    INTEGER,
             local_loss    REAL,
-            weights_json  TEXT
+            weights_blob  BLOB,
+            weights_shape TEXT
         );
         CREATE TABLE IF NOT EXISTS fl_models (
             track         INTEGER PRIMARY KEY,
@@ -236,19 +341,35 @@ def init_db():
             version       TEXT     DEFAULT '1.0',
             client_count  INTEGER  DEFAULT 0,
             updated_at    REAL,
-            weights_json  TEXT
+            weights_blob  BLOB,
+            weights_shape TEXT
         );
         CREATE TABLE IF NOT EXISTS sessions (
             token      TEXT PRIMARY KEY,
             expires_at REAL
         );
     """)
+    conn.executescript(rollups.SCHEMA)
+    conn.executescript(blob_store.SCHEMA)
+    conn.executescript(fl_scheduler.SCHEMA)
+    converted = fl_weights.migrate(conn)
+    if converted:
+        log.info("Converted %d FL weight sets from JSON to float32 blobs", converted)
     conn.commit()
-    try:
-        conn.execute("ALTER TABLE alerts ADD COLUMN status TEXT DEFAULT 'open'")
-        conn.commit()
-    except Exception:
-        pass
+    _partitions = PartitionStore(PARTITION_DIR or Path(DB_PATH).parent / "alerts",
+                                 span=PARTITION_SPAN, max_attached=PARTITION_ATTACH)
+    _partitions.open(conn)
+    conn.commit()
+    codec = BlobCodec()
+    codec.load(conn)
+    moved = _partitions.migrate_legacy(conn, codec)
+    if moved:
+        log.info("Moved %d alerts into partitions under %s "
+                 "(run VACUUM to return the freed pages to the OS)", moved, _partitions.dir)
+    upgraded = _partitions.upgrade(conn)
+    if upgraded:
+        log.info("Added feedback-label columns and indexes to %d alert partition(s)", upgraded)
+    _partitions.detach(conn)
     conn.close()
     log.info("Database ready: %s", DB_PATH)
 
@@ -261,111 +382,128 @@ def _load_initial_weights() -> Optional[dict]:
     return None
 
 def bootstrap_fl_model():
-    conn = _get_conn()
-    row = conn.execute("SELECT weights_json FROM fl_models WHERE track=?", (pb.TRACK_NETWORK,)).fetchone()
-    if row and row["weights_json"]:
-        conn.close()
+    with _db.reader() as conn:
+        row = conn.execute("SELECT weights_blob FROM fl_models WHERE track=?", (pb.TRACK_NETWORK,)).fetchone()
+    if row and row["weights_blob"] is not None:
         return
     weights = _load_initial_weights()
     if weights is None:
-        conn.close()
         return
     now = time.time()
-    conn.execute(
-        """INSERT INTO fl_models (track, round, version, client_count, updated_at, weights_json)
-           VALUES (?,0,?,0,?,?)
-           ON CONFLICT(track) DO UPDATE SET
-             weights_json=excluded.weights_json, updated_at=excluded.updated_at""",
-       (pb.TRACK_NETWORK, weights.get("version", "1.0"), now, json.dumps(weights)),
-    )
-    conn.commit()
-    conn.close()
+    with _db.writer() as conn:
+        conn.execute(
+            """INSERT INTO fl_models (track, round, version, client_count, updated_at, weights_blob, weights_shape)
+               VALUES (?,0,?,0,?,?,?)
+               ON CONFLICT(track) DO UPDATE SET
+                 weights_blob=excluded.weights_blob, weights_shape=excluded.weights_shape,
+                 updated_at=excluded.updated_at""",
+           (pb.TRACK_NETWORK, weights.get("version", "1.0"), now, *fl_weights.pack(weights)),
+        )
     log.info("Seeded initial FL model for TRACK_NETWORK")
 
 def get_fl_model_proto(track: int) -> Optional[pb.ModelUpdate]:
-    conn = _get_conn()
-    row = conn.execute("SELECT * FROM fl_models WHERE track=?", (track,)).fetchone()
-    conn.close()
-    if not row or not row["weights_json"]: return None
-    w  = json.loads(row["weights_json"])
+    with _db.reader() as conn:
+        row = conn.execute("SELECT * FROM fl_models WHERE track=?", (track,)).fetchone()
+    if not row or row["weights_blob"] is None: return None
+    w  = fl_weights.unpack(row["weights_blob"], row["weights_shape"])
     mu = pb.ModelUpdate()
-    mu.timestamp    = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    mu.timestamp    = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(row["updated_at"] or time.time()))
     mu.track        = track
     mu.version      = row["version"]
     mu.round        = row["round"]
     mu.client_count = row["client_count"]
 
-    for coef_matrix in w.get("coefs", []):
-        arr = np.array(coef_matrix, dtype=np.float32)
+    for arr in w["coefs"]:
         lw  = mu.coefs.add()
-        lw.values.extend(arr.flatten().tolist())
+        lw.values.extend(arr.ravel().tolist())
         lw.rows = arr.shape[0]
         lw.cols = arr.shape[1] if arr.ndim > 1 else 0
 
-    for bias_vec in w.get("intercepts", []):
-        arr = np.array(bias_vec, dtype=np.float32).flatten()
+    for arr in w["intercepts"]:
+        arr = arr.ravel()
         lw  = mu.intercepts.add()
         lw.values.extend(arr.tolist())
         lw.rows = len(arr)
         lw.cols = 0
 
-    mu.scaler_mean.extend(w.get("scaler_mean",  []))
-    mu.scaler_scale.extend(w.get("scaler_scale", []))
+    if "scaler_mean" in w:  mu.scaler_mean.extend(w["scaler_mean"].tolist())
+    if "scaler_scale" in w: mu.scaler_scale.extend(w["scaler_scale"].tolist())
+    mu.checksum = weight_codec.checksum(w["coefs"] + w["intercepts"])
     return mu
 
-_fedavg_lock = threading.Lock()
-def _maybe_run_fedavg(track: int):
-    with _fedavg_lock:
-        conn = _get_conn()
-        row  = conn.execute("SELECT round, version FROM fl_models WHERE track=?", (track,)).fetchone()
-        current_round = row["round"] if row else 0
-        updates = conn.execute(
-            "SELECT weights_json, sample_count FROM fl_updates WHERE track=? AND base_round >= ? ORDER BY received_at",
-           (track, current_round - 1),
-        ).fetchall()
-        if len(updates) < MIN_FL_CLIENTS:
-            conn.close()
-            return
-
-        total_samples = sum(u["sample_count"] for u in updates)
-        avg: Optional[dict] = None
-
-        for upd in updates:
-            w    = json.loads(upd["weights_json"])
-            frac = upd["sample_count"] / total_samples
-            if avg is None:
-                avg = {
-                    "coefs":       [np.array(c, dtype=np.float64) * frac for c in w["coefs"]],
-                    "intercepts":  [np.array(b, dtype=np.float64) * frac for b in w["intercepts"]],
-                }
-                if w.get("scaler_mean"): avg["scaler_mean"] = np.array(w["scaler_mean"], dtype=np.float64) * frac
-                if w.get("scaler_scale"): avg["scaler_scale"] = np.array(w["scaler_scale"], dtype=np.float64) * frac
-            else:
-                for i, c in enumerate(w["coefs"]): avg["coefs"][i] += np.array(c, dtype=np.float64) * frac
-                for i, b in enumerate(w["intercepts"]): avg["intercepts"][i] += np.array(b, dtype=np.float64) * frac
-                if w.get("scaler_mean"): avg["scaler_mean"] += np.array(w["scaler_mean"], dtype=np.float64) * frac
-                if w.get("scaler_scale"): avg["scaler_scale"] += np.array(w["scaler_scale"], dtype=np.float64) * frac
-
-        new_round   = current_round + 1
-        new_version = f"round-{new_round}"
-        serializable = {
-            "coefs":       [c.tolist() for c in avg["coefs"]],
-            "intercepts":  [b.tolist() for b in avg["intercepts"]],
-            "scaler_mean":  avg["scaler_mean"].tolist() if "scaler_mean" in avg else [],
-            "scaler_scale": avg["scaler_scale"].tolist() if "scaler_scale" in avg else [],
-            "version": new_version,
-        }
-        now = time.time()
-        conn.execute(
-            """INSERT INTO fl_models (track, round, version, client_count, updated_at, weights_json)
-               VALUES (?,?,?,?,?,?)
-               ON CONFLICT(track) DO UPDATE SET round=excluded.round, version=excluded.version,
-               client_count=excluded.client_count, updated_at=excluded.updated_at, weights_json=excluded.weights_json""",
-           (track, new_round, new_version, len(updates), now, json.dumps(serializable)),
-        )
-        conn.execute("DELETE FROM fl_updates WHERE track=? AND base_round < ?", (track, new_round))
-        conn.commit()
-        conn.close()
+def _fl_model_layout(conn, track: int) -> Optional[dict]:
+    """fl_weights.layout() of the current global model of `track`."""
+    row = conn.execute("SELECT weights_shape FROM fl_models WHERE track=?", (track,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+def _decode_layers(layers, shapes: Optional[list]) -> list:
+    """weight_codec.decode() of each LayerWeights in `layers`. With `shapes`
+    (a group of the expected layout) the layer count and sizes must match
+    it (no layers at all is fine: a scaler-only update); without, the layers
+    may hold weight_codec.MAX_VALUES values in all. Raises ValueError before
+    decoding anything that doesn't fit."""
+    if shapes and len(layers):
+        if len(layers) != len(shapes):
+            raise ValueError(f"{len(layers)} layers, expected {len(shapes)}")
+        return [weight_codec.decode(lw, int(np.prod(s))) for lw, s in zip(layers, shapes)]
+    if sum(max(lw.rows, 0) * max(lw.cols, 1) for lw in layers) > weight_codec.MAX_VALUES:
+        raise ValueError(f"layers exceed {weight_codec.MAX_VALUES} values")
+    return [weight_codec.decode(lw) for lw in layers]
+
+def _fl_base_weights(conn, track: int, rnd: int) -> Optional[dict]:
+    """The global model of round `rnd`, the base of a delta-encoded FLUpdate."""
+    row = conn.execute("SELECT weights_blob, weights_shape FROM fl_model_history "
+                       "WHERE track=? AND round=?", (track, rnd)).fetchone() or \
+          conn.execute("SELECT weights_blob, weights_shape FROM fl_models "
+                       "WHERE track=? AND round=?", (track, rnd)).fetchone()
+    if not row or row[0] is None:
+        return None
+    return fl_weights.unpack(row[0], row[1])
+
+# ── Model distribution ───────────────────────────────────────────────────────
+# The framed ModelUpdate for each track is serialised once per round and kept
+# here, so GET /api/fl/model/{track} is a dict lookup. The FedAvg scheduler
+# installs the new round's frame as soon as it is written (_on_fl_round).
+# When model deltas are on, the entry also holds the delta-encoded frame for
+# agents on the previous round.
+_model_frames: dict = {}    # track -> (round, full etag, full frame, delta frame | None)
+_model_frames_lock = threading.Lock()
+
+def _build_model_frame(track: int) -> Optional[tuple]:
+    mu = get_fl_model_proto(track)
+    if mu is None:
+        return None
+    with _db.reader() as conn:
+        row = conn.execute("SELECT delta_pb FROM fl_model_history WHERE track=? AND round=?",
+                           (track, mu.round)).fetchone()
+    delta = None
+    if row and row[0]:
+        d = pb.ModelUpdate()
+        d.CopyFrom(mu)
+        del d.coefs[:], d.intercepts[:]
+        d.MergeFromString(row[0])       # encoded layers, is_delta, base_round
+        delta = write_frame(d.SerializeToString())
+    return mu.round, f'"{track}-{mu.round}-full"', write_frame(mu.SerializeToString()), delta
+
+def _store_model_frame(track: int, entry: Optional[tuple]) -> Optional[tuple]:
+    """Install `entry` unless a newer round is already cached (a slow
+    first-request build can finish after FedAvg installed the next round)."""
+    with _model_frames_lock:
+        cur = _model_frames.get(track)
+        if entry is not None and (cur is None or cur[0] < entry[0]):
+            _model_frames[track] = cur = entry
+            if _channel is not None:
+                _channel.model_changed()
+        return cur
+
+def _on_fl_round(track: int, rnd: int):
+    """FedAvgScheduler callback, on its thread, after round `rnd` committed."""
+    _store_model_frame(track, _build_model_frame(track))
+    _versions.bump("fl")
+    if _events.active:
+        with _db.reader() as conn:
+            fl_row, fl_pending = _fl_status(conn)
+        _events.publish("fl", {"fl_model": fl_row, "fl_pending_updates": fl_pending})
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Session-based dashboard auth
@@ -374,29 +512,354 @@ _SESSION_TTL   = 28_800
 def _hash_pw(pw: str) -> str: return hashlib.sha256(pw.encode("utf-8")).hexdigest()
 def _create_session() -> str:
     token = secrets.token_hex(32)
-    conn = _get_conn()
-    conn.execute("INSERT INTO sessions (token, expires_at) VALUES (?,?)", (token, time.time() + _SESSION_TTL))
-    conn.commit(); conn.close()
+    with _db.writer() as conn:
+        conn.execute("INSERT INTO sessions (token, expires_at) VALUES (?,?)", (token, time.time() + _SESSION_TTL))
     return token
 
 def _valid_session(token: str) -> bool:
     if not token: return False
-    conn = _get_conn()
-    row = conn.execute("SELECT expires_at FROM sessions WHERE token=?", (token,)).fetchone()
-    conn.close()
+    with _db.reader() as conn:
+        row = conn.execute("SELECT expires_at FROM sessions WHERE token=?", (token,)).fetchone()
     return bool(row and time.time() < row["expires_at"])
 
-def _require_session(request: Request):
-    if not _valid_session(request.cookies.get("flare_session", "")):
+async def _require_session(request: Request):
+    if not await _db.run(_valid_session, request.cookies.get("flare_session", "")):
         raise HTTPException(status_code=401, detail="Not logged in")
 
+_ingest_writer: Optional[IngestWriter] = None
+_rollup_compactor: Optional[RollupCompactor] = None
+_retention: Optional[PartitionRetention] = None
+_fl_scheduler: Optional[FedAvgScheduler] = None
+_provisioner: Optional[Provisioner] = None
+_cluster: Optional[cluster.Cluster] = None   # WORKERS > 1: the bus to the other workers
+_channel: Optional[AgentChannel] = None      # CHANNEL_PORT: agents' long-lived connections
+_recorder: Optional[TrafficRecorder] = None  # RECORD_FILE: agent traffic captured for replay.py
+
+# ── Conditional GET (see http_cache.py) ─────────────────────────────────────
+_versions  = DataVersions()
+_responses = ResponseCache()
+_ui        = StaticAssets(UI_DIR)
+
+async def _cached_json(request: Request, key, version, build):
+    """Answer from the response cache while `version` holds, else await
+    build() for the body and cache it. Either way 304 on a matching
+    If-None-Match."""
+    entry = _responses.get(key, version)
+    if entry is None:
+        entry = _responses.put(key, version, JSONResponse(await build()).body)
+    return entry.response(request)
+
+# ── Live dashboard events (GET /api/stream, see event_hub.py) ────────────────
+_events = EventHub()
+_presence: dict = {}          # client_id -> last heartbeat, mirrors clients.last_seen
+_PRESENCE_SWEEP_S = 5
+
+def _presence_counts(now: float) -> dict:
+    online = sum(1 for seen in _presence.values() if now - seen < OFFLINE_AFTER_SECS)
+    return {"online_clients": online, "total_clients": len(_presence)}
+
+def _publish_client(client_id: str, online: bool, now: float):
+    _versions.bump("presence")
+    _events.publish("client", {"client_id": client_id, "online": online, **_presence_counts(now)})
+
+async def _presence_watch():
+    """Publish the moment an agent crosses OFFLINE_AFTER_SECS without a
+    heartbeat — nothing else happens at that moment to announce it."""
+    prev = time.time()
+    while True:
+        await asyncio.sleep(_PRESENCE_SWEEP_S)
+        now = time.time()
+        if _cluster is not None and not _cluster.leader:
+            prev = now                  # the aggregator worker announces these
+            continue
+        for client_id, seen in list(_presence.items()):
+            if prev - seen < OFFLINE_AFTER_SECS <= now - seen:
+                _publish_client(client_id, False, now)
+        prev = now
+
+async def _announce_watching():
+    """Cluster: while dashboards stream from this worker, keep telling the
+    others so they send their events with the data (EventHub.watched)."""
+    while True:
+        if _events.subscribed:
+            _cluster.publish("watching", None)
+        await asyncio.sleep(5)
+
+def _new_fl_scheduler() -> FedAvgScheduler:
+    return FedAvgScheduler(
+        _db.writer, mode=FL_MODE, min_updates=MIN_FL_CLIENTS, buffer_size=FL_BUFFER_SIZE,
+        deadline=FL_ROUND_DEADLINE, server_lr=FL_SERVER_LR,
+        max_stale=FL_MAX_STALENESS if FL_MODE == "async" else MAX_STALE_ROUNDS,
+        model_encoding=weight_codec.parse_encoding(FL_MODEL_ENCODING),
+        model_topk=FL_MODEL_TOPK, on_round=_on_fl_round,
+        on_progress=_on_fl_progress if _cluster is not None else None)
+
+def _on_fl_progress():
+    _cluster.publish("fl_state", _fl_scheduler.snapshot())
+
+def _start_aggregator():
+    """Start what runs once per deployment: FedAvg, rollup compaction and
+    partition retention. With several workers, called on the cluster thread
+    of the worker elected aggregator."""
+    global _fl_scheduler, _rollup_compactor, _retention
+    scheduler = _new_fl_scheduler()
+    with _db.reader() as conn:
+        scheduler.load(conn)
+    _fl_scheduler = scheduler
+    scheduler.start()
+    _rollup_compactor = RollupCompactor(_db.writer)
+    _rollup_compactor.start()
+    if RETENTION_DAYS > 0:
+        _retention = PartitionRetention(
+            _partitions, _db, RETENTION_DAYS, versions=_versions,
+            on_expire=(lambda keys: _cluster.publish("expired", keys)) if _cluster else None)
+        _retention.start()
+    if _cluster is not None:
+        _on_fl_progress()
+
+def _on_fl_state(snap: dict, seq: int):
+    """Cluster: the aggregator's rounds moved — install the new model frames."""
+    if _fl_scheduler.is_alive():
+        return
+    for track in _fl_scheduler.mirror(snap):
+        _store_model_frame(track, _build_model_frame(track))
+
+def _on_fl_stored(update_id: int, seq: int):
+    """Cluster: another worker stored an FL update for the aggregator."""
+    if _fl_scheduler.is_alive():
+        with _db.reader() as conn:
+            _fl_scheduler.submit_stored(conn, update_id)
+
+def _join_cluster():
+    """WORKERS > 1: connect this worker to the others (cluster.py) and wire
+    the shared state over the bus."""
+    global _cluster
+    _cluster = cluster.Cluster(Path(DB_PATH).parent, on_lead=_start_aggregator)
+    _cluster.on("event", lambda d, seq: _events.deliver(d[0], d[1], seq), own=True)
+    _cluster.on("watching", lambda d, seq: _events.watched(15))
+    _cluster.on("versions", lambda d, seq: _versions.apply(*d))
+    _cluster.on("presence", lambda d, seq: _presence.update(d))
+    _cluster.on("fl_update", _on_fl_stored, own=True)
+    _cluster.on("fl_state", _on_fl_state)
+    _cluster.on("expired", lambda d, seq: _partitions.release(_db, d))
+    _cluster.on("metrics", _on_peer_metrics)
+    _cluster.on("scraped", lambda d, seq: _metrics_scraped(), own=True)
+    _events.forward(lambda event, data: _cluster.publish("event", [event, data]), _cluster.cursor)
+    _versions.share(lambda domains: _cluster.publish("versions", domains))
+
+# ── Agent channel (see agent_channel.py) ────────────────────────────────────
+
+_CHANNEL_ENDPOINTS = {"alerts": "/api/alerts/ingest", "heartbeat": "/api/heartbeat",
+                      "fl_update": "/api/fl/update"}
+
+async def _channel_message(session, msg: pb.ChannelMessage) -> pb.Ack:
+    """AgentChannel handler: what the matching HTTP endpoint does with one
+    message, its response (or HTTPException) as the Ack."""
+    kind = msg.WhichOneof("body")
+    if _recorder is not None:
+        _recorder.record(_CHANNEL_ENDPOINTS[kind], [getattr(msg, kind)], channel=True)
+    try:
+        if kind == "alerts":
+            await _ingest([msg.alerts])
+            return pb.Ack(status=200, queued=len(msg.alerts.alerts))
+        if kind == "heartbeat":
+            await _record_heartbeats([msg.heartbeat])
+        else:
+            result = await _accept_fl_updates([msg.fl_update])
+            if result["rejected"]:
+                return pb.Ack(status=200, detail="FL update rejected")
+    except HTTPException as exc:
+        return pb.Ack(status=exc.status_code, detail=str(exc.detail))
+    return pb.Ack(status=200)
+
+def _channel_model(since_round: int) -> Optional[tuple]:
+    """AgentChannel: the network model frame for an agent holding round
+    `since_round` — the delta when it is one round behind, like
+    GET /api/fl/model — or None when it is current."""
+    entry = _model_frames.get(pb.TRACK_NETWORK)
+    if entry is None or entry[0] <= since_round:
+        return None
+    rnd, _, frame, delta = entry
+    return rnd, (delta if delta is not None and since_round == rnd - 1 else frame)
+
+# ── Metrics (GET /metrics, see metrics.py) ─────────────────────────────────
+# Request latency, frames and DB commit times are recorded as they happen;
+# everything else is read from the components' own counters at scrape time.
+_metrics          = metrics.Registry()
+_route_requests   = metrics.Family(metrics.Counter, "method", "route", "status")
+_route_latency    = metrics.Family(metrics.Histogram, "method", "route")
+_frames_parsed    = metrics.Family(metrics.Counter, "type")
+_frames_rejected  = metrics.Family(metrics.Counter, "status")
+_dashboard_sessions = metrics.Gauge()      # unexpired sessions rows, set per scrape
+_peer_metrics: dict = {}      # cluster: worker -> (monotonic received, collect())
+_scraped_at  = 0.0            # cluster: monotonic time of the last scrape on any worker
+METRICS_SHARE_S = 5           # cluster: snapshot interval while being scraped
+METRICS_IDLE_S  = 120         # ...and for how long after the last scrape
+
+def _client_counts() -> dict:
+    now = time.time()
+    online = sum(1 for seen in list(_presence.values()) if now - seen < OFFLINE_AFTER_SECS)
+    return {"online": online, "offline": len(_presence) - online}
+
+def _session_counts() -> dict:
+    counts = {"dashboard": _dashboard_sessions.value, "live": _events.stats()["subscribers"]}
+    if _channel is not None:
+        counts["agent_channel"] = _channel.stats()["sessions"]
+    return counts
+
+def _channel_stat(key: str):
+    return lambda: _channel.stats()[key]
+
+def _db_stat(key: str):
+    return lambda: {kind: _db.stats()[f"{kind}_{key}"] for kind in ("read", "write")}
+
+def _register_metrics():
+    for name, kind, help, source, labels in (
+        ("flare_http_requests_total", "counter", "HTTP requests by route and status", _route_requests, ()),
+        ("flare_http_request_duration_seconds", "histogram", "HTTP request latency by route", _route_latency, ()),
+        ("flare_frames_parsed_total", "counter", "Protobuf frames parsed from HTTP request bodies", _frames_parsed, ()),
+        ("flare_frames_rejected_total", "counter", "Framed request bodies refused (400 malformed, 413 too large)",
+         _frames_rejected, ()),
+        ("flare_alerts_total", "counter", "Alerts committed by the ingest writer, new rows vs dedup merges",
+         lambda: {"inserted": _ingest_writer.inserted, "merged": _ingest_writer.merged}, ("result",)),
+        ("flare_ingest_commits_total", "counter", "Ingest writer group commits", lambda: _ingest_writer.commits, ()),
+        ("flare_ingest_queue_depth", "gauge", "Ingest requests queued for the writer", lambda: _ingest_writer.depth(), ()),
+        ("flare_ingest_flush_seconds", "histogram", "Ingest writer flush time, dedup to commit",
+         lambda: _ingest_writer.flush_seconds, ()),
+        ("flare_db_commit_seconds", "histogram", "SQLite COMMIT latency by writer",
+         lambda: {"ingest": _ingest_writer.commit_seconds, "pool": _db.commit_seconds}, ("writer",)),
+        ("flare_db_checkouts_total", "counter", "DB pool connection checkouts", _db_stat("checkouts"), ("kind",)),
+        ("flare_db_wait_seconds_total", "counter", "Time spent waiting for a DB pool connection",
+         _db_stat("wait_s"), ("kind",)),
+        ("flare_fedavg_rounds_total", "counter", "FedAvg rounds closed by this process", lambda: _fl_scheduler.closed, ()),
+        ("flare_fedavg_updates_total", "counter", "FL updates aggregated into closed rounds",
+         lambda: _fl_scheduler.aggregated, ()),
+        ("flare_fedavg_dropped_total", "counter", "FL updates dropped as too stale", lambda: _fl_scheduler.dropped, ()),
+        ("flare_fedavg_rejected_total", "counter", "FL updates dropped by the scheduler for a mismatched layout",
+         lambda: _fl_scheduler.rejected, ()),
+        ("flare_fedavg_round_seconds", "histogram", "Time to close and publish a FedAvg round",
+         lambda: _fl_scheduler.close_seconds, ()),
+        ("flare_fedavg_open_updates", "gauge", "Updates collected by the open round of each track",
+         lambda: {str(p["track"]): p["updates"] for p in _fl_scheduler.progress()}, ("track",)),
+        ("flare_provision_seconds", "histogram", "Time to issue a client cert bundle",
+         lambda: _provisioner.issue_seconds, ()),
+        ("flare_provision_issued_total", "counter", "Client cert bundles issued", lambda: _provisioner.issued, ()),
+        ("flare_provision_pool_misses_total", "counter", "Bundles issued without a pre-generated key",
+         lambda: _provisioner.pool_misses, ()),
+        ("flare_sessions", "gauge", "Open sessions: dashboard logins, live event streams, agent channel connections",
+         _session_counts, ("kind",)),
+        ("flare_clients", "gauge", "Known agents by heartbeat state", _client_counts, ("state",)),
+        ("flare_channel_messages_total", "counter", "Messages received on the agent channel", _channel_stat("messages"), ()),
+        ("flare_channel_models_pushed_total", "counter", "Models pushed down the agent channel",
+         _channel_stat("models_pushed"), ()),
+        ("flare_channel_rejected_total", "counter", "Agent channel connections dropped for a malformed frame",
+         _channel_stat("rejected"), ()),
+        ("flare_traffic_recorded_total", "counter", "Agent requests recorded for replay, written vs dropped",
+         lambda: {"written": _recorder.recorded, "dropped": _recorder.dropped}, ("result",)),
+    ):
+        _metrics.add(name, kind, help, source, labels)
+
+_register_metrics()
+
+def _count_sessions(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+def _metrics_scraped():
+    global _scraped_at
+    _scraped_at = time.monotonic()
+
+def _on_peer_metrics(data: list, seq: int):
+    _peer_metrics[data[0]] = (time.monotonic(), data[1])
+
+async def _share_metrics():
+    """Cluster: while /metrics is being scraped on any worker, send this
+    worker's snapshot to the others every METRICS_SHARE_S."""
+    while True:
+        await asyncio.sleep(METRICS_SHARE_S)
+        if time.monotonic() - _scraped_at < METRICS_IDLE_S:
+            _cluster.publish("metrics", [_metrics.worker, _metrics.collect()])
+
 @asynccontextmanager
 async def _lifespan(app: FastAPI):
-    init_db()
+    global _ingest_writer, _rollup_compactor, _retention, _fl_scheduler, _provisioner, _db, _channel, _recorder
+    workers = max(1, WORKERS)
+    if workers > 1:
+        _join_cluster()
+        with _cluster.writer_lock:      # one worker migrates, the others find it done
+            init_db()
+    else:
+        init_db()
+    _db = _open_pool(lock=_cluster.writer_lock if _cluster else None)
     bootstrap_fl_model()
+    with _db.reader() as conn:
+        _blob_codec.load(conn)
+        _presence.update(conn.execute("SELECT client_id, last_seen FROM clients").fetchall())
+    _events.bind(asyncio.get_running_loop())
+    tasks = [asyncio.create_task(_presence_watch())]
+    _ingest_writer = IngestWriter(_db.writer, _blob_codec, _partitions,
+                                  max_queue=INGEST_QUEUE_MAX, batch_max=INGEST_BATCH_MAX,
+                                  events=_events, versions=_versions,
+                                  shared=_cluster is not None)
+    _ingest_writer.start()
+    if _cluster is None:
+        _start_aggregator()
+    else:
+        # Until this worker is elected, its scheduler only answers accepts()
+        # and progress(), from what the aggregator publishes.
+        _fl_scheduler = _new_fl_scheduler()
+        with _db.reader() as conn:
+            _fl_scheduler.load(conn)
+        _cluster.start()
+        await asyncio.to_thread(_cluster.ready.wait)
+        tasks.append(asyncio.create_task(_announce_watching()))
+        _metrics.worker = str(_cluster.origin)
+        tasks.append(asyncio.create_task(_share_metrics()))
+    # The key pool and signing processes are split between the workers.
+    _provisioner = Provisioner(ROOT / "certs" / "ca.crt", ROOT / "certs" / "ca.key",
+                               ROOT / "certs" / "clients", key_type=PROVISION_KEY_TYPE,
+                               pool_size=-(-PROVISION_KEY_POOL // workers),
+                               workers=-(-PROVISION_WORKERS // workers))
+    _provisioner.start()
+    if RECORD_FILE:
+        _recorder = TrafficRecorder(RECORD_FILE if _cluster is None else f"{RECORD_FILE}.{_cluster.origin}",
+                                    sample=RECORD_SAMPLE, max_bytes=int(RECORD_MAX_MB * 1024 * 1024))
+        _recorder.start()
+    if CHANNEL_PORT:
+        try:
+            ctx = agent_channel.server_context(TLS_CERT, TLS_KEY, TLS_CA)
+        except (OSError, ssl.SSLError) as exc:
+            log.error("Agent channel disabled — cannot load the server cert or CA: %s", exc)
+        else:
+            _channel = AgentChannel(CHANNEL_PORT, ctx, _channel_message, _channel_model,
+                                    shared=_cluster is not None)
+            await _channel.start()
     yield
+    _events.close()
+    for task in tasks:
+        task.cancel()
+    if _channel is not None:
+        await _channel.stop()
+        _channel = None
+    _ingest_writer.stop()
+    if _recorder is not None:
+        _recorder.stop()
+        _recorder = None
+    if _rollup_compactor is not None:
+        _rollup_compactor.stop()
+        _rollup_compactor = None
+    if _fl_scheduler.is_alive():
+        _fl_scheduler.stop()
+    _provisioner.stop()
+    if _retention is not None:
+        _retention.stop()
+        _retention = None
+    if _cluster is not None:
+        _cluster.stop()
+    log.info("DB pool: %s", _db.stats())
+    _db.close()
 
 app = FastAPI(title="FLARE", lifespan=_lifespan)
+app.add_middleware(metrics.RouteMetrics, requests=_route_requests, latency=_route_latency)
 
 # ─────────────────────────────────────────────────────────────────────────────
 # PROVISIONING APIS
@@ -408,30 +871,22 @@ async def provision_health():
 
 @app.get("/api/provision")
 async def provision_cert(token: str, client: str):
+    """Issue a client cert bundle (zip of ca.crt, client.crt, client.key).
+    Keys come from the provisioner's pool and signing runs in its workers,
+    so a rollout of many agents doesn't hold up other requests."""
     if token != PROVISION_TOKEN:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # The name becomes a directory under certs/clients.
+    if not client or client in (".", "..") or any(c in client for c in "/\\:"):
+        raise HTTPException(status_code=400, detail="Invalid client name")
     try:
-        import generate_pki
-        ca_key_path = ROOT / "certs" / "ca.key"
-        ca_cert_path = ROOT / "certs" / "ca.crt"
-        if not ca_key_path.exists() or not ca_cert_path.exists():
-            raise HTTPException(status_code=500, detail="Server CA not found")
-
-        ca_key_obj, ca_cert_obj = generate_pki.generate_ca(ca_cert_path, ca_key_path)
-        client_dir = ROOT / "certs" / "clients" / client
-        generate_pki.generate_client_bundle(client, ca_key_obj, ca_cert_obj, client_dir)
-
-        mem_zip = io.BytesIO()
-        with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.write(ca_cert_path, arcname="ca.crt")
-            zf.write(client_dir / "client.crt", arcname="client.crt")
-            zf.write(client_dir / "client.key", arcname="client.key")
-        
-        mem_zip.seek(0)
-        return Response(mem_zip.read(), media_type="application/zip")
+        body = await _provisioner.provision(client)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Server CA not found")
     except Exception as e:
         log.error(f"Provisioning failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return Response(body, media_type="application/zip")
 
 # ─────────────────────────────────────────────────────────────────────────────
 # API Endpoints
@@ -439,140 +894,208 @@ async def provision_cert(token: str, client: str):
 
 @app.post("/api/alerts/ingest")
 async def ingest_alerts(request: Request):
-    body = await request.body()
-    frames = read_frames(body)
-    inserted = 0
+    """Parse framed AlertBatches and hand the alerts to the ingest writer.
+
+    Dedup merging and the INSERT/UPDATEs happen on the writer thread in one
+    group-committed transaction. With FLARE_INGEST_DURABILITY=commit the
+    response waits for that commit; otherwise it returns once queued.
+
+    The body is decoded as it arrives and every INGEST_CHUNK_ROWS alerts are
+    queued before the rest is read, so a large upload never sits in memory
+    whole. An error part-way (503, 400) leaves the earlier chunks queued;
+    the agent's resend of the batch is absorbed by dedup merging.
+    """
     now = time.time()
-    conn = _get_conn()
+    wait = INGEST_DURABILITY == "commit"
+    rows, futs, queued = [], [], 0
+    async for batch in read_frames(request, pb.AlertBatch):
+        rows.extend(alert_row(ev, now) for ev in batch.alerts)
+        if len(rows) >= INGEST_CHUNK_ROWS:
+            futs.append(_submit_rows(rows, wait))
+            queued += len(rows)
+            rows = []
+    if rows:
+        futs.append(_submit_rows(rows, wait))
+        queued += len(rows)
+    if not wait or not futs:
+        return {"queued": queued}
+    return await _committed(futs)
+
+async def _ingest(batches: list) -> dict:
+    now = time.time()
+    rows = [alert_row(ev, now) for batch in batches for ev in batch.alerts]
+    if not rows:
+        return {"queued": 0}
+    fut = _submit_rows(rows, INGEST_DURABILITY == "commit")
+    if fut is None:
+        return {"queued": len(rows)}
+    return await _committed([fut])
+
+def _submit_rows(rows: list, wait: bool):
+    try:
+        return _ingest_writer.submit(rows, wait=wait)
+    except queue.Full:
+        # Writer is saturated — the agent keeps the batch in its retry buffer.
+        raise HTTPException(status_code=503, detail="Ingest queue full", headers={"Retry-After": "2"})
 
-    # Server-side burst deduplication window (seconds).
-    # If the same client already has an alert with the same attack_type
-    # received within this window, merge the new one in (update event_count
-    # and confidence) rather than inserting a duplicate row.
-    # This handles the case where the agent still sends per-flow alerts during
-    # an attack burst — the server collapses them into one running tally.
-    _DEDUP_WINDOW = 60  # seconds
-
-    for frame in frames:
-        batch = pb.AlertBatch()
-        batch.ParseFromString(frame)
-        for ev in batch.alerts:
-            try:
-                # Check for a recent alert from the same client with same type
-                existing = conn.execute(
-                    """SELECT id, event_count, confidence, rule_id
-                       FROM alerts
-                       WHERE client_id   = ?
-                         AND attack_type = ?
-                         AND track       = ?
-                         AND received_at >= ?
-                       ORDER BY received_at DESC
-                       LIMIT 1""",
-                   (ev.client_id, ev.attack_type, ev.track, now - _DEDUP_WINDOW)
-                ).fetchone()
-
-                if existing:
-                    # Merge: bump event_count, keep highest confidence.
-                    # Also backfill rule metadata if the stored row has it empty
-                    # (happens when earlier alerts arrived before the agent fix).
-                    new_count = existing[1] + max(ev.event_count, 1)
-                    new_conf  = max(existing[2], ev.confidence)
-                    conn.execute(
-                        """UPDATE alerts SET
-                               event_count  = ?,
-                               confidence   = ?,
-                               received_at  = ?,
-                               rule_id      = CASE WHEN (rule_id IS NULL OR rule_id = '') AND ? != '' THEN ? ELSE rule_id END,
-                               mitre_id     = CASE WHEN (mitre_id IS NULL OR mitre_id = '') AND ? != '' THEN ? ELSE mitre_id END,
-                               mitre_tactic = CASE WHEN (mitre_tactic IS NULL OR mitre_tactic = '') AND ? != '' THEN ? ELSE mitre_tactic END,
-                               suggestion   = CASE WHEN (suggestion IS NULL OR suggestion = '') AND ? != '' THEN ? ELSE suggestion END,
-                               risk_note    = CASE WHEN (risk_note IS NULL OR risk_note = '') AND ? != '' THEN ? ELSE risk_note END
-                           WHERE id = ?""",
-                       (new_count, new_conf, now,
-                         ev.rule_id,      ev.rule_id,
-                         ev.mitre_id,     ev.mitre_id,
-                         ev.mitre_tactic, ev.mitre_tactic,
-                         ev.suggestion,   ev.suggestion,
-                         ev.risk_note,    ev.risk_note,
-                         existing[0])
-                    )
-                    # don't increment inserted — this is a merge not a new row
-                else:
-                    conn.execute(
-                        """INSERT OR IGNORE INTO alerts
-                          (alert_id, received_at, client_id, client_ip, timestamp,
-                            track, attack_type, severity, confidence,
-                            window_start, window_end, event_count, evidence,
-                            rule_id, mitre_id, mitre_tactic, suggestion, risk_note, raw_log)
-                           VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-                       (ev.alert_id or str(uuid.uuid4()), now,
-                         ev.client_id, ev.client_ip, ev.timestamp,
-                         ev.track, ev.attack_type, ev.severity, ev.confidence,
-                         ev.window_start, ev.window_end, max(ev.event_count, 1),
-                         ev.evidence, ev.rule_id, ev.mitre_id, ev.mitre_tactic,
-                         ev.suggestion, ev.risk_note, ev.raw_log)
-                    )
-                    if conn.total_changes > 0: inserted += 1
-            except Exception:
-                pass
-
-    conn.commit(); conn.close()
-    return {"inserted": inserted}
+async def _committed(futs: list) -> dict:
+    """Await the group commits holding `futs`; their counts summed."""
+    try:
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futs))
+    except sqlite3.Error as exc:
+        raise HTTPException(status_code=503, detail=f"Ingest commit failed: {exc}")
+    if len(results) == 1:
+        return results[0]
+    return {k: sum(r[k] for r in results) for k in results[0]}
 
 @app.post("/api/heartbeat")
 async def heartbeat(request: Request):
-    body = await request.body()
-    frames = read_frames(body)
-    for frame in frames:
-        hb = pb.Heartbeat()
-        hb.ParseFromString(frame)
-        conn = _get_conn()
-        conn.execute(
+    beats = [hb async for hb in read_frames(request, pb.Heartbeat)]
+    return await _record_heartbeats(beats)
+
+async def _record_heartbeats(beats: list) -> dict:
+    params = []
+    now = time.time()
+    for hb in beats:
+        params.append(
+           (hb.client_id, hb.client_ip, now, hb.agent_version, hb.host_model_hash, hb.net_model_hash, hb.uptime_seconds, int(hb.host_track_ok), int(hb.net_track_ok), hb.host_alerts_total, hb.net_alerts_total, hb.ioc_matches_total, hb.rule_hits_total))
+    if params:
+        await _db.write(lambda conn: conn.executemany(
             """INSERT INTO clients (client_id, client_ip, last_seen, agent_version, host_model_hash, net_model_hash, uptime_seconds, host_track_ok, net_track_ok, host_alerts_total, net_alerts_total, ioc_matches_total, rule_hits_total) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?) ON CONFLICT(client_id) DO UPDATE SET client_ip=excluded.client_ip, last_seen=excluded.last_seen, agent_version=excluded.agent_version, host_model_hash=excluded.host_model_hash, net_model_hash=excluded.net_model_hash, uptime_seconds=excluded.uptime_seconds, host_track_ok=excluded.host_track_ok, net_track_ok=excluded.net_track_ok, host_alerts_total=excluded.host_alerts_total, net_alerts_total=excluded.net_alerts_total, ioc_matches_total=excluded.ioc_matches_total, rule_hits_total=excluded.rule_hits_total""",
-           (hb.client_id, hb.client_ip, time.time(), hb.agent_version, hb.host_model_hash, hb.net_model_hash, hb.uptime_seconds, int(hb.host_track_ok), int(hb.net_track_ok), hb.host_alerts_total, hb.net_alerts_total, hb.ioc_matches_total, hb.rule_hits_total)
-        )
-        conn.commit(); conn.close()
+            params))
+    _versions.bump("clients")
+    if _cluster is not None and params:
+        _cluster.publish("presence", {p[0]: now for p in params})
+    for p in params:
+        prev = _presence.get(p[0])
+        _presence[p[0]] = now
+        if prev is None or now - prev >= OFFLINE_AFTER_SECS:
+            _publish_client(p[0], True, now)
     return {"ok": True}
 
 @app.post("/api/fl/update")
 async def fl_update(request: Request):
-    body = await request.body()
-    frames = read_frames(body)
-    for frame in frames:
-        flu = pb.FLUpdate()
-        flu.ParseFromString(frame)
-        conn = _get_conn()
-        row  = conn.execute("SELECT round FROM fl_models WHERE track=?", (flu.track,)).fetchone()
-        conn.close()
-        current_round = row["round"] if row else 0
-        if flu.base_round < current_round - MAX_STALE_ROUNDS: continue
+    updates = [flu async for flu in read_frames(request, pb.FLUpdate)]
+    return await _accept_fl_updates(updates)
+
+async def _accept_fl_updates(updates: list) -> dict:
+    """Store and submit each FLUpdate of a request. One that can't be used
+    (stale, malformed, wrong layout) is logged and skipped, never failing
+    the others: {"accepted": n, "rejected": m} says how many were taken."""
+    accepted, taken = 0, {}     # track -> layout of the first update taken from this request
+    for flu in updates:
+        if not _fl_scheduler.accepts(flu.track, flu.base_round): continue
         if flu.sample_count <= 0 or flu.sample_count > 100000: continue
             
-        coefs = [np.array(list(lw.values), dtype=np.float32).reshape(lw.rows, lw.cols if lw.cols > 0 else 1).tolist() for lw in flu.coefs]
-        intercepts = [list(lw.values) for lw in flu.intercepts]
+        # Shapes must fit what it will be averaged with: the open round's
+        # updates (including those of this request the scheduler hasn't
+        # folded in yet), or else the global model. Checked on the message,
+        # before any array is decoded.
+        expected = _fl_scheduler.layout(flu.track) or taken.get(flu.track) \
+            or await _db.read(_fl_model_layout, flu.track) or {}
+        try:
+            coefs = [a.reshape(lw.rows, lw.cols if lw.cols > 0 else 1)
+                     for lw, a in zip(flu.coefs, _decode_layers(flu.coefs, expected.get("coefs")))]
+            intercepts = [a.ravel() for a in _decode_layers(flu.intercepts, expected.get("intercepts"))]
+        except ValueError as exc:
+            log.warning("FL update from %s dropped: %s", flu.client_id, exc)
+            continue
+        if flu.is_delta:
+            # Compressed update: weights relative to the model of base_round.
+            base = await _db.read(_fl_base_weights, flu.track, flu.base_round)
+            if base is None or [a.shape for a in base["coefs"]] != [a.shape for a in coefs] \
+                    or [a.shape for a in base["intercepts"]] != [a.shape for a in intercepts]:
+                log.warning("FL update from %s dropped: no matching round-%d base for its delta",
+                            flu.client_id, flu.base_round)
+                continue
+            coefs      = [b + d for b, d in zip(base["coefs"], coefs)]
+            intercepts = [b + d for b, d in zip(base["intercepts"], intercepts)]
+        if not all(np.isfinite(a).all() for a in coefs + intercepts):
+            log.warning("FL update from %s dropped: non-finite weights", flu.client_id)
+            continue
         # FLARE does scaler-only FL: clients send scaler_mean/scaler_scale with
         # empty coefs/intercepts. Persist the scaler fields too (they were being
-        # dropped here), so _maybe_run_fedavg can weight-average them and the
+        # dropped here), so the FedAvg scheduler can weight-average them and the
         # published global model actually carries an updated scaler.
         weights = {"coefs": coefs, "intercepts": intercepts}
-        if flu.scaler_mean:  weights["scaler_mean"]  = list(flu.scaler_mean)
-        if flu.scaler_scale: weights["scaler_scale"] = list(flu.scaler_scale)
-        conn = _get_conn()
-        conn.execute("INSERT INTO fl_updates (received_at, client_id, track, sample_count, base_round, local_loss, weights_json) VALUES (?,?,?,?,?,?,?)",
-           (time.time(), flu.client_id, flu.track, flu.sample_count, flu.base_round, flu.local_loss, json.dumps(weights)))
-        conn.commit(); conn.close()
-        _maybe_run_fedavg(flu.track)
-    return {"ok": True}
+        if flu.scaler_mean:  weights["scaler_mean"]  = flu.scaler_mean
+        if flu.scaler_scale: weights["scaler_scale"] = flu.scaler_scale
+        problem = fl_weights.mismatch(expected, weights)
+        if problem:
+            log.warning("FL update from %s refused: %s", flu.client_id, problem)
+            continue
+        blob, shape = fl_weights.pack(weights)
+        now = time.time()
+        update_id = await _db.write(lambda conn: conn.execute(
+            "INSERT INTO fl_updates (received_at, client_id, track, sample_count, base_round, local_loss, weights_blob, weights_shape) VALUES (?,?,?,?,?,?,?,?)",
+           (now, flu.client_id, flu.track, flu.sample_count, flu.base_round, flu.local_loss, blob, shape)).lastrowid)
+        # Aggregation happens on the scheduler thread (fl_scheduler.py), in
+        # whichever worker is the aggregator.
+        if _cluster is None or _fl_scheduler.is_alive():
+            _fl_scheduler.submit(flu.track, update_id, flu.client_id, flu.sample_count,
+                                 flu.base_round, now, fl_weights.unpack(blob, shape))
+        else:
+            _cluster.publish("fl_update", update_id)
+        _versions.bump("fl")
+        if _events.active:
+            fl_row, fl_pending = await _db.read(_fl_status)
+            _events.publish("fl", {"fl_model": fl_row, "fl_pending_updates": fl_pending})
+        taken.setdefault(flu.track, fl_weights.layout(weights))
+        accepted += 1
+    return {"ok": True, "accepted": accepted, "rejected": len(updates) - accepted}
 
 @app.get("/api/fl/model/{track_name}")
-async def get_fl_model(track_name: str):
+async def get_fl_model(track_name: str, request: Request, since_round: Optional[int] = None,
+                       full: bool = False):
+    """The current global model as a framed ModelUpdate, from the per-round
+    cache (_model_frames). since_round = round - 1 gets the delta-encoded
+    frame when there is one, unless `full` is set. The ETag names the
+    representation ("<track>-<round>-full", "<track>-<round>-delta-<base>");
+    an agent that sends it back in If-None-Match, or passes since_round =
+    the current round, gets a bodyless 304. A since_round ahead of the
+    current round (the database was reset or restored) gets the full
+    frame, so the agent can step back to it."""
     track_map = {"host": pb.TRACK_HOST, "network": pb.TRACK_NETWORK}
-    mu = get_fl_model_proto(track_map[track_name])
-    if mu is None: return Response(status_code=204)
-    return Response(content=write_frame(mu.SerializeToString()), media_type="application/octet-stream")
+    track = track_map[track_name]
+    entry = _model_frames.get(track)
+    if entry is None:
+        entry = _store_model_frame(track, await _db.run(_build_model_frame, track))
+        if entry is None: return Response(status_code=204)
+    rnd, etag, frame, delta = entry
+    if delta is not None and since_round == rnd - 1 and not full:
+        etag, frame = f'"{track}-{rnd}-delta-{since_round}"', delta
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if since_round == rnd or not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=frame, media_type="application/octet-stream", headers=headers)
+
+@app.get("/api/fl/rounds")
+async def fl_rounds(request: Request, track: Optional[str] = None, limit: int = 20):
+    """Round progress: what each open round has collected so far, and the most
+    recent closed rounds with their timing (newest first)."""
+    await _require_session(request)
+    track_map = {"host": pb.TRACK_HOST, "network": pb.TRACK_NETWORK}
+    if track is not None and track not in track_map:
+        raise HTTPException(400, "track must be host or network")
+    tid   = track_map.get(track)
+    limit = max(1, min(limit, 500))
+
+    def _query(conn):
+        return [dict(r) for r in conn.execute(
+            "SELECT track, round, trigger, updates, clients, samples, opened_at, closed_at, close_ms "
+            "FROM fl_rounds WHERE (? IS NULL OR track = ?) ORDER BY id DESC LIMIT ?",
+            (tid, tid, limit))]
+    rounds = await _db.read(_query)
+    return {
+        "open":     [o for o in _fl_scheduler.progress() if tid is None or o["track"] == tid],
+        "rounds":   rounds,
+        "mode":     _fl_scheduler.mode,
+        "deadline": FL_ROUND_DEADLINE,
+    }
 
 @app.get("/api/fl/labels/{client_id}")
-async def fl_labels(client_id: str, request: Request, days: int = 7):
+async def fl_labels(client_id: str, request: Request, days: int = 7,
+                    since: Optional[float] = None):
     """Return dashboard-feedback label windows for a client.
 
     The agent merges these with its local ground-truth windows before
@@ -581,76 +1104,176 @@ async def fl_labels(client_id: str, request: Request, days: int = 7):
       - false_positive alert  → treat that time window as BENIGN
       - resolved alert        → treat that time window as ATTACK
 
-    Response: JSON list of {"start": <unix float>, "end": <unix float>,
-                             "label": "BENIGN"|"ATTACK"} dicts.
-    Only alerts with window_start/window_end set are included (network-track
-    alerts always have these; host-track alerts may not).
+    Response: {"client_id", "windows": [{"start": <unix float>, "end": <unix
+    float>, "label": "BENIGN"|"ATTACK"}], "full": bool, "cursor": float|null}.
+    Windows with the same label that overlap are merged, sorted by start.
+    Only alerts received in the last `days` with a window set are included
+    (network-track alerts always have one; host-track alerts may not).
+
+    `since` is the `cursor` of the agent's previous call. When every status
+    change after it is a first label (see labelled_at), the response holds
+    just those windows and full is false: the agent adds them to the ones
+    it has. Otherwise — no cursor, or an alert relabelled or reopened — it
+    holds every window and full is true.
     No session required — agents authenticate via mTLS client cert.
     """
-    since = time.time() - days * 86400
-    conn = _get_conn()
-    rows = conn.execute(
-        """SELECT status, window_start, window_end, received_at
-           FROM alerts
-           WHERE client_id = ?
-             AND status IN ('false_positive', 'resolved')
-             AND received_at >= ?
-             AND window_start IS NOT NULL
-             AND window_end   IS NOT NULL
-           ORDER BY received_at""",
-       (client_id, since),
-    ).fetchall()
-    conn.close()
+    horizon = time.time() - days * 86400
+
+    def _read(conn):
+        changed = _partitions.select(conn,
+            """SELECT status, status_at, labelled_at, window_start_epoch, window_end_epoch
+               FROM {s}.alerts
+               WHERE client_id = ? AND status_at > ? AND received_at >= ?""",
+            (client_id, since or 0.0, horizon), since=horizon,
+        )
+        cursor = max((r["status_at"] for r in changed), default=since)
+        if since is not None and since >= horizon and all(
+                r["labelled_at"] is None or r["labelled_at"] > since for r in changed):
+            return False, cursor, [r for r in changed if r["status"] in LABEL_STATUSES]
+        return True, cursor, _partitions.select(conn,
+            f"""SELECT status, window_start_epoch, window_end_epoch
+               FROM {{s}}.alerts
+               WHERE client_id = ?
+                 AND status IN ({', '.join('?' * len(LABEL_STATUSES))})
+                 AND received_at >= ?""",
+            (client_id, *LABEL_STATUSES, horizon), since=horizon,
+        )
 
-    result = []
-    for r in rows:
-        try:
-            # window_start/end are ISO strings like "2026-06-15T12:34:56.789"
-            from datetime import datetime as _dt
-            def _ts(s):
-                s = str(s).strip()
-                try: return _dt.fromisoformat(s).timestamp()
-                except ValueError: pass
-                return float(s)  # fallback: assume already unix float
-            label = "BENIGN" if r["status"] == "false_positive" else "ATTACK"
-            result.append({"start": _ts(r["window_start"]),
-                           "end":   _ts(r["window_end"]),
-                           "label": label})
-        except Exception:
-            pass
+    full, cursor, rows = await _db.read(_read)
+    windows = _merge_windows(
+        ("BENIGN" if r["status"] == "false_positive" else "ATTACK",
+         r["window_start_epoch"], r["window_end_epoch"])
+        for r in rows
+        if r["window_start_epoch"] is not None and r["window_end_epoch"] is not None
+    )
+    return {"client_id": client_id, "windows": windows, "full": full, "cursor": cursor}
 
-    return {"client_id": client_id, "windows": result}
 
+def _merge_windows(windows) -> list:
+    """[(label, start, end)] -> [{"start", "end", "label"}] sorted by start,
+    with overlapping or touching windows of the same label merged."""
+    merged, last = [], {}
+    for lo, hi, label in sorted((min(s, e), max(s, e), label) for label, s, e in windows):
+        w = last.get(label)
+        if w is not None and lo <= w["end"]:
+            w["end"] = max(w["end"], hi)
+        else:
+            w = last[label] = {"start": lo, "end": hi, "label": label}
+            merged.append(w)
+    return merged
 
-@app.get("/api/alerts")
-async def list_alerts(request: Request, limit: int = 100, offset: int = 0,
-                      track: Optional[int] = None, min_severity: Optional[int] = None,
-                      rule_id: Optional[str] = None, client_id: Optional[str] = None):
-    _require_session(request)
-    conn = _get_conn()
 
-    # Build a WHERE clause from the optional filters. rule_id / client_id are
-    # partial, case-insensitive matches (SQLite LIKE is case-insensitive for
-    # ASCII); rule_id also matches the human-readable attack_type so a search
-    # works whether the user types the rule id or the attack name.
-    where, params = [], []
+# Cached COUNT(*) results for count=estimate on filters the rollups can't
+# answer: (where, params) -> (expires_at, total)
+_COUNT_CACHE_TTL = 30.0
+_count_cache: dict = {}
+
+def _encode_cursor(received_at: float, row_id: int) -> str:
+    raw = json.dumps([received_at, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        received_at, row_id = json.loads(raw)
+        return float(received_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _rollup_total(conn, track: Optional[int], min_severity: Optional[int]) -> Optional[int]:
+    """Exact total from the rollups when the only filter is a single rollup
+    dimension; None when the filter combination needs a real COUNT."""
+    if track is None and min_severity is None:
+        return rollups.total(conn)
+    if min_severity is None:
+        return dict(rollups.counts(conn, "track")).get(str(track), 0)
+    if track is None:
+        return sum(n for key, n in rollups.counts(conn, "severity")
+                   if key and int(key) >= min_severity)
+    return None
+
+def _alert_filters(q: str, rule_id: str, client_id: str,
+                   track: Optional[int], min_severity: Optional[int]) -> tuple:
+    """(where fragments, params) for the alert list filters. rule_id also
+    matches the human-readable attack_type so a search works whether the
+    user types the rule id or the attack name."""
+    where, params = alert_search.filter_sql(q, rule_id, client_id)
     if track is not None:
         where.append("track = ?"); params.append(track)
     if min_severity is not None:
         where.append("severity >= ?"); params.append(min_severity)
-    if rule_id:
-        where.append("(rule_id LIKE ? OR attack_type LIKE ?)")
-        params += [f"%{rule_id}%", f"%{rule_id}%"]
-    if client_id:
-        where.append("client_id LIKE ?"); params.append(f"%{client_id}%")
-    clause = (" WHERE " + " AND ".join(where)) if where else ""
-
-    rows = conn.execute(
-        f"SELECT * FROM alerts{clause} ORDER BY received_at DESC LIMIT ? OFFSET ?",
-        params + [limit, offset]).fetchall()
-    total = conn.execute(f"SELECT COUNT(*) FROM alerts{clause}", params).fetchone()[0]
-    conn.close()
-    return {"total": total, "offset": offset, "limit": limit, "alerts": [dict(r) for r in rows]}
+    return where, params
+
+@app.get("/api/alerts")
+async def list_alerts(request: Request, limit: int = 100, offset: int = 0,
+                      track: Optional[int] = None, min_severity: Optional[int] = None,
+                      rule_id: Optional[str] = None, client_id: Optional[str] = None,
+                      q: Optional[str] = None, cursor: Optional[str] = None,
+                      count: str = "exact", detail: bool = False):
+    """List alerts newest-first.
+
+    Text filters go through the alerts_fts trigram index (alert_search.py):
+    `q` matches any of rule_id / attack_type / client_id / mitre_id /
+    evidence, `rule_id` matches rule_id or attack_type, `client_id` matches
+    client_id — all as case-insensitive substrings.
+
+    Paging: pass the previous response's `next_cursor` as `cursor` to get the
+    next page by keyset on (received_at, id) — every page costs the same as
+    the first. `offset` still works when no cursor is given. Pages are merged
+    across the time partitions that can hold them (PartitionStore.newest).
+
+    count=exact     COUNT(*) over the filtered set (default)
+    count=estimate  exact from the rollups for no filter / track only /
+                    min_severity only, else a COUNT(*) cached for 30 s
+    count=none      skip counting; `total` is null
+
+    Rows carry the list columns only; `detail=true` also decodes evidence and
+    raw_log for every row (GET /api/alerts/{alert_id} does it for one).
+    """
+    await _require_session(request)
+    if count not in ("exact", "estimate", "none"):
+        raise HTTPException(status_code=400, detail="count must be 'exact', 'estimate', or 'none'")
+    after = _decode_cursor(cursor) if cursor else None
+
+    q, rule_id, client_id = (q or "").strip(), (rule_id or "").strip(), (client_id or "").strip()
+    where, params = _alert_filters(q, rule_id, client_id, track, min_severity)
+    if after is not None:
+        offset = 0
+
+    def _query(conn):
+        # One extra row tells us whether there is a next page.
+        rows = _partitions.newest(conn, _ALERT_LIST_COLS, where, params,
+                                  offset + limit + 1, after)[offset:]
+        if detail:
+            for r in rows[:limit]:
+                r.update(_blob_codec.fetch(conn, _partitions.schema_of(conn, r["id"]), r["id"]))
+
+        total, estimated = None, False
+        if count == "exact":
+            total = _partitions.count(conn, where, params)
+        elif count == "estimate":
+            estimated = True
+            if not q and not rule_id and not client_id:
+                total = _rollup_total(conn, track, min_severity)
+            if total is None:
+                key = (tuple(where), tuple(params))
+                hit = _count_cache.get(key)
+                if hit and hit[0] > time.time():
+                    total = hit[1]
+                else:
+                    total = _partitions.count(conn, where, params)
+                    if len(_count_cache) > 256:
+                        _count_cache.clear()
+                    _count_cache[key] = (time.time() + _COUNT_CACHE_TTL, total)
+        return rows, total, estimated
+    rows, total, estimated = await _db.read(_query)
+
+    next_cursor = None
+    if 0 < limit < len(rows):
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["received_at"], rows[-1]["id"])
+    return {"total": total, "total_estimated": estimated, "offset": offset, "limit": limit,
+            "next_cursor": next_cursor, "alerts": rows}
 
 @app.patch("/api/alerts/{alert_id}/status")
 async def update_alert_status(alert_id: str, request: Request):
@@ -660,60 +1283,69 @@ async def update_alert_status(alert_id: str, request: Request):
 
     Returns 200 with the updated alert row on success.
     """
-    _require_session(request)
+    await _require_session(request)
     body = await request.json()
     status = body.get("status", "").strip()
     if status not in ("open", "resolved", "false_positive"):
         raise HTTPException(status_code=400, detail="status must be 'open', 'resolved', or 'false_positive'")
-    conn = _get_conn()
-    conn.execute(
-        "UPDATE alerts SET status = ? WHERE alert_id = ?",
-       (status, alert_id)
-    )
-    conn.commit()
-    row = conn.execute("SELECT * FROM alerts WHERE alert_id = ?", (alert_id,)).fetchone()
-    conn.close()
+    def _update(conn):
+        schema, row = _partitions.find(conn, alert_id, "id")
+        if row is None:
+            return None
+        # status_at / labelled_at drive the agents' /api/fl/labels cursor.
+        now = time.time()
+        conn.execute(
+            f"""UPDATE {schema}.alerts SET
+                   status_at   = CASE WHEN status IS ? THEN status_at ELSE ? END,
+                   labelled_at = COALESCE(labelled_at, ?),
+                   status      = ?
+               WHERE id = ?""",
+           (status, now, now if status in LABEL_STATUSES else None, status, row["id"])
+        )
+        return conn.execute(f"SELECT {_ALERT_LIST_COLS} FROM {schema}.alerts WHERE id = ?",
+                            (row["id"],)).fetchone()
+    row = await _db.write(_update)
     if row is None:
         raise HTTPException(status_code=404, detail="Alert not found")
+    _events.publish("alert_status", {"id": row["id"], "alert_id": row["alert_id"], "status": status})
     return dict(row)
 
 
 @app.get("/api/alerts/stats")
 async def alert_stats(request: Request, hours: int = 24):
-    _require_session(request)
-    conn   = _get_conn()
-    cutoff = time.time() - (hours * 3600)
+    """Alert counts over the last `hours`, answered from the rollup tables
+    (see rollups.py) rather than by scanning alerts. Cached until an ingest
+    commit, or for at most a minute as the window slides."""
+    await _require_session(request)
+    now = time.time()
+    return await _cached_json(request, ("stats", hours),
+                              (*_versions.get("alerts"), int(now // 60)),
+                              lambda: _alert_stats(now, hours))
+
+async def _alert_stats(now: float, hours: int) -> dict:
+    cutoff = now - (hours * 3600)
+
+    def _query(conn):
+        return (rollups.counts(conn, "severity", cutoff),
+                rollups.counts(conn, "track", cutoff),
+                rollups.counts(conn, "attack_type", cutoff, limit=16))
+    sev_rows, trk_rows, type_rows = await _db.read(_query)
 
     # Severity breakdown  {4: N, 3: N, 2: N, 1: N, 0: N}
-    sev_rows = conn.execute(
-        "SELECT severity, COUNT(*) as count FROM alerts WHERE received_at >= ? GROUP BY severity",
-       (cutoff,)
-    ).fetchall()
     by_severity = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
-    for r in sev_rows:
-        k = int(r["severity"] or 0)
-        by_severity[k] = by_severity.get(k, 0) + r["count"]
+    for key, n in sev_rows:
+        k = int(key or 0)
+        by_severity[k] = by_severity.get(k, 0) + n
 
     # Track breakdown  {1: N, 2: N, 0: N}
-    trk_rows = conn.execute(
-        "SELECT track, COUNT(*) as count FROM alerts WHERE received_at >= ? GROUP BY track",
-       (cutoff,)
-    ).fetchall()
     by_track = {0: 0, 1: 0, 2: 0}
-    for r in trk_rows:
-        k = int(r["track"] or 0)
-        by_track[k] = by_track.get(k, 0) + r["count"]
+    for key, n in trk_rows:
+        k = int(key or 0)
+        by_track[k] = by_track.get(k, 0) + n
 
     # Top attack types (shown in bar chart as "rules")
-    type_rows = conn.execute(
-        """SELECT attack_type as rule_id, COUNT(*) as count
-           FROM alerts WHERE received_at >= ? AND attack_type IS NOT NULL AND attack_type != ''
-           GROUP BY attack_type ORDER BY count DESC LIMIT 15""",
-       (cutoff,)
-    ).fetchall()
-    by_rule_id = [{"rule_id": r["rule_id"], "count": r["count"]} for r in type_rows]
+    by_rule_id = [{"rule_id": key, "count": n} for key, n in type_rows if key][:15]
 
-    conn.close()
     return {
         "hours":       hours,
         "by_severity": by_severity,
@@ -721,13 +1353,121 @@ async def alert_stats(request: Request, hours: int = 24):
         "by_rule_id":  by_rule_id,
     }
 
+# Export columns; raw_log is appended when asked for.
+_EXPORT_COLS = (
+    "alert_id", "received_at", "client_id", "client_ip", "track", "attack_type",
+    "severity", "confidence", "rule_id", "mitre_id", "mitre_tactic", "suggestion",
+    "risk_note", "event_count", "status", "evidence",
+)
+_EXPORT_CHUNK = 500
+
+@app.get("/api/alerts/export")
+async def export_alerts(request: Request, format: str = "csv", compress: str = "none",
+                        raw_log: bool = False, track: Optional[int] = None,
+                        min_severity: Optional[int] = None, rule_id: Optional[str] = None,
+                        client_id: Optional[str] = None, q: Optional[str] = None):
+    """Every alert matching the list_alerts filters, newest first, as a
+    CSV or NDJSON download.
+
+    Rows are read in keyset chunks of _EXPORT_CHUNK — the same
+    (received_at, id) walk as cursor paging — each on a briefly borrowed
+    reader, so memory stays flat however many rows match, and a slow
+    download neither holds a pooled connection nor pins a WAL snapshot.
+    evidence is always included; raw_log=true adds the raw event XML.
+    compress=gzip sends a .gz file.
+    """
+    await _require_session(request)
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    if compress not in ("none", "gzip"):
+        raise HTTPException(status_code=400, detail="compress must be 'none' or 'gzip'")
+    where, params = _alert_filters((q or "").strip(), (rule_id or "").strip(),
+                                   (client_id or "").strip(), track, min_severity)
+    cols = _EXPORT_COLS + (("raw_log",) if raw_log else ())
+
+    def _chunk(conn, after):
+        rows = _partitions.newest(conn, _ALERT_LIST_COLS, where, params, _EXPORT_CHUNK, after)
+        by_part = defaultdict(list)
+        for r in rows:
+            by_part[PartitionStore.key_of(r["id"])].append(r["id"])
+        blobs = {}
+        for key, ids in by_part.items():
+            # Attach right before use: a chunk can span more partitions than
+            # stay attached at once.
+            schema = _partitions.attach(conn, key)
+            if schema is not None:
+                blobs.update(_blob_codec.fetch_many(conn, schema, ids))
+        empty = {"evidence": "", "raw_log": ""}
+        for r in rows:
+            r.update(blobs.get(r["id"], empty))
+        return rows
+
+    def _encode(rows) -> str:
+        if format == "ndjson":
+            return "".join(json.dumps({c: r[c] for c in cols}, separators=(",", ":")) + "\n"
+                           for r in rows)
+        buf = io.StringIO()
+        csv.writer(buf).writerows([r[c] for c in cols] for r in rows)
+        return buf.getvalue()
+
+    async def _body():
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress == "gzip" else None
+        def _out(text: str) -> bytes:
+            data = text.encode("utf-8")
+            return gz.compress(data) if gz else data
+
+        if format == "csv":
+            yield _out(",".join(cols) + "\r\n")
+        after = None
+        while True:
+            rows = await _db.read(_chunk, after)
+            if rows:
+                data = _out(_encode(rows))
+                if data:
+                    yield data
+            if len(rows) < _EXPORT_CHUNK:
+                break
+            after = (rows[-1]["received_at"], rows[-1]["id"])
+        if gz:
+            yield gz.flush()
+
+    ext = format + (".gz" if compress == "gzip" else "")
+    media_type = ("application/gzip" if compress == "gzip" else
+                  "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson")
+    filename = f"flare_alerts_{time.strftime('%Y-%m-%d')}.{ext}"
+    return StreamingResponse(_body(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/alerts/{alert_id}")
+async def get_alert(alert_id: str, request: Request):
+    """One alert with its evidence and raw_log decompressed from alert_blobs."""
+    await _require_session(request)
+
+    def _query(conn):
+        schema, row = _partitions.find(conn, alert_id, _ALERT_LIST_COLS)
+        if row is None:
+            return None
+        d = dict(row)
+        d.update(_blob_codec.fetch(conn, schema, d["id"]))
+        return d
+    alert = await _db.read(_query)
+    if alert is None:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return alert
+
 @app.get("/api/clients")
 async def list_clients(request: Request):
-    _require_session(request)
-    now  = time.time()
-    conn = _get_conn()
-    rows = conn.execute("SELECT * FROM clients ORDER BY last_seen DESC").fetchall()
-    conn.close()
+    """Every agent that has sent a heartbeat. Cached until the next one, or
+    for at most 10 s so `last_seen_ago` keeps moving."""
+    await _require_session(request)
+    now = time.time()
+    return await _cached_json(request, "clients",
+                              (*_versions.get("clients", "presence"), int(now // 10)),
+                              lambda: _list_clients(now))
+
+async def _list_clients(now: float) -> dict:
+    rows = await _db.read(lambda conn: conn.execute(
+        "SELECT * FROM clients ORDER BY last_seen DESC").fetchall())
     clients = []
     for row in rows:
         d = dict(row)
@@ -736,60 +1476,128 @@ async def list_clients(request: Request):
         clients.append(d)
     return {"clients": clients}
 
-@app.get("/api/status")
-async def status(request: Request):
-    _require_session(request)
-    now  = time.time()
-    conn = _get_conn()
-
-    total_alerts = conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
-    all_clients  = conn.execute("SELECT last_seen FROM clients").fetchall()
-    online_count = sum(1 for c in all_clients if (now - c["last_seen"]) < OFFLINE_AFTER_SECS)
-
-    # FL model info
+def _fl_status(conn):
+    """(network FL model info | None, pending FL updates) for the dashboard."""
     fl_row = conn.execute(
         "SELECT round, version, client_count, updated_at FROM fl_models WHERE track=2 ORDER BY round DESC LIMIT 1"
     ).fetchone()
-    fl_model = dict(fl_row) if fl_row else None
 
     # Pending FL updates (submitted but not yet aggregated)
     fl_pending = conn.execute(
         "SELECT COUNT(*) FROM fl_updates WHERE base_round >= (SELECT COALESCE(MAX(round),0) FROM fl_models WHERE track=2)"
     ).fetchone()[0]
+    return (dict(fl_row) if fl_row else None), fl_pending
+
+@app.get("/api/status")
+async def status(request: Request):
+    """Dashboard header figures. Cached until alerts, client presence or FL
+    state change; `server_time`, `db_pool` and `live` are as of when the
+    body was built."""
+    await _require_session(request)
+    return await _cached_json(request, "status", _versions.get("alerts", "presence", "fl"),
+                              _status)
+
+async def _status() -> dict:
+    now = time.time()
+
+    def _query(conn):
+        total_alerts = rollups.total(conn)
+        all_clients  = conn.execute("SELECT last_seen FROM clients").fetchall()
+        return (total_alerts, all_clients, *_fl_status(conn))
+    total_alerts, all_clients, fl_row, fl_pending = await _db.read(_query)
+    online_count = sum(1 for c in all_clients if (now - c["last_seen"]) < OFFLINE_AFTER_SECS)
 
-    conn.close()
     return {
         "server_time":        now,
         "total_alerts":       total_alerts,
         "online_clients":     online_count,
         "total_clients":      len(all_clients),
-        "fl_model":           fl_model,
+        "fl_model":           fl_row,
         "fl_pending_updates": fl_pending,
         "fl_min_clients":     MIN_FL_CLIENTS,
+        "db_pool":            _db.stats(),
+        "live":               _events.stats(),
+        "agent_channel":      _channel.stats() if _channel is not None else None,
     }
 
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """Prometheus text format (metrics.py). Open to loopback so a local
+    Prometheus or curl needs no login; from elsewhere it takes a dashboard
+    session. With several workers the answer covers all of them."""
+    if not (request.client and _is_loopback(request.client.host)):
+        await _require_session(request)
+    _dashboard_sessions.set(await _db.read(_count_sessions))
+    peers = None
+    if _cluster is not None:
+        if time.monotonic() - _scraped_at >= METRICS_SHARE_S:
+            _cluster.publish("scraped", None)
+        cutoff = time.monotonic() - 3 * METRICS_SHARE_S
+        peers = {w: m for w, (at, m) in list(_peer_metrics.items()) if at >= cutoff}
+    return Response(_metrics.render(peers), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+@app.get("/api/stream")
+async def stream(request: Request):
+    """Server-Sent Events feed of dashboard changes (event_hub.py).
+
+    The browser's EventSource reconnects on its own and sends Last-Event-ID;
+    events it missed are replayed, or a `resync` event tells it to refetch.
+    A comment line every 15 s keeps proxies from timing the stream out, and
+    the session is re-checked each time so a logged-out stream ends.
+    """
+    await _require_session(request)
+    try:
+        last_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_id = None
+    token = request.cookies.get("flare_session", "")
+    if _cluster is not None and not _events.subscribed:
+        _cluster.publish("watching", None)
+    sub = _events.subscribe(last_id)
+
+    async def _body():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                msg = await _events.next(sub, 15)
+                if msg is None:
+                    return
+                if msg[0] == ":" and not await _db.run(_valid_session, token):
+                    return
+                yield msg
+        finally:
+            _events.unsubscribe(sub)
+
+    return StreamingResponse(_body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/login")
 async def login(request: Request):
     body = await request.json()
     if body.get("username") != DASHBOARD_USER or _hash_pw(body.get("password")) != DASHBOARD_PASS_HASH:
         raise HTTPException(status_code=401, detail="Invalid")
-    token = _create_session()
+    token = await _db.run(_create_session)
     response = JSONResponse({"ok": True})
     response.set_cookie("flare_session", token, httponly=True, samesite="strict", max_age=_SESSION_TTL)
     return response
 
 @app.get("/")
-async def dashboard():
-    index = UI_DIR / "index.html"
-    if index.exists(): return FileResponse(str(index))
+async def dashboard(request: Request):
+    # Precompressed, strong ETag; no-cache so an upgraded UI shows up at once
+    # while an unchanged one costs a 304.
+    if _ui.exists("index.html"): return _ui.response(request, "index.html")
     return JSONResponse({"status": "FLARE server running"})
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Network interface discovery + LAN beacon
 # ─────────────────────────────────────────────────────────────────────────────
 
-BEACON_PORT       = 37020
-BEACON_INTERVAL_S = 3.0
 _beacon_stop      = threading.Event()
 
 def _get_local_ipv4_addresses() -> list[str]:
@@ -823,47 +1631,6 @@ def _select_advertised_ip(cli_host: Optional[str]) -> tuple[str, str]:
     except Exception: pass
     return "0.0.0.0", ips[0]
 
-def _broadcast_presence(advertised_ip: str, port: int, stop_event: threading.Event):
-    # IMPORTANT: do NOT bind this socket to a specific source IP. On Windows,
-    # binding a broadcast socket to a unicast address suppresses transmission of
-    # the limited broadcast (255.255.255.255) — that bind was the regression that
-    # broke install-time auto-discovery. Leave the socket unbound and let the OS
-    # pick the route per destination.
-    ips = _get_local_ipv4_addresses()
-    if not ips and advertised_ip and advertised_ip != "0.0.0.0":
-        ips = [advertised_ip]
-
-    # Build the destination set from every attached /24:
-    #   • 255.255.255.255          — limited broadcast (same-segment wired clients)
-    #   • <subnet>.255             — directed broadcast for each /24
-    #   • <subnet>.1 .. .254       — unicast sweep. Wi-Fi APs routinely drop
-    #     broadcast frames from the wired side, so a wireless client never sees
-    #     the broadcast — but unicast reaches it exactly like a file copy does.
-    dests = {"255.255.255.255"}
-    for ip in ips:
-        o = ip.split(".")
-        if len(o) == 4:
-            base = ".".join(o[:3])
-            dests.add(base + ".255")
-            dests.update(f"{base}.{h}" for h in range(1, 255) if str(h) != o[3])
-    dests = sorted(dests)
-
-    try:
-        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    except Exception as e:
-        log.error(f"Beacon socket creation failed: {e}")
-        return
-
-    payload = f"FLARE_SERVER::{advertised_ip}::{port}".encode("utf-8")
-    log.info(f"beacon       : advertising {advertised_ip}:{port} on udp/{BEACON_PORT} "
-             f"(limited + directed broadcast + /24 unicast sweep, {len(dests)} dests)")
-    while not stop_event.is_set():
-        for dest in dests:
-            try: udp.sendto(payload, (dest, BEACON_PORT))
-            except Exception: pass
-        stop_event.wait(BEACON_INTERVAL_S)
-
 def _cert_covers_ip(cert_path: Path, ip: str) -> bool:
     """Return True if the server cert's SAN already includes the given IP."""
     try:
@@ -913,14 +1680,20 @@ def _run_uvicorn_server(bind_host: str, port: int, stop_event: threading.Event):
     config = uvicorn.Config(
         "flare_server:app", host=bind_host, port=port, log_level="info",
         ssl_certfile=TLS_CERT, ssl_keyfile=TLS_KEY,
+        # Open /api/stream responses never finish on their own.
+        timeout_graceful_shutdown=5,
         # No ssl_ca_certs / ssl_cert_reqs here — requesting client certs at the
         # SSL layer breaks browser connections (Chrome drops with ERR_EMPTY_RESPONSE).
         # Agent identity is checked at the application layer instead.
     )
+    if WORKERS > 1:
+        cluster.serve(config, WORKERS, stop_event, setup="flare_server:_setup_worker")
+        return
     server = uvicorn.Server(config)
 
     def _watch_stop():
         stop_event.wait()
+        _events.close()
         server.should_exit = True
 
     threading.Thread(target=_watch_stop, daemon=True).start()
@@ -937,7 +1710,9 @@ def _start_dashboard(stop_event: threading.Event, foreground: bool = True):
 
     if advertised_ip:
         _beacon_stop.clear()
-        threading.Thread(target=_broadcast_presence, args=(advertised_ip, SERVER_PORT, _beacon_stop), daemon=True).start()
+        Discovery(advertised_ip, SERVER_PORT, _get_local_ipv4_addresses(), mode=DISCOVERY_MODE,
+                  group=DISCOVERY_GROUP, max_interval=BEACON_MAX_INTERVAL,
+                  stop_event=_beacon_stop).start()
 
     print(f"\n  FLARE Server\n    advertised : https://{advertised_ip}:{SERVER_PORT}\n")
     if foreground:
@@ -0,0 +1,886 @@
+"""
+FLARE - Simulated Agent Fleet
+──────────────────────────────────
+Load generator for benchmarking the server on one machine, without Windows
+endpoints. Thousands of simulated agents run as asyncio tasks in one
+process, each presenting a client certificate signed by the FLARE CA
+(generate_pki.py) on its own keep-alive HTTPS connection, and put on the
+wire what flare_agent.py does:
+
+  heartbeat   a Heartbeat every 60 s, its counters advancing
+  host alerts rule hits (host/rules.py rule ids, MITRE ids and confidences)
+              arriving as a Poisson process; brute force and spray rules fire
+              in waves of several alerts
+  net alerts  a detection check every 30 s (flare_network_infer.run_once):
+              one alert per flagged flow up to 20 flows, above that a single
+              MLP-burst summary carrying the flow count and top ports
+  alert flush alerts buffered like AlertSenderThread — batches of 20 every
+              5 s, a batch refused with 503 kept for the next flush, at most
+              500 buffered
+  model poll  GET /api/fl/model/network with since_round and If-None-Match
+  FL update   the held global model plus noise, as an FLUpdate
+
+With --channel, heartbeats, alert batches and FL updates go over the agent
+channel (agent_channel.py) instead: one connection per agent, every batch
+of a flush in flight at once, and pushed models are counted.
+
+The host and network alert mix can be reweighted (--host-mix, --net-mix),
+and --speed divides every interval (10 = a 60 s heartbeat every 6 s). Every
+--report seconds and at the end it prints requests, throughput, p50/p99
+latency and errors per endpoint; --json writes the final numbers so two
+server builds can be compared.
+
+Without --server, a server is started on a scratch directory (--workers
+processes), with any FLARE_* settings from the environment.
+
+Usage
+-----
+  # 2000 agents against a scratch server, 2 minutes at 10x speed
+  python fleet_sim.py --agents 2000 --duration 120 --speed 10
+
+  # An existing server; its CA (ca.crt + ca.key in certs/) signs the agent certs
+  python fleet_sim.py --server 10.0.0.5:7331 --ca certs --agents 500 --channel
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import socket
+import ssl
+import struct
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from proto import log_schema_pb2 as pb
+from proto import weight_codec
+
+# Agent timings (flare_agent.py, flare_network_infer.py), in seconds.
+HEARTBEAT_S   = 60
+NET_INFER_S   = 30
+ALERT_FLUSH_S = 5
+ALERT_BATCH   = 20
+ALERT_MAX_BUF = 500
+BURST_FLOWS   = 20       # run_once: more flagged flows than this -> one summary alert
+KEEPALIVE_S   = 4.0      # reconnect rather than reuse a connection idle this long
+                         # (uvicorn closes idle keep-alive connections after 5 s)
+
+# Host rules: rule_id -> (attack_type, mitre_id, tactic, confidence, event_id, weight).
+HOST_RULES = {
+    "brute_force_logon":             ("Brute Force Logon Attempt", "T1110.001", "Credential Access", 0.85, 4625, 20),
+    "password_spray":                ("Password Spray Attack", "T1110.003", "Credential Access", 0.90, 4625, 6),
+    "scheduled_task_created":        ("Scheduled Task Created", "T1053.005", "Persistence", 0.75, 4698, 22),
+    "scheduled_task_suspicious":     ("Suspicious Scheduled Task Created", "T1053.005", "Persistence", 0.85, 4698, 3),
+    "ps_encoded_command":            ("PowerShell Encoded / Obfuscated Execution", "T1027", "Defense Evasion", 0.90, 4104, 8),
+    "ps_download_cradle":            ("PowerShell Download Cradle", "T1059.001", "Execution", 0.95, 4104, 4),
+    "ps_reflection_load":            ("PowerShell Reflection Assembly Load", "T1620", "Defense Evasion", 0.90, 4104, 1),
+    "ioc_domain_match":              ("DNS Query to Known Malicious Domain", "T1071.004", "Command and Control", 0.95, 3008, 6),
+    "ioc_ip_connection":             ("Connection to Known Malicious IP", "T1071.001", "Command and Control", 0.95, 5156, 6),
+    "ioc_process_name":              ("Known Attack Tool Executed: mimikatz.exe", "T1588.002", "Resource Development", 0.90, 4688, 2),
+    "ioc_process_chain":             ("Suspicious Process Chain: winword.exe -> powershell.exe", "T1059", "Execution", 0.95, 4688, 3),
+    "net_portscan":                  ("Port Scan", "T1046", "Discovery", 0.90, 5157, 4),
+    "new_service_suspicious_path":   ("Malicious Service Installation", "T1543.003", "Persistence", 0.90, 7045, 3),
+    "psexec_lateral_movement":       ("PsExec Remote Execution (Lateral Movement)", "T1569.002", "Lateral Movement", 1.0, 7045, 2),
+    "privileged_group_modification": ("User Added to Privileged Group", "T1098", "Privilege Escalation", 0.85, 4732, 3),
+    "kerberoasting_rc4":             ("Kerberoasting via RC4 Downgrade", "T1558.003", "Credential Access", 1.0, 4769, 2),
+    "asrep_roasting":                ("AS-REP Roasting (Pre-Auth Disabled)", "T1558.004", "Credential Access", 0.95, 4768, 1),
+    "audit_policy_changed":          ("Audit Policy Modified", "T1562.002", "Defense Evasion", 0.95, 4719, 2),
+    "wmi_persistence":               ("WMI Event Subscription (Persistence)", "T1546.003", "Persistence", 0.95, 5861, 1),
+    "defender_disabled":             ("Windows Defender Real-Time Protection Disabled", "T1562.001", "Defense Evasion", 1.0, 5001, 1),
+    "shadow_copy_deletion":          ("Volume Shadow Copy Deletion (Pre-Ransomware)", "T1490", "Impact", 1.0, 4688, 1),
+    "security_log_cleared":          ("Security Log Cleared", "T1070.001", "Defense Evasion", 0.95, 1102, 1),
+}
+WAVE_RULES = ("brute_force_logon", "password_spray")
+
+# Network detections: attack_type -> (rule_id, mitre_id, tactic, weight).
+NET_TYPES = {
+    "Port Scan":               ("net_portscan", "T1046", "Discovery", 30),
+    "SSH Brute Force":         ("net_bruteforce_ssh", "T1110", "Credential Access", 12),
+    "FTP Brute Force":         ("net_bruteforce_ssh", "T1110", "Credential Access", 4),
+    "DDoS / Volumetric Flood": ("net_dos", "T1498", "Impact", 10),
+    "UDP Flood":               ("net_dos", "T1498", "Impact", 8),
+    "DoS – HTTP Flood":        ("net_dos", "T1499", "Impact", 8),
+    "Web Attack":              ("net_web_attack", "T1190", "Initial Access", 8),
+    "Botnet C2 Beaconing":     ("net_infiltration", "T1071", "Command and Control", 10),
+    "Network Attack Detected": ("net_mlp_detection", "", "", 10),
+}
+_PORTS = {"Port Scan": 0, "SSH Brute Force": 22, "FTP Brute Force": 21, "Web Attack": 80,
+          "DoS – HTTP Flood": 80, "UDP Flood": 53, "DDoS / Volumetric Flood": 443,
+          "Botnet C2 Beaconing": 8443, "Network Attack Detected": 445}
+
+_EVENT_XML = (
+    "<Event xmlns='http://schemas.microsoft.com/win/2004/08/events/event'><System>"
+    "<Provider Name='Microsoft-Windows-Security-Auditing' Guid='{{54849625-5478-4994-a5ba-3e3b0328c30d}}'/>"
+    "<EventID>{event_id}</EventID><Version>0</Version><Level>0</Level><Task>12544</Task><Opcode>0</Opcode>"
+    "<Keywords>0x8010000000000000</Keywords><TimeCreated SystemTime='{ts}'/>"
+    "<EventRecordID>{record}</EventRecordID><Correlation/><Execution ProcessID='{pid}' ThreadID='{tid}'/>"
+    "<Channel>Security</Channel><Computer>{host}</Computer><Security/></System><EventData>"
+    "<Data Name='SubjectUserSid'>S-1-5-18</Data><Data Name='SubjectUserName'>{host}$</Data>"
+    "<Data Name='SubjectDomainName'>CORP</Data><Data Name='SubjectLogonId'>0x3e7</Data>"
+    "<Data Name='TargetUserSid'>S-1-0-0</Data><Data Name='TargetUserName'>{user}</Data>"
+    "<Data Name='TargetDomainName'>CORP</Data><Data Name='Status'>0xc000006d</Data>"
+    "<Data Name='FailureReason'>%%2313</Data><Data Name='SubStatus'>0xc000006a</Data>"
+    "<Data Name='LogonType'>3</Data><Data Name='LogonProcessName'>NtLmSsp </Data>"
+    "<Data Name='AuthenticationPackageName'>NTLM</Data><Data Name='WorkstationName'>WS-{ws}</Data>"
+    "<Data Name='TransmittedServices'>-</Data><Data Name='LmPackageName'>-</Data>"
+    "<Data Name='KeyLength'>0</Data><Data Name='ProcessId'>0x0</Data><Data Name='ProcessName'>-</Data>"
+    "<Data Name='IpAddress'>{src}</Data><Data Name='IpPort'>{sport}</Data></EventData></Event>"
+)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _severity(confidence: float) -> int:
+    if confidence >= 0.95:
+        return pb.SEVERITY_CRITICAL
+    if confidence >= 0.85:
+        return pb.SEVERITY_HIGH
+    if confidence >= 0.75:
+        return pb.SEVERITY_MEDIUM
+    return pb.SEVERITY_LOW
+
+
+def _frame(msg) -> bytes:
+    data = msg.SerializeToString()
+    return struct.pack(">I", len(data)) + data
+
+
+def _mix(table: dict, spec: str) -> tuple:
+    """(keys, weights) of `table`, with "key=weight,…" from `spec` applied."""
+    weights = {k: v[-1] for k, v in table.items()}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, w = part.rpartition("=")
+        if key not in table:
+            raise SystemExit(f"unknown mix entry {key!r}; choose from: {', '.join(table)}")
+        weights[key] = float(w)
+    keys = [k for k, w in weights.items() if w > 0]
+    return keys, [weights[k] for k in keys]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Results
+# ─────────────────────────────────────────────────────────────────────────────
+
+class Stats:
+    """Latencies and errors per endpoint, for the whole run and the current
+    report interval."""
+
+    def __init__(self):
+        self.latency: dict = defaultdict(list)    # endpoint -> [seconds] of successes
+        self.errors:  dict = defaultdict(Counter) # endpoint -> {reason: n}
+        self.interval: Counter = Counter()        # endpoint -> requests since last report
+        self.counts:  Counter = Counter()         # alerts_sent, alerts_dropped, models_pushed, …
+
+    def ok(self, endpoint: str, seconds: float):
+        self.latency[endpoint].append(seconds)
+        self.interval[endpoint] += 1
+
+    def error(self, endpoint: str, reason: str):
+        self.errors[endpoint][reason] += 1
+        self.interval[endpoint] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        out = {}
+        for ep in sorted(set(self.latency) | set(self.errors)):
+            lat = sorted(self.latency[ep])
+            n_err = sum(self.errors[ep].values())
+            n = len(lat) + n_err
+            out[ep] = {
+                "requests":   n,
+                "per_second": round(n / elapsed, 2) if elapsed else 0.0,
+                "p50_ms":     round(lat[len(lat) // 2] * 1000, 2) if lat else None,
+                "p99_ms":     round(lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000, 2) if lat else None,
+                "errors":     n_err,
+                "error_rate": round(n_err / n, 4) if n else 0.0,
+                "error_reasons": dict(self.errors[ep].most_common(5)),
+            }
+        return out
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Transports
+# ─────────────────────────────────────────────────────────────────────────────
+
+class HttpConnection:
+    """One agent's keep-alive HTTPS connection (what requests.Session gives
+    the real agent): reconnects when idle past KEEPALIVE_S or closed by the
+    server, and retries once if a reused connection turns out to be closed."""
+
+    def __init__(self, host: str, port: int, ctx: ssl.SSLContext):
+        self.host, self.port, self.ctx = host, port, ctx
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._used = 0.0
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[dict] = None, timeout: float = 30.0) -> tuple:
+        """(status, {lower-case header: value}, body)."""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                f"Content-Length: {len(body)}"]
+        if body:
+            head.append("Content-Type: application/octet-stream")
+        head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        data = ("\r\n".join(head) + "\r\n\r\n").encode() + body
+        for attempt in (1, 2):
+            fresh = self._writer is None or time.monotonic() - self._used > KEEPALIVE_S
+            if fresh:
+                self.close()
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, ssl=self.ctx,
+                                            server_hostname=self.host), timeout)
+            try:
+                self._writer.write(data)
+                return await asyncio.wait_for(self._response(), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+                self.close()
+                if fresh or attempt == 2:
+                    raise
+
+    async def _response(self) -> tuple:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionResetError("connection closed by server")
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                body += await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                del body[-2:]
+            body = bytes(body[:-2]) if body.endswith(b"\r\n") else bytes(body)
+        else:
+            n = int(headers.get("content-length", 0))
+            body = await self._reader.readexactly(n) if n else b""
+        self._used = time.monotonic()
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, headers, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.transport.abort()
+        self._reader = self._writer = None
+
+
+class ChannelConnection:
+    """One agent's agent-channel connection: messages are sent with a seq and
+    send() resolves with the matching Ack; pushed models go to on_model."""
+
+    def __init__(self, host: str, port: int, ctx: ssl.SSLContext, hello: pb.ChannelHello, on_model):
+        self.host, self.port, self.ctx = host, port, ctx
+        self.hello, self.on_model = hello, on_model
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: dict = {}
+        self._seq = 0
+
+    async def send(self, kind: str, message, timeout: float = 30.0) -> pb.Ack:
+        if self._writer is None:
+            reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ctx,
+                                        server_hostname=self.host), timeout)
+            self._writer.write(_frame(pb.ChannelMessage(hello=self.hello)))
+            self._reader_task = asyncio.ensure_future(self._read(reader))
+        self._seq += 1
+        msg = pb.ChannelMessage(seq=self._seq)
+        getattr(msg, kind).CopyFrom(message)
+        fut = self._pending[self._seq] = asyncio.get_running_loop().create_future()
+        self._writer.write(_frame(msg))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(msg.seq, None)
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                (length,) = struct.unpack(">I", await reader.readexactly(4))
+                msg = pb.ChannelMessage.FromString(await reader.readexactly(length))
+                kind = msg.WhichOneof("body")
+                if kind == "ack":
+                    fut = self._pending.get(msg.ack.seq)
+                    if fut is not None and not fut.done():
+                        fut.set_result(msg.ack)
+                elif kind == "model":
+                    self.on_model(msg.model)
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError) as exc:
+            self._fail(exc)
+        except asyncio.CancelledError:
+            self._fail(ConnectionAbortedError("closed"))
+
+    def _fail(self, exc: Exception):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionResetError(str(exc) or type(exc).__name__))
+        if self._writer is not None:
+            self._writer.transport.abort()
+        self._writer = None
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.transport.abort()
+        self._writer = None
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Simulated agent
+# ─────────────────────────────────────────────────────────────────────────────
+
+class SimAgent:
+    """
+    One simulated endpoint.
+
+    index  — agent number; client_id is sim-<index>
+    sim    — the Fleet (settings, shared Stats, random source)
+    ctx    — client SSLContext (a cert signed by the FLARE CA)
+    """
+
+    def __init__(self, index: int, sim: "Fleet", ctx: ssl.SSLContext):
+        self.sim = sim
+        self.cid = f"sim-{index:05d}"
+        self.ip  = f"10.{64 + (index >> 16) % 64}.{(index >> 8) & 255}.{index & 255}"
+        self.rng = random.Random(sim.seed * 1_000_003 + index)
+        self.http = HttpConnection(sim.host, sim.port, ctx)
+        self.channel: Optional[ChannelConnection] = None
+        if sim.channel_port:
+            hello = pb.ChannelHello(client_id=self.cid, agent_version=sim.agent_version, model_round=-1)
+            self.channel = ChannelConnection(sim.host, sim.channel_port, ctx, hello, self._pushed)
+        self.buffer: list = []
+        self.started = time.monotonic()
+        self.round, self.etag = -1, None
+        self.weights = sim.weights    # (coefs, intercepts): the shipped model until a global one arrives
+        self.want_full = False
+        self.host_total = self.net_total = self.rule_hits = self.ioc_matches = 0
+        self.records = self.rng.randrange(10_000, 5_000_000)
+
+    async def run(self, until: float):
+        s, rng, now = self.sim, self.rng, time.monotonic()
+        host_rate = s.host_rate * s.speed / 3600
+        due = {
+            "heartbeat": now,
+            "flush":     now + s.flush_s,
+            "net":       now + rng.uniform(0, s.net_s),
+            "host":      now + (rng.expovariate(host_rate) if host_rate else float("inf")),
+            "poll":      now + rng.uniform(0, s.poll_s),
+            "fl":        now + rng.uniform(0.2, 1.0) * s.fl_s if s.fl_s else float("inf"),
+        }
+        try:
+            while True:
+                name = min(due, key=due.get)
+                at = due[name]
+                if at >= until:
+                    break
+                await asyncio.sleep(max(0.0, at - time.monotonic()))
+                if name == "heartbeat":
+                    await self._heartbeat()
+                    due[name] = at + s.heartbeat_s
+                elif name == "flush":
+                    if self.buffer:
+                        await self._flush()
+                    due[name] = at + s.flush_s
+                elif name == "net":
+                    self._net_tick()
+                    due[name] = at + s.net_s
+                elif name == "host":
+                    self._host_alert()
+                    due[name] = at + rng.expovariate(host_rate)
+                elif name == "poll":
+                    await self._poll()
+                    due[name] = at + s.poll_s
+                else:
+                    await self._fl_update()
+                    due[name] = at + s.fl_s
+        finally:
+            self.http.close()
+            if self.channel is not None:
+                self.channel.close()
+
+    # ── Upstream messages ────────────────────────────────────────────────────
+
+    async def _send(self, kind: str, endpoint: str, message) -> bool:
+        """Deliver one message over the channel or HTTP; records the result."""
+        stats = self.sim.stats
+        if self.channel is not None:
+            label = f"channel {kind}"
+            t0 = time.perf_counter()
+            try:
+                ack = await self.channel.send(kind, message)
+            except (OSError, asyncio.TimeoutError, ssl.SSLError) as exc:
+                stats.error(label, type(exc).__name__)
+                return False
+            if ack.status != 200:
+                stats.error(label, str(ack.status))
+                return False
+            stats.ok(label, time.perf_counter() - t0)
+            return True
+        label = f"POST {endpoint}"
+        t0 = time.perf_counter()
+        try:
+            status, _, _ = await self.http.request("POST", endpoint, _frame(message))
+        except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError) as exc:
+            stats.error(label, type(exc).__name__)
+            return False
+        if status != 200:
+            stats.error(label, str(status))
+            return False
+        stats.ok(label, time.perf_counter() - t0)
+        return True
+
+    async def _heartbeat(self):
+        hb = pb.Heartbeat(
+            client_id=self.cid, timestamp=_now_iso(), client_ip=self.ip,
+            agent_version=self.sim.agent_version, host_model_hash="",
+            net_model_hash=f"{self.round:08x}", uptime_seconds=int(time.monotonic() - self.started),
+            host_track_ok=True, net_track_ok=True, host_alerts_total=self.host_total,
+            net_alerts_total=self.net_total, ioc_matches_total=self.ioc_matches,
+            rule_hits_total=self.rule_hits)
+        await self._send("heartbeat", "/api/heartbeat", hb)
+
+    async def _flush(self):
+        """AlertSenderThread._flush_buffer: batches of ALERT_BATCH; what the
+        server refuses stays buffered for the next flush."""
+        batches = [self.buffer[i:i + ALERT_BATCH] for i in range(0, len(self.buffer), ALERT_BATCH)]
+        msgs = [pb.AlertBatch(alerts=b) for b in batches]
+        if self.channel is not None:
+            results = await asyncio.gather(*(self._send("alerts", "/api/alerts/ingest", m) for m in msgs))
+        else:
+            results = []
+            for m in msgs:
+                results.append(await self._send("alerts", "/api/alerts/ingest", m))
+                if not results[-1]:
+                    break
+        done = 0
+        for ok in results:
+            if not ok:
+                break
+            done += 1
+        sent = sum(len(b) for b in batches[:done])
+        self.sim.stats.counts["alerts_sent"] += sent
+        self.buffer = self.buffer[sent:]
+
+    async def _fl_update(self):
+        rng, coefs, intercepts = self.rng, *self.weights
+        noise = np.random.default_rng(rng.randrange(1 << 30))
+        flu = pb.FLUpdate(timestamp=_now_iso(), client_id=self.cid, track=pb.TRACK_NETWORK,
+                          sample_count=rng.randrange(500, 20_000), base_round=max(self.round, 0),
+                          local_loss=round(rng.uniform(0.01, 0.08), 4))
+        for a in coefs:
+            weight_codec.encode(flu.coefs.add(), (a + noise.normal(0, 0.01, a.shape)).astype(np.float32))
+        for a in intercepts:
+            weight_codec.encode(flu.intercepts.add(), (a + noise.normal(0, 0.01, a.shape)).astype(np.float32))
+        if await self._send("fl_update", "/api/fl/update", flu):
+            self.sim.stats.counts["fl_updates_sent"] += 1
+
+    # ── Global model ─────────────────────────────────────────────────────────
+
+    async def _poll(self):
+        path, headers = "/api/fl/model/network", {}
+        if self.want_full:
+            path += "?full=1"
+        else:
+            if self.round >= 0:
+                path += f"?since_round={self.round}"
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+        label = "GET /api/fl/model/network"
+        t0 = time.perf_counter()
+        try:
+            status, resp_headers, body = await self.http.request("GET", path, headers=headers)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError) as exc:
+            self.sim.stats.error(label, type(exc).__name__)
+            return
+        if status not in (200, 204, 304):
+            self.sim.stats.error(label, str(status))
+            return
+        self.sim.stats.ok(label, time.perf_counter() - t0)
+        if status == 200 and len(body) > 4:
+            (length,) = struct.unpack_from(">I", body)
+            if self._take(pb.ModelUpdate.FromString(body[4:4 + length])):
+                self.etag = resp_headers.get("etag")
+
+    def _pushed(self, mu: pb.ModelUpdate):
+        self.sim.stats.counts["models_pushed"] += 1
+        self._take(mu)
+
+    def _take(self, mu: pb.ModelUpdate) -> bool:
+        """Hold `mu` (a full model, or a delta against the round held);
+        False when it could not be applied."""
+        try:
+            layers = ([weight_codec.decode(lw).reshape(lw.rows, lw.cols if lw.cols > 0 else 1)
+                       for lw in mu.coefs],
+                      [weight_codec.decode(lw).ravel() for lw in mu.intercepts])
+        except ValueError:
+            return False
+        if mu.is_delta:
+            if self.weights is None or mu.base_round != self.round:
+                self.want_full = True
+                return False
+            layers = tuple([b + d for b, d in zip(held, new)] for held, new in zip(self.weights, layers))
+        self.weights, self.round, self.want_full = layers, mu.round, False
+        if self.channel is not None:
+            self.channel.hello.model_round = mu.round
+        return True
+
+    # ── Detections ───────────────────────────────────────────────────────────
+
+    def _queue(self, alerts: list):
+        room = ALERT_MAX_BUF - len(self.buffer)
+        self.buffer.extend(alerts[:max(0, room)])
+        if len(alerts) > room:
+            self.sim.stats.counts["alerts_dropped"] += len(alerts) - max(0, room)
+
+    def _host_alert(self):
+        s, rng = self.sim, self.rng
+        rule = rng.choices(s.host_keys, s.host_weights)[0]
+        attack_type, mitre, tactic, conf, event_id, _ = HOST_RULES[rule]
+        n = 1 + int(rng.expovariate(1 / s.wave)) if rule in WAVE_RULES else 1
+        src, user = f"192.168.{rng.randrange(1, 255)}.{rng.randrange(1, 255)}", rng.choice(s.users)
+        alerts = []
+        for _ in range(n):
+            self.records += 1
+            ts = _now_iso()
+            evidence = {"event_id": event_id, "TargetUserName": user, "IpAddress": src}
+            if rule.startswith("ioc_"):
+                self.ioc_matches += 1
+            self.rule_hits += 1
+            alerts.append(pb.AlertEvent(
+                alert_id=str(uuid.uuid4()), timestamp=ts, client_id=self.cid, client_ip=self.ip,
+                severity=_severity(conf), track=pb.TRACK_HOST, attack_type=attack_type,
+                confidence=conf, window_start=ts, window_end=ts, event_count=1,
+                evidence=json.dumps(evidence), rule_id=rule, mitre_id=mitre, mitre_tactic=tactic,
+                suggestion=f"Investigate {attack_type.lower()} on {self.cid}.",
+                risk_note=f"{attack_type} ({mitre}) reported by the host rule engine.",
+                raw_log=_EVENT_XML.format(event_id=event_id, ts=ts, record=self.records,
+                                          pid=rng.randrange(400, 9000), tid=rng.randrange(400, 9000),
+                                          host=self.cid.upper(), user=user, ws=rng.randrange(100),
+                                          src=src, sport=rng.randrange(1024, 65535))))
+        self.host_total += n
+        self._queue(alerts)
+
+    def _net_tick(self):
+        """run_once(): most checks find nothing; a detection is a handful of
+        flagged flows, or an attack burst collapsed into one summary."""
+        s, rng = self.sim, self.rng
+        if rng.random() >= s.net_rate * s.net_s / s.speed / 3600:
+            return
+        attack_type = rng.choices(s.net_keys, s.net_weights)[0]
+        rule_id, mitre, tactic, _ = NET_TYPES[attack_type]
+        ts = _now_iso()
+        if rng.random() < s.net_burst:
+            flows = rng.randrange(BURST_FLOWS + 1, 5000)
+        else:
+            flows = 1 + min(BURST_FLOWS - 1, int(rng.expovariate(1 / 3)))
+        src = f"203.0.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        port = _PORTS[attack_type] or rng.randrange(1, 1024)
+        if flows > BURST_FLOWS:
+            conf = rng.uniform(0.8, 0.99)
+            alerts = [pb.AlertEvent(
+                alert_id=str(uuid.uuid4()), timestamp=ts, client_id=self.cid, client_ip=self.ip,
+                severity=_severity(conf), track=pb.TRACK_NETWORK, attack_type=attack_type,
+                confidence=conf, window_start=ts, window_end=ts, event_count=flows,
+                evidence=json.dumps({"flow_count": flows, "mean_conf": round(conf, 4),
+                                     "max_conf": round(min(1.0, conf + 0.01), 4),
+                                     "top_ports": {str(port): flows}, "method": "MLP-burst"}),
+                rule_id=rule_id, mitre_id=mitre, mitre_tactic=tactic)]
+        else:
+            alerts = []
+            for _ in range(flows):
+                conf = rng.uniform(0.65, 0.99)
+                alerts.append(pb.AlertEvent(
+                    alert_id=str(uuid.uuid4()), timestamp=ts, client_id=self.cid, client_ip=self.ip,
+                    severity=_severity(conf), track=pb.TRACK_NETWORK, attack_type=attack_type,
+                    confidence=conf, window_start=ts, window_end=ts, event_count=1,
+                    evidence=json.dumps({"SourceIP": src, "DestinationPort": port,
+                                         "FlowBytes/s": round(rng.uniform(1e2, 1e7), 4),
+                                         "FlowDuration": rng.randrange(1, 10_000_000),
+                                         "TotalFwdPackets": rng.randrange(1, 500)}),
+                    rule_id=rule_id, mitre_id=mitre, mitre_tactic=tactic))
+        self.net_total += len(alerts)
+        self._queue(alerts)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Fleet
+# ─────────────────────────────────────────────────────────────────────────────
+
+class Fleet:
+    """Settings shared by every SimAgent, the agents, and their Stats."""
+
+    def __init__(self, args, host: str, port: int, channel_port: int):
+        self.host, self.port, self.channel_port = host, port, channel_port
+        self.speed        = args.speed
+        self.heartbeat_s  = HEARTBEAT_S / args.speed
+        self.flush_s      = ALERT_FLUSH_S / args.speed
+        self.net_s        = NET_INFER_S / args.speed
+        self.poll_s       = args.poll_interval / args.speed
+        self.fl_s         = args.fl_interval / args.speed if args.fl_interval else 0
+        self.host_rate    = args.host_rate
+        self.net_rate     = args.net_rate
+        self.net_burst    = args.net_burst
+        self.wave         = args.wave
+        self.seed         = args.seed
+        self.agent_version = "1.0-sim"
+        self.host_keys, self.host_weights = _mix(HOST_RULES, args.host_mix)
+        self.net_keys, self.net_weights   = _mix(NET_TYPES, args.net_mix)
+        self.weights = _initial_weights()
+        self.users = ["administrator", "svc_backup", "svc_sql", "jdoe", "asmith", "helpdesk",
+                     "guest", "scanner", "webadmin", "krbtgt"]
+        self.stats = Stats()
+
+    async def run(self, contexts: list, agents: int, duration: float, ramp: float, report: float):
+        start = time.monotonic()
+        until = start + duration
+        fleet = [SimAgent(i, self, contexts[i % len(contexts)]) for i in range(agents)]
+
+        async def launch(agent: SimAgent, delay: float):
+            await asyncio.sleep(delay)
+            agent.started = time.monotonic()
+            await agent.run(until)
+
+        tasks = [asyncio.ensure_future(launch(a, ramp * i / max(1, agents)))
+                 for i, a in enumerate(fleet)]
+        cpu0, last = time.process_time(), start
+        while not all(t.done() for t in tasks):
+            await asyncio.wait(tasks, timeout=report)
+            now = time.monotonic()
+            self._progress(now - start, now - last)
+            last = now
+        for t in tasks:
+            if t.exception() is not None:
+                logging.getLogger("flare_server.fleet_sim").warning("agent failed: %r", t.exception())
+        return time.monotonic() - start, time.process_time() - cpu0
+
+    def _progress(self, elapsed: float, interval: float):
+        parts = []
+        for ep, n in sorted(self.stats.interval.items()):
+            parts.append(f"{ep.split()[-1].replace('/api/', '')} {n / interval:.1f}/s")
+        errors = sum(sum(c.values()) for c in self.stats.errors.values())
+        print(f"  [{elapsed:6.0f}s] {'  '.join(parts) or 'idle'}  "
+              f"alerts sent {self.stats.counts['alerts_sent']}  errors {errors}", flush=True)
+        self.stats.interval.clear()
+
+
+def print_endpoints(summary: dict):
+    """Table of Stats.summary()."""
+    print(f"    {'endpoint':<34}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for ep, r in summary.items():
+        p50 = f"{r['p50_ms']:.2f}" if r["p50_ms"] is not None else "-"
+        p99 = f"{r['p99_ms']:.2f}" if r["p99_ms"] is not None else "-"
+        err = f"{r['error_rate'] * 100:.1f}%"
+        print(f"    {ep:<34}{r['requests']:>9}{r['per_second']:>9.1f}{p50:>9}{p99:>9}{err:>8}")
+        if r["error_reasons"]:
+            print(f"    {'':<34}{', '.join(f'{k} x{v}' for k, v in r['error_reasons'].items())}")
+
+
+def _report(stats: Stats, elapsed: float, cpu: float, agents: int, speed: float) -> dict:
+    summary = stats.summary(elapsed)
+    print(f"\n  {agents} agents, {elapsed:.0f} s at {speed:g}x speed")
+    print_endpoints(summary)
+    c = stats.counts
+    print(f"    alerts sent {c['alerts_sent']}, dropped from full buffers {c['alerts_dropped']}, "
+          f"FL updates {c['fl_updates_sent']}, models pushed {c['models_pushed']}")
+    load = cpu / elapsed if elapsed else 0.0
+    print(f"    generator CPU {load * 100:.0f}% of one core"
+          + ("  (saturated: latencies include the generator's own queueing)" if load > 0.85 else ""))
+    return {"agents": agents, "seconds": round(elapsed, 1), "speed": speed,
+            "generator_cpu": round(load, 3), "endpoints": summary, "counts": dict(c)}
+
+
+def _initial_weights() -> tuple:
+    """(coefs, intercepts) of the network MLP agents ship with, or random
+    weights of its shape (38-64-32-1) when no copy is at hand."""
+    here = Path(__file__).parent
+    for p in (here.parent / "client" / "network" / "models" / "network_mlp_weights.json",
+              here / "engine" / "network" / "models" / "network_mlp_weights.json"):
+        if p.exists():
+            w = json.loads(p.read_text(encoding="utf-8"))
+            return ([np.asarray(a, dtype=np.float32) for a in w["coefs"]],
+                    [np.asarray(a, dtype=np.float32).ravel() for a in w["intercepts"]])
+    rng = np.random.default_rng(0)
+    dims = (38, 64, 32, 1)
+    return ([rng.normal(0, 0.1, (a, b)).astype(np.float32) for a, b in zip(dims, dims[1:])],
+            [np.zeros(b, dtype=np.float32) for b in dims[1:]])
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Certificates and the scratch server
+# ─────────────────────────────────────────────────────────────────────────────
+
+def agent_contexts(ca_dir: Path, out: Path, n: int) -> list:
+    """n client SSLContexts with ECDSA certs signed by the CA in `ca_dir`
+    (agents share them round-robin; the server doesn't tie a cert to a
+    client_id, and thousands of contexts would only cost memory)."""
+    import generate_pki
+    ca_key, ca_cert = generate_pki.load_ca((ca_dir / "ca.crt").read_bytes(),
+                                           (ca_dir / "ca.key").read_bytes())
+    contexts = []
+    for i in range(n):
+        d = out / f"sim-{i:03d}"
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_pki.generate_client_bundle(f"sim-{i:03d}", ca_key, ca_cert, d, key_type="ecdsa")
+        ctx = ssl.create_default_context(cafile=str(ca_dir / "ca.crt"))
+        ctx.check_hostname = False
+        ctx.load_cert_chain(str(d / "client.crt"), str(d / "client.key"))
+        contexts.append(ctx)
+    return contexts
+
+
+def _server_setup(index: int):
+    """Worker setup for the scratch server: point it at the scratch directory."""
+    import flare_server
+    d = Path(os.environ["FLARE_SIM_DIR"])
+    flare_server.DB_PATH = str(d / "flare.db")
+    flare_server.TLS_CERT, flare_server.TLS_KEY = str(d / "server.crt"), str(d / "server.key")
+    flare_server.TLS_CA = str(d / "ca.crt")
+    flare_server.WORKERS = int(os.environ["FLARE_SIM_WORKERS"])
+    flare_server.CHANNEL_PORT = int(os.environ["FLARE_SIM_CHANNEL"])
+    flare_server.PROVISION_KEY_POOL = flare_server.PROVISION_WORKERS = 0
+    # Seed the global model from the weights the agents start with.
+    seed = json.loads((d / "network_mlp_weights.json").read_text())
+    flare_server._load_initial_weights = lambda: seed
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _server(directory: str, port: int, channel_port: int, workers: int, stop):
+    import uvicorn
+    import cluster
+    os.environ.update(FLARE_SIM_DIR=directory, FLARE_SIM_WORKERS=str(workers),
+                      FLARE_SIM_CHANNEL=str(channel_port))
+    config = uvicorn.Config("flare_server:app", host="127.0.0.1", port=port, log_level="warning",
+                            access_log=False, ssl_certfile=str(Path(directory) / "server.crt"),
+                            ssl_keyfile=str(Path(directory) / "server.key"),
+                            timeout_graceful_shutdown=5)
+    cluster.serve(config, workers, stop, setup="fleet_sim:_server_setup")
+
+
+@contextlib.contextmanager
+def target_server(server: str, ca: str, channel_port: int, workers: int, root: Path):
+    """Yield (host, port, channel port, CA directory) of the server to load:
+    `server` ("host:port") with its CA in `ca`, or, when `server` is empty,
+    a scratch server with `workers` processes started in `root` and stopped
+    on exit."""
+    if server:
+        host, _, port = server.rpartition(":")
+        yield host or "127.0.0.1", int(port or 7331), channel_port, Path(ca)
+        return
+    import multiprocessing
+    import generate_pki
+    port, channel_port = _free_port(), _free_port()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ca_key, ca_cert = generate_pki.generate_ca(root / "ca.crt", root / "ca.key")
+        generate_pki.generate_server_cert(root / "server.crt", root / "server.key", ca_key, ca_cert)
+    coefs, intercepts = _initial_weights()
+    (root / "network_mlp_weights.json").write_text(json.dumps(
+        {"coefs": [a.tolist() for a in coefs], "intercepts": [a.tolist() for a in intercepts]}))
+    stop = multiprocessing.get_context("spawn").Event()
+    proc = multiprocessing.get_context("spawn").Process(
+        target=_server, args=(str(root), port, channel_port, workers, stop))
+    proc.start()
+    try:
+        yield "127.0.0.1", port, channel_port, root
+    finally:
+        stop.set()
+        proc.join(30)
+        if proc.is_alive():
+            proc.terminate()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(host: str, port: int, ctx: ssl.SSLContext, timeout: float = 60.0):
+    conn = HttpConnection(host, port, ctx)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                status, _, _ = await conn.request("GET", "/api/provision/health", timeout=5)
+                if status == 200:
+                    return
+            except (OSError, asyncio.TimeoutError, ssl.SSLError):
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"server on {host}:{port} did not come up")
+            await asyncio.sleep(0.3)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE simulated agent fleet (load generator)")
+    parser.add_argument("--agents", type=int, default=1000, help="Simulated agents")
+    parser.add_argument("--duration", type=float, default=120, help="Seconds to run")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time compression: every interval and rate scaled by this factor")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds over which agents start")
+    parser.add_argument("--server", default="",
+                        help="host:port of a running server (default: start one on a scratch dir)")
+    parser.add_argument("--ca", default="", help="Directory with the server's ca.crt and ca.key (--server)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the scratch server")
+    parser.add_argument("--channel", action="store_true",
+                        help="Send heartbeats, alerts and FL updates over the agent channel")
+    parser.add_argument("--channel-port", type=int, default=7332, help="Agent channel port (--server)")
+    parser.add_argument("--certs", type=int, default=32, help="Distinct client certs across the fleet")
+    parser.add_argument("--host-rate", type=float, default=6.0, help="Host rule hits per agent per hour")
+    parser.add_argument("--net-rate", type=float, default=4.0, help="Network detections per agent per hour")
+    parser.add_argument("--net-burst", type=float, default=0.2,
+                        help="Fraction of network detections that are bursts (> 20 flows)")
+    parser.add_argument("--wave", type=float, default=8.0, help="Mean alerts per brute-force / spray wave")
+    parser.add_argument("--host-mix", default="", help="Host rule weights, e.g. brute_force_logon=50,defender_disabled=5")
+    parser.add_argument("--net-mix", default="", help="Network attack weights, e.g. 'Port Scan=10,UDP Flood=40'")
+    parser.add_argument("--poll-interval", type=float, default=120, help="Model poll interval (agent FL test mode: 120)")
+    parser.add_argument("--fl-interval", type=float, default=300,
+                        help="FL update interval (agent FL test mode: 300); 0 sends none")
+    parser.add_argument("--report", type=float, default=10, help="Seconds between progress lines")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", default="", help="Write the final results to this file")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    if args.server and not args.ca:
+        parser.error("--server needs --ca (the directory holding the server's ca.crt and ca.key)")
+    with tempfile.TemporaryDirectory(prefix="flare-sim-") as tmp, \
+            target_server(args.server, args.ca, args.channel_port, args.workers, Path(tmp)) as \
+            (host, port, channel_port, ca_dir):
+        contexts = agent_contexts(ca_dir, Path(tmp) / "agents", max(1, min(args.certs, args.agents)))
+        asyncio.run(wait_ready(host, port, contexts[0]))
+        where = f"{host}:{port}" + (f" (channel {channel_port})" if args.channel else "")
+        print(f"  {args.agents} agents -> {where} for {args.duration:g} s at {args.speed:g}x, "
+              f"{len(contexts)} client certs, {os.cpu_count()} CPU(s)", flush=True)
+        fleet = Fleet(args, host, port, channel_port if args.channel else 0)
+        elapsed, cpu = asyncio.run(fleet.run(contexts, args.agents, args.duration, args.ramp, args.report))
+        result = _report(fleet.stats, elapsed, cpu, args.agents, args.speed)
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
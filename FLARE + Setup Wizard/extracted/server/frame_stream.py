@@ -0,0 +1,220 @@
+"""
+FLARE - Streaming Frame Decoder
+──────────────────────────────────
+Decodes the length-prefixed protobuf frames that agents POST
+(/api/alerts/ingest, /api/heartbeat, /api/fl/update) while the body is still
+arriving, instead of awaiting the whole body and slicing it into copies:
+
+  [4-byte big-endian length][protobuf bytes] [length][bytes] ...
+
+  FrameDecoder   feed() it the body chunks as they come off the socket; it
+                 yields one memoryview per complete frame. A frame that lies
+                 inside one chunk is a view straight into that chunk (no
+                 copy); only a frame split across chunks is assembled, once,
+                 into a buffer of exactly its length.
+  read_messages  async generator over an ASGI body stream (request.stream())
+                 that parses each frame into a message as soon as it is
+                 complete, so the handler can act on the first batch before
+                 the last one is uploaded.
+
+Limits are checked before anything is buffered: a frame header claiming more
+than max_frame bytes, or a body (by Content-Length, or by count when it is
+chunked) over max_body, raises FrameTooLarge (HTTP 413). Truncated or
+unparseable bodies raise FrameError (HTTP 400). A request therefore never
+holds more than one chunk plus one frame of body, whatever the batch size.
+
+Usage
+-----
+  # Whole-body read_frames vs streaming: peak memory and time to first frame
+  python frame_stream.py --bench [-n 2000]
+"""
+
+import argparse
+import struct
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+from google.protobuf.message import DecodeError
+
+MAX_FRAME = 16 * 1024 * 1024     # largest single frame accepted
+MAX_BODY  = 64 * 1024 * 1024     # largest request body accepted
+
+_HEADER = struct.Struct(">I")
+
+
+class FrameError(ValueError):
+    """Malformed framed body; `status` is the HTTP status to answer with."""
+    status = 400
+
+
+class FrameTooLarge(FrameError):
+    status = 413
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for one framed body.
+
+    max_frame  — largest frame accepted (bytes, excluding the 4-byte header)
+    max_body   — largest total body accepted (bytes)
+    """
+
+    def __init__(self, max_frame: int = MAX_FRAME, max_body: int = MAX_BODY):
+        self.max_frame = max_frame
+        self.max_body  = max_body
+        self.received  = 0             # body bytes fed so far
+        self.frames    = 0             # frames yielded so far
+        self._head     = bytearray()   # partial header carried between chunks
+        self._frame: Optional[bytearray] = None   # frame being assembled
+        self._filled   = 0
+
+    def feed(self, chunk: bytes) -> Iterator[memoryview]:
+        """Yield every frame completed by `chunk`. Views into `chunk` stay
+        valid for as long as the caller keeps them."""
+        self.received += len(chunk)
+        if self.received > self.max_body:
+            raise FrameTooLarge(f"Body exceeds {self.max_body} bytes")
+        view, pos, end = memoryview(chunk), 0, len(chunk)
+        while pos < end:
+            if self._frame is None:
+                if not self._head and end - pos >= 4:
+                    (length,) = _HEADER.unpack_from(view, pos)
+                    pos += 4
+                else:
+                    take = min(4 - len(self._head), end - pos)
+                    self._head += view[pos:pos + take]
+                    pos += take
+                    if len(self._head) < 4:
+                        break
+                    (length,) = _HEADER.unpack(self._head)
+                    self._head.clear()
+                if length > self.max_frame:
+                    raise FrameTooLarge(f"Frame claims {length} bytes (limit {self.max_frame})")
+                if end - pos >= length:
+                    self.frames += 1
+                    yield view[pos:pos + length]
+                    pos += length
+                    continue
+                self._frame, self._filled = bytearray(length), 0
+            take = min(len(self._frame) - self._filled, end - pos)
+            self._frame[self._filled:self._filled + take] = view[pos:pos + take]
+            self._filled += take
+            pos += take
+            if self._filled == len(self._frame):
+                frame, self._frame = self._frame, None
+                self.frames += 1
+                yield memoryview(frame)
+
+    def close(self):
+        """End of body: raise FrameError if it stopped inside a frame."""
+        if self._head:
+            raise FrameError("Truncated frame header")
+        if self._frame is not None:
+            raise FrameError(f"Frame claims {len(self._frame)} bytes but only {self._filled} remain")
+
+
+async def read_messages(stream: AsyncIterator[bytes], message_type,
+                        max_frame: int = MAX_FRAME, max_body: int = MAX_BODY,
+                        content_length: Optional[str] = None) -> AsyncIterator:
+    """Yield a `message_type` for every frame of `stream` as it completes.
+
+    `content_length` (the request header, when present) lets an oversized
+    body be refused before any of it is read."""
+    if content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise FrameTooLarge(f"Body of {content_length} bytes exceeds {max_body}")
+    decoder = FrameDecoder(max_frame, max_body)
+    async for chunk in stream:
+        for frame in decoder.feed(chunk):
+            msg = message_type()
+            try:
+                msg.ParseFromString(frame)
+            except DecodeError as exc:
+                raise FrameError(f"Frame {decoder.frames} is not a valid {message_type.__name__}: {exc}")
+            yield msg
+    decoder.close()
+
+
+# ── Benchmark ─────────────────────────────────────────────────────────────────
+
+def _bench(n: int, chunk_size: int = 64 * 1024):
+    import asyncio
+    import tracemalloc
+
+    from proto import log_schema_pb2 as pb
+
+    raw = "<Event><System><Provider Name='Microsoft-Windows-Security-Auditing'/>" \
+          "<EventID>4625</EventID></System><EventData>" + "<Data Name='x'>y</Data>" * 40 + \
+          "</EventData></Event>"
+    batch = pb.AlertBatch()
+    for _ in range(20):
+        a = batch.alerts.add()
+        a.client_id, a.attack_type, a.raw_log = "bench", "brute_force", raw
+    frame = batch.SerializeToString()
+    body = (_HEADER.pack(len(frame)) + frame) * n
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    print(f"  {n} AlertBatch frames of {len(frame)} bytes, "
+          f"{len(body) / 1e6:.1f} MB body in {chunk_size // 1024} KiB chunks")
+
+    async def stream(delay: float):
+        for c in chunks:
+            if delay:
+                await asyncio.sleep(delay)
+            yield c
+
+    async def whole_body(delay: float):
+        # The old path: await request.body(), then slice it into frames.
+        first = None
+        parts = [c async for c in stream(delay)]
+        body = b"".join(parts)
+        del parts
+        offset, frames = 0, []
+        while offset < len(body):
+            (length,) = _HEADER.unpack_from(body, offset)
+            frames.append(body[offset + 4:offset + 4 + length])
+            offset += 4 + length
+        alerts = 0
+        for f in frames:
+            msg = pb.AlertBatch()
+            msg.ParseFromString(f)
+            alerts += len(msg.alerts)
+            if first is None:
+                first = time.perf_counter()
+        return alerts, first
+
+    async def streaming(delay: float):
+        first, alerts = None, 0
+        async for msg in read_messages(stream(delay), pb.AlertBatch, max_body=len(body)):
+            alerts += len(msg.alerts)
+            if first is None:
+                first = time.perf_counter()
+        return alerts, first
+
+    for label, fn in (("whole body + slices", whole_body), ("streaming decoder  ", streaming)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        alerts, _ = asyncio.run(fn(0))
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Time to first frame with the upload paced at ~50 MB/s.
+        t0 = time.perf_counter()
+        _, first = asyncio.run(fn(chunk_size / 50e6))
+        print(f"    {label}: {alerts} alerts  {elapsed * 1000:8.1f} ms  "
+              f"peak {peak / 1e6:7.1f} MB  "
+              f"first frame after {(first - t0) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE streaming frame decoder")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare whole-body and streaming frame decoding")
+    parser.add_argument("-n", type=int, default=2000, help="Frames in the body")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.n)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,9 @@ Usage
   # 3. Same, but protect the .p12 with a passphrase:
   python generate_pki.py --client DESKTOP-ABC --p12-pass s3cr3t
 
+  # 4. Same, with an ECDSA P-256 key instead of RSA 2048:
+  python generate_pki.py --client DESKTOP-ABC --key-type ecdsa
+
 Called by server/setup/1_setup.ps1 during server setup.
 """
 
@@ -40,7 +43,7 @@ import sys
 try:
     from cryptography import x509
     from cryptography.hazmat.primitives import hashes, serialization
-    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
     from cryptography.hazmat.primitives.serialization import pkcs12
     from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID
 except ImportError:
@@ -53,7 +56,15 @@ except ImportError:
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _gen_key():
+KEY_TYPES = ("rsa", "ecdsa")
+
+
+def _gen_key(key_type: str = "rsa"):
+    """RSA 2048 (default) or, for key_type "ecdsa", an ECDSA P-256 key."""
+    if key_type == "ecdsa":
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type != "rsa":
+        raise ValueError(f"key type must be one of {KEY_TYPES}, not {key_type!r}")
     return rsa.generate_private_key(public_exponent=65537, key_size=2048)
 
 
@@ -61,12 +72,20 @@ def _now():
     return datetime.datetime.now(datetime.timezone.utc)
 
 
-def _write_key(key, path: pathlib.Path):
-    path.write_bytes(key.private_bytes(
+def key_pem(key) -> bytes:
+    return key.private_bytes(
         serialization.Encoding.PEM,
         serialization.PrivateFormat.TraditionalOpenSSL,
         serialization.NoEncryption(),
-    ))
+    )
+
+
+def load_key(pem: bytes):
+    return serialization.load_pem_private_key(pem, password=None)
+
+
+def _write_key(key, path: pathlib.Path):
+    path.write_bytes(key_pem(key))
 
 
 def _has_aki(cert_path: pathlib.Path) -> bool:
@@ -91,6 +110,11 @@ def _has_aki(cert_path: pathlib.Path) -> bool:
 # CA
 # ---------------------------------------------------------------------------
 
+def load_ca(cert_pem: bytes, key_pem: bytes):
+    """Parse an existing CA. Returns: (ca_key, ca_cert)"""
+    return load_key(key_pem), x509.load_pem_x509_certificate(cert_pem)
+
+
 def generate_ca(
     cert_path: pathlib.Path,
     key_path:  pathlib.Path,
@@ -105,8 +129,7 @@ def generate_ca(
     key_path.parent.mkdir(parents=True, exist_ok=True)
 
     if cert_path.exists() and key_path.exists():
-        ca_key  = serialization.load_pem_private_key(key_path.read_bytes(), password=None)
-        ca_cert = x509.load_pem_x509_certificate(cert_path.read_bytes())
+        ca_key, ca_cert = load_ca(cert_path.read_bytes(), key_path.read_bytes())
         print(f"CA_EXISTS    {cert_path}")
         return ca_key, ca_cert
 
@@ -264,29 +287,8 @@ def generate_server_cert(
 # Client bundle
 # ---------------------------------------------------------------------------
 
-def generate_client_bundle(
-    name:         str,
-    ca_key,
-    ca_cert,
-    out_dir:      pathlib.Path,
-    p12_password: str = "",
-):
-    """
-    Generate a per-client cert bundle signed by the CA.
-
-    Writes three files:
-      client.crt  — PEM cert (FLARE_CLIENT_CERT on the agent machine)
-      client.key  — PEM key  (FLARE_CLIENT_KEY  on the agent machine)
-      client.p12  — PKCS12   (import into browser for dashboard access)
-
-    The cert CN is set to `name` (e.g. hostname or user@host).
-    """
-    out_dir.mkdir(parents=True, exist_ok=True)
-    cert_path = out_dir / "client.crt"
-    key_path  = out_dir / "client.key"
-    p12_path  = out_dir / "client.p12"
-
-    key     = _gen_key()
+def sign_client_cert(name: str, key, ca_key, ca_cert):
+    """Client-auth certificate for `key`, CN = `name`, signed by the CA."""
     subject = x509.Name([
         x509.NameAttribute(NameOID.COMMON_NAME,              name),
         x509.NameAttribute(NameOID.ORGANIZATION_NAME,        "FLARE"),
@@ -294,7 +296,7 @@ def generate_client_bundle(
     ])
 
     now  = _now()
-    cert = (
+    return (
         x509.CertificateBuilder()
         .subject_name(subject)
         .issuer_name(ca_cert.subject)
@@ -324,9 +326,26 @@ def generate_client_bundle(
         .sign(ca_key, hashes.SHA256())
     )
 
+
+def write_client_bundle(
+    name:         str,
+    key,
+    cert,
+    ca_cert,
+    out_dir:      pathlib.Path,
+    p12_password: str = "",
+):
+    """
+    Write client.crt / client.key / client.p12 for `key` + `cert` to
+    `out_dir`. Returns: (cert_pem, key_pem) as written.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+    pem      = key_pem(key)
+
     # PEM cert + key
-    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
-    _write_key(key, key_path)
+    (out_dir / "client.crt").write_bytes(cert_pem)
+    (out_dir / "client.key").write_bytes(pem)
 
     # PKCS12 bundle (cert + key + CA chain) for browser import
     p12_enc = (
@@ -341,11 +360,35 @@ def generate_client_bundle(
         cas=[ca_cert],
         encryption_algorithm=p12_enc,
     )
-    p12_path.write_bytes(p12_bytes)
+    (out_dir / "client.p12").write_bytes(p12_bytes)
+    return cert_pem, pem
+
+
+def generate_client_bundle(
+    name:         str,
+    ca_key,
+    ca_cert,
+    out_dir:      pathlib.Path,
+    p12_password: str = "",
+    key_type:     str = "rsa",
+):
+    """
+    Generate a per-client cert bundle signed by the CA.
+
+    Writes three files:
+      client.crt  — PEM cert (FLARE_CLIENT_CERT on the agent machine)
+      client.key  — PEM key  (FLARE_CLIENT_KEY  on the agent machine)
+      client.p12  — PKCS12   (import into browser for dashboard access)
+
+    The cert CN is set to `name` (e.g. hostname or user@host).
+    """
+    key  = _gen_key(key_type)
+    cert = sign_client_cert(name, key, ca_key, ca_cert)
+    write_client_bundle(name, key, cert, ca_cert, out_dir, p12_password)
 
-    print(f"CLIENT_CERT  {cert_path}")
-    print(f"CLIENT_KEY   {key_path}")
-    print(f"CLIENT_P12   {p12_path}")
+    print(f"CLIENT_CERT  {out_dir / 'client.crt'}")
+    print(f"CLIENT_KEY   {out_dir / 'client.key'}")
+    print(f"CLIENT_P12   {out_dir / 'client.p12'}")
     if p12_password:
         print(f"P12_PASS    (as supplied via --p12-pass)")
     else:
@@ -378,6 +421,8 @@ Examples:
                              "(default: certs/clients/<name>)")
     parser.add_argument("--p12-pass",    default="",
                         help="Optional passphrase for the PKCS12 browser bundle")
+    parser.add_argument("--key-type",    default="rsa", choices=KEY_TYPES,
+                        help="Client key: rsa (2048-bit, default) or ecdsa (P-256)")
     args = parser.parse_args()
 
     root             = pathlib.Path(__file__).parent
@@ -399,7 +444,8 @@ Examples:
             else root / "certs" / "clients" / name
         )
         print()
-        generate_client_bundle(name, ca_key_obj, ca_cert_obj, client_dir, args.p12_pass)
+        generate_client_bundle(name, ca_key_obj, ca_cert_obj, client_dir, args.p12_pass,
+                               args.key_type)
         print()
         print("  --- Deployment instructions -----------------------------------")
         print("  Copy to the agent machine:")
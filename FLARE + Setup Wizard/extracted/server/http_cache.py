@@ -0,0 +1,224 @@
+"""
+FLARE - HTTP Response Cache
+──────────────────────────────────
+Conditional-GET support for the read endpoints that the dashboard polls
+(/api/status, /api/alerts/stats, /api/clients) and for the dashboard page
+itself. (Agents' /api/fl/model/{track} polls have their own per-round frame
+cache in flare_server.py and use not_modified() from here.)
+
+  DataVersions   change counters per data domain, bumped by the code paths
+                 that write that data:
+                   alerts    ingest writer commits, retention
+                   clients   every heartbeat
+                   presence  an agent appearing, coming online, going offline
+                   fl        FL updates received, FedAvg rounds
+                 With several worker processes (cluster.py) each bump is
+                 passed on to the others, which apply() it.
+  ResponseCache  the serialised body of each response, keyed by request and
+                 stamped with the versions it was built from. While none of
+                 them move, a poll is a dict lookup; the ETag is a hash of the
+                 body, so a client that sends it back gets a 304.
+  StaticAssets   files under ui/, read once, hashed and precompressed (gzip,
+                 plus brotli when the `brotli` package is installed), reloaded
+                 when the file's mtime changes.
+
+Responses are sent with `Cache-Control: no-cache`: browsers keep the body
+and revalidate with If-None-Match on every fetch(), which costs the server a
+lookup and the network a header-only 304.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:         # optional: gzip alone is fine
+    brotli = None
+
+DOMAINS = ("alerts", "clients", "presence", "fl")
+
+
+def etag_for(body: bytes) -> str:
+    """Strong ETag for `body`."""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """True when the request's If-None-Match already names `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison (RFC 9110 §13.1.2).
+    return etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+class DataVersions:
+    """Monotonic change counter per domain. bump() is safe from any thread."""
+
+    def __init__(self):
+        self._v    = dict.fromkeys(DOMAINS, 0)
+        self._lock = threading.Lock()
+        self._send: Optional[Callable[[tuple], None]] = None
+
+    def share(self, send: Callable[[tuple], None]):
+        """Also hand the domains of every bump() to `send` (the cluster bus)."""
+        self._send = send
+
+    def bump(self, *domains: str):
+        self.apply(*domains)
+        if self._send is not None:
+            self._send(domains)
+
+    def apply(self, *domains: str):
+        """bump() without passing it on — for bumps made by another worker."""
+        with self._lock:
+            for d in domains:
+                self._v[d] += 1
+
+    def get(self, *domains: str) -> tuple:
+        return tuple(self._v[d] for d in domains)
+
+    def snapshot(self) -> dict:
+        return dict(self._v)
+
+
+class CachedResponse:
+    __slots__ = ("version", "body", "etag", "media_type")
+
+    def __init__(self, version, body: bytes, media_type: str):
+        self.version    = version
+        self.body       = body
+        self.etag       = etag_for(body)
+        self.media_type = media_type
+
+    def response(self, request: Request, cache_control: str = "private, no-cache") -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": cache_control}
+        if not_modified(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type=self.media_type, headers=headers)
+
+
+class ResponseCache:
+    """
+    Serialised responses keyed by request (path + the parameters that shape
+    the body). Used from the event loop thread only.
+
+    max_entries — least recently used entries beyond this are dropped
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self._entries: OrderedDict = OrderedDict()
+        self._max  = max_entries
+        self.hits   = 0
+        self.misses = 0
+
+    def get(self, key, version) -> Optional[CachedResponse]:
+        """The entry for `key` if it was built at `version`, else None."""
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, version, body: bytes, media_type: str = "application/json") -> CachedResponse:
+        entry = CachedResponse(version, body, media_type)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max:
+            self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# ── Static files ──────────────────────────────────────────────────────────────
+
+_MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8", ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",   ".svg": "image/svg+xml",
+    ".json": "application/json",         ".png": "image/png", ".ico": "image/x-icon",
+}
+_COMPRESSIBLE = (".html", ".js", ".css", ".svg", ".json")
+
+
+class _Asset:
+    __slots__ = ("mtime", "media_type", "etag", "variants")
+
+    def __init__(self, path: Path):
+        data = path.read_bytes()
+        self.mtime      = path.stat().st_mtime_ns
+        self.media_type = _MEDIA_TYPES.get(path.suffix, "application/octet-stream")
+        self.etag       = etag_for(data)
+        self.variants   = {"identity": data}          # Content-Encoding -> body
+        if path.suffix in _COMPRESSIBLE:
+            self.variants["gzip"] = gzip.compress(data, 9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(data, quality=11)
+
+
+def _accepted(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, *params = (p.strip() for p in part.split(";"))
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class StaticAssets:
+    """Files under `directory`, served precompressed with strong ETags."""
+
+    def __init__(self, directory: Path):
+        self.dir = Path(directory)
+        self._assets: dict = {}
+        self._lock = threading.Lock()
+
+    def _load(self, name: str) -> Optional[_Asset]:
+        path = self.dir / name
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        asset = self._assets.get(name)
+        if asset is None or asset.mtime != mtime:
+            with self._lock:
+                asset = self._assets[name] = _Asset(path)
+        return asset
+
+    def exists(self, name: str) -> bool:
+        return self._load(name) is not None
+
+    def response(self, request: Request, name: str, cache_control: str = "no-cache") -> Response:
+        """Serve `name` in the best encoding the client accepts, or 304 when
+        its If-None-Match is current. 404 when the file doesn't exist."""
+        asset = self._load(name)
+        if asset is None:
+            return Response(status_code=404)
+        accepted = _accepted(request)
+        coding = next((c for c in ("br", "gzip") if c in asset.variants and c in accepted), "identity")
+        # A strong ETag names one exact byte sequence, so each encoding gets its own.
+        etag = asset.etag if coding == "identity" else f'{asset.etag[:-1]}-{coding}"'
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=asset.variants[coding], media_type=asset.media_type, headers=headers)
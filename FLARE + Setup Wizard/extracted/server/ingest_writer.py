@@ -0,0 +1,542 @@
+"""
+FLARE - Alert Ingest Writer
+──────────────────────────────────
+Single-writer stage between the /api/alerts/ingest handler and SQLite.
+
+The request handler only parses frames and hands the resulting rows to
+IngestWriter.submit(). One background thread drains the bounded queue and
+writes everything it finds in ONE transaction (group commit) using
+executemany for the inserts and the dedup merges. A burst from one agent
+therefore never blocks the event loop for every other agent, and N
+concurrent requests cost one fsync instead of N. The thread writes through
+the pool's single writer connection (db_pool.ConnectionPool.writer).
+
+Burst dedup is resolved against DedupIndex, an in-memory map of the latest
+row per (client_id, attack_type, track) rebuilt from the last DEDUP_WINDOW
+seconds on startup, so merges never read the alerts table. The same
+transaction records the per-minute rollup deltas (rollups.py) for every row
+inserted or moved to a new minute by a merge, and keeps the alerts_fts
+search index (alert_search.py) in step with the rows. raw_log and evidence are
+not stored in the alerts row; they go compressed into alert_blobs
+(blob_store.py).
+
+Rows are written to the time partition (partitions.py) of their received_at
+at insert time, with ids the writer allocates per partition; merges update
+the row in whichever partition its id names.
+
+After each commit the new and merged rows are published as one `alerts`
+event to the live dashboards (event_hub.py), when any are listening, and
+the "alerts" data version (http_cache.py) is bumped.
+
+With several server processes (cluster.py, shared=True) every process runs
+its own writer, taking turns on the database through the pool's process
+lock. A flush that finds flare.db or a partition in the dedup window changed
+by another process since its own last commit (PRAGMA data_version of each)
+forgets its allocated ids, picks up a newly trained blob dictionary, and
+re-reads from the alerts table, by index, the latest row of each dedup key
+in its batch before trusting the index.
+
+Durability modes (FLARE_INGEST_DURABILITY):
+  enqueue  — handler acknowledges as soon as the rows are queued (default)
+  commit   — handler awaits the group commit that contains its rows
+
+A full queue is reported back to the handler (queue.Full) so it can answer
+503 and let the agent's retry buffer absorb the burst.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, ContextManager, Optional
+
+import alert_search
+from blob_store import BlobCodec
+from metrics import Histogram
+from partitions import PartitionStore, window_epoch
+from rollups import DIMS, RollupDelta
+
+log = logging.getLogger("flare_server.ingest")
+
+# Server-side burst deduplication window (seconds).
+# If the same client already has an alert with the same attack_type received
+# within this window, merge the new one in (update event_count and confidence)
+# rather than inserting a duplicate row. This handles the case where the agent
+# still sends per-flow alerts during an attack burst — the server collapses
+# them into one running tally.
+DEDUP_WINDOW = 60
+
+# Column order of the rows produced by alert_row().
+ALERT_COLUMNS = (
+    "alert_id", "received_at", "client_id", "client_ip", "timestamp",
+    "track", "attack_type", "severity", "confidence",
+    "window_start", "window_end", "event_count", "evidence",
+    "rule_id", "mitre_id", "mitre_tactic", "suggestion", "risk_note", "raw_log",
+    "window_start_epoch", "window_end_epoch",
+)
+_C = {name: i for i, name in enumerate(ALERT_COLUMNS)}
+
+# Rule metadata that a merge backfills when the stored row has it empty
+# (happens when earlier alerts arrived before the agent fix).
+_BACKFILL = ("rule_id", "mitre_id", "mitre_tactic", "suggestion", "risk_note")
+
+# Columns stored in the partition's `alerts` table (payloads -> alert_blobs).
+_STORED = tuple(c for c in ALERT_COLUMNS if c not in ("evidence", "raw_log"))
+
+# {s} is the partition schema (PartitionStore.attach).
+_INSERT_SQL = (
+    f"INSERT OR IGNORE INTO {{s}}.alerts (id, {', '.join(_STORED)}) "
+    f"VALUES (?, {', '.join('?' * len(_STORED))})"
+)
+# Merges are resolved against DedupIndex, which knows the stored values, so
+# the rule-metadata backfill is decided in Python and written verbatim.
+_MERGE_SQL = """UPDATE {s}.alerts SET
+        event_count  = ?,
+        confidence   = ?,
+        received_at  = ?,
+        rule_id      = ?,
+        mitre_id     = ?,
+        mitre_tactic = ?,
+        suggestion   = ?,
+        risk_note    = ?
+    WHERE id = ?"""
+_REBUILD_SQL = f"""SELECT id, client_id, attack_type, track, event_count, confidence,
+           received_at, {', '.join(DIMS)}, {', '.join(_BACKFILL)}
+    FROM {{s}}.alerts
+    WHERE received_at >= ?"""
+# Served by partitions' idx_alerts_dedup.
+_LATEST_SQL = _REBUILD_SQL + """
+      AND client_id = ? AND attack_type = ? AND track = ?
+    ORDER BY received_at DESC LIMIT 1"""
+
+
+def alert_row(ev, received_at: float) -> tuple:
+    """Flatten one AlertEvent proto into an `alerts` row (ALERT_COLUMNS order)."""
+    return (
+        ev.alert_id or str(uuid.uuid4()), received_at,
+        ev.client_id, ev.client_ip, ev.timestamp,
+        ev.track, ev.attack_type, ev.severity, ev.confidence,
+        ev.window_start, ev.window_end, max(ev.event_count, 1),
+        ev.evidence, ev.rule_id, ev.mitre_id, ev.mitre_tactic,
+        ev.suggestion, ev.risk_note, ev.raw_log,
+        window_epoch(ev.window_start), window_epoch(ev.window_end),
+    )
+
+
+class _Item:
+    __slots__ = ("rows", "future")
+
+    def __init__(self, rows: list, future: Optional[Future]):
+        self.rows   = rows
+        self.future = future
+
+
+class _Entry:
+    """Latest alert row for one dedup key. row_id is None until the INSERT
+    that created it has been committed; `row` is that pending insert.
+    stored_at is the received_at currently committed for the row."""
+    __slots__ = ("row_id", "row", "event_count", "confidence", "last_seen",
+                 "stored_at", "dims", "meta", "fts_stale")
+
+    def __init__(self, row_id, row, event_count, confidence, last_seen, dims, meta):
+        self.row_id      = row_id
+        self.row         = row
+        self.event_count = event_count
+        self.confidence  = confidence
+        self.last_seen   = last_seen
+        self.stored_at   = last_seen if row_id is not None else None
+        self.dims        = dims      # rollup dimension values (rollups.DIMS order)
+        self.meta        = meta      # current values of the _BACKFILL columns
+        self.fts_stale   = False     # merge backfilled an indexed column
+
+
+class DedupIndex:
+    """
+    In-memory replacement for the per-event "most recent alert for this
+    (client_id, attack_type, track)" query. Only the writer thread touches it,
+    so there is no locking. Entries older than the window are treated as
+    missing and swept out periodically.
+
+    After stale() (another process wrote) no key is trusted until refresh()
+    has re-read it.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW):
+        self.window = window
+        self._entries: dict = {}
+        self._swept = 0.0
+        self._verified: Optional[set] = None    # None: every key is current
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.last_seen < now - self.window:
+            del self._entries[key]
+            return None
+        return entry
+
+    def add(self, key, row: list) -> _Entry:
+        entry = _Entry(None, row, row[_C["event_count"]], row[_C["confidence"]],
+                       row[_C["received_at"]], tuple(row[_C[d]] for d in DIMS),
+                       [row[_C[c]] for c in _BACKFILL])
+        self._entries[key] = entry
+        return entry
+
+    def merge(self, entry: _Entry, row: tuple):
+        entry.event_count += row[_C["event_count"]]
+        entry.confidence   = max(entry.confidence, row[_C["confidence"]])
+        entry.last_seen    = row[_C["received_at"]]
+        for i, col in enumerate(_BACKFILL):
+            if not entry.meta[i] and row[_C[col]]:
+                entry.meta[i] = row[_C[col]]
+                if col in alert_search.COLUMNS:
+                    entry.fts_stale = True
+
+    def discard(self, key, entry: _Entry):
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+
+    def sweep(self, now: float):
+        """Drop expired entries (at most once per window)."""
+        if now - self._swept < self.window:
+            return
+        cutoff = now - self.window
+        self._entries = {k: e for k, e in self._entries.items() if e.last_seen >= cutoff}
+        self._swept = now
+
+    @staticmethod
+    def _stored(r) -> _Entry:
+        nd = 7 + len(DIMS)
+        return _Entry(r[0], None, r[4] or 0, r[5] or 0.0, r[6],
+                      tuple(r[7:nd]), [v or "" for v in r[nd:]])
+
+    def rebuild(self, conn: sqlite3.Connection, parts: PartitionStore, now: float):
+        """Reload the index from the rows received within the last window."""
+        self._entries = {}
+        rows = parts.select(conn, _REBUILD_SQL, (now - self.window,), since=now - self.window)
+        rows.sort(key=lambda r: r[6])
+        for r in rows:
+            self._entries[(r[1], r[2], r[3])] = self._stored(r)
+        self._swept = now
+        self._verified = None
+
+    def stale(self):
+        self._verified = set()
+
+    def refresh(self, conn: sqlite3.Connection, schemas: list, keys: set, since: float):
+        """Re-read from partitions `schemas` every key in `keys` not read since
+        stale()."""
+        if self._verified is None:
+            return
+        todo = keys - self._verified
+        for key in todo:
+            rows = [r for r in (conn.execute(_LATEST_SQL.format(s=s), (since, *key)).fetchone()
+                                for s in schemas) if r is not None]
+            if rows:
+                self._entries[key] = self._stored(max(rows, key=lambda r: r[6]))
+            else:
+                self._entries.pop(key, None)
+        self._verified |= todo
+
+
+class IngestWriter(threading.Thread):
+    """
+    The only code path that writes alert rows. Rows arrive via submit(); the
+    thread groups everything queued into one transaction per flush.
+
+    writer      — context-manager factory yielding the writer connection
+                  (ConnectionPool.writer); held only for the length of a flush
+    codec       — BlobCodec used to compress raw_log / evidence
+    parts       — PartitionStore the rows are written to
+    max_queue   — bound on queued submissions (one per ingest request)
+    batch_max   — soft cap on alerts written per transaction
+    events      — optional EventHub; told about every committed flush
+    versions    — optional http_cache.DataVersions; "alerts" bumped per commit
+    shared      — other processes write alerts to the same database too
+    """
+
+    def __init__(self, writer: Callable[[], ContextManager[sqlite3.Connection]],
+                 codec: BlobCodec, parts: PartitionStore,
+                 max_queue: int = 5000, batch_max: int = 2000, events=None,
+                 versions=None, shared: bool = False):
+        super().__init__(name="IngestWriter", daemon=True)
+        self._writer    = writer
+        self._codec     = codec
+        self._parts     = parts
+        self._events    = events
+        self._versions  = versions
+        self._q: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._batch_max = batch_max
+        self._stop_evt  = threading.Event()
+        self._dedup     = DedupIndex()
+        self._next_id: dict = {}     # partition key -> next id to allocate
+        self._shared    = shared
+        self._data_version = None    # PRAGMA data_version after our last commit
+        self.inserted   = 0
+        self.merged     = 0
+        self.commits    = 0
+        self.commit_seconds = Histogram()    # the group commit itself
+        self.flush_seconds  = Histogram()    # a whole flush, dedup to commit
+
+    # ── Producer side (called from request handlers) ─────────────────────────
+
+    def submit(self, rows: list, wait: bool = False) -> Optional[Future]:
+        """Queue rows for the next group commit. Never blocks.
+
+        Returns a Future resolved with {"inserted": n, "merged": m} after the
+        commit when wait=True, else None. Raises queue.Full when the writer is
+        saturated.
+        """
+        fut = Future() if wait else None
+        self._q.put_nowait(_Item(rows, fut))
+        return fut
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def stop(self, timeout: float = 10.0):
+        """Drain whatever is queued, commit it, and stop the thread."""
+        self._stop_evt.set()
+        self.join(timeout=timeout)
+
+    # ── Writer thread ─────────────────────────────────────────────────────────
+
+    def run(self):
+        with self._writer() as conn:
+            self._resync(conn)
+        log.info("Ingest writer: started (queue=%d batch=%d, %d dedup keys)",
+                 self._q.maxsize, self._batch_max, len(self._dedup))
+        try:
+            while True:
+                items = self._take()
+                if items:
+                    self._write(items)
+                elif self._stop_evt.is_set():
+                    break
+        finally:
+            log.info("Ingest writer: stopped (%d inserted, %d merged, %d commits)",
+                     self.inserted, self.merged, self.commits)
+
+    def _take(self) -> list:
+        """Block briefly for the first submission, then grab everything else
+        already queued (up to batch_max alerts) for the same transaction."""
+        try:
+            first = self._q.get(timeout=0.25)
+        except queue.Empty:
+            return []
+        items, n = [first], len(first.rows)
+        while n < self._batch_max:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            n += len(item.rows)
+        return items
+
+    def _resync(self, conn: sqlite3.Connection):
+        """Reload the dedup index and blob dictionaries from the DB and forget
+        the allocated ids (re-read from each partition on next use)."""
+        self._dedup.rebuild(conn, self._parts, time.time())
+        self._codec.load(conn)
+        self._next_id = {}
+        self._data_version = None
+
+    def _sync(self, conn: sqlite3.Connection, items: list):
+        """shared: catch up with what other processes committed since our
+        last flush, for the dedup keys of `items`. Attaches the partitions
+        of the dedup window, so it runs before the first write."""
+        rows  = [row for item in items for row in item.rows]
+        since = min(r[_C["received_at"]] for r in rows) - self._dedup.window
+        parts = self._parts
+        schemas = [s for s in (parts.attach(conn, k) for k, _, _ in parts.catalog(conn, since=since))
+                   if s is not None]
+        version = tuple(conn.execute(f"PRAGMA {s}.data_version").fetchone()[0]
+                        for s in ["main"] + schemas)
+        if version != self._data_version:
+            self._data_version = version
+            self._next_id = {}
+            self._codec.refresh(conn)
+            self._dedup.stale()
+        keys = {(r[_C["client_id"]], r[_C["attack_type"]], r[_C["track"]]) for r in rows}
+        self._dedup.refresh(conn, schemas, keys, since)
+
+    def _allocate(self, conn: sqlite3.Connection, key: int, schema: str, n: int) -> int:
+        """Reserve n ids in partition `key`; returns the first."""
+        first = self._next_id.get(key)
+        if first is None:
+            first = conn.execute(f"SELECT COALESCE(MAX(id) + 1, ?) FROM {schema}.alerts",
+                                 (PartitionStore.first_id(key),)).fetchone()[0]
+        self._next_id[key] = first + n
+        return first
+
+    def _write(self, items: list):
+        for attempt in (1, 2):
+            try:
+                t0 = time.perf_counter()
+                with self._writer() as conn:
+                    counts = self._flush(conn, items)
+                self.flush_seconds.observe(time.perf_counter() - t0)
+                break
+            except sqlite3.Error as exc:
+                # The writer context has rolled back; _flush mutated the dedup
+                # index before the failed commit, so reload it.
+                try:
+                    with self._writer() as conn:
+                        self._resync(conn)
+                except sqlite3.Error:
+                    pass
+                if attempt == 2:
+                    log.error("Ingest writer: dropping %d alerts after failed commit: %s",
+                              sum(len(i.rows) for i in items), exc)
+                    for item in items:
+                        if item.future is not None:
+                            item.future.set_exception(exc)
+                    return
+                log.warning("Ingest writer: commit failed (%s) — retrying once", exc)
+                time.sleep(0.5)
+
+        for item, result in zip(items, counts):
+            if item.future is not None:
+                item.future.set_result(result)
+
+    def _flush(self, conn: sqlite3.Connection, items: list) -> list:
+        """Resolve dedup merges for every queued row against the in-memory
+        index, then write the whole set with one executemany per statement and
+        a single commit."""
+        if self._shared:
+            self._sync(conn, items)
+        dedup   = self._dedup
+        inserts = []    # (key, entry) for new rows, in arrival order
+        touched = {}    # row_id -> entry for committed rows that were merged into
+        counts  = []
+
+        for item in items:
+            n_new = n_merged = 0
+            for row in item.rows:
+                key = (row[_C["client_id"]], row[_C["attack_type"]], row[_C["track"]])
+                entry = dedup.get(key, row[_C["received_at"]])
+                if entry is not None:
+                    dedup.merge(entry, row)
+                    if entry.row_id is not None:
+                        touched[entry.row_id] = entry
+                    n_merged += 1
+                else:
+                    inserts.append((key, dedup.add(key, list(row))))
+                    n_new += 1
+            counts.append({"inserted": n_new, "merged": n_merged})
+
+        # ATTACH is refused inside a transaction, so every partition this
+        # flush writes to is attached before the first statement.
+        parts   = self._parts
+        by_part = defaultdict(list)     # partition key -> [(dedup key, entry)]
+        for key, e in inserts:
+            by_part[parts.key_for(e.last_seen)].append((key, e))
+        schemas = {pk: parts.attach(conn, pk, create=True) for pk in by_part}
+        merges  = defaultdict(list)     # schema -> [(row_id, entry)]
+        for row_id, e in touched.items():
+            schema = parts.schema_of(conn, row_id)
+            if schema is not None:      # else expired by retention meanwhile
+                merges[schema].append((row_id, e))
+
+        cur = conn.cursor()
+        writes = {}                     # partition key -> [min_received, max_received, rows]
+        for schema, group in merges.items():
+            cur.executemany(_MERGE_SQL.format(s=schema), [
+                (e.event_count, e.confidence, e.last_seen, *e.meta, row_id)
+                for row_id, e in group
+            ])
+            seen = [e.last_seen for _, e in group]
+            writes[PartitionStore.key_of(group[0][0])] = [min(seen), max(seen), 0]
+
+        delta = RollupDelta()
+        inserted = 0
+        live = self._events is not None and self._events.active
+        new_rows = []                   # published after commit (live dashboards)
+        for pk, group in by_part.items():
+            schema = schemas[pk]
+            first = self._allocate(conn, pk, schema, len(group))
+            rows = []
+            for i, (_, e) in enumerate(group):
+                r = e.row
+                r[_C["event_count"]] = e.event_count
+                r[_C["confidence"]]  = e.confidence
+                r[_C["received_at"]] = e.last_seen
+                for col, val in zip(_BACKFILL, e.meta):
+                    r[_C[col]] = val
+                rows.append((first + i, *(r[_C[c]] for c in _STORED)))
+            cur.executemany(_INSERT_SQL.format(s=schema), rows)
+            inserted += max(cur.rowcount, 0)
+
+            # A row whose alert_id already exists is ignored by the INSERT and
+            # doesn't show up among the ids allocated to this batch.
+            ids = dict(conn.execute(f"SELECT alert_id, id FROM {schema}.alerts WHERE id >= ?",
+                                    (first,)))
+            fts_rows, blobs, stamps = [], [], []
+            for key, e in group:
+                r = e.row
+                e.row_id = ids.get(r[_C["alert_id"]])
+                e.row = None
+                if e.row_id is None:
+                    dedup.discard(key, e)
+                    continue
+                delta.add(e.last_seen, e.dims)
+                fts_rows.append((e.row_id, *(r[_C[c]] for c in alert_search.COLUMNS)))
+                blobs.append((e.row_id, r[_C["evidence"]], r[_C["raw_log"]]))
+                stamps.append(e.last_seen)
+                if live:
+                    new_rows.append(dict(zip(_STORED, (r[_C[c]] for c in _STORED)),
+                                         id=e.row_id, status="open"))
+            alert_search.index_rows(conn, schema, fts_rows)
+            self._codec.write(conn, schema, blobs)
+            if stamps:
+                lo, hi, _ = writes.get(pk, (min(stamps), max(stamps), 0))
+                writes[pk] = [min(lo, *stamps), max(hi, *stamps), len(stamps)]
+
+        for e in touched.values():
+            delta.move(e.stored_at, e.last_seen, e.dims)
+        if delta:
+            delta.apply(conn)
+        for schema, group in merges.items():
+            alert_search.update_meta(conn, schema, [
+                (e.meta[_BACKFILL.index("rule_id")], e.meta[_BACKFILL.index("mitre_id")], row_id)
+                for row_id, e in group if e.fts_stale
+            ])
+        parts.note(conn, writes)
+        if schemas:
+            self._codec.maybe_train(conn, schemas[max(schemas)])
+        t0 = time.perf_counter()
+        conn.commit()
+        self.commit_seconds.observe(time.perf_counter() - t0)
+
+        for e in [e for _, e in inserts] + list(touched.values()):
+            e.stored_at = e.last_seen
+            e.fts_stale = False
+        dedup.sweep(time.time())
+
+        if self._versions is not None:
+            self._versions.bump("alerts")
+        if live:
+            self._publish(new_rows, touched)
+
+        self.inserted += inserted
+        self.merged   += sum(c["merged"] for c in counts)
+        self.commits  += 1
+        return counts
+
+    def _publish(self, new_rows: list, touched: dict):
+        merged = []
+        for row_id, e in touched.items():
+            m = {"id": row_id, "event_count": e.event_count,
+                 "confidence": e.confidence, "received_at": e.last_seen}
+            m.update(zip(_BACKFILL, e.meta))
+            merged.append(m)
+        if new_rows or merged:
+            new_rows.sort(key=lambda r: (r["received_at"], r["id"]))
+            self._events.publish("alerts", {"new": new_rows, "merged": merged})
@@ -0,0 +1,303 @@
+"""
+FLARE - Server Metrics
+──────────────────────────────────
+Counters, gauges and latency histograms for GET /metrics, in the Prometheus
+text exposition format (scrape it with a local Prometheus, or just curl it).
+No client library: the few types the server needs are a handful of lines.
+
+  Counter / Gauge / Histogram   one series each; updates are a lock and an
+                                add, cheap enough for the ingest path
+  Family                        one series per combination of label values,
+                                created on first use
+  Registry                      names, help text and sources of everything
+                                exported. A source is a metric, a Family, or
+                                a callable returning a number, a metric or
+                                {label values: number | metric}, evaluated
+                                at scrape time — so counts the components
+                                already keep (IngestWriter.inserted,
+                                ConnectionPool.stats(), …) cost nothing until
+                                someone scrapes.
+  RouteMetrics                  ASGI middleware: requests by status and
+                                latency per route template
+
+With several worker processes (cluster.py) each one sends its collect()
+snapshot to the others over the bus, and Registry.render() adds them with a
+`worker` label, so any worker answers a scrape for the whole server.
+
+Usage
+-----
+  # Cost of an observe() / inc() next to an uninstrumented loop
+  python metrics.py --bench [-n 1000000]
+"""
+
+import argparse
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+# Seconds; covers a sub-millisecond ingest ack up to a slow FedAvg round.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+KINDS = ("counter", "gauge", "histogram")
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1):
+        with self._lock:
+            self.value += n
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self, value: float = 0):
+        self.value = value
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)    # last one is +Inf
+        self.sum     = 0.0
+        self._lock   = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self) -> list:
+        """[(suffix, {"le": …} or {}, value)] in exposition order."""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        out, running = [], 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            running += n
+            out.append(("_bucket", {"le": _number(bound)}, running))
+        out.append(("_sum", {}, total))
+        out.append(("_count", {}, running))
+        return out
+
+
+class Family:
+    """Series of `factory` keyed by the values of `labels`."""
+
+    def __init__(self, factory: Callable, *labels: str):
+        self.factory  = factory
+        self.label_names = labels
+        self._series: dict = {}
+        self._lock    = threading.Lock()
+
+    def labels(self, *values: str):
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self.factory())
+        return series
+
+    def items(self) -> list:
+        return list(self._series.items())
+
+
+class Registry:
+    """Everything /metrics exports, in registration order."""
+
+    def __init__(self):
+        self._metrics: list = []     # (name, kind, help, label names, source)
+        self.worker: Optional[str] = None   # set with several worker processes
+
+    def add(self, name: str, kind: str, help: str, source, labels: tuple = ()):
+        """Export `source` as `name`; a Family brings its own label names."""
+        if kind not in KINDS:
+            raise ValueError(f"metric kind must be one of {KINDS}, not {kind!r}")
+        if isinstance(source, Family) and not labels:
+            labels = source.label_names
+        self._metrics.append((name, kind, help, tuple(labels), source))
+
+    def collect(self) -> list:
+        """[[name, kind, help, [[suffix, {label: value}, number], …]], …] —
+        plain lists and dicts, so it can be sent to the other workers. A
+        source that raises is left out of this scrape."""
+        out = []
+        for name, kind, help, labels, source in self._metrics:
+            try:
+                value = source.items() if isinstance(source, Family) else \
+                    source() if callable(source) else source
+                if isinstance(value, dict):
+                    value = value.items()
+                if isinstance(value, (int, float, Counter, Gauge, Histogram)):
+                    value = [((), value)]
+                samples = []
+                for key, v in value:
+                    tags = dict(zip(labels, key if isinstance(key, tuple) else (key,)))
+                    for suffix, extra, number in _samples(v):
+                        samples.append([suffix, {**tags, **extra}, number])
+            except Exception:
+                continue
+            out.append([name, kind, help, samples])
+        return out
+
+    def render(self, peers: Optional[dict] = None) -> str:
+        """Exposition text of collect(), plus `peers` ({worker: collect() of
+        another process}) when running with several workers."""
+        own = self.collect()
+        if self.worker is None:
+            sources = [(None, own)]
+        else:
+            sources = [(self.worker, own)] + sorted((peers or {}).items())
+        merged: dict = {}
+        for worker, families in sources:
+            for name, kind, help, samples in families:
+                entry = merged.setdefault(name, (kind, help, []))
+                for suffix, tags, number in samples:
+                    if worker is not None:
+                        tags = {"worker": worker, **tags}
+                    entry[2].append((suffix, tags, number))
+        lines = []
+        for name, (kind, help, samples) in merged.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, tags, number in samples:
+                if tags:
+                    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in tags.items())
+                    lines.append(f"{name}{suffix}{{{body}}} {_number(number)}")
+                else:
+                    lines.append(f"{name}{suffix} {_number(number)}")
+        return "\n".join(lines) + "\n"
+
+
+def _samples(value) -> Iterable:
+    if isinstance(value, Histogram):
+        return value.samples()
+    if isinstance(value, (Counter, Gauge)):
+        return [("", {}, value.value)]
+    return [("", {}, value)]
+
+
+def _number(v: float) -> str:
+    if isinstance(v, bool):
+        return str(int(v))
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        if math.isnan(v):
+            return "NaN"
+        if v.is_integer() and abs(v) < 1e15:
+            return str(int(v))
+        return repr(v)
+    return str(v)
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class RouteMetrics:
+    """
+    ASGI middleware counting requests and timing them per route.
+
+    requests — Family(Counter, "method", "route", "status")
+    latency  — Family(Histogram, "method", "route")
+
+    The route label is the path template ("/api/alerts/{alert_id}/status"),
+    read from the endpoint the router matched, so ids in paths don't
+    multiply the series; unmatched paths share route="unmatched". Latency
+    runs until the last byte of the response is sent (for /api/stream,
+    until the dashboard disconnects).
+    """
+
+    def __init__(self, app, requests: Family, latency: Family):
+        self.app      = app
+        self.requests = requests
+        self.latency  = latency
+        self._paths: dict = {}       # endpoint -> route path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = self._route(scope)
+            self.latency.labels(scope["method"], route).observe(time.perf_counter() - t0)
+            self.requests.labels(scope["method"], route, str(status)).inc()
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            routes = getattr(scope.get("app"), "routes", ())
+            self._paths = {getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")}
+            path = self._paths.setdefault(endpoint, getattr(endpoint, "__name__", "unmatched"))
+        return path
+
+
+# ── Benchmark ─────────────────────────────────────────────────────────────────
+
+def _bench(n: int):
+    hist, counter = Histogram(), Counter()
+    family = Family(Histogram, "method", "route")
+    values = [(i % 997) / 20000 for i in range(n)]
+
+    t0 = time.perf_counter()
+    for v in values:
+        pass
+    base = time.perf_counter() - t0
+
+    for label, fn in (("Counter.inc()", lambda v: counter.inc()),
+                      ("Histogram.observe()", hist.observe),
+                      ("Family.labels().observe()",
+                       lambda v: family.labels("POST", "/api/alerts/ingest").observe(v))):
+        t0 = time.perf_counter()
+        for v in values:
+            fn(v)
+        per = (time.perf_counter() - t0 - base) / n
+        print(f"    {label:<28}{per * 1e9:8.0f} ns")
+
+    reg = Registry()
+    reg.add("flare_bench_seconds", "histogram", "bench", family)
+    t0 = time.perf_counter()
+    text = reg.render()
+    print(f"    render()                    {(time.perf_counter() - t0) * 1000:8.3f} ms "
+          f"({len(text)} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE server metrics")
+    parser.add_argument("--bench", action="store_true", help="Time metric updates")
+    parser.add_argument("-n", type=int, default=1_000_000, help="Updates to time")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.n)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
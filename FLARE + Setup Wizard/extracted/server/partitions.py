@@ -0,0 +1,542 @@
+"""
+FLARE - Time-Partitioned Alert Storage
+──────────────────────────────────
+Alert rows live in one SQLite file per day (or per week) next to flare.db
+instead of one ever-growing `alerts` table:
+
+  <data>/alerts/alerts-20261018.db   alerts, alerts_fts, alert_blobs
+  flare.db: alert_partitions         catalog (key, start, min/max received_at, rows)
+
+A partition is ATTACHed to a pooled connection, under the schema name
+p20261018, the first time a query on that connection needs it. Each
+connection keeps at most `max_attached` partitions attached (SQLite allows
+10) and detaches the least recently used one beyond that.
+
+Ids are global: id = (partition key << 32) | sequence, assigned by the ingest
+writer. Any id therefore names its partition, and alerts_fts rowids and
+alert_blobs ids in the same file share it. Rows stay in the partition they
+were inserted into; a dedup merge can push received_at past the end of the
+span, so queries route on the catalog's [min_received, max_received] and not
+on the nominal span.
+
+Retention (FLARE_RETENTION_DAYS) expires a partition once its newest row is
+older than the cutoff. It DETACHes the partition from every connection, drops
+its catalog row and rollup history, and deletes the file. No DELETE runs
+against alert rows, so the cost does not grow with the row count. With
+several server processes the others are told to release() the expired keys;
+a file Windows refuses to delete while another process still has it attached
+is retried at the next expiry.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import alert_search
+import blob_store
+import rollups
+
+log = logging.getLogger("flare_server.partitions")
+
+SPANS        = {"day": 86400, "week": 7 * 86400}
+ID_BITS      = 32
+MAX_ATTACHED = 8               # per connection; SQLite's default limit is 10
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alert_partitions (
+        key           INTEGER PRIMARY KEY,
+        span          INTEGER NOT NULL,
+        start         REAL    NOT NULL,
+        file          TEXT    NOT NULL,
+        min_received  REAL,
+        max_received  REAL,
+        rows          INTEGER NOT NULL DEFAULT 0,
+        created_at    REAL
+    );
+"""
+
+# /api/fl/labels: feedback windows of one client over the last N days,
+# answered from the first index alone, and the rows whose status changed
+# since an agent's cursor (few rows ever have status_at set).
+_LABEL_INDEXES = (
+    "idx_alerts_labels ON alerts(client_id, status, received_at, "
+    "window_start_epoch, window_end_epoch)",
+    "idx_alerts_status_at ON alerts(client_id, status_at) WHERE status_at IS NOT NULL",
+)
+# Columns that partitions written by older servers lack (PartitionStore.upgrade).
+_LABEL_COLUMNS = ("window_start_epoch", "window_end_epoch", "status_at", "labelled_at")
+LABEL_STATUSES = ("false_positive", "resolved")
+# Ingest dedup looks up the newest row of one (client_id, attack_type, track)
+# when another process may have written it (ingest_writer.DedupIndex.refresh);
+# the client_id prefix also serves the per-client queries.
+_DEDUP_INDEX = "idx_alerts_dedup ON alerts(client_id, attack_type, track, received_at)"
+
+# Schema of every partition file. evidence / raw_log are not columns here;
+# they live compressed in the partition's alert_blobs.
+PARTITION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id             INTEGER PRIMARY KEY,
+        alert_id       TEXT    UNIQUE,
+        received_at    REAL,
+        client_id      TEXT,
+        client_ip      TEXT,
+        timestamp      TEXT,
+        track          INTEGER,
+        attack_type    TEXT,
+        severity       INTEGER,
+        confidence     REAL,
+        window_start   TEXT,
+        window_end     TEXT,
+        event_count    INTEGER,
+        rule_id        TEXT,
+        mitre_id       TEXT,
+        mitre_tactic   TEXT,
+        suggestion     TEXT,
+        risk_note      TEXT,
+        status         TEXT DEFAULT 'open',
+        window_start_epoch REAL,          -- window_start / window_end in unix
+        window_end_epoch   REAL,          -- seconds, parsed once at ingest
+        status_at      REAL,              -- last status change, NULL if never
+        labelled_at    REAL               -- first false_positive / resolved
+    );
+    CREATE INDEX IF NOT EXISTS {dedup};
+    CREATE INDEX IF NOT EXISTS idx_alerts_rule ON alerts(rule_id);
+    -- (received_at, id) ordering backs keyset pagination in /api/alerts
+    CREATE INDEX IF NOT EXISTS idx_alerts_track_recv ON alerts(track, received_at, id);
+    CREATE INDEX IF NOT EXISTS idx_alerts_recv_id ON alerts(received_at, id);
+""".replace("{dedup}", _DEDUP_INDEX) \
+  + "".join(f"    CREATE INDEX IF NOT EXISTS {i};\n" for i in _LABEL_INDEXES) \
+  + alert_search.SCHEMA + blob_store.PARTITION_SCHEMA
+
+_NOTE_SQL = """INSERT INTO main.alert_partitions
+        (key, span, start, file, min_received, max_received, rows, created_at)
+    VALUES (?,?,?,?,?,?,?,?)
+    ON CONFLICT(key) DO UPDATE SET
+        min_received = MIN(COALESCE(min_received, excluded.min_received), excluded.min_received),
+        max_received = MAX(COALESCE(max_received, excluded.max_received), excluded.max_received),
+        rows         = rows + excluded.rows"""
+
+# Columns copied from a pre-partitioning flare.db `alerts` table.
+_LEGACY_COLUMNS = (
+    "alert_id", "received_at", "client_id", "client_ip", "timestamp", "track",
+    "attack_type", "severity", "confidence", "window_start", "window_end",
+    "event_count", "rule_id", "mitre_id", "mitre_tactic", "suggestion", "risk_note",
+)
+
+
+def window_epoch(value) -> Optional[float]:
+    """window_start / window_end as agents send them -> unix seconds. ISO 8601
+    without an offset ("2026-06-15T12:34:56.789") is read as server local
+    time; a bare number is taken as unix seconds. None when empty or
+    unparseable."""
+    s = str(value or "").strip()
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(s).timestamp()
+    except ValueError:
+        pass
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _fill_label_columns(conn, schema: str) -> int:
+    """Compute the window epochs of rows stored without them, and give rows
+    that already carry a feedback status labelled_at = 0 (labelled before
+    any agent cursor). Returns the rows given epochs."""
+    rows = conn.execute(f"SELECT id, window_start, window_end FROM {schema}.alerts "
+                        "WHERE window_start_epoch IS NULL AND window_start IS NOT NULL "
+                        "AND window_start != ''").fetchall()
+    conn.executemany(f"UPDATE {schema}.alerts SET window_start_epoch = ?, window_end_epoch = ? "
+                     "WHERE id = ?",
+                     [(window_epoch(r[1]), window_epoch(r[2]), r[0]) for r in rows])
+    conn.execute(f"UPDATE {schema}.alerts SET labelled_at = 0 WHERE labelled_at IS NULL "
+                 f"AND status IN ({', '.join('?' * len(LABEL_STATUSES))})", LABEL_STATUSES)
+    return len(rows)
+
+
+def _where(fragments: list, schema: str) -> str:
+    return (" WHERE " + " AND ".join(fragments)).format(s=schema) if fragments else ""
+
+
+def _order(row: dict) -> tuple:
+    return row["received_at"] or 0.0, row["id"]
+
+
+class PartitionStore:
+    """
+    directory     — where the partition files live
+    span          — "day" or "week"; fixed by the first partition written
+    max_attached  — partitions kept attached per connection
+
+    Methods that take a connection may ATTACH / DETACH on it, which SQLite
+    refuses mid-transaction: call them before the first write of a
+    transaction.
+    """
+
+    def __init__(self, directory, span: str = "day", max_attached: int = MAX_ATTACHED):
+        if span not in SPANS:
+            raise ValueError(f"span must be one of {tuple(SPANS)}")
+        self.dir          = Path(directory)
+        self.span         = SPANS[span]
+        self.max_attached = max(1, min(int(max_attached), 9))
+        self._attached: dict = {}        # id(conn) -> OrderedDict(key -> schema)
+        self._lock = threading.Lock()
+        self._orphans: set = set()       # expired files that could not be deleted yet
+
+    def open(self, conn):
+        """Create the catalog and adopt the span of partitions already stored."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        conn.executescript(SCHEMA)
+        row = conn.execute("SELECT span FROM main.alert_partitions LIMIT 1").fetchone()
+        if row is not None and row[0] != self.span:
+            log.warning("Partitions: keeping the stored span of %ds (configured %ds)",
+                        row[0], self.span)
+            self.span = row[0]
+
+    # ── Keys, names, ids ─────────────────────────────────────────────────────
+
+    def key_for(self, ts: float) -> int:
+        return int(ts // self.span)
+
+    @staticmethod
+    def key_of(row_id: int) -> int:
+        return row_id >> ID_BITS
+
+    @staticmethod
+    def first_id(key: int) -> int:
+        return (key << ID_BITS) + 1
+
+    def _stamp(self, key: int) -> str:
+        return datetime.fromtimestamp(key * self.span, timezone.utc).strftime("%Y%m%d")
+
+    def path(self, key: int) -> Path:
+        return self.dir / f"alerts-{self._stamp(key)}.db"
+
+    # ── Attachment ───────────────────────────────────────────────────────────
+
+    def _create(self, path: Path):
+        conn = sqlite3.connect(str(path))
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(PARTITION_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def attach(self, conn, key: int, create: bool = False) -> Optional[str]:
+        """Schema name of partition `key` on `conn`, attaching it if needed.
+        None when the partition has no file and create is False."""
+        with self._lock:
+            attached = self._attached.setdefault(id(conn), OrderedDict())
+        schema = attached.get(key)
+        if schema is not None:
+            attached.move_to_end(key)
+            return schema
+        path = self.path(key)
+        if not path.exists():
+            if not create:
+                return None
+            self._create(path)
+        while len(attached) >= self.max_attached:
+            _, old = attached.popitem(last=False)
+            conn.execute(f"DETACH DATABASE {old}")
+        schema = "p" + self._stamp(key)
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (str(path),))
+        for pragma in ("synchronous", "cache_size"):
+            value = conn.execute(f"PRAGMA main.{pragma}").fetchone()[0]
+            conn.execute(f"PRAGMA {schema}.{pragma}={value}")
+        attached[key] = schema
+        return schema
+
+    def schema_of(self, conn, row_id: int) -> Optional[str]:
+        return self.attach(conn, self.key_of(row_id))
+
+    def detach(self, conn, keys=None):
+        """Detach `keys` (default: every partition) from `conn`."""
+        with self._lock:
+            attached = self._attached.get(id(conn))
+            if attached is None:
+                return
+            if keys is None:
+                del self._attached[id(conn)]
+        for key in [k for k in attached if keys is None or k in keys]:
+            conn.execute(f"DETACH DATABASE {attached[key]}")
+            if keys is not None:
+                del attached[key]
+
+    # ── Catalog ──────────────────────────────────────────────────────────────
+
+    def catalog(self, conn, since: Optional[float] = None,
+                before: Optional[float] = None) -> list:
+        """[(key, min_received, max_received)], newest first, of partitions
+        that can hold rows received at or after `since` / at or before `before`."""
+        sql, args = "SELECT key, min_received, max_received FROM main.alert_partitions WHERE rows > 0", []
+        if since is not None:
+            sql += " AND max_received >= ?"; args.append(since)
+        if before is not None:
+            sql += " AND min_received <= ?"; args.append(before)
+        sql += " ORDER BY max_received DESC, key DESC"
+        return [tuple(r) for r in conn.execute(sql, args)]
+
+    def note(self, conn, writes: dict):
+        """Record rows written: {key: [min_received, max_received, new_rows]}."""
+        now = time.time()
+        conn.executemany(_NOTE_SQL, [
+            (key, self.span, key * self.span, self.path(key).name, lo, hi, n, now)
+            for key, (lo, hi, n) in writes.items()
+        ])
+
+    # ── Reads across partitions ──────────────────────────────────────────────
+
+    def newest(self, conn, cols: str, where: list, params: list, limit: int,
+               after: Optional[tuple] = None) -> list:
+        """Up to `limit` rows ordered by (received_at, id) DESC over every
+        partition, optionally strictly below the keyset position `after`.
+        `cols` must include received_at and id; `where` fragments may name
+        the partition schema as {s}.
+
+        Partitions are visited newest first, and the scan stops once the
+        next one's max_received can't beat the rows already collected.
+        """
+        found = []
+        for key, _, hi in self.catalog(conn, before=after[0] if after else None):
+            if len(found) >= limit and hi < found[limit - 1]["received_at"]:
+                break
+            schema = self.attach(conn, key)
+            if schema is None:
+                continue
+            w, p = list(where), list(params)
+            if after is not None:
+                w.append("(received_at, id) < (?, ?)"); p += list(after)
+            rows = conn.execute(
+                f"SELECT {cols} FROM {schema}.alerts{_where(w, schema)} "
+                "ORDER BY received_at DESC, id DESC LIMIT ?", p + [limit]).fetchall()
+            if rows:
+                found = sorted(found + [dict(r) for r in rows], key=_order, reverse=True)[:limit]
+        return found
+
+    def count(self, conn, where: list, params: list) -> int:
+        total = 0
+        for key, _, _ in self.catalog(conn):
+            schema = self.attach(conn, key)
+            if schema is not None:
+                total += conn.execute(f"SELECT COUNT(*) FROM {schema}.alerts{_where(where, schema)}",
+                                      params).fetchone()[0]
+        return total
+
+    def find(self, conn, alert_id: str, cols: str) -> tuple:
+        """(schema, row) of the alert with `alert_id`, or (None, None)."""
+        for key, _, _ in self.catalog(conn):
+            schema = self.attach(conn, key)
+            if schema is None:
+                continue
+            row = conn.execute(f"SELECT {cols} FROM {schema}.alerts WHERE alert_id = ?",
+                               (alert_id,)).fetchone()
+            if row is not None:
+                return schema, row
+        return None, None
+
+    def select(self, conn, sql: str, params, since: Optional[float] = None) -> list:
+        """Rows of `sql` (which names the partition schema as {s}) from every
+        partition holding rows received at or after `since`, unordered."""
+        rows = []
+        for key, _, _ in self.catalog(conn, since=since):
+            schema = self.attach(conn, key)
+            if schema is not None:
+                rows += conn.execute(sql.format(s=schema), params).fetchall()
+        return rows
+
+    # ── Retention ────────────────────────────────────────────────────────────
+
+    def expire(self, pool, days: float) -> list:
+        """Delete every partition whose newest row is older than `days`.
+        Returns the keys of the partitions removed."""
+        self._unlink(set(self._orphans))
+        cutoff = time.time() - days * 86400
+        with pool.reader() as conn:
+            old = [tuple(r) for r in conn.execute(
+                "SELECT key, file FROM main.alert_partitions "
+                "WHERE COALESCE(max_received, start) < ?", (cutoff,))]
+        if not old:
+            return []
+        keys = {key for key, _ in old}
+        with pool.exclusive() as conns:
+            conn = conns[0]
+            # Rollup buckets all start and end on day boundaries or inside a
+            # day, so history is cut at the day holding the oldest row still
+            # stored. Expired rows counted after that edge (normally only a
+            # merge overhang past their partition's end) are taken out one by
+            # one.
+            oldest = conn.execute(
+                "SELECT MIN(min_received) FROM main.alert_partitions "
+                f"WHERE key NOT IN ({', '.join('?' * len(keys))})", tuple(keys)).fetchone()[0]
+            edge  = float("inf") if oldest is None else int(oldest) // rollups.RES_DAY * rollups.RES_DAY
+            delta = rollups.RollupDelta()
+            if oldest is not None:
+                for key in keys:
+                    schema = self.attach(conn, key)
+                    if schema is None:
+                        continue
+                    for r in conn.execute(f"SELECT received_at, {', '.join(rollups.DIMS)} "
+                                          f"FROM {schema}.alerts WHERE received_at >= ?", (edge,)):
+                        delta.add(r[0], tuple(r[1:]), -1)
+            for c in conns:
+                self.detach(c, keys)
+            conn.executemany("DELETE FROM main.alert_partitions WHERE key = ?",
+                             [(key,) for key in keys])
+            rollups.expire(conn, edge)
+            if delta:
+                delta.apply(conn)
+        self._unlink({name for _, name in old})
+        log.info("Retention: expired %d alert partition(s) older than %g days", len(old), days)
+        return sorted(keys)
+
+    def _unlink(self, names: set):
+        for name in names:
+            try:
+                for suffix in ("", "-wal", "-shm"):
+                    (self.dir / (name + suffix)).unlink(missing_ok=True)
+            except OSError as exc:       # still attached by another process (Windows)
+                log.debug("Retention: %s not deleted yet — %s", name, exc)
+                self._orphans.add(name)
+            else:
+                self._orphans.discard(name)
+
+    def release(self, pool, keys):
+        """Detach partitions another process expired from every connection."""
+        with pool.exclusive() as conns:
+            for c in conns:
+                self.detach(c, set(keys))
+
+    # ── Migration from the single alerts table ───────────────────────────────
+
+    def upgrade(self, conn) -> int:
+        """Add the label columns and the label / dedup indexes to partitions
+        written before they existed and fill them in. Commits once per
+        partition; returns the number of partitions upgraded."""
+        done = 0
+        for (key,) in conn.execute("SELECT key FROM main.alert_partitions").fetchall():
+            s = self.attach(conn, key)
+            if s is None:
+                continue
+            cols = {r[1] for r in conn.execute(f"PRAGMA {s}.table_info(alerts)")}
+            missing = [c for c in _LABEL_COLUMNS if c not in cols]
+            indexes = {r[1] for r in conn.execute(f"PRAGMA {s}.index_list(alerts)")}
+            if not missing and "idx_alerts_dedup" in indexes:
+                continue
+            for col in missing:
+                conn.execute(f"ALTER TABLE {s}.alerts ADD COLUMN {col} REAL")
+            for index in _LABEL_INDEXES + (_DEDUP_INDEX,):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {s}.{index}")
+            conn.execute(f"DROP INDEX IF EXISTS {s}.idx_alerts_client")
+            if missing:
+                _fill_label_columns(conn, s)
+            conn.commit()
+            done += 1
+        return done
+
+    def migrate_legacy(self, conn, codec) -> int:
+        """Move a pre-partitioning flare.db `alerts` table (with its search
+        index and blobs, if present) into partition files and drop it.
+        Commits once per partition; returns the number of rows moved."""
+        tables = {r[0] for r in conn.execute("SELECT name FROM main.sqlite_master WHERE type='table'")}
+        if "alerts" not in tables:
+            return 0
+        if rollups.backfill(conn):
+            conn.commit()
+        status = ("status" if "status" in {r[1] for r in conn.execute("PRAGMA main.table_info(alerts)")}
+                  else "'open'")
+        inline = ("((a.evidence IS NOT NULL AND a.evidence != '') "
+                  "OR (a.raw_log IS NOT NULL AND a.raw_log != ''))")
+        if codec.current == 0:
+            rows = conn.execute(f"SELECT a.evidence, a.raw_log FROM main.alerts a WHERE {inline} "
+                                "ORDER BY a.id DESC LIMIT ?", (blob_store.TRAIN_SAMPLES,)).fetchall()
+            if len(rows) >= blob_store.TRAIN_MIN and codec.train(conn, [v for r in rows for v in r], len(rows)):
+                conn.commit()
+
+        cols  = ", ".join(_LEGACY_COLUMNS)
+        fts   = ", ".join(alert_search.COLUMNS)
+        if "alerts_fts" in tables:
+            fts_src = (", ".join(f"f.{c}" for c in alert_search.COLUMNS)
+                       + " FROM main.alerts_fts f JOIN main.alerts a ON a.id = f.rowid")
+        else:
+            fts_src = (", ".join(f"COALESCE(a.{c}, '')" for c in alert_search.COLUMNS)
+                       + " FROM main.alerts a")
+        rng   = "COALESCE(a.received_at, 0) >= ? AND COALESCE(a.received_at, 0) < ?"
+        done  = {r[0] for r in conn.execute("SELECT key FROM main.alert_partitions")}
+        keys  = {r[0] for r in conn.execute(
+            f"SELECT DISTINCT CAST(COALESCE(received_at, 0) / {self.span} AS INTEGER) FROM main.alerts")}
+        moved = 0
+        for key in sorted(keys - done):
+            s = self.attach(conn, key, create=True)
+            args = (self.first_id(key) - 1, key * self.span, (key + 1) * self.span)
+            conn.execute(f"INSERT OR IGNORE INTO {s}.alerts (id, {cols}, status) "
+                         f"SELECT a.id + ?, {cols}, {status} FROM main.alerts a WHERE {rng}", args)
+            _fill_label_columns(conn, s)
+            conn.execute(f"INSERT OR REPLACE INTO {s}.alerts_fts (rowid, {fts}) "
+                         f"SELECT a.id + ?, {fts_src} WHERE {rng}", args)
+            if "alert_blobs" in tables:
+                conn.execute(f"INSERT OR IGNORE INTO {s}.alert_blobs (id, dict_id, evidence, raw_log) "
+                             "SELECT b.id + ?, b.dict_id, b.evidence, b.raw_log "
+                             f"FROM main.alert_blobs b JOIN main.alerts a ON a.id = b.id WHERE {rng}", args)
+            cur = conn.execute(f"SELECT a.id + ?, a.evidence, a.raw_log FROM main.alerts a "
+                               f"WHERE {rng} AND {inline}", args)
+            while True:
+                chunk = cur.fetchmany(5000)
+                if not chunk:
+                    break
+                codec.write(conn, s, [tuple(r) for r in chunk])
+            lo, hi, n = conn.execute(f"SELECT MIN(received_at), MAX(received_at), COUNT(*) "
+                                     f"FROM {s}.alerts").fetchone()
+            self.note(conn, {key: [lo, hi, n]})
+            conn.commit()
+            moved += n
+
+        for table in ("alerts_fts", "alert_blobs", "alerts"):
+            if table in tables:
+                conn.execute(f"DROP TABLE main.{table}")
+        conn.commit()
+        return moved
+
+
+class PartitionRetention(threading.Thread):
+    """Runs PartitionStore.expire() at start-up and every `interval` seconds.
+    `versions` (http_cache.DataVersions), when given, has "alerts" bumped
+    whenever partitions were removed; `on_expire`, when given, is called
+    with the removed keys."""
+
+    def __init__(self, store: PartitionStore, pool, days: float, interval: float = 3600.0,
+                 versions=None, on_expire=None):
+        super().__init__(name="PartitionRetention", daemon=True)
+        self._store    = store
+        self._pool     = pool
+        self._days     = days
+        self._interval = interval
+        self._versions = versions
+        self._on_expire = on_expire
+        self._stop_evt = threading.Event()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_evt.set()
+        self.join(timeout=timeout)
+
+    def run(self):
+        while True:
+            try:
+                keys = self._store.expire(self._pool, self._days)
+                if keys and self._versions is not None:
+                    self._versions.bump("alerts")
+                if keys and self._on_expire is not None:
+                    self._on_expire(keys)
+            except Exception as exc:
+                log.warning("Partition retention failed: %s", exc)
+            if self._stop_evt.wait(self._interval):
+                break
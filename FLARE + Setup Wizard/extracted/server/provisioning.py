@@ -0,0 +1,288 @@
+"""
+FLARE - Agent Provisioning
+──────────────────────────────────
+Issues the client cert bundles that GET /api/provision hands to new agents,
+without blocking the event loop:
+
+  CA        ca.crt / ca.key are read once, at the first bundle, and kept in
+            memory (each worker process parses them once as well).
+  Key pool  a background thread keeps `pool_size` client keys generated
+            ahead of demand (RSA 2048, or ECDSA P-256 with key_type="ecdsa"),
+            so a rollout burst doesn't wait ~80 ms per RSA key. cryptography
+            releases the GIL while generating, so the thread doesn't stall
+            request handling. When the pool runs dry the worker generates
+            the key itself.
+  Workers   signing, writing certs/clients/<name>/ and zipping the bundle
+            run in a process pool (threads with workers=0); the endpoint
+            only awaits the result.
+
+Usage
+-----
+  # Bundles/s and worst event-loop stall, old inline path vs the pool
+  python provisioning.py --bench [-n 200] [--key-type ecdsa] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import multiprocessing
+import queue
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+
+from metrics import Histogram
+
+log = logging.getLogger("flare_server.provision")
+
+# ── Worker side ──────────────────────────────────────────────────────────────
+
+# Parsed CA per worker process: (cert_pem, key_pem) -> (ca_key, ca_cert)
+_worker_ca: dict = {}
+
+
+def _new_key(key_type: str) -> bytes:
+    import generate_pki
+    return generate_pki.key_pem(generate_pki._gen_key(key_type))
+
+
+def _issue(ca_pems: tuple, name: str, key_pem: Optional[bytes], key_type: str,
+           out_dir: str) -> bytes:
+    """Sign a client cert for `name` (with `key_pem`, or a fresh key when
+    None), write its bundle to `out_dir` and return the zip agents unpack."""
+    import generate_pki
+    ca = _worker_ca.get(ca_pems)
+    if ca is None:
+        ca = _worker_ca[ca_pems] = generate_pki.load_ca(*ca_pems)
+    ca_key, ca_cert = ca
+    key  = generate_pki.load_key(key_pem) if key_pem else generate_pki._gen_key(key_type)
+    cert = generate_pki.sign_client_cert(name, key, ca_key, ca_cert)
+    cert_pem, pem = generate_pki.write_client_bundle(name, key, cert, ca_cert, Path(out_dir))
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("ca.crt", ca_pems[0])
+        zf.writestr("client.crt", cert_pem)
+        zf.writestr("client.key", pem)
+    return buf.getvalue()
+
+
+# ── Server side ──────────────────────────────────────────────────────────────
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn, not fork: the server process is full of threads by now.
+    ctx = multiprocessing.get_context("spawn")
+    if Path(sys.executable).name.lower().startswith("pythonservice"):
+        # Running as a Windows service: children must start python.exe.
+        ctx.set_executable(str(Path(sys.exec_prefix) / "python.exe"))
+    return ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+
+
+class Provisioner(threading.Thread):
+    """
+    ca_cert / ca_key  — CA files (read at the first bundle)
+    out_dir           — bundles are written to out_dir/<client name>
+    key_type          — "rsa" or "ecdsa"
+    pool_size         — pre-generated keys kept ready (0: none)
+    workers           — processes signing and packaging; 0 runs them on
+                        two threads instead
+
+    The thread is the key-pool filler; provision() is awaited from the
+    event loop.
+    """
+
+    def __init__(self, ca_cert: Path, ca_key: Path, out_dir: Path, key_type: str = "rsa",
+                 pool_size: int = 16, workers: int = 2):
+        super().__init__(name="ProvisionKeys", daemon=True)
+        import generate_pki
+        if key_type not in generate_pki.KEY_TYPES:
+            raise ValueError(f"provisioning key type must be one of {generate_pki.KEY_TYPES}, "
+                             f"not {key_type!r}")
+        self._ca_paths = (Path(ca_cert), Path(ca_key))
+        self._ca_pems: Optional[tuple] = None
+        self.out_dir   = Path(out_dir)
+        self.key_type  = key_type
+        self._keys: queue.Queue = queue.Queue(maxsize=max(0, pool_size) or 1)
+        self._size     = max(0, pool_size)
+        self._workers  = max(0, workers)
+        self._exec     = _process_pool(self._workers) if self._workers else ThreadPoolExecutor(2)
+        self._lock     = threading.Lock()
+        self._taken    = threading.Event()
+        self._stop_evt = threading.Event()
+        self.issued      = 0
+        self.pool_misses = 0
+        self.issue_seconds = Histogram()     # provision(), request to zip
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_evt.set()
+        self._taken.set()
+        self.join(timeout)
+        self._exec.shutdown(wait=False, cancel_futures=True)
+
+    def run(self):
+        if not self._size:
+            return
+        log.info("Provisioning: keeping %d %s key(s) ready, %s", self._size, self.key_type,
+                 f"{self._workers} worker process(es)" if self._workers else "worker threads")
+        while not self._stop_evt.is_set():
+            if self._keys.qsize() >= self._size:
+                self._taken.wait(1.0)
+                self._taken.clear()
+                continue
+            try:
+                pem = _new_key(self.key_type)
+            except Exception as exc:
+                log.warning("Provisioning: key generation failed — %s", exc)
+                self._stop_evt.wait(5.0)
+                continue
+            with contextlib.suppress(queue.Full):
+                self._keys.put_nowait(pem)
+
+    def _ca(self) -> tuple:
+        if self._ca_pems is None:
+            with self._lock:
+                if self._ca_pems is None:
+                    cert, key = self._ca_paths
+                    if not cert.exists() or not key.exists():
+                        raise FileNotFoundError("Server CA not found")
+                    self._ca_pems = (cert.read_bytes(), key.read_bytes())
+        return self._ca_pems
+
+    async def provision(self, name: str) -> bytes:
+        """Zip of ca.crt / client.crt / client.key for client `name`; the
+        bundle is also left under out_dir/<name>. FileNotFoundError when
+        the CA is missing."""
+        t0 = time.perf_counter()
+        ca = self._ca()
+        try:
+            key = self._keys.get_nowait()
+        except queue.Empty:
+            key = None
+            self.pool_misses += 1
+        self._taken.set()
+        args = (ca, name, key, self.key_type, str(self.out_dir / name))
+        try:
+            body = await asyncio.wrap_future(self._exec.submit(_issue, *args))
+        except BrokenProcessPool:
+            log.error("Provisioning: worker processes died — signing on threads from now on")
+            self._exec, self._workers = ThreadPoolExecutor(2), 0
+            body = await asyncio.wrap_future(self._exec.submit(_issue, *args))
+        self.issued += 1
+        self.issue_seconds.observe(time.perf_counter() - t0)
+        return body
+
+    def stats(self) -> dict:
+        return {"key_type": self.key_type, "keys_ready": self._keys.qsize(),
+                "pool_size": self._size, "issued": self.issued, "pool_misses": self.pool_misses}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Micro-benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def _loop_stall(done: asyncio.Event) -> float:
+    """Longest gap between 1 ms ticks of the event loop until `done`."""
+    worst, last = 0.0, time.perf_counter()
+    while not done.is_set():
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        worst, last = max(worst, now - last), now
+    return worst
+
+
+async def _bench_inline(root: Path, n: int, concurrency: int, key_type: str):
+    """What /api/provision did before: CA re-read, key, signing and zip on
+    the event loop."""
+    import generate_pki
+    ca_cert, ca_key = root / "ca.crt", root / "ca.key"
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            with contextlib.redirect_stdout(io.StringIO()):
+                ca = generate_pki.generate_ca(ca_cert, ca_key)
+                out = root / "inline" / f"agent-{i}"
+                generate_pki.generate_client_bundle(f"agent-{i}", *ca, out, key_type=key_type)
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+                zf.write(ca_cert, arcname="ca.crt")
+                zf.write(out / "client.crt", arcname="client.crt")
+                zf.write(out / "client.key", arcname="client.key")
+            await asyncio.sleep(0)
+
+    done = asyncio.Event()
+    stall = asyncio.create_task(_loop_stall(done))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    return elapsed, await stall
+
+
+async def _bench_pool(root: Path, n: int, concurrency: int, key_type: str, pool: int,
+                      workers: int):
+    p = Provisioner(root / "ca.crt", root / "ca.key", root / "pool", key_type, pool, workers)
+    p.start()
+    await p.provision("warm-up")            # spawns the workers, parses the CA
+    while p._keys.qsize() < pool:           # a pool filled while the server idled
+        await asyncio.sleep(0.05)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await p.provision(f"agent-{i}")
+
+    done = asyncio.Event()
+    stall = asyncio.create_task(_loop_stall(done))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    worst = await stall
+    misses = p.pool_misses
+    p.stop()
+    return elapsed, worst, misses
+
+
+def _bench(n: int, concurrency: int, key_type: str, pool: int, workers: int):
+    import generate_pki
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_pki.generate_ca(root / "ca.crt", root / "ca.key")
+        print(f"  {n} {key_type} bundles, {concurrency} requests in flight, "
+              f"key pool {pool}, {workers} worker process(es)")
+        print(f"    {'path':<16}{'bundles/s':>10}{'worst loop stall':>20}")
+        t, stall = asyncio.run(_bench_inline(root, n, concurrency, key_type))
+        print(f"    {'inline (old)':<16}{n / t:>10.1f}{stall * 1000:>17.1f} ms")
+        t, stall, misses = asyncio.run(_bench_pool(root, n, concurrency, key_type, pool, workers))
+        print(f"    {'pool':<16}{n / t:>10.1f}{stall * 1000:>17.1f} ms"
+              f"   ({n - misses} keys from the pool)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE agent provisioning")
+    parser.add_argument("--bench", action="store_true",
+                        help="Compare inline and pooled provisioning")
+    parser.add_argument("-n", type=int, default=200, help="Bundles to issue")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight")
+    parser.add_argument("--key-type", default="rsa", choices=("rsa", "ecdsa"))
+    parser.add_argument("--pool", type=int, default=16, help="Pre-generated keys")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes (0: threads)")
+    args = parser.parse_args()
+    if args.bench:
+        _bench(args.n, args.concurrency, args.key_type, args.pool, args.workers)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+FLARE - Traffic Replay
+──────────────────────────────────
+Re-issues a recording made with FLARE_RECORD_FILE (traffic_record.py)
+against a server: the agents' alert batches, heartbeats and FL updates, as
+the framed bodies they sent, in the order and at the pace they arrived —
+or 10x faster, or as fast as the server takes them. Use it to reproduce an
+alert storm on a test server and to compare ingest, dedup and rollup
+changes on real traffic instead of a synthetic mix (fleet_sim.py).
+
+  --speed 1     original timing
+  --speed 10    every gap ten times shorter
+  --speed max   no gaps; --connections requests in flight at once
+
+alert_ids are rewritten (uuid5 of the original, under a namespace new to
+each run), so replaying into a database that already holds the recording —
+or holds an earlier replay — inserts rows instead of hitting INSERT OR
+IGNORE, while an agent's resend of the same batch within the recording
+still carries one id. --keep-ids sends them unchanged. Recorded requests are
+sent once each: the agents' retries after a 503 are already in the
+recording.
+
+Dedup and rollups work on the time the server receives an alert, so a
+faster replay folds more of a burst into one dedup window — as a burst that
+fast would. Several recordings (one per worker, FILE.<pid>) are merged by
+time.
+
+Without --server, the recording is replayed into a scratch server
+(--workers processes), with any FLARE_* settings from the environment.
+
+Usage
+-----
+  # Record on the production server (30 % of agents), then summarise
+  set FLARE_RECORD_FILE=C:\\flare\\traffic.rec & set FLARE_RECORD_SAMPLE=0.3
+  python traffic_record.py --info traffic.rec
+
+  # Replay into a scratch server at 10x, then into a test server at full tilt
+  python replay.py traffic.rec --speed 10
+  python replay.py traffic.rec* --server 10.0.0.9:7331 --ca certs --speed max --json run.json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import ssl
+import tempfile
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from proto import log_schema_pb2 as pb
+from fleet_sim import HttpConnection, Stats, agent_contexts, print_endpoints, target_server, wait_ready
+from traffic_record import frame_body, iter_frames, read_records
+
+_SHORT = {"alerts": "/api/alerts/ingest", "heartbeat": "/api/heartbeat", "fl": "/api/fl/update"}
+
+
+def rewrite_alert_ids(body: bytes, namespace: uuid.UUID) -> bytes:
+    """The framed AlertBatches of `body` with every alert_id mapped to
+    uuid5(namespace, alert_id). Empty ids stay empty (the server assigns)."""
+    batches = [pb.AlertBatch.FromString(f) for f in iter_frames(body)]
+    for batch in batches:
+        for ev in batch.alerts:
+            if ev.alert_id:
+                ev.alert_id = str(uuid.uuid5(namespace, ev.alert_id))
+    return frame_body(batches)
+
+
+class Replay:
+    """
+    Sends recorded requests on schedule over a pool of connections.
+
+    connections — HttpConnections requests are spread over
+    speed       — time compression; 0 = as fast as the server answers
+    namespace   — uuid5 namespace for alert_ids, None to send them unchanged
+    """
+
+    def __init__(self, connections: list, speed: float, namespace):
+        self.connections = connections
+        self.speed      = speed
+        self.namespace  = namespace
+        self.stats      = Stats()
+        self.lag: list  = []             # seconds each request was sent behind schedule
+        self.ingest     = Counter()      # /api/alerts/ingest responses summed (queued, inserted, merged)
+        self.alerts     = 0
+        self.span       = 0.0            # recorded time covered
+
+    async def run(self, records, report: float) -> float:
+        q: asyncio.Queue = asyncio.Queue(maxsize=len(self.connections) * 4)
+        workers = [asyncio.ensure_future(self._worker(c, q)) for c in self.connections]
+        progress = asyncio.ensure_future(self._progress(report))
+        start, first = time.monotonic(), None
+        try:
+            for rec in records:
+                if first is None:
+                    first = rec.received
+                self.span = rec.received - first
+                if self.speed:
+                    due = start + self.span / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    due = time.monotonic()
+                await q.put((due, rec))
+            for _ in workers:
+                await q.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            progress.cancel()
+            for c in self.connections:
+                c.close()
+        return time.monotonic() - start
+
+    async def _worker(self, conn: HttpConnection, q: asyncio.Queue):
+        while True:
+            item = await q.get()
+            if item is None:
+                return
+            due, rec = item
+            self.lag.append(max(0.0, time.monotonic() - due))
+            body = rec.body
+            is_ingest = rec.endpoint == "/api/alerts/ingest"
+            if is_ingest:
+                if self.namespace is not None:
+                    body = rewrite_alert_ids(body, self.namespace)
+                self.alerts += sum(len(pb.AlertBatch.FromString(f).alerts) for f in iter_frames(body))
+            label = f"POST {rec.endpoint}"
+            t0 = time.perf_counter()
+            try:
+                status, _, resp = await conn.request("POST", rec.endpoint, body)
+            except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError) as exc:
+                self.stats.error(label, type(exc).__name__)
+                continue
+            if status != 200:
+                self.stats.error(label, str(status))
+                continue
+            self.stats.ok(label, time.perf_counter() - t0)
+            if is_ingest:
+                try:
+                    self.ingest.update({k: v for k, v in json.loads(resp).items() if isinstance(v, int)})
+                except ValueError:
+                    pass
+
+    async def _progress(self, report: float):
+        start = last = time.monotonic()
+        while True:
+            await asyncio.sleep(report)
+            now = time.monotonic()
+            parts = [f"{ep.split()[-1].replace('/api/', '')} {n / (now - last):.1f}/s"
+                     for ep, n in sorted(self.stats.interval.items())]
+            behind = self.lag[-1] if self.lag else 0.0
+            print(f"  [{now - start:6.0f}s] recorded +{self.span:.0f} s  {'  '.join(parts) or 'idle'}  "
+                  f"alerts {self.alerts}  behind schedule {behind:.2f} s", flush=True)
+            self.stats.interval.clear()
+            last = now
+
+
+def _records(paths: list, endpoints: set):
+    streams = [read_records(p) for p in paths]
+    for rec in heapq.merge(*streams, key=lambda r: r.received):
+        if rec.endpoint in endpoints:
+            yield rec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE traffic replay")
+    parser.add_argument("recordings", nargs="+", help="Recording files (FLARE_RECORD_FILE)")
+    parser.add_argument("--speed", default="1", help="1 = original timing, 10 = ten times faster, max = no gaps")
+    parser.add_argument("--server", default="",
+                        help="host:port of the server to replay into (default: a scratch server)")
+    parser.add_argument("--ca", default="", help="Directory with the server's ca.crt and ca.key (--server)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the scratch server")
+    parser.add_argument("--connections", type=int, default=32, help="Connections requests are spread over")
+    parser.add_argument("--endpoints", default="alerts,heartbeat,fl",
+                        help="Which recorded requests to send: alerts, heartbeat, fl")
+    parser.add_argument("--keep-ids", action="store_true", help="Send alert_ids as recorded")
+    parser.add_argument("--report", type=float, default=10, help="Seconds between progress lines")
+    parser.add_argument("--json", default="", help="Write the final results to this file")
+    args = parser.parse_args()
+    try:
+        speed = 0.0 if args.speed == "max" else float(args.speed)
+    except ValueError:
+        parser.error("--speed is a number or max")
+    if speed < 0:
+        parser.error("--speed must be positive")
+    try:
+        endpoints = {_SHORT[e.strip()] for e in args.endpoints.split(",") if e.strip()}
+    except KeyError as exc:
+        parser.error(f"unknown endpoint {exc}; choose from: {', '.join(_SHORT)}")
+    if args.server and not args.ca:
+        parser.error("--server needs --ca (the directory holding the server's ca.crt and ca.key)")
+    for path in args.recordings:
+        try:
+            next(read_records(path), None)    # refuse a file that isn't a recording before starting
+        except (OSError, ValueError) as exc:
+            parser.error(str(exc))
+
+    with tempfile.TemporaryDirectory(prefix="flare-replay-") as tmp, \
+            target_server(args.server, args.ca, 0, args.workers, Path(tmp)) as (host, port, _, ca_dir):
+        contexts = agent_contexts(ca_dir, Path(tmp) / "agents", min(8, args.connections))
+        asyncio.run(wait_ready(host, port, contexts[0]))
+        print(f"  {', '.join(args.recordings)} -> {host}:{port} at "
+              f"{'max' if not speed else f'{speed:g}x'} speed, {args.connections} connections", flush=True)
+        replay = Replay([HttpConnection(host, port, contexts[i % len(contexts)])
+                         for i in range(args.connections)], speed,
+                        None if args.keep_ids else uuid.uuid4())
+        cpu0 = time.process_time()
+        elapsed = asyncio.run(replay.run(_records(args.recordings, endpoints), args.report))
+        cpu = time.process_time() - cpu0
+
+    summary = replay.stats.summary(elapsed)
+    lag = sorted(replay.lag)
+    p99_lag = lag[min(len(lag) - 1, int(len(lag) * 0.99))] if lag else 0.0
+    print(f"\n  {len(lag)} requests, {replay.span:.0f} s of traffic replayed in {elapsed:.0f} s "
+          f"({replay.span / elapsed if elapsed else 0:.1f}x)")
+    print_endpoints(summary)
+    print(f"    alerts {replay.alerts}; ingest responses "
+          f"{', '.join(f'{k} {v}' for k, v in sorted(replay.ingest.items())) or '-'}")
+    print(f"    behind schedule p99 {p99_lag * 1000:.0f} ms, generator CPU {cpu / elapsed * 100:.0f}% of one core"
+          if elapsed else "")
+    if args.json:
+        Path(args.json).write_text(json.dumps({
+            "recordings": args.recordings, "speed": args.speed, "seconds": round(elapsed, 1),
+            "recorded_seconds": round(replay.span, 1), "alerts": replay.alerts,
+            "ingest": dict(replay.ingest), "behind_p99_ms": round(p99_lag * 1000, 1),
+            "generator_cpu": round(cpu / elapsed, 3) if elapsed else 0.0, "endpoints": summary,
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
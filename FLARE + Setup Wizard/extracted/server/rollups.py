@@ -0,0 +1,181 @@
+"""
+FLARE - Alert Rollups
+──────────────────────────────────
+Pre-aggregated alert counts so the dashboard's 15-second refresh
+(/api/status, /api/alerts/stats) reads O(buckets) rows instead of scanning
+the alerts table.
+
+One table, `alert_rollup(dim, res, bucket, key, count)`:
+
+  dim     — "all" (key "") or one of DIMS
+  res     — bucket width in seconds: 60 (minute), 3600 (hour), 86400 (day)
+  bucket  — unix time of the bucket start (UTC-aligned)
+  count   — number of alert ROWS whose received_at falls in the bucket
+
+The ingest writer records minute deltas in the same transaction as the alert
+rows (RollupDelta). A dedup merge moves received_at forward, so a merged row
+can move from one minute bucket to the next; the writer records that as
+-1 / +1. RollupCompactor folds minutes older than MINUTE_KEEP into hours and
+hours older than HOUR_KEEP into days.
+
+Range queries include every bucket that overlaps [since, now], so counts are
+exact to the bucket width at the start of the range: one minute for the
+last MINUTE_KEEP seconds, one hour or one day beyond that.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, ContextManager, Optional
+
+log = logging.getLogger("flare_server.rollups")
+
+DIMS = ("severity", "track", "attack_type", "client_id")
+
+RES_MINUTE = 60
+RES_HOUR   = 3600
+RES_DAY    = 86400
+
+MINUTE_KEEP = 48 * 3600        # minute buckets kept for the last 48 h
+HOUR_KEEP   = 90 * 86400       # hour buckets kept for the last 90 days
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alert_rollup (
+        dim     TEXT    NOT NULL,
+        res     INTEGER NOT NULL,
+        bucket  INTEGER NOT NULL,
+        key     TEXT    NOT NULL,
+        count   INTEGER NOT NULL,
+        PRIMARY KEY (dim, res, bucket, key)
+    ) WITHOUT ROWID;
+"""
+
+_UPSERT_SQL = """INSERT INTO alert_rollup (dim, res, bucket, key, count) VALUES (?,?,?,?,?)
+    ON CONFLICT(dim, res, bucket, key) DO UPDATE SET count = count + excluded.count"""
+
+# A bucket overlaps [since, ∞) when bucket + res > since.
+_RANGE = "((res = 60 AND bucket > ?) OR (res = 3600 AND bucket > ?) OR (res = 86400 AND bucket > ?))"
+
+
+def _key(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _range_args(since: float) -> tuple:
+    return (since - RES_MINUTE, since - RES_HOUR, since - RES_DAY)
+
+
+class RollupDelta:
+    """Minute-bucket count changes collected over one writer transaction."""
+
+    def __init__(self):
+        self._d: dict = defaultdict(int)
+
+    def __bool__(self) -> bool:
+        return any(self._d.values())
+
+    def add(self, ts: float, values: tuple, n: int = 1):
+        """Count n rows received at ts with DIMS values `values`."""
+        bucket = int(ts) // RES_MINUTE * RES_MINUTE
+        self._d[("all", bucket, "")] += n
+        for dim, value in zip(DIMS, values):
+            self._d[(dim, bucket, _key(value))] += n
+
+    def move(self, old_ts: float, new_ts: float, values: tuple):
+        """A row's received_at changed from old_ts to new_ts."""
+        if int(old_ts) // RES_MINUTE != int(new_ts) // RES_MINUTE:
+            self.add(old_ts, values, -1)
+            self.add(new_ts, values, 1)
+
+    def apply(self, conn):
+        conn.executemany(_UPSERT_SQL, [
+            (dim, RES_MINUTE, bucket, key, n)
+            for (dim, bucket, key), n in self._d.items() if n
+        ])
+
+
+def counts(conn, dim: str, since: float = 0.0, limit: Optional[int] = None) -> list:
+    """[(key, count)] for `dim` over alerts received since `since`, largest
+    first."""
+    sql = (f"SELECT key, SUM(count) AS n FROM alert_rollup WHERE dim = ? AND {_RANGE} "
+           "GROUP BY key HAVING n > 0 ORDER BY n DESC")
+    args = (dim, *_range_args(since))
+    if limit is not None:
+        sql += " LIMIT ?"
+        args += (limit,)
+    return [(r[0], r[1]) for r in conn.execute(sql, args)]
+
+
+def total(conn, since: float = 0.0) -> int:
+    """Number of alert rows received since `since` (all time by default)."""
+    row = conn.execute(
+        f"SELECT COALESCE(SUM(count), 0) FROM alert_rollup WHERE dim = 'all' AND {_RANGE}",
+        _range_args(since)).fetchone()
+    return row[0]
+
+
+def backfill(conn) -> bool:
+    """Populate the rollups from existing alerts the first time the table is
+    created on a database that already has history. Returns True if it ran."""
+    if conn.execute("SELECT 1 FROM alert_rollup LIMIT 1").fetchone():
+        return False
+    if not conn.execute("SELECT 1 FROM alerts LIMIT 1").fetchone():
+        return False
+    bucket = f"CAST(received_at AS INTEGER) / {RES_MINUTE} * {RES_MINUTE}"
+    conn.execute(
+        f"""INSERT INTO alert_rollup (dim, res, bucket, key, count)
+            SELECT 'all', {RES_MINUTE}, {bucket} AS b, '', COUNT(*)
+            FROM alerts GROUP BY b""")
+    for dim in DIMS:
+        conn.execute(
+            f"""INSERT INTO alert_rollup (dim, res, bucket, key, count)
+                SELECT '{dim}', {RES_MINUTE}, {bucket} AS b,
+                       COALESCE(CAST({dim} AS TEXT), ''), COUNT(*)
+                FROM alerts GROUP BY b, 4""")
+    compact(conn, time.time())
+    return True
+
+
+def compact(conn, now: float):
+    """Fold minute buckets older than MINUTE_KEEP into hours and hour buckets
+    older than HOUR_KEEP into days. Only whole destination buckets are folded."""
+    for src, dst, keep in ((RES_MINUTE, RES_HOUR, MINUTE_KEEP), (RES_HOUR, RES_DAY, HOUR_KEEP)):
+        edge = int(now - keep) // dst * dst
+        conn.execute(
+            """INSERT INTO alert_rollup (dim, res, bucket, key, count)
+               SELECT dim, ?, bucket - bucket % ?, key, SUM(count)
+               FROM alert_rollup WHERE res = ? AND bucket < ?
+               GROUP BY dim, bucket - bucket % ?, key
+               ON CONFLICT(dim, res, bucket, key) DO UPDATE SET count = count + excluded.count""",
+            (dst, dst, src, edge, dst))
+        conn.execute("DELETE FROM alert_rollup WHERE res = ? AND bucket < ?", (src, edge))
+    conn.execute("DELETE FROM alert_rollup WHERE count = 0")
+
+
+def expire(conn, before: float):
+    """Drop buckets that end at or before `before` — their alerts were removed
+    by partition retention (partitions.py)."""
+    conn.execute("DELETE FROM alert_rollup WHERE bucket + res <= ?", (before,))
+
+
+class RollupCompactor(threading.Thread):
+    """Runs compact() every `interval` seconds through the writer connection."""
+
+    def __init__(self, writer: Callable[[], ContextManager], interval: float = 300.0):
+        super().__init__(name="RollupCompactor", daemon=True)
+        self._writer   = writer
+        self._interval = interval
+        self._stop_evt = threading.Event()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_evt.set()
+        self.join(timeout=timeout)
+
+    def run(self):
+        while not self._stop_evt.wait(self._interval):
+            try:
+                with self._writer() as conn:
+                    compact(conn, time.time())
+            except Exception as exc:
+                log.warning("Rollup compaction failed: %s", exc)
@@ -174,6 +174,40 @@ if ($OpenFirewall) {
             Out-Null
         Write-OK "Inbound firewall rule created (TCP port $ServerPort)"
     }
+
+    # Agents keep their long-lived agent channel connection on TCP 7332.
+    $channelRule = "FLARE-Channel-Inbound"
+    if (Get-NetFirewallRule -DisplayName $channelRule -ErrorAction SilentlyContinue) {
+        Write-Warn "Rule '$channelRule' already exists"
+    } else {
+        New-NetFirewallRule `
+            -DisplayName $channelRule `
+            -Direction   Inbound `
+            -Protocol    TCP `
+            -LocalPort   7332 `
+            -Action      Allow `
+            -Profile     Any `
+            -Description "Allow FLARE agents to hold their agent channel connection" |
+            Out-Null
+        Write-OK "Inbound firewall rule created (TCP port 7332 - agent channel)"
+    }
+
+    # Agents and the client installer find the server by probing UDP 37021.
+    $discoverRule = "FLARE-Discovery-Inbound"
+    if (Get-NetFirewallRule -DisplayName $discoverRule -ErrorAction SilentlyContinue) {
+        Write-Warn "Rule '$discoverRule' already exists"
+    } else {
+        New-NetFirewallRule `
+            -DisplayName $discoverRule `
+            -Direction   Inbound `
+            -Protocol    UDP `
+            -LocalPort   37021 `
+            -Action      Allow `
+            -Profile     Any `
+            -Description "Allow FLARE agents to probe for the server on the LAN" |
+            Out-Null
+        Write-OK "Inbound firewall rule created (UDP port 37021 - discovery probes)"
+    }
 }
 
 Write-Host ""
@@ -0,0 +1,240 @@
+"""
+FLARE - Traffic Recorder
+──────────────────────────────────
+Captures the agent traffic the server receives — alert batches, heartbeats
+and FL updates, over HTTP or the agent channel — into an append-only file,
+so replay.py can re-issue it against a test server: real alert storms to
+benchmark ingest, dedup and rollup changes against.
+
+Each record is one request body (or one channel message) as the framed
+protobuf the agents send, with the time it arrived and its endpoint:
+
+  header  b"FLARETRC" + format version (1 byte)
+  record  [8-byte big-endian float: unix time received]
+          [1 byte: endpoint code, ENDPOINTS] [1 byte: flags, FLAG_CHANNEL]
+          [4-byte big-endian body length]
+          [body: [4-byte length][protobuf] [length][protobuf] ...]
+
+Sampling is per agent, by a stable hash of client_id, so an agent that is
+recorded has all of its traffic recorded and its bursts stay whole. The
+request path only queues the parsed messages; serialising and writing
+happen on the recorder thread. When that thread falls behind, records are
+dropped and counted, never waited for. Recording stops at max_bytes.
+
+Usage
+-----
+  # Summarise a recording: records per endpoint, agents, alerts, time span
+  python traffic_record.py --info traffic.rec
+"""
+
+import argparse
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from proto import log_schema_pb2 as pb
+
+log = logging.getLogger("flare_server.record")
+
+MAGIC    = b"FLARETRC"
+VERSION  = 1
+_RECORD  = struct.Struct(">dBBI")
+_FRAME   = struct.Struct(">I")
+
+# Endpoint code -> (path, message type of its frames).
+ENDPOINTS = {
+    1: ("/api/alerts/ingest", pb.AlertBatch),
+    2: ("/api/heartbeat",     pb.Heartbeat),
+    3: ("/api/fl/update",     pb.FLUpdate),
+}
+_CODES = {path: code for code, (path, _) in ENDPOINTS.items()}
+
+FLAG_CHANNEL = 0x01      # arrived on the agent channel rather than over HTTP
+
+
+class Record(NamedTuple):
+    received: float      # unix time
+    endpoint: str        # path, e.g. "/api/alerts/ingest"
+    flags:    int
+    body:     bytes      # framed, as POSTed
+
+
+def client_of(message) -> str:
+    """client_id of an AlertBatch (its first alert), Heartbeat or FLUpdate."""
+    if isinstance(message, pb.AlertBatch):
+        return message.alerts[0].client_id if message.alerts else ""
+    return message.client_id
+
+
+def frame_body(messages: list) -> bytes:
+    parts = []
+    for m in messages:
+        data = m.SerializeToString()
+        parts.append(_FRAME.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def iter_frames(body: bytes) -> Iterator[bytes]:
+    pos = 0
+    while pos + 4 <= len(body):
+        (n,) = _FRAME.unpack_from(body, pos)
+        yield body[pos + 4:pos + 4 + n]
+        pos += 4 + n
+
+
+def read_records(path) -> Iterator[Record]:
+    """Records of the file at `path`, in the order written. A record cut
+    short (the server stopped mid-write) ends the iteration."""
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC) + 1)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a FLARE traffic recording")
+        if head[len(MAGIC)] != VERSION:
+            raise ValueError(f"{path}: recording format {head[len(MAGIC)]}, expected {VERSION}")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            received, code, flags, n = _RECORD.unpack(head)
+            body = f.read(n)
+            if len(body) < n:
+                return
+            if code in ENDPOINTS:
+                yield Record(received, ENDPOINTS[code][0], flags, body)
+
+
+class TrafficRecorder(threading.Thread):
+    """
+    Appends sampled agent traffic to a recording file.
+
+    path       — file to append to; the header is written when it is new
+    sample     — fraction of agents recorded (1.0 = all)
+    max_bytes  — stop recording once the file reaches this size
+    max_queue  — records waiting for the thread before new ones are dropped
+    """
+
+    def __init__(self, path, sample: float = 1.0, max_bytes: int = 1 << 30,
+                 max_queue: int = 10_000):
+        super().__init__(name="TrafficRecorder", daemon=True)
+        self.path      = Path(path)
+        self.sample    = max(0.0, min(1.0, sample))
+        self.max_bytes = max_bytes
+        self._q: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop_evt = threading.Event()
+        self._full     = False
+        self.recorded  = 0      # records written
+        self.dropped   = 0      # records lost to a full queue
+        self.bytes     = 0      # file size
+
+    # ── Producer side (called from request handlers) ─────────────────────────
+
+    def wants(self, client_id: str) -> bool:
+        if self.sample >= 1.0:
+            return True
+        return zlib.crc32(client_id.encode()) < self.sample * 0x1_0000_0000
+
+    def record(self, endpoint: str, messages: list, channel: bool = False):
+        """Queue `messages` (parsed frames of one request to `endpoint`) if
+        their agent is sampled. Never blocks."""
+        code = _CODES.get(endpoint)
+        if code is None or not messages or self._full or not self.wants(client_of(messages[0])):
+            return
+        try:
+            self._q.put_nowait((time.time(), code, FLAG_CHANNEL if channel else 0, messages))
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 10.0):
+        """Write whatever is queued and stop the thread."""
+        self._stop_evt.set()
+        self.join(timeout=timeout)
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "dropped": self.dropped, "bytes": self.bytes,
+                "queued": self._q.qsize()}
+
+    # ── Recorder thread ───────────────────────────────────────────────────────
+
+    def run(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC + bytes([VERSION]))
+            self.bytes = f.tell()
+            log.info("Traffic recorder: appending %.0f%% of agents to %s", self.sample * 100, self.path)
+            while not (self._stop_evt.is_set() and self._q.empty()):
+                try:
+                    item = self._q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                while item is not None:
+                    self._write(f, *item)
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        item = None
+                f.flush()
+
+    def _write(self, f, received: float, code: int, flags: int, messages: list):
+        if self._full:
+            return
+        body = frame_body(messages)
+        if self.bytes + _RECORD.size + len(body) > self.max_bytes:
+            self._full = True
+            log.warning("Traffic recorder: %s reached %d bytes, recording stopped", self.path, self.max_bytes)
+            return
+        f.write(_RECORD.pack(received, code, flags, len(body)))
+        f.write(body)
+        self.bytes += _RECORD.size + len(body)
+        self.recorded += 1
+
+
+# ── Inspection ────────────────────────────────────────────────────────────────
+
+def _info(paths: list):
+    for path in paths:
+        counts, sizes, clients, alerts, channel = {}, {}, set(), 0, 0
+        first = last = None
+        for rec in read_records(path):
+            first = rec.received if first is None else first
+            last = rec.received
+            counts[rec.endpoint] = counts.get(rec.endpoint, 0) + 1
+            sizes[rec.endpoint] = sizes.get(rec.endpoint, 0) + len(rec.body)
+            channel += bool(rec.flags & FLAG_CHANNEL)
+            msg_type = ENDPOINTS[_CODES[rec.endpoint]][1]
+            for frame in iter_frames(rec.body):
+                m = msg_type.FromString(frame)
+                clients.add(client_of(m))
+                if msg_type is pb.AlertBatch:
+                    alerts += len(m.alerts)
+        print(f"  {path}")
+        if first is None:
+            print("    no records")
+            continue
+        span = last - first
+        print(f"    {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first))} + {span:.0f} s, "
+              f"{len(clients)} agents, {alerts} alerts, {channel} records from the agent channel")
+        for endpoint in sorted(counts):
+            rate = f"{counts[endpoint] / span:.2f}/s" if span else "-"
+            print(f"    {endpoint:<22}{counts[endpoint]:>9} records {rate:>10} "
+                  f"{sizes[endpoint] / 1e6:9.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLARE traffic recordings")
+    parser.add_argument("--info", nargs="+", metavar="FILE", help="Summarise recordings")
+    args = parser.parse_args()
+    if args.info:
+        _info(args.info)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()